@@ -1,9 +1,25 @@
+import signal
 import sys
 
 from batch_processor import sample1  # type: ignore
 from batch_processor.config import load_config_from_env  # type: ignore
 from batch_processor.models import Sample1Params  # type: ignore
 
+# 中断によるリトライ可能な終了を表す終了コード（EX_TEMPFAIL）
+# Terraform の retry_exit_conditions でこの値を RETRY に設定している
+EXIT_CODE_INTERRUPTED = 75
+
+
+def handle_sigterm(signum, frame):
+    """
+    Spot 回収時の SIGTERM を受けて、出力を書き出しリトライ可能な終了コードで終了する。
+    sample1 は外部パッケージの処理のため途中での停止はできず、ジョブ全体が再実行される。
+    """
+    print("SIGTERM received. Flushing output and exiting for retry.", file=sys.stderr)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.exit(EXIT_CODE_INTERRUPTED)
+
 
 def main():
     """
@@ -11,6 +27,7 @@ def main():
     環境変数から設定を読み込み、sample1コマンドを実行する。
     (ローカル実行は poetry run cli を使用)
     """
+    signal.signal(signal.SIGTERM, handle_sigterm)
     print("Starting batch execution using installed package...")
 
     try:
@@ -0,0 +1,125 @@
+"""
+バンドル実行モジュール
+
+複数の小さな作業アイテム（CONFIG と同じ形式のJSON）を1コンテナ内で順番に処理し、
+アイテムごとの成否を BUNDLE_ITEM_RESULT 行として標準出力に報告する。
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, List, Literal, Optional
+
+from pydantic import BaseModel
+
+from fastconfig import loads
+from shutdown import Checkpoint, GracefulShutdown
+
+# 送信側 history.py が取り込む結果行のマーカー
+RESULT_MARKER = "BUNDLE_ITEM_RESULT"
+
+
+class BundleItemResult(BaseModel):
+    """バンドル内アイテムの実行結果"""
+    index: int
+    key: str
+    status: Literal["SUCCEEDED", "FAILED", "SKIPPED"]
+    seconds: float
+    error: Optional[str] = None
+
+
+def item_key(item: Any) -> str:
+    """
+    作業アイテムを識別するキーを返す（送信側 history.item_key と同じ規則）
+
+    同じ入力を設定や出力先を変えて処理するアイテムを区別するよう、アイテム全体（キーの順序によらない）の
+    ハッシュを入力ファイルの後ろに付ける。作業アイテムは解析前の JSON の値を渡す。
+    """
+    canonical = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    if isinstance(item, dict) and item.get("inputFile"):
+        digest = hashlib.blake2b(canonical.encode("utf-8"), digest_size=6).hexdigest()
+        return f"{item['inputFile']}#{digest}"
+    return canonical
+
+
+def load_bundle(env_var_name: str = "BUNDLE") -> Optional[List[Any]]:
+    """
+    環境変数からバンドル（作業アイテムの配列）を読み込む
+
+    Args:
+        env_var_name: JSON配列を含む環境変数名
+
+    Returns:
+        作業アイテムのリスト。環境変数が未設定の場合は None
+
+    Raises:
+        ValueError: JSONとして無効、または配列でない場合
+    """
+    json_str = os.environ.get(env_var_name)
+    if not json_str:
+        return None
+
+    try:
+        # アイテム数が多いため、orjson があれば fastconfig と同じデコーダーを使う
+        items = loads(json_str)
+    except ValueError:
+        raise ValueError(f"環境変数 {env_var_name} に有効なJSONが含まれていません")
+    if not isinstance(items, list):
+        raise ValueError(f"環境変数 {env_var_name} はJSON配列である必要があります")
+    return items
+
+
+def run_bundle(
+    items: List[Any],
+    process: Callable[[Any], None],
+    shutdown: Optional[GracefulShutdown] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> List[BundleItemResult]:
+    """
+    バンドル内のアイテムを順番に処理する
+
+    1アイテムの失敗で残りのアイテムを止めないよう、例外はアイテム単位で捕捉する。
+    停止が要求された場合は処理中のアイテムを終えた時点で新しいアイテムの取り出しをやめる。
+    チェックポイントで完了済みのアイテムは再実行せず SKIPPED として報告する。
+
+    Args:
+        items: 作業アイテムのリスト
+        process: 1アイテムを処理する関数
+        shutdown: SIGTERM の受信状態
+        checkpoint: 完了済みアイテムの記録先
+
+    Returns:
+        処理した（またはスキップした）アイテムの実行結果
+    """
+    results = []
+    for index, item in enumerate(items):
+        if shutdown is not None and shutdown.requested:
+            print(f"停止要求のため残り {len(items) - index} アイテムを処理しません", flush=True)
+            break
+
+        key = item_key(item)
+        if checkpoint is not None and checkpoint.is_done(key):
+            result = BundleItemResult(index=index, key=key, status="SKIPPED", seconds=0.0)
+            print(f"{RESULT_MARKER} {result.model_dump_json()}", flush=True)
+            results.append(result)
+            continue
+
+        start = time.monotonic()
+        error = None
+        try:
+            process(item)
+        except Exception as e:
+            error = str(e)
+
+        result = BundleItemResult(
+            index=index,
+            key=key,
+            status="FAILED" if error else "SUCCEEDED",
+            seconds=round(time.monotonic() - start, 3),
+            error=error,
+        )
+        if checkpoint is not None and error is None:
+            checkpoint.mark_done(key)
+        print(f"{RESULT_MARKER} {result.model_dump_json()}", flush=True)
+        results.append(result)
+    return results
@@ -0,0 +1,260 @@
+"""
+ホスト共有のコンテンツキャッシュモジュール
+
+EC2 コンピュート環境では同じインスタンス上の複数のジョブが同じ参照ファイル
+（ルックアップテーブルやモデルなど）を繰り返しダウンロードする。
+ホストのディレクトリをバインドマウントしてコンテナ間で共有し、
+一度ダウンロードしたオブジェクトを再利用するリードスルーキャッシュを提供する。
+
+使用中のファイルは共有ロック（flock の LOCK_SH）を保持し、削除側は排他ロックが取れたファイルだけを削除する。
+ロックはファイルを閉じるかプロセスが終了すると外れるため、異常終了したジョブがファイルを残し続けることはない。
+
+ディレクトリ構成:
+    <root>/objects/<内容の sha256>   キャッシュ本体（内容アドレス）
+    <root>/index/<URI の sha256>.json URI と ETag から本体への対応
+    <root>/locks/<URI の sha256>.lock ダウンロードの排他制御
+    <root>/tmp/                      ダウンロード途中のファイル
+    <root>/lookup/*.lkix             ルックアップのインデックス（lookup_index.py が作る。上限サイズに含める）
+"""
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from storage import download_to, head_etag, is_s3_uri
+
+# キャッシュの上限サイズ（バイト）のデフォルト
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+# 上限サイズの対象にするディレクトリと、その中の対象のファイルの拡張子（空文字はすべてのファイル）
+# ロックファイルや作成途中の一時ファイルは対象にしない
+ACCOUNTED_FILES = {"objects": "", "lookup": ".lkix"}
+
+
+class _HashingWriter:
+    """書き込んだ内容の sha256 とサイズを計算しながらファイルに書き出す"""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.f.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    """ファイルロック（flock）で排他区間を作る。別コンテナのプロセスとも排他される"""
+    with open(path, "a+b") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def pin(path: str) -> Optional[int]:
+    """
+    ファイルを開いて共有ロックをかけ、ファイル記述子を返す（閉じるまで evict で削除されない）
+
+    削除済みの場合は None を返す。
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    # evict が削除する直前に開いた場合、ロックが取れたときには名前のないファイルになっている
+    if os.fstat(fd).st_nlink == 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class PinnedFile:
+    """
+    キャッシュ内のファイルのパスと、使用中であることを示す共有ロック
+
+    close するまで（with ブロックを抜けるまで）別のジョブの evict で削除されない。
+    キャッシュしないローカルパスはロックを持たない。
+    """
+
+    def __init__(self, path: str, fd: Optional[int] = None):
+        self.path = path
+        self._fd = fd
+
+    def close(self):
+        """共有ロックを外す（以降は evict で削除されうる）"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "PinnedFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ContentCache:
+    """内容アドレスで保存し、LRU で上限サイズを守るリードスルーキャッシュ"""
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        for name in ("objects", "index", "locks", "tmp"):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ContentCache"]:
+        """CACHE_DIR が設定されていればキャッシュを開く。未設定の場合は None"""
+        root = os.environ.get("CACHE_DIR")
+        if not root:
+            return None
+        max_bytes = int(os.environ.get("CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        return cls(root, max_bytes)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest)
+
+    def fetch(self, uri: str) -> PinnedFile:
+        """
+        オブジェクトを取得し、共有ロックを保持したファイルを返す
+
+        キャッシュ済みで ETag が一致すればダウンロードせずに返す。
+        同じ URI を複数のコンテナが同時に要求しても、ダウンロードは1回だけ行われる。
+        ローカルパスはキャッシュせずそのまま返す。
+        返したファイルは close するまで別のジョブの evict で削除されない。
+
+        Args:
+            uri: s3:// URI またはローカルパス
+
+        Returns:
+            キャッシュ内のファイル（path がローカルパス）
+
+        Raises:
+            FileNotFoundError: オブジェクトが存在しない場合
+        """
+        if not is_s3_uri(uri):
+            return PinnedFile(uri)
+
+        uri_key = hashlib.sha256(uri.encode("utf-8")).hexdigest()
+        index_path = os.path.join(self.root, "index", f"{uri_key}.json")
+        etag = head_etag(uri)
+        if etag is None:
+            raise FileNotFoundError(f"オブジェクトが見つかりません: {uri}")
+
+        fd = None
+        with _locked(os.path.join(self.root, "locks", f"{uri_key}.lock")):
+            entry = self._read_index(index_path)
+            if entry and entry["etag"] == etag:
+                object_path = self._object_path(entry["digest"])
+                fd = pin(object_path)
+                if fd is not None:
+                    # LRU の順序は更新時刻で管理する（noatime マウントでも動くように）
+                    os.utime(object_path)
+
+            downloaded = fd is None
+            while fd is None:
+                # ダウンロードの直後に別のジョブの evict で削除された場合はやり直す
+                object_path = self._download(uri)
+                fd = pin(object_path)
+            if downloaded:
+                entry = {"uri": uri, "etag": etag, "digest": os.path.basename(object_path)}
+                tmp_path = f"{index_path}.tmp-{os.getpid()}"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, index_path)
+
+        pinned = PinnedFile(object_path, fd)
+        if downloaded:
+            try:
+                self.evict(keep=object_path)
+            except BaseException:
+                pinned.close()
+                raise
+        return pinned
+
+    @contextmanager
+    def pinned(self, uri: str) -> Iterator[str]:
+        """オブジェクトのローカルパスを返し、with ブロックを抜けるまで削除されないよう共有ロックを保持する"""
+        with self.fetch(uri) as pinned:
+            yield pinned.path
+
+    def _read_index(self, index_path: str) -> Optional[dict]:
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _download(self, uri: str) -> str:
+        """一時ファイルにダウンロードし、内容の sha256 の名前で本体に移す"""
+        tmp_path = os.path.join(self.root, "tmp", f"{os.getpid()}-{time.monotonic_ns()}")
+        try:
+            with open(tmp_path, "wb") as f:
+                writer = _HashingWriter(f)
+                download_to(uri, writer)
+            object_path = self._object_path(writer.digest.hexdigest())
+            # 同じ内容が別の URI で既にキャッシュされていれば置き換えても結果は同じ
+            os.replace(tmp_path, object_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return object_path
+
+    def evict(self, keep: Optional[str] = None):
+        """
+        合計サイズが上限を超えていれば、最も古く使われたオブジェクトから削除する
+
+        CACHE_DIR/lookup のルックアップのインデックスも同じ上限と LRU の順序で削除する。
+
+        keep と、別のジョブが使用中（pin）のファイルは削除しない。
+        削除済みのオブジェクトを mmap 中のプロセスは、閉じるまで内容を読み続けられる。
+        """
+        with _locked(os.path.join(self.root, "locks", "evict.lock")):
+            entries = []
+            total = 0
+            for name, suffix in ACCOUNTED_FILES.items():
+                directory = os.path.join(self.root, name)
+                if not os.path.isdir(directory):
+                    continue
+                for entry in os.scandir(directory):
+                    if not entry.is_file() or not entry.name.endswith(suffix):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                if self._remove_unused(path):
+                    total -= size
+
+    def _remove_unused(self, path: str) -> bool:
+        """どのプロセスも使用中（pin）でなければ削除する。削除したか既になければ True"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            os.remove(path)
+            return True
+        finally:
+            os.close(fd)
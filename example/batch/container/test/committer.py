@@ -0,0 +1,263 @@
+"""
+出力コミットモジュール
+
+配列ジョブの子ジョブはすべて同じ outputPath に書き込み、リトライや投機的な重複実行
+（SHARD_INDEX を指定した別ジョブ）によって同じシャードが複数のジョブで処理されることもある。
+途中で失敗した書き込みや負けたジョブの出力が混ざらないよう、次の手順で出力を確定させる。
+
+1. 出力ファイルはジョブIDと試行回数ごとのステージング領域に書く
+2. シャードの処理が成功したら、出力ファイルの一覧を含む小さなマニフェストを
+   条件付き書き込みで公開する（最初にコミットしたジョブだけが成功する）
+3. 全シャードの完了後、ファイナライザがシャードのマニフェストをまとめて
+   アイテムごとのマニフェスト（_manifests/<アイテムID>.json）を書く
+
+シャードのマニフェストとステージング領域は実行（run_id()）ごとに分ける。同じ outputPath に
+入力を変えて再実行しても、前回の実行のコミット済みのシャードは飛ばされず、前回の出力も公開されない。
+出力の読み手は outputPath を走査せず、アイテムのマニフェストに列挙されたファイルだけを読む。
+
+レイアウト:
+    <outputPath>/_staging/<アイテムID>/<実行ID>/<ジョブID>/attempt-<試行回数>/<ファイル名>
+    <outputPath>/_shards/<アイテムID>/<実行ID>/shard-<番号>-of-<シャード数>.json
+    <outputPath>/_manifests/<アイテムID>.json
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# アイテムIDとシャードのマニフェストの場所の規則は送信側と共有する memo_keys.py に置く
+from memo_keys import item_id, shard_manifest_uri
+from storage import (
+    delete_uris,
+    is_s3_uri,
+    head_etag,
+    join_uri,
+    list_uris,
+    read_bytes,
+    upload_file,
+    write_bytes,
+    write_bytes_if_absent,
+)
+
+# 他のジョブが先にシャードをコミットしていないかを確認する間隔（秒）
+DEFAULT_CHECK_SECONDS = float(os.environ.get("COMMIT_CHECK_SECONDS", "30"))
+
+# アイテムごとのマニフェストを置くディレクトリ
+MANIFEST_DIR = "_manifests"
+
+
+def run_id(input_file: Optional[str] = None) -> str:
+    """
+    実行の識別子
+
+    RUN_ID（送信側が配列ジョブ名を設定し、ファイナライズ用ジョブ・投機的な重複実行・OOM の再送信にも渡す）、
+    なければ配列の親ジョブID（単独のジョブは自身のジョブID。リトライでは変わらない）。
+    Batch の外で実行した場合は、入力が変わると別の実行になるよう、入力のバージョンから作る。
+    """
+    value = os.environ.get("RUN_ID")
+    if value:
+        return value.replace("/", "-").replace(":", "-")
+    job_id = os.environ.get("AWS_BATCH_JOB_ID")
+    if job_id:
+        return job_id.split(":", 1)[0]
+    version = head_etag(input_file) if input_file and not is_s3_uri(input_file) else None
+    if version is None:
+        return "local"
+    return "local-" + hashlib.sha256(version.encode("utf-8")).hexdigest()[:12]
+
+
+def manifest_uri(config: Dict[str, Any]) -> str:
+    """アイテムのマニフェストの URI"""
+    return join_uri(config["outputPath"], MANIFEST_DIR, f"{item_id(config)}.json")
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _dumps(data: Dict[str, Any]) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+class ShardCommitter:
+    """1つのシャードの出力をステージングし、最初の1回だけ確定させる"""
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        shard_index: int,
+        shard_count: int,
+        check_seconds: float = DEFAULT_CHECK_SECONDS,
+        run: Optional[str] = None,
+    ):
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.job_id = os.environ.get("AWS_BATCH_JOB_ID", f"local-{os.getpid()}")
+        self.attempt = int(os.environ.get("AWS_BATCH_JOB_ATTEMPT", "1"))
+        self.run = run or run_id(config["inputFile"])
+        self.manifest_uri = shard_manifest_uri(config, self.run, shard_index, shard_count)
+        # 配列の子ジョブのIDは "<親ジョブID>:<インデックス>" の形式
+        self.staging_uri = join_uri(
+            config["outputPath"],
+            "_staging",
+            item_id(config),
+            self.run,
+            self.job_id.replace(":", "-"),
+            f"attempt-{self.attempt}",
+        )
+        self.files: List[Dict[str, Any]] = []
+        self.reused: List[Dict[str, Any]] = []
+        self.check_seconds = check_seconds
+        self._checked_at: Optional[float] = None
+
+    def is_committed(self) -> bool:
+        """シャードが既にコミットされているかどうか"""
+        return head_etag(self.manifest_uri) is not None
+
+    def lost(self) -> bool:
+        """
+        処理の途中で、別のジョブが先にシャードをコミットしたかどうか
+
+        処理ループから頻繁に呼ばれても、確認は check_seconds ごとに1回だけ行う。
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+            return False
+        self._checked_at = now
+        return self.is_committed()
+
+    def add_file(self, name: str, path: str, **attributes: Any) -> str:
+        """
+        ローカルファイルをステージング領域に書き出し、マニフェストに登録する
+
+        Args:
+            name: ステージング領域内のファイル名
+            path: ローカルファイルのパス
+            attributes: マニフェストに記録する追加の属性（行数など）
+
+        Returns:
+            書き出し先の URI
+        """
+        uri = join_uri(self.staging_uri, name)
+        upload_file(path, uri)
+        self.files.append(
+            {
+                "uri": uri,
+                "bytes": os.path.getsize(path),
+                "sha256": _file_digest(path),
+                **attributes,
+            }
+        )
+        return uri
+
+    def reuse(self, files: List[Dict[str, Any]]):
+        """
+        前回コミットされた出力ファイルを、書き出し直さずにマニフェストに登録する
+
+        再利用したファイルは前回のマニフェストからも参照されているため、abort() では削除しない。
+        マニフェストでは、この試行が書き出したファイルより前に並べる（中断前の試行の出力が先になる）。
+        """
+        self.reused.extend(files)
+
+    def commit(self, result: Dict[str, Any]) -> bool:
+        """
+        シャードのマニフェストを公開して結果を確定させる
+
+        Returns:
+            このジョブの結果が確定した場合は True、別のジョブが先にコミットしていた場合は False
+        """
+        manifest = {
+            "shard": self.shard_index,
+            "count": self.shard_count,
+            "jobId": self.job_id,
+            "runId": self.run,
+            "attempt": self.attempt,
+            "speculativeOf": os.environ.get("SPECULATIVE_OF"),
+            "result": result,
+            "files": self.reused + self.files,
+            "committedAt": datetime.now(timezone.utc).isoformat(),
+        }
+        return write_bytes_if_absent(self.manifest_uri, _dumps(manifest))
+
+    def abort(self):
+        """確定しなかった出力をステージング領域から削除する"""
+        delete_uris(entry["uri"] for entry in self.files)
+        self.files = []
+        self.reused = []
+
+
+def finalize(
+    config: Dict[str, Any], shard_count: int, cleanup: bool = True, run: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    実行の全シャードのマニフェストからアイテムのマニフェストを作る
+
+    何度実行しても同じ内容になる。cleanup が True の場合、この実行のステージング領域のうち
+    どのマニフェストにも含まれないファイル（失敗した試行や負けたジョブの出力）を削除する。
+    前回までの実行のステージング領域は、結果インデックスから再利用されている場合があるため削除しない。
+
+    Args:
+        config: 検証後の設定（run_batch.config_dict の形式）
+        shard_count: シャード数
+        cleanup: 参照されないステージングファイルを削除するかどうか
+        run: 実行ID（省略時は run_id()）
+
+    Returns:
+        アイテムのマニフェスト
+
+    Raises:
+        RuntimeError: コミットされていないシャードがある場合
+    """
+    output_path = config["outputPath"]
+    run = run or run_id(config["inputFile"])
+    shards = []
+    missing = []
+    for index in range(shard_count):
+        data = read_bytes(shard_manifest_uri(config, run, index, shard_count))
+        if data is None:
+            missing.append(index)
+            continue
+        shards.append(json.loads(data))
+    if missing:
+        preview = ", ".join(str(index) for index in missing[:10])
+        raise RuntimeError(f"コミットされていないシャードがあります（{len(missing)} 件）: {preview}")
+
+    files = [entry for shard in shards for entry in shard["files"]]
+    manifest = {
+        "inputFile": config["inputFile"],
+        "outputPath": output_path,
+        "itemId": item_id(config),
+        "runId": run,
+        "shardCount": shard_count,
+        "rows": sum(shard["result"].get("rows", 0) for shard in shards),
+        "bytes": sum(entry["bytes"] for entry in files),
+        "files": files,
+        "shards": [
+            {"shard": shard["shard"], "jobId": shard["jobId"], "attempt": shard["attempt"]}
+            for shard in shards
+        ],
+    }
+    write_bytes(manifest_uri(config), _dumps(manifest))
+
+    if cleanup:
+        referenced = {entry["uri"] for entry in files}
+        garbage = [
+            uri
+            for uri in list_uris(join_uri(output_path, "_staging", item_id(config), run))
+            if uri not in referenced
+        ]
+        delete_uris(garbage)
+        manifest["removed"] = len(garbage)
+    return manifest
+
+
+def load_manifest(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """アイテムのマニフェストを読む。まだ作られていなければ None"""
+    data = read_bytes(manifest_uri(config))
+    return json.loads(data) if data is not None else None
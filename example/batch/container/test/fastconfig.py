@@ -0,0 +1,355 @@
+"""
+高速な CONFIG 解析モジュール
+
+バンドル実行やワーカー実行で1プロセスが数千件の設定を扱う場合、
+pydantic の BaseSettings を毎回構築するコストが無視できない。
+models.py の pydantic モデル（BatchJobConfig）のフィールド定義を import 時に一度だけ
+検証関数へ変換し、__slots__ を使った不変オブジェクトに変換する軽量な経路を提供する。
+スキーマはモデルから作るため、モデルにフィールドを追加すればこちらにも反映される。
+同じペイロードの解析結果はハッシュをキーにキャッシュする。
+
+ベンチマーク:
+    python fastconfig.py --bench 20000
+"""
+import hashlib
+import json
+import math
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Literal, Tuple, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+from models import BatchJobConfig
+
+try:
+    import orjson
+
+    loads = orjson.loads
+    DECODER = "orjson"
+except ImportError:
+    loads = json.loads
+    DECODER = "json"
+
+# 解析済み設定のキャッシュ件数
+CACHE_SIZE = 4096
+
+_REQUIRED = object()
+
+
+class _Frozen:
+    """__slots__ で属性を固定した不変オブジェクトの基底クラス"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"{type(self).__name__} は変更できません")
+
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """辞書に変換する"""
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, _Frozen):
+                value = value.to_dict()
+            elif isinstance(value, tuple):
+                value = list(value)
+            result[name] = value
+        return result
+
+    def model_dump_json(self, indent: Union[int, None] = None, ensure_ascii: bool = False) -> str:
+        """元のモデルの model_dump_json と同じ形式のJSONを返す"""
+        separators = (",", ":") if indent is None else (",", ": ")
+        return json.dumps(self.to_dict(), indent=indent, separators=separators, ensure_ascii=ensure_ascii)
+
+
+# pydantic の lax モードで整数として受け付ける文字列（"64", " +64 ", "6_4", "64.0" など）
+_INT_STRING = re.compile(r"[+-]?[0-9](?:_?[0-9])*(?:\.0+)?")
+
+# pydantic の lax モードで真偽値として受け付ける文字列（大文字・小文字は区別しない）
+_BOOL_STRINGS = {
+    "0": False, "off": False, "f": False, "false": False, "n": False, "no": False,
+    "1": True, "on": True, "t": True, "true": True, "y": True, "yes": True,
+}
+
+
+def _check_int(value: Any, path: str) -> int:
+    # pydantic と同じく、真偽値・小数部のない数値・整数を表す文字列も受け付ける
+    kind = type(value)
+    if kind is int:
+        return value
+    if kind is bool:
+        return int(value)
+    if kind is float and math.isfinite(value) and value.is_integer():
+        return int(value)
+    if kind is str:
+        text = value.strip()
+        if _INT_STRING.fullmatch(text):
+            return int(text.split(".", 1)[0])
+    raise ValueError(f"{path}: 整数である必要があります")
+
+
+def _check_float(value: Any, path: str) -> float:
+    kind = type(value)
+    if kind in (int, float, bool):
+        return float(value)
+    if kind is str and value.isascii():
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    raise ValueError(f"{path}: 数値である必要があります")
+
+
+def _check_bool(value: Any, path: str) -> bool:
+    kind = type(value)
+    if kind is bool:
+        return value
+    if kind in (int, float) and value in (0, 1):
+        return bool(value)
+    if kind is str and value.lower() in _BOOL_STRINGS:
+        return _BOOL_STRINGS[value.lower()]
+    raise ValueError(f"{path}: 真偽値である必要があります")
+
+
+def _check_str(value: Any, path: str) -> str:
+    if type(value) is not str:
+        raise ValueError(f"{path}: 文字列である必要があります")
+    return value
+
+
+def _check_str_list(value: Any, path: str) -> Tuple[str, ...]:
+    if type(value) is not list or any(type(item) is not str for item in value):
+        raise ValueError(f"{path}: 文字列の配列である必要があります")
+    return tuple(value)
+
+
+def _literal(*choices: str) -> Callable[[Any, str], str]:
+    def check(value: Any, path: str) -> str:
+        if value not in choices:
+            raise ValueError(f"{path}: {choices} のいずれかである必要があります")
+        return value
+
+    return check
+
+
+def _optional(check: Callable[[Any, str], Any]) -> Callable[[Any, str], Any]:
+    def optional(value: Any, path: str) -> Any:
+        return None if value is None else check(value, path)
+
+    return optional
+
+
+def _compile(cls: type, schema: Dict[str, Tuple[Callable, Any]], forbid_extra: bool) -> Callable[[Any, str], Any]:
+    """
+    スキーマを検証・構築関数に変換する
+
+    pydantic と同様に、スキーマにないキーは forbid_extra（BaseSettings の extra='forbid'）ならエラーにし、
+    それ以外（BaseModel の既定の extra='ignore'）なら無視する。
+    """
+    fields = tuple(schema.items())
+    allowed = frozenset(schema)
+
+    def build(data: Any, path: str = "") -> Any:
+        if type(data) is not dict:
+            raise ValueError(f"{path or 'CONFIG'}: オブジェクトである必要があります")
+        if forbid_extra:
+            unknown = data.keys() - allowed
+            if unknown:
+                raise ValueError(f"{path}{sorted(unknown)[0]}: 未知のフィールドです")
+        obj = object.__new__(cls)
+        for name, (check, default) in fields:
+            if name in data:
+                value = check(data[name], f"{path}{name}")
+            elif default is _REQUIRED:
+                raise ValueError(f"{path}{name}: 必須のフィールドです")
+            else:
+                value = default
+            object.__setattr__(obj, name, value)
+        return obj
+
+    return build
+
+
+def _checker(annotation: Any, classes: Dict[str, type]) -> Callable[[Any, str], Any]:
+    """モデルのフィールドの型注釈を検証関数に変換する"""
+    origin = get_origin(annotation)
+    if annotation is int:
+        return _check_int
+    if annotation is float:
+        return _check_float
+    if annotation is str:
+        return _check_str
+    if annotation is bool:
+        return _check_bool
+    if origin is list and get_args(annotation) == (str,):
+        return _check_str_list
+    if origin is Literal:
+        return _literal(*get_args(annotation))
+    if origin is Union:
+        members = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(members) == 1 and len(get_args(annotation)) == 2:
+            return _optional(_checker(members[0], classes))
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        build = _compile_model(annotation, classes)
+        return lambda value, path: build(value, f"{path}.")
+    raise TypeError(f"fastconfig が対応していない型です: {annotation!r}")
+
+
+def _compile_model(model: type, classes: Dict[str, type], name: str = "") -> Callable[[Any, str], Any]:
+    """
+    pydantic モデルから軽量版のクラス（Fast<モデル名>）と検証・構築関数を作る
+
+    型の変換は pydantic の lax モード（JSON から来る値の範囲）に合わせる。
+
+    リストのデフォルト値は不変にするためタプルにする。作ったクラスは classes に登録する。
+    """
+    schema = {}
+    for field_name, field in model.model_fields.items():
+        if field.is_required():
+            default = _REQUIRED
+        else:
+            default = field.get_default(call_default_factory=True)
+            if isinstance(default, list):
+                default = tuple(default)
+        schema[field_name] = (_checker(field.annotation, classes), default)
+    name = name or f"Fast{model.__name__}"
+    cls = type(
+        name,
+        (_Frozen,),
+        {"__slots__": tuple(schema), "__doc__": f"{model.__name__} の軽量版（属性アクセスは {model.__name__} と同じ）"},
+    )
+    classes[name] = cls
+    return _compile(cls, schema, model.model_config.get("extra") == "forbid")
+
+
+# スキーマは import 時に一度だけモデルから変換する
+_classes: Dict[str, type] = {}
+_build_config = _compile_model(BatchJobConfig, _classes, "FastJobConfig")
+FastJobConfig = _classes["FastJobConfig"]
+FastJobSettings = _classes["FastJobSettings"]
+FastMetadata = _classes["FastMetadata"]
+FastLookupSettings = _classes["FastLookupSettings"]
+
+_cache: "OrderedDict[bytes, FastJobConfig]" = OrderedDict()
+
+
+def config_from_dict(data: Any) -> FastJobConfig:
+    """
+    デコード済みの辞書から設定を構築する
+
+    Raises:
+        ValueError: スキーマに合わない場合
+    """
+    return _build_config(data)
+
+
+def parse_config(payload: Union[str, bytes]) -> FastJobConfig:
+    """
+    JSON ペイロードから設定を構築する
+
+    同じペイロードはハッシュをキーにキャッシュから返す。設定は不変なので共有しても安全。
+
+    Raises:
+        ValueError: JSONとして無効、またはスキーマに合わない場合
+    """
+    raw = payload.encode("utf-8") if isinstance(payload, str) else payload
+    key = hashlib.blake2b(raw, digest_size=16).digest()
+    config = _cache.get(key)
+    if config is not None:
+        _cache.move_to_end(key)
+        return config
+
+    try:
+        data = loads(raw)
+    except ValueError:
+        # orjson.JSONDecodeError と json.JSONDecodeError はどちらも ValueError のサブクラス
+        raise ValueError("有効なJSONではありません")
+    config = _build_config(data)
+    _cache[key] = config
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return config
+
+
+def config_from_env(env_var_name: str = "CONFIG") -> FastJobConfig:
+    """
+    環境変数の JSON から設定を構築する（BatchJobConfig.from_env の軽量版）
+
+    Raises:
+        ValueError: 環境変数が見つからないか、JSONとして無効、またはスキーマに合わない場合
+    """
+    payload = os.environ.get(env_var_name)
+    if not payload:
+        raise ValueError(f"環境変数 {env_var_name} が設定されていません")
+    try:
+        return parse_config(payload)
+    except ValueError as e:
+        raise ValueError(f"環境変数 {env_var_name} の設定が不正です: {e}")
+
+
+def _bench(count: int):
+    """pydantic の経路と高速経路で1秒あたりの解析件数と1件あたりのメモリを比較する"""
+    import time
+    import tracemalloc
+
+    payloads = [
+        json.dumps(
+            {
+                "inputFile": f"s3://example-bucket/input/{i}.csv",
+                "outputPath": "s3://example-bucket/output/",
+                "settings": {"batchSize": 64, "maxIterations": 100, "learningRate": 0.01},
+                "metadata": {"jobType": "batch-processing", "version": "1.0.0", "description": "bench"},
+            }
+        )
+        for i in range(count)
+    ]
+
+    def pydantic_path(payload):
+        return BatchJobConfig(**json.loads(payload))
+
+    def uncached_path(payload):
+        return config_from_dict(loads(payload))
+
+    for name, parse in (
+        ("pydantic", pydantic_path),
+        (f"fast ({DECODER})", uncached_path),
+        (f"fast+cache ({DECODER})", parse_config),
+    ):
+        _cache.clear()
+        start = time.perf_counter()
+        for payload in payloads:
+            parse(payload)
+        elapsed = time.perf_counter() - start
+        # 2周目はキャッシュに当たる
+        start_cached = time.perf_counter()
+        for payload in payloads[-CACHE_SIZE:]:
+            parse(payload)
+        elapsed_cached = time.perf_counter() - start_cached
+
+        tracemalloc.start()
+        kept = [parse(payload) for payload in payloads[:1000]]
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        print(
+            f"{name:<22} {count / elapsed:>10.0f} 件/秒  "
+            f"再解析 {min(count, CACHE_SIZE) / elapsed_cached:>10.0f} 件/秒  "
+            f"{current / 1000:>7.0f} バイト/件"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CONFIG 解析のベンチマーク")
+    parser.add_argument("--bench", type=int, default=20000, help="解析する設定の件数")
+    _bench(parser.parse_args().bench)
@@ -0,0 +1,451 @@
+"""
+シャードのリーステーブルモジュール
+
+配列ジョブの子ジョブが AWS_BATCH_JOB_ARRAY_INDEX で担当範囲を固定的に決めると、
+重いシャードや遅い子ジョブがあったときに配列全体の完了が遅れる。
+リース実行では入力を子ジョブの数より多い小さなシャードに分けてリーステーブルに登録し、
+各子ジョブが未処理のシャードをリースで取得して処理する。処理中はハートビートで
+リースを延長し、期限切れのリース（停止した子ジョブのシャード）は他の子ジョブが取得し直す。
+テーブルが空になる（全シャードが完了する）まで取得を続けるため、負荷は自動的に分散される。
+
+- テーブルは DynamoDB（dynamodb://テーブル名）か、テスト用の SQLite（sqlite:///path）
+- 出力の重複は committer.py の条件付きコミットで防ぐため、リースが奪われても結果は壊れない
+- 失敗したシャードはリースを解放して他の子ジョブに任せ、max_attempts 回失敗したら FAILED にする
+
+DynamoDB のテーブル（送信側が作成する）:
+    パーティションキー lease_group (S)、ソートキー shard (N)
+    属性 lease_state, lease_owner, expires_at, attempts, group_state
+    グローバルセカンダリインデックス STATE_INDEX: パーティションキー group_state (S)、ソートキー expires_at (N)
+    （group_state は "<グループ>#<状態>"。取得できるシャードだけを読むために使う）
+"""
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from shutdown import GracefulShutdown
+
+# リースの有効期間（秒）。ハートビートはこの3分の1ごとに延長する
+DEFAULT_LEASE_SECONDS = float(os.environ.get("LEASE_SECONDS", "120"))
+
+# 取得できるシャードがないまま待つ時間（秒）。超えたら子ジョブを終了する
+# 停止した子ジョブのリースが期限切れになるまで待てるよう、リースの有効期間より長くする
+DEFAULT_IDLE_SECONDS = float(os.environ.get("LEASE_IDLE_SECONDS", str(2 * DEFAULT_LEASE_SECONDS)))
+
+# 同じシャードの処理を試みる回数の上限
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get("LEASE_MAX_ATTEMPTS", "3"))
+
+# 状態ごとにシャードを引くグローバルセカンダリインデックスの名前
+STATE_INDEX = "group_state-expires_at-index"
+
+# 1回の取得で読む候補のシャード数
+CLAIM_CANDIDATES = 25
+
+PENDING = "PENDING"
+LEASED = "LEASED"
+DONE = "DONE"
+FAILED = "FAILED"
+
+
+class Lease(NamedTuple):
+    """取得したシャードのリース"""
+    group: str
+    shard: int
+    owner: str
+    attempts: int
+
+
+class SqliteLeaseTable:
+    """SQLite のリーステーブル（ローカルでの動作確認用）。複数のプロセスから同じファイルを開いて使える"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "lease_group TEXT NOT NULL, shard INTEGER NOT NULL, "
+            "lease_state TEXT NOT NULL, lease_owner TEXT, "
+            "expires_at REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (lease_group, shard))"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS leases_state ON leases (lease_group, lease_state, expires_at)"
+        )
+
+    def register(self, group: str, count: int):
+        with self._lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO leases (lease_group, shard, lease_state) VALUES (?, ?, ?)",
+                [(group, shard, PENDING) for shard in range(count)],
+            )
+
+    def claim(self, group: str, owner: str, lease_seconds: float, start: int = 0) -> Optional[Lease]:
+        now = time.time()
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT shard, attempts FROM leases WHERE lease_group = ? AND "
+                    "(lease_state = ? OR (lease_state = ? AND expires_at < ?)) "
+                    "ORDER BY shard < ?, shard LIMIT 1",
+                    (group, PENDING, LEASED, now, start),
+                ).fetchone()
+                if row is None:
+                    return None
+                shard, attempts = row
+                self.db.execute(
+                    "UPDATE leases SET lease_state = ?, lease_owner = ?, expires_at = ?, attempts = ? "
+                    "WHERE lease_group = ? AND shard = ?",
+                    (LEASED, owner, now + lease_seconds, attempts + 1, group, shard),
+                )
+                return Lease(group, shard, owner, attempts + 1)
+            finally:
+                self.db.execute("COMMIT")
+
+    def _update_owned(self, lease: Lease, assignments: str, values: tuple) -> bool:
+        with self._lock:
+            cursor = self.db.execute(
+                f"UPDATE leases SET {assignments} "
+                "WHERE lease_group = ? AND shard = ? AND lease_owner = ? AND lease_state = ?",
+                (*values, lease.group, lease.shard, lease.owner, LEASED),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, lease: Lease, lease_seconds: float) -> bool:
+        return self._update_owned(lease, "expires_at = ?", (time.time() + lease_seconds,))
+
+    def complete(self, lease: Lease) -> bool:
+        return self._update_owned(lease, "lease_state = ?", (DONE,))
+
+    def release(self, lease: Lease, state: str = PENDING) -> bool:
+        return self._update_owned(lease, "lease_state = ?, expires_at = 0", (state,))
+
+    def counts(self, group: str) -> Dict[str, int]:
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT lease_state, COUNT(*) FROM leases WHERE lease_group = ? GROUP BY lease_state",
+                (group,),
+            ).fetchall()
+        return dict(rows)
+
+
+def group_state(group: str, state: str) -> str:
+    """状態インデックスのパーティションキー"""
+    return f"{group}#{state}"
+
+
+class DynamoLeaseTable:
+    """
+    DynamoDB のリーステーブル。取得・延長・完了はすべて条件付き更新で行う
+
+    取得の候補は状態インデックス（STATE_INDEX）から未処理のシャードと期限切れのリースだけを
+    少数読む。インデックスは結果整合のため、候補の状態は条件付き更新で確かめる。
+    shard などの予約語と衝突しないよう、式の属性名はすべて ExpressionAttributeNames で置き換える。
+    """
+
+    # 式で使う属性名のプレースホルダ
+    NAMES = {
+        "#g": "lease_group",
+        "#k": "shard",
+        "#s": "lease_state",
+        "#o": "lease_owner",
+        "#e": "expires_at",
+        "#a": "attempts",
+        "#gs": "group_state",
+    }
+
+    def __init__(self, table_name: str):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("DynamoDB を使うには boto3 のインストールが必要です")
+        self.table_name = table_name
+        self.client = boto3.client("dynamodb")
+
+    @classmethod
+    def _names(cls, *expressions: str) -> Dict[str, str]:
+        """式で使われているプレースホルダだけの ExpressionAttributeNames（未使用の名前はエラーになる）"""
+        text = " ".join(expressions)
+        return {
+            placeholder: name
+            for placeholder, name in cls.NAMES.items()
+            if re.search(re.escape(placeholder) + r"\b", text)
+        }
+
+    def _key(self, group: str, shard: int) -> Dict[str, Any]:
+        return {"lease_group": {"S": group}, "shard": {"N": str(shard)}}
+
+    def register(self, group: str, count: int):
+        # 既に登録されたシャード（処理中・完了済み）は上書きしない
+        condition = "attribute_not_exists(#k)"
+        for shard in range(count):
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        **self._key(group, shard),
+                        "lease_state": {"S": PENDING},
+                        "group_state": {"S": group_state(group, PENDING)},
+                        "expires_at": {"N": "0"},
+                        "attempts": {"N": "0"},
+                    },
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames=self._names(condition),
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                pass
+
+    def _candidates(self, group: str, state: str, now: float) -> List[int]:
+        """状態インデックスから、状態が state のシャード（LEASED は期限切れのもの）を最大 CLAIM_CANDIDATES 件読む"""
+        condition = "#gs = :gs"
+        values = {":gs": {"S": group_state(group, state)}}
+        if state == LEASED:
+            condition += " AND #e < :now"
+            values[":now"] = {"N": str(now)}
+        response = self.client.query(
+            TableName=self.table_name,
+            IndexName=STATE_INDEX,
+            KeyConditionExpression=condition,
+            ExpressionAttributeNames=self._names(condition, "#k"),
+            ExpressionAttributeValues=values,
+            ProjectionExpression="#k",
+            Limit=CLAIM_CANDIDATES,
+        )
+        return [int(item["shard"]["N"]) for item in response.get("Items", [])]
+
+    def claim(self, group: str, owner: str, lease_seconds: float, start: int = 0) -> Optional[Lease]:
+        now = time.time()
+        update = "SET #s = :leased, #gs = :gs, #o = :owner, #e = :expires, #a = if_not_exists(#a, :zero) + :one"
+        condition = "#s = :pending OR (#s = :leased AND #e < :now)"
+        for state in (PENDING, LEASED):
+            candidates = self._candidates(group, state, now)
+            # 子ジョブごとに異なる位置から試し、同じシャードの取り合いを減らす
+            candidates.sort(key=lambda shard: (shard < start, shard))
+            for shard in candidates:
+                try:
+                    response = self.client.update_item(
+                        TableName=self.table_name,
+                        Key=self._key(group, shard),
+                        UpdateExpression=update,
+                        ConditionExpression=condition,
+                        ExpressionAttributeNames=self._names(update, condition),
+                        ExpressionAttributeValues={
+                            ":leased": {"S": LEASED},
+                            ":pending": {"S": PENDING},
+                            ":gs": {"S": group_state(group, LEASED)},
+                            ":owner": {"S": owner},
+                            ":expires": {"N": str(now + lease_seconds)},
+                            ":zero": {"N": "0"},
+                            ":one": {"N": "1"},
+                            ":now": {"N": str(now)},
+                        },
+                        ReturnValues="UPDATED_NEW",
+                    )
+                    return Lease(group, shard, owner, int(response["Attributes"]["attempts"]["N"]))
+                except self.client.exceptions.ConditionalCheckFailedException:
+                    continue
+        return None
+
+    def _update_owned(self, lease: Lease, expression: str, values: Dict[str, Any]) -> bool:
+        condition = "#o = :owner AND #s = :leased"
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key=self._key(lease.group, lease.shard),
+                UpdateExpression=expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=self._names(expression, condition),
+                ExpressionAttributeValues={
+                    ":owner": {"S": lease.owner},
+                    ":leased": {"S": LEASED},
+                    **values,
+                },
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def renew(self, lease: Lease, lease_seconds: float) -> bool:
+        return self._update_owned(
+            lease, "SET #e = :expires", {":expires": {"N": str(time.time() + lease_seconds)}}
+        )
+
+    def complete(self, lease: Lease) -> bool:
+        return self._update_owned(
+            lease,
+            "SET #s = :state, #gs = :gs",
+            {":state": {"S": DONE}, ":gs": {"S": group_state(lease.group, DONE)}},
+        )
+
+    def release(self, lease: Lease, state: str = PENDING) -> bool:
+        return self._update_owned(
+            lease,
+            "SET #s = :state, #gs = :gs, #e = :zero",
+            {
+                ":state": {"S": state},
+                ":gs": {"S": group_state(lease.group, state)},
+                ":zero": {"N": "0"},
+            },
+        )
+
+    def counts(self, group: str) -> Dict[str, int]:
+        # 状態ごとに件数だけを数える（項目は返さない）
+        counts: Dict[str, int] = {}
+        paginator = self.client.get_paginator("query")
+        for state in (PENDING, LEASED, DONE, FAILED):
+            total = sum(
+                page["Count"]
+                for page in paginator.paginate(
+                    TableName=self.table_name,
+                    IndexName=STATE_INDEX,
+                    KeyConditionExpression="#gs = :gs",
+                    ExpressionAttributeNames=self._names("#gs"),
+                    ExpressionAttributeValues={":gs": {"S": group_state(group, state)}},
+                    Select="COUNT",
+                )
+            )
+            if total:
+                counts[state] = total
+        return counts
+
+
+def open_lease_table(url: str):
+    """URL からリーステーブルを開く（sqlite:///path または dynamodb://テーブル名）"""
+    if url.startswith("sqlite://"):
+        return SqliteLeaseTable(url[len("sqlite://"):])
+    if url.startswith("dynamodb://"):
+        return DynamoLeaseTable(url[len("dynamodb://"):])
+    raise ValueError(f"LEASE_TABLE が不正です: {url}（sqlite:///path または dynamodb://テーブル名）")
+
+
+def lease_group() -> str:
+    """
+    リースのグループ（配列ジョブ単位）を返す
+
+    LEASE_GROUP（送信側が配列ジョブ名を設定する）、なければ配列ジョブの親ジョブID。
+    配列の子ジョブのIDは "<親ジョブID>:<インデックス>" の形式。
+    """
+    group = os.environ.get("LEASE_GROUP")
+    if group:
+        return group
+    return os.environ.get("AWS_BATCH_JOB_ID", "local").split(":")[0]
+
+
+class LeaseHeartbeat:
+    """処理中のシャードのリースを定期的に延長するスレッド"""
+
+    def __init__(self, table, lease: Lease, lease_seconds: float):
+        self.table = table
+        self.lease = lease
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        # 有効期間の3分の1ごとに延長し、1回失敗しても間に合うようにする
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.table.renew(self.lease, self.lease_seconds):
+                    # 延長が間に合わず他の子ジョブが取得した。出力は先にコミットした方が採用される
+                    self.lost = True
+                    print(f"シャード {self.lease.shard} のリースを失いました", flush=True)
+                    return
+            except Exception as e:
+                print(f"リースの延長に失敗しました: {e}", flush=True)
+
+    def __enter__(self) -> "LeaseHeartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_leases(
+    table,
+    group: str,
+    count: int,
+    process: Callable[[int], None],
+    shutdown: Optional[GracefulShutdown] = None,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    idle_seconds: float = DEFAULT_IDLE_SECONDS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> List[Dict[str, Any]]:
+    """
+    テーブルが空になるか停止が要求されるまで、シャードを取得して処理する
+
+    取得できるシャードがなくても、他の子ジョブが処理中のシャードが残っていれば、
+    リースの期限切れ（子ジョブの停止）に備えて idle_seconds まで待つ。
+
+    Args:
+        table: リーステーブル
+        group: リースのグループ
+        count: シャード数
+        process: シャード番号を受け取って処理する関数
+        shutdown: SIGTERM の受信状態
+        lease_seconds: リースの有効期間（秒）
+        idle_seconds: 取得できるシャードがないまま待つ時間（秒）
+        max_attempts: 同じシャードの処理を試みる回数の上限
+
+    Returns:
+        処理したシャードの結果（{"shard", "status", "seconds", "error"}）のリスト
+    """
+    job_id = os.environ.get("AWS_BATCH_JOB_ID", f"local-{os.getpid()}")
+    owner = f"{job_id}#{os.environ.get('AWS_BATCH_JOB_ATTEMPT', '1')}"
+    # 子ジョブごとに異なるシャードから取得を始める
+    start = random.Random(owner).randrange(count)
+    poll_seconds = min(10.0, lease_seconds / 4)
+    results = []
+    idle_since = time.monotonic()
+    while not (shutdown and shutdown.requested):
+        lease = table.claim(group, owner, lease_seconds, start)
+        if lease is None:
+            counts = table.counts(group)
+            finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+            if finished >= count:
+                print(f"全 {count} シャードの処理が終わりました（失敗 {counts.get(FAILED, 0)} 件）", flush=True)
+                break
+            if time.monotonic() - idle_since >= idle_seconds:
+                print(
+                    f"{idle_seconds:.0f} 秒間取得できるシャードがないため終了します"
+                    f"（他の子ジョブが処理中 {counts.get(LEASED, 0)} 件）",
+                    flush=True,
+                )
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        started = time.monotonic()
+        error = None
+        with LeaseHeartbeat(table, lease, lease_seconds):
+            try:
+                process(lease.shard)
+            except Exception as e:
+                error = str(e)
+        if error is None:
+            table.complete(lease)
+            status = "SUCCEEDED"
+        elif lease.attempts >= max_attempts:
+            table.release(lease, FAILED)
+            status = "FAILED"
+        else:
+            # 他の子ジョブ（または自分）が後で処理し直す
+            table.release(lease)
+            status = "RELEASED"
+        results.append(
+            {
+                "shard": lease.shard,
+                "status": status,
+                "attempt": lease.attempts,
+                "seconds": round(time.monotonic() - started, 3),
+                "error": error,
+            }
+        )
+        idle_since = time.monotonic()
+    return results
@@ -0,0 +1,533 @@
+"""
+ルックアップ結合モジュール
+
+入力の各行に参照テーブル（商品・顧客などの CSV）の列を付け加える結合ステージ。
+参照テーブルを Python の dict に読み込むと、行数によっては数 GB のメモリを使い、
+ジョブの memory を引き上げる必要がある。ここでは参照テーブルの版（ETag）ごとに1回だけ、
+不変のハッシュインデックスファイルを作り、各ジョブはそれをメモリマップしてバッチ単位で引く。
+同じホストのコンテナはページキャッシュを共有し、ルックアップのためのメモリはほとんど使わない。
+
+インデックスファイルのレイアウト（整数はリトルエンディアン）:
+    ヘッダー     MAGIC, 形式の版, 件数, メタデータの長さ, ハッシュの位置, データの位置
+    メタデータ   JSON（キー列・値の列・区切り文字・元の URI と ETag）
+    ハッシュ     キーの 64 ビットハッシュ（昇順） × 件数
+    オフセット   ハッシュと同じ順序の、データ内のレコードの位置 × 件数
+    データ       レコード（キーの長さ u32, 値の長さ u32, キー, 値）を参照テーブルの順に並べたもの
+
+構築は外部ソートで行う（ハッシュの上位8ビットで256個のバケットに分け、バケットごとに並べ替える）ため、
+構築時のメモリも参照テーブル全体の大きさによらない。同じキーが複数あれば後の行が優先される（dict と同じ）。
+
+インデックスの置き場所:
+    LOOKUP_INDEX_DIR     ローカルの置き場所（省略時は CACHE_DIR/lookup、なければ一時ディレクトリ）
+                         CACHE_DIR/lookup のインデックスはコンテンツキャッシュの上限サイズに含めて LRU で削除する
+    LOOKUP_INDEX_PREFIX  共有の置き場所（s3:// URI またはディレクトリ）。あれば取得し、なければ作ってアップロードする
+
+事前の構築とベンチマーク:
+    python lookup_index.py build --reference s3://bucket/ref/products.csv --key product_id --prefix s3://bucket/lookup-index/
+    python lookup_index.py --bench --rows 1000000
+"""
+import csv
+import fcntl
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from cache import ContentCache
+from storage import download_to, head_etag, is_s3_uri, join_uri, upload_file
+
+MAGIC = b"LKIX"
+FORMAT_VERSION = 1
+
+# MAGIC, 形式の版, 件数, メタデータの長さ, ハッシュの位置, データの位置
+HEADER = struct.Struct("<4sIQQQQ")
+RECORD_HEADER = struct.Struct("<II")
+BUCKET_ENTRY = struct.Struct("<QQ")
+
+# 構築時に分けるバケットの数（ハッシュの上位8ビット）
+BUCKETS = 256
+
+
+def key_hash(key: bytes) -> int:
+    """キーの 64 ビットハッシュ（プロセスによらず同じ値。Python の hash() はプロセスごとに変わる）"""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def _align8(value: int) -> int:
+    return (value + 7) & ~7
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    """ファイルロック（flock）で排他区間を作る。同じホストの別コンテナのプロセスとも排他される"""
+    with open(path, "a+b") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _format_values(values: List[str], delimiter: str) -> str:
+    """値の列を区切り文字でつなぐ（区切り文字や引用符を含む値だけ CSV の規則で引用する）"""
+    if not any(delimiter in value or '"' in value or "\n" in value for value in values):
+        return delimiter.join(values)
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=delimiter, lineterminator="").writerow(values)
+    return buffer.getvalue()
+
+
+def build_index(
+    reference_path: str,
+    output_path: str,
+    key: str,
+    columns: Sequence[str] = (),
+    delimiter: str = ",",
+    source: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    参照テーブル（ヘッダー付きの CSV）からインデックスファイルを作る
+
+    Args:
+        reference_path: 参照テーブルのローカルパス
+        output_path: インデックスファイルのパス（一時ファイルに書いてから置き換える）
+        key: キーの列名
+        columns: 付け加える列名（省略時はキー以外のすべての列）
+        delimiter: 区切り文字
+        source: メタデータに記録する元の参照テーブルの情報
+
+    Returns:
+        レコードの件数
+
+    Raises:
+        ValueError: キーや列が参照テーブルのヘッダーにない場合
+    """
+    work = tempfile.mkdtemp(prefix="lookup-build-", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        data_path = os.path.join(work, "data")
+        buckets = [open(os.path.join(work, f"bucket-{number:03d}"), "wb") for number in range(BUCKETS)]
+        count = 0
+        try:
+            with open(reference_path, "r", encoding="utf-8", newline="") as f, open(data_path, "wb") as data:
+                reader = csv.reader(f, delimiter=delimiter)
+                header = next(reader, None)
+                if header is None:
+                    raise ValueError(f"参照テーブルが空です: {reference_path}")
+                if key not in header:
+                    raise ValueError(f"キーの列 {key} が参照テーブルのヘッダーにありません")
+                value_columns = list(columns) or [name for name in header if name != key]
+                missing = [name for name in value_columns if name not in header]
+                if missing:
+                    raise ValueError(f"列 {missing[0]} が参照テーブルのヘッダーにありません")
+                key_index = header.index(key)
+                value_indexes = [header.index(name) for name in value_columns]
+
+                position = 0
+                for row in reader:
+                    if len(row) <= key_index:
+                        continue
+                    key_bytes = row[key_index].encode("utf-8")
+                    values = [row[index] if index < len(row) else "" for index in value_indexes]
+                    value_bytes = _format_values(values, delimiter).encode("utf-8")
+                    data.write(RECORD_HEADER.pack(len(key_bytes), len(value_bytes)))
+                    data.write(key_bytes)
+                    data.write(value_bytes)
+                    hashed = key_hash(key_bytes)
+                    buckets[hashed >> 56].write(BUCKET_ENTRY.pack(hashed, position))
+                    position += RECORD_HEADER.size + len(key_bytes) + len(value_bytes)
+                    count += 1
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+        meta = json.dumps(
+            {
+                "key": key,
+                "columns": value_columns,
+                "delimiter": delimiter,
+                "source": source or {"path": reference_path},
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        hashes_offset = _align8(HEADER.size + len(meta))
+        data_offset = hashes_offset + count * 16
+        tmp_path = f"{output_path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as out:
+                out.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, len(meta), hashes_offset, data_offset))
+                out.write(meta)
+                out.write(b"\0" * (hashes_offset - HEADER.size - len(meta)))
+                # バケットごとに (ハッシュ, 位置) の順に並べ、ハッシュを書きながら位置を集める
+                offsets = array("Q")
+                for number in range(BUCKETS):
+                    entries = array("Q")
+                    with open(os.path.join(work, f"bucket-{number:03d}"), "rb") as bucket:
+                        entries.frombytes(bucket.read())
+                    pairs = sorted(zip(entries[0::2], entries[1::2]))
+                    out.write(array("Q", [hashed for hashed, _ in pairs]).tobytes())
+                    offsets.extend(position for _, position in pairs)
+                out.write(offsets.tobytes())
+                with open(data_path, "rb") as data:
+                    shutil.copyfileobj(data, out, 8 * 1024 * 1024)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return count
+
+
+class LookupIndex:
+    """インデックスファイルをメモリマップして引く"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        # 開いている間はキャッシュの evict で削除されないよう共有ロックを保持する（cache.pin と同じ）
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_SH)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # 引く位置は入力によって飛ぶため、先読みしない
+        if hasattr(self._mmap, "madvise"):
+            self._mmap.madvise(mmap.MADV_RANDOM)
+        view = memoryview(self._mmap)
+        magic, version, count, meta_length, hashes_offset, data_offset = HEADER.unpack_from(view)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"インデックスファイルの形式が不正です: {path}")
+        self.count = count
+        self.meta = json.loads(bytes(view[HEADER.size:HEADER.size + meta_length]))
+        self.hashes = view[hashes_offset:hashes_offset + count * 8].cast("Q")
+        self.offsets = view[hashes_offset + count * 8:data_offset].cast("Q")
+        self.data = view[data_offset:]
+        self._view = view
+
+    def close(self):
+        for name in ("hashes", "offsets", "data", "_view"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "LookupIndex":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _match(self, position: int, hashed: int, key: bytes) -> Optional[memoryview]:
+        """position から同じハッシュのレコードを調べ、キーが一致する最後のレコードの値を返す"""
+        found = None
+        hashes, offsets, data = self.hashes, self.offsets, self.data
+        while position < self.count and hashes[position] == hashed:
+            offset = offsets[position]
+            key_length, value_length = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            if data[start:start + key_length] == key:
+                found = data[start + key_length:start + key_length + value_length]
+            position += 1
+        return found
+
+    def get(self, key: bytes) -> Optional[memoryview]:
+        """キーの値（列を区切り文字でつないだもの）を返す。なければ None"""
+        hashed = key_hash(key)
+        return self._match(bisect_left(self.hashes, hashed), hashed, key)
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[memoryview]]:
+        """
+        キーの値をまとめて引く
+
+        ハッシュの順に並べてから引き、二分探索の下限を前のキーの位置から始めることで、
+        インデックスのページを前から順に触る。
+        """
+        hashed = [key_hash(key) for key in keys]
+        results: List[Optional[memoryview]] = [None] * len(keys)
+        low = 0
+        for index in sorted(range(len(keys)), key=hashed.__getitem__):
+            low = bisect_left(self.hashes, hashed[index], low)
+            results[index] = self._match(low, hashed[index], keys[index])
+        return results
+
+
+class LookupJoin:
+    """入力のバッチの各行に、キーで引いた参照テーブルの列を付け加える"""
+
+    def __init__(self, index: LookupIndex, input_column: int, missing: str = "empty"):
+        self.index = index
+        self.input_column = input_column
+        self.missing = missing
+        self.delimiter = index.meta["delimiter"].encode("utf-8")
+        # 一致しない行に付ける空の列
+        self.empty = self.delimiter * len(index.meta["columns"])
+        self.matched = 0
+        self.missed = 0
+
+    def _key(self, row: bytes) -> bytes:
+        """行からキーの列を取り出す（キーまでの列に引用符があれば CSV の規則で読む）"""
+        fields = row.split(self.delimiter, self.input_column + 1)
+        if len(fields) <= self.input_column:
+            return b""
+        if not any(b'"' in field for field in fields[: self.input_column + 1]):
+            return fields[self.input_column]
+        # 引用符で囲まれた列は区切り文字や "" でエスケープした引用符を含みうる
+        text = row.decode("utf-8", "surrogateescape")
+        values = next(csv.reader([text], delimiter=self.delimiter.decode("utf-8")), [])
+        if len(values) <= self.input_column:
+            return b""
+        return values[self.input_column].encode("utf-8", "surrogateescape")
+
+    def apply(self, batch) -> bytes:
+        """バッチ（RecordBatch）の各行を結合し、改行区切りの出力を返す"""
+        rows = [bytes(row) for row in batch]
+        keys = [self._key(row) for row in rows]
+        parts: List[Any] = []
+        for row, value in zip(rows, self.index.get_many(keys)):
+            if value is None:
+                self.missed += 1
+                if self.missing == "drop":
+                    continue
+                parts += [row, self.empty, b"\n"]
+            else:
+                self.matched += 1
+                parts += [row, self.delimiter, value, b"\n"]
+        return b"".join(parts)
+
+
+def index_name(uri: str, etag: str, lookup: Dict[str, Any]) -> str:
+    """参照テーブルの URI と版・キーと列ごとに決まるインデックスファイル名"""
+    version = json.dumps(
+        {
+            "etag": etag,
+            "key": lookup["key"],
+            "columns": list(lookup.get("columns") or []),
+            "delimiter": lookup.get("delimiter", ","),
+            "format": FORMAT_VERSION,
+        },
+        sort_keys=True,
+    )
+    uri_key = hashlib.sha256(uri.encode("utf-8")).hexdigest()[:16]
+    return f"{uri_key}-{hashlib.sha256(version.encode('utf-8')).hexdigest()[:16]}.lkix"
+
+
+def local_index_dir() -> str:
+    """ローカルのインデックスの置き場所"""
+    directory = os.environ.get("LOOKUP_INDEX_DIR")
+    if not directory:
+        cache_dir = os.environ.get("CACHE_DIR")
+        directory = os.path.join(cache_dir, "lookup") if cache_dir else os.path.join(tempfile.gettempdir(), "lookup-index")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _touch(path: str) -> bool:
+    """インデックスがあれば更新時刻を更新して True を返す（キャッシュの LRU の順序に使う）"""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@contextmanager
+def _reference_file(uri: str, cache: Optional[ContentCache]) -> Iterator[str]:
+    """参照テーブルのローカルパス（キャッシュがあれば構築の間は削除されないようにする）"""
+    if cache is not None:
+        with cache.pinned(uri) as path:
+            yield path
+        return
+    if not is_s3_uri(uri):
+        yield uri
+        return
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            download_to(uri, f)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def ensure_index(lookup: Dict[str, Any], prefix: Optional[str] = None) -> str:
+    """
+    参照テーブルの現在の版のインデックスファイルのローカルパスを返す
+
+    ローカルになければ、共有の置き場所（prefix）から取得し、そこにもなければ作る。
+    同じホストの複数のコンテナが同時に要求しても、取得・構築は1回だけ行われる。
+
+    Raises:
+        FileNotFoundError: 参照テーブルが存在しない場合
+    """
+    uri = lookup["referenceFile"]
+    etag = head_etag(uri)
+    if etag is None:
+        raise FileNotFoundError(f"参照テーブルが見つかりません: {uri}")
+    name = index_name(uri, etag, lookup)
+    path = os.path.join(local_index_dir(), name)
+    cache = ContentCache.from_env()
+    if _touch(path):
+        return path
+
+    with _locked(f"{path}.lock"):
+        if _touch(path):
+            return path
+        remote = join_uri(prefix, name) if prefix else None
+        if remote and head_etag(remote) is not None:
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                download_to(remote, f)
+            os.replace(tmp_path, path)
+            print(f"ルックアップのインデックスを取得しました: {remote}")
+            if cache is not None:
+                cache.evict(keep=path)
+            return path
+
+        with _reference_file(uri, cache) as reference_path:
+            count = build_index(
+                reference_path,
+                path,
+                lookup["key"],
+                lookup.get("columns") or [],
+                lookup.get("delimiter", ","),
+                source={"uri": uri, "etag": etag},
+            )
+        print(f"ルックアップのインデックスを作りました: {uri} の {count} 件 -> {path}")
+        if remote:
+            # 同じ版からは同じ内容のファイルができるため、競合して上書きしても結果は同じ
+            upload_file(path, remote)
+    if cache is not None:
+        # CACHE_DIR/lookup のインデックスも参照ファイルと同じ上限サイズで管理する
+        cache.evict(keep=path)
+    return path
+
+
+# プロセス内で開いたインデックス（バンドル実行・リース実行で繰り返し開かない）
+_indexes: Dict[str, LookupIndex] = {}
+
+
+def open_join(lookup: Dict[str, Any]) -> LookupJoin:
+    """設定の lookup から結合ステージを作る（インデックスはプロセス内で共有する）"""
+    prefix = os.environ.get("LOOKUP_INDEX_PREFIX")
+    path = ensure_index(lookup, prefix)
+    index = _indexes.get(path)
+    if index is None:
+        try:
+            index = LookupIndex(path)
+        except FileNotFoundError:
+            # 確認してから開くまでの間に別のジョブの evict で削除された場合は取得し直す
+            index = LookupIndex(ensure_index(lookup, prefix))
+        _indexes[path] = index
+    return LookupJoin(index, lookup.get("inputColumn", 0), lookup.get("missing", "empty"))
+
+
+def _bench(rows: int, probes: int, batch_size: int):
+    """dict に読み込む場合とインデックスをメモリマップする場合のメモリと引く速さを比べる"""
+    import random
+    import resource
+    import time
+    import tracemalloc
+
+    work = tempfile.mkdtemp(prefix="lookup-bench-")
+    try:
+        reference = os.path.join(work, "reference.csv")
+        with open(reference, "w", encoding="utf-8") as f:
+            f.write("product_id,name,category,price\n")
+            for i in range(rows):
+                f.write(f"P{i:09d},product-{i},category-{i % 97},{i % 10000 / 100:.2f}\n")
+        random.seed(0)
+        keys = [f"P{random.randrange(rows * 11 // 10):09d}".encode() for _ in range(probes)]
+
+        started = time.perf_counter()
+        path = os.path.join(work, "reference.lkix")
+        build_index(reference, path, "product_id")
+        build_seconds = time.perf_counter() - started
+        max_rss_after_build = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        tracemalloc.start()
+        index = LookupIndex(path)
+        index_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        started = time.perf_counter()
+        found = 0
+        for start in range(0, probes, batch_size):
+            found += sum(value is not None for value in index.get_many(keys[start:start + batch_size]))
+        index_seconds = time.perf_counter() - started
+        index.close()
+
+        tracemalloc.start()
+        table = {}
+        with open(reference, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                table[row[0].encode()] = row[1:]
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        started = time.perf_counter()
+        found_dict = sum(table.get(key) is not None for key in keys)
+        dict_seconds = time.perf_counter() - started
+
+        print(f"参照テーブル {rows} 行（{os.path.getsize(reference) / 1e6:.1f} MB）, 引くキー {probes} 件")
+        print(f"  構築            {build_seconds:8.2f} 秒, ファイル {os.path.getsize(path) / 1e6:.1f} MB, "
+              f"構築後の最大 RSS {max_rss_after_build / 1024:.0f} MB")
+        print(f"  dict            {dict_bytes / 1e6:8.1f} MB, {probes / dict_seconds:>10.0f} 件/秒, 一致 {found_dict}")
+        print(f"  インデックス    {index_bytes / 1e6:8.3f} MB, {probes / index_seconds:>10.0f} 件/秒, 一致 {found}"
+              f"（ヒープ外のページキャッシュはプロセス間で共有）")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ルックアップのインデックスの構築と確認")
+    parser.add_argument("command", nargs="?", choices=["build", "probe"], help="build: 構築 / probe: キーを引く")
+    parser.add_argument("--reference", help="参照テーブル（s3:// URI またはローカルパス）")
+    parser.add_argument("--key", help="キーの列名")
+    parser.add_argument("--columns", nargs="+", default=[], help="付け加える列名（省略時はキー以外のすべて）")
+    parser.add_argument("--delimiter", default=",", help="区切り文字")
+    parser.add_argument("--prefix", help="インデックスをアップロードする共有の置き場所（LOOKUP_INDEX_PREFIX と同じ）")
+    parser.add_argument("--index", help="probe で引くインデックスファイル")
+    parser.add_argument("keys", nargs="*", help="probe で引くキー")
+    parser.add_argument("--bench", action="store_true", help="dict とインデックスのメモリと速さを比べる")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="ベンチマークの参照テーブルの行数")
+    parser.add_argument("--probes", type=int, default=500_000, help="ベンチマークで引くキーの数")
+    parser.add_argument("--batch-size", type=int, default=64, help="ベンチマークで1回に引くキーの数")
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args.rows, args.probes, args.batch_size)
+    elif args.command == "build":
+        if not args.reference or not args.key:
+            parser.error("build には --reference と --key が必要です")
+        lookup = {
+            "referenceFile": args.reference,
+            "key": args.key,
+            "columns": args.columns,
+            "delimiter": args.delimiter,
+        }
+        print(ensure_index(lookup, args.prefix or os.environ.get("LOOKUP_INDEX_PREFIX")))
+    elif args.command == "probe":
+        if not args.index:
+            parser.error("probe には --index が必要です")
+        with LookupIndex(args.index) as index:
+            print(f"{len(index)} 件, 列: {', '.join(index.meta['columns'])}")
+            for key, value in zip(args.keys, index.get_many([key.encode("utf-8") for key in args.keys])):
+                print(f"{key}\t{bytes(value).decode('utf-8') if value is not None else '(なし)'}")
+    else:
+        parser.error("build / probe / --bench のいずれかを指定してください")
+
+
+if __name__ == "__main__":
+    main()
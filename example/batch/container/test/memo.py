@@ -0,0 +1,114 @@
+"""
+処理結果のメモ化モジュール
+
+夜間の定期実行では、入力の大半が前回の実行から変わっていないことが多い。
+(入力の ETag, 設定のハッシュ, コードのバージョン, シャード) から作るフィンガープリントを
+キーに、コミットしたシャードの出力ファイルを結果インデックスに記録しておき、
+同じキーのシャードは入力をダウンロードも処理もせず、前回の出力ファイルを参照する
+マニフェストをコミットする。処理量は前回から変わった入力の分だけになる。
+
+結果インデックスのレイアウト（MEMO_INDEX は s3:// URI またはローカルのディレクトリ）:
+    <MEMO_INDEX>/<キーの先頭2文字>/<キー>.json
+
+送信側 memo.py も同じ規則でキーを計算し、変更のないアイテムをジョブを送らずにコミットする。
+キーの規則（設定のハッシュ・フィンガープリント・ETag）は両側が memo_keys.py を共有する。
+
+環境変数:
+    MEMO_INDEX    結果インデックスの場所。未設定ならメモ化しない
+    CODE_VERSION  コードのバージョン。未設定ならこのディレクトリの *.py の内容のハッシュ
+"""
+import json
+import os
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# キーの規則は送信側と共有する memo_keys.py に置く（config_hash などはこのモジュールからも参照できる）
+from memo_keys import UNHASHED_FIELDS, config_hash, fingerprint, reference_uris, source_version  # noqa: F401
+from storage import head_etag, join_uri, read_bytes, write_bytes
+
+
+@lru_cache(maxsize=1)
+def code_version(source_dir: Optional[str] = None) -> str:
+    """
+    コードのバージョンを返す
+
+    CODE_VERSION が設定されていればその値、なければ source_dir（省略時はこのモジュールの
+    ディレクトリ）の *.py のファイル名と内容のハッシュ。コードを変更すると別のキーになる。
+    """
+    version = os.environ.get("CODE_VERSION")
+    if version:
+        return version
+    return source_version(source_dir or os.path.dirname(os.path.abspath(__file__)))
+
+
+def output_options() -> Dict[str, str]:
+    """出力の内容に影響する環境変数"""
+    return {
+        "codec": os.environ.get("OUTPUT_CODEC", "auto").lower(),
+        "level": os.environ.get("OUTPUT_COMPRESSION_LEVEL", ""),
+    }
+
+
+class ResultIndex:
+    """フィンガープリントからコミット済みの出力ファイルを引く結果インデックス"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultIndex"]:
+        """MEMO_INDEX が設定されていればインデックスを開く。未設定の場合は None"""
+        root = os.environ.get("MEMO_INDEX")
+        return cls(root) if root else None
+
+    def entry_uri(self, key: str) -> str:
+        return join_uri(self.root, key[:2], f"{key}.json")
+
+    def key_for(self, config: Dict[str, Any], shard_index: int, shard_count: int) -> Optional[str]:
+        """
+        設定とシャードのキーを計算する
+
+        入力または参照ファイルが存在しない場合は None（メモ化せず通常どおり処理してエラーにする）
+        """
+        input_etag = head_etag(config["inputFile"])
+        reference_etags = [head_etag(uri) for uri in reference_uris(config)]
+        if input_etag is None or None in reference_etags:
+            return None
+        return fingerprint(
+            input_etag,
+            config_hash(config),
+            code_version(),
+            shard_index,
+            shard_count,
+            reference_etags,
+            output_options(),
+        )
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        キーの記録を返す
+
+        記録があっても出力ファイルが1つでも削除されていれば再利用できないため None を返す。
+        """
+        data = read_bytes(self.entry_uri(key))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        if any(head_etag(file["uri"]) is None for file in entry["files"]):
+            return None
+        return entry
+
+    def record(self, key: str, config: Dict[str, Any], result: Dict[str, Any], files: List[Dict[str, Any]]):
+        """コミットしたシャードの出力ファイルを記録する（同じキーは新しい記録で上書きする）"""
+        entry = {
+            "key": key,
+            "inputFile": config["inputFile"],
+            "outputPath": config["outputPath"],
+            "codeVersion": code_version(),
+            "jobId": os.environ.get("AWS_BATCH_JOB_ID", f"local-{os.getpid()}"),
+            "result": result,
+            "files": files,
+            "recordedAt": datetime.now(timezone.utc).isoformat(),
+        }
+        write_bytes(self.entry_uri(key), json.dumps(entry, ensure_ascii=False, indent=2).encode("utf-8"))
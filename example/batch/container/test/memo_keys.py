@@ -0,0 +1,168 @@
+"""
+結果インデックスとシャードのマニフェストのキーの規則
+
+コンテナ側（memo.py / committer.py）と送信側（job/version_test/memo.py）が同じキーを計算するよう、
+規則はこのモジュールだけに置く。送信側は config.MEMO_CONFIG["source_dir"] からこのファイルを読み込むため、
+標準ライブラリ以外を import しないこと。
+
+設定のデフォルト値（SETTINGS_DEFAULTS / LOOKUP_DEFAULTS）は models.py のモデルもここから取るため、
+送信側が補うデフォルト値とコンテナが検証後に得る値はずれない。
+"""
+import glob
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# JobSettings のデフォルト値（models.py のフィールドのデフォルトもこの値を使う）
+SETTINGS_DEFAULTS: Dict[str, Any] = {
+    "batchSize": 64,
+    "modelType": "classification",
+    "maxIterations": 100,
+    "learningRate": 0.01,
+}
+
+# LookupSettings の省略可能な項目のデフォルト値
+LOOKUP_DEFAULTS: Dict[str, Any] = {
+    "inputColumn": 0,
+    "columns": [],
+    "missing": "empty",
+    "delimiter": ",",
+}
+
+# LookupSettings の必須の項目と Metadata の項目（検証後の設定に残る入れ子の項目）
+LOOKUP_REQUIRED = ("referenceFile", "key")
+METADATA_FIELDS = ("jobType", "version", "description")
+
+# 設定のハッシュから除く項目（入力は ETag、参照ファイルはそれぞれの ETag でキーに含める）
+UNHASHED_FIELDS = ("inputFile", "outputPath", "referenceFiles", "cacheInput")
+
+# アイテムIDに含めない項目（出力の内容に影響しない実行時の選択）
+UNIDENTIFIED_FIELDS = ("cacheInput",)
+
+
+def split_s3_uri(uri: str) -> Tuple[str, str]:
+    """s3://bucket/key をバケット名とキーに分割する"""
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def join_uri(base: str, *parts: str) -> str:
+    """URI またはパスに要素を連結する"""
+    return "/".join([base.rstrip("/")] + [part.strip("/") for part in parts])
+
+
+def head_etag(uri: str, s3_client: Callable[[], Any]) -> Optional[str]:
+    """
+    オブジェクトのバージョンを識別する値を返す
+
+    S3 では ETag、ローカルパスではサイズと更新時刻から作る。存在しない場合は None
+    """
+    if uri.startswith("s3://"):
+        bucket, key = split_s3_uri(uri)
+        client = s3_client()
+        try:
+            return client.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+        except client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+    try:
+        stat = os.stat(uri)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def source_version(source_dir: str) -> str:
+    """source_dir の *.py のファイル名と内容のハッシュ（コードを変更すると別のキーになる）"""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.py"))):
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def normalize_config(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    送信前の作業アイテムを、コンテナが検証後に得る設定の辞書（run_batch.config_dict）と同じ形にする
+
+    省略された項目にデフォルト値を補い、入れ子のモデルが無視する未知の項目を除く。
+    検証後の設定に適用しても変わらない。
+    """
+    normalized = dict(item)
+    settings = {**SETTINGS_DEFAULTS, **(item.get("settings") or {})}
+    normalized["settings"] = {name: settings[name] for name in SETTINGS_DEFAULTS}
+    normalized["settings"]["learningRate"] = float(normalized["settings"]["learningRate"])
+    if isinstance(item.get("metadata"), dict):
+        metadata = item["metadata"]
+        normalized["metadata"] = {name: metadata[name] for name in METADATA_FIELDS if name in metadata}
+    normalized.setdefault("referenceFiles", [])
+    if item.get("lookup"):
+        lookup = {**LOOKUP_DEFAULTS, **item["lookup"]}
+        fields = LOOKUP_REQUIRED + tuple(LOOKUP_DEFAULTS)
+        normalized["lookup"] = {name: lookup[name] for name in fields if name in lookup}
+    return normalized
+
+
+def _digest(fields: Dict[str, Any], excluded: Tuple[str, ...]) -> bytes:
+    kept = {name: value for name, value in fields.items() if name not in excluded and value is not None}
+    return json.dumps(kept, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def config_hash(config: Dict[str, Any]) -> str:
+    """入力と出力先を除いた設定のハッシュを返す（キーの順序によらない。値が null の省略可能な項目は除く）"""
+    return hashlib.sha256(_digest(config, UNHASHED_FIELDS)).hexdigest()
+
+
+def item_id(config: Dict[str, Any]) -> str:
+    """
+    作業アイテムの識別子
+
+    バンドル実行では複数のアイテムが同じ outputPath を使い、同じ入力を設定を変えて処理することもあるため、
+    シャードのマニフェストとステージング領域は検証後の設定全体（入力・出力先・処理設定・参照ファイル）で分ける。
+    キーの順序によらず、値が null の省略可能な項目は除く。
+    """
+    return hashlib.blake2b(_digest(config, UNIDENTIFIED_FIELDS), digest_size=8).hexdigest()
+
+
+def reference_uris(config: Dict[str, Any]) -> List[str]:
+    """出力の内容に影響する参照ファイル（referenceFiles とルックアップ結合の参照テーブル）"""
+    uris = list(config.get("referenceFiles") or [])
+    if config.get("lookup"):
+        uris.append(config["lookup"]["referenceFile"])
+    return uris
+
+
+def fingerprint(
+    input_etag: str,
+    config_digest: str,
+    version: str,
+    shard_index: int,
+    shard_count: int,
+    reference_etags: List[str],
+    options: Dict[str, str],
+) -> str:
+    """結果インデックスのキーを返す"""
+    payload = json.dumps(
+        {
+            "input": input_etag,
+            "config": config_digest,
+            "code": version,
+            "shard": [shard_index, shard_count],
+            "references": reference_etags,
+            "output": options,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def shard_manifest_uri(config: Dict[str, Any], run: str, shard_index: int, shard_count: int) -> str:
+    """シャードのマニフェストの URI"""
+    return join_uri(
+        config["outputPath"], "_shards", item_id(config), run, f"shard-{shard_index:05d}-of-{shard_count:05d}.json"
+    )
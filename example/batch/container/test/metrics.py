@@ -0,0 +1,448 @@
+"""
+メトリクスモジュール
+
+処理した行数・バッチの処理時間・読み書きしたバイト数・メモリ使用量（RSS）を
+カウンタ・ゲージ・ヒストグラムとして集計し、終了時に最終的な値を
+Pushgateway 互換のエンドポイントに送る（バッチジョブはスクレイプされる前に終了するため）。
+containerOverrides の環境変数 PUSHGATEWAY_URL または METRICS で有効にする。
+
+ホットループ（process_batches のバッチごとの処理）で行うのは一定間隔で抜き出したバッチの
+処理時間の記録だけで、行数とバイト数はループの外でまとめて加算する。オーバーヘッドは
+    python metrics.py --benchmark
+で確認できる（バッチ1個あたりの記録の関数1回の時間が、バッチの処理時間の 1% 未満であること）。
+
+Pushgateway の代わりに、送信側の metrics.py --standin でローカルの受け口を起動できる。
+
+環境変数:
+    PUSHGATEWAY_URL  送信先（例: http://pushgateway:9091）。未設定なら送らず、ログに出力する
+    METRICS          on で有効（PUSHGATEWAY_URL を設定した場合は省略可）/ off で無効
+    METRICS_JOB      グループのジョブ名（デフォルト awa-batch）。インスタンスはジョブIDと試行回数
+    METRICS_BATCH_SAMPLE  バッチの処理時間を記録する間隔（デフォルト 16 バッチに1回。1 ですべて）
+
+使用例:
+    PUSHGATEWAY_URL=http://localhost:9091 CONFIG='{...}' python run_batch.py
+"""
+import os
+import resource
+import sys
+import time
+import urllib.parse
+import urllib.request
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# バッチの処理時間のヒストグラムの境界（秒）
+BATCH_SECONDS_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Pushgateway が受け付ける Prometheus のテキスト形式
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """メトリクスの系列（ラベルの組み合わせごとの値）をまとめて持つ"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[LabelKey, object] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調に増える値（表示名に _total を付ける）"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        return [f"{self.name}_total{_labels(key)} {_number(value)}" for key, value in self.values.items()]
+
+
+class Gauge(_Metric):
+    """任意に上下する値"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        return [f"{self.name}{_labels(key)} {_number(value)}" for key, value in self.values.items()]
+
+
+class Histogram(_Metric):
+    """
+    境界ごとの件数・合計・件数を持つヒストグラム
+
+    observe はバケットの件数を累積せずに持ち、出力時に累積する（ホットループで呼ぶため）。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def series(self, **labels: str) -> List[float]:
+        """ラベルの組み合わせの [境界ごとの件数..., +Inf の件数, 合計]"""
+        key = self._key(labels)
+        values = self.values.get(key)
+        if values is None:
+            values = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        return values  # type: ignore[return-value]
+
+    def observe(self, value: float, **labels: str):
+        values = self.series(**labels)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        lines = []
+        for key, values in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):  # type: ignore[index]
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {_number(values[-1])}")  # type: ignore[index]
+        return lines
+
+
+class Registry:
+    """メトリクスの登録と出力"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter(name, help_text))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge(name, help_text))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float]) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets))  # type: ignore[return-value]
+
+    def render(self, openmetrics: bool = True) -> str:
+        """
+        テキスト形式で出力する
+
+        openmetrics=False の場合は Prometheus のテキスト形式（Pushgateway 用。カウンタの TYPE 行の名前に
+        _total を含め、末尾の # EOF を付けない）。
+        """
+        lines = []
+        for metric in self.metrics.values():
+            if not metric.values:
+                continue
+            name = metric.name
+            if metric.kind == "counter" and not openmetrics:
+                name += "_total"
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines += metric.samples(openmetrics)
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def push(url: str, job: str, grouping: Dict[str, str], body: str, timeout: float = 10):
+    """
+    Pushgateway 互換のエンドポイントにグループの値を送る（同じグループの値は置き換える）
+
+    パスは /metrics/job/<ジョブ名>/<ラベル>/<値>...。値に / などを含めてもよいよう、すべてエスケープする。
+    """
+    path = "/metrics/job/" + urllib.parse.quote(job, safe="")
+    for name, value in grouping.items():
+        path += f"/{name}/{urllib.parse.quote(value, safe='')}"
+    request = urllib.request.Request(
+        url.rstrip("/") + path,
+        data=body.encode("utf-8"),
+        method="PUT",
+        headers={"Content-Type": TEXT_CONTENT_TYPE},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+def current_rss_bytes() -> Optional[int]:
+    """現在の RSS（Linux 以外では取得できないため None）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class JobMetrics:
+    """コンテナのメトリクス"""
+
+    def __init__(self, pushgateway: Optional[str] = None, job: str = "awa-batch", sample_every: int = 16):
+        self.pushgateway = pushgateway
+        self.job = job
+        self.sample_every = max(1, sample_every)
+        self.registry = Registry()
+        registry = self.registry
+        self.rows = registry.counter("batch_job_rows", "処理した行数")
+        self.bytes_read = registry.counter("batch_job_read_bytes", "処理した入力のバイト数（展開後）")
+        self.bytes_written = registry.counter("batch_job_written_bytes", "書き出した出力のバイト数（圧縮後）")
+        self.compute_seconds = registry.counter("batch_job_compute_seconds", "バッチ処理にかかった時間（秒）")
+        self.shards = registry.counter("batch_job_shards", "結果ごとのシャード数（COMMITTED / LOST / REUSED）")
+        self.batch_seconds = registry.histogram(
+            "batch_job_batch_seconds", "1バッチの読み込みと処理にかかった時間（秒）", BATCH_SECONDS_BUCKETS
+        )
+        self.rows_per_second = registry.gauge("batch_job_rows_per_second", "バッチ処理の行数/秒")
+        self.rss = registry.gauge("batch_job_rss_bytes", "終了時の RSS（バイト）")
+        self.max_rss = registry.gauge("batch_job_max_rss_bytes", "RSS の最大値（バイト）")
+        self.seconds = registry.gauge("batch_job_seconds", "ジョブの開始から終了までの時間（秒）")
+        self._started = time.perf_counter()
+
+    @classmethod
+    def from_env(cls) -> Optional["JobMetrics"]:
+        """PUSHGATEWAY_URL または METRICS=on が設定されていれば JobMetrics を作る。無効なら None"""
+        pushgateway = os.environ.get("PUSHGATEWAY_URL") or None
+        enabled = os.environ.get("METRICS", "on" if pushgateway else "off").lower()
+        if enabled in ("off", "false", "0", ""):
+            return None
+        return cls(
+            pushgateway,
+            os.environ.get("METRICS_JOB", "awa-batch"),
+            int(os.environ.get("METRICS_BATCH_SAMPLE", "16")),
+        )
+
+    def batch_timer(self) -> Callable[[], None]:
+        """
+        バッチの処理時間を記録する関数を返す（ループの各バッチの最後に呼ぶ）
+
+        時刻の取得と二分探索は1回で数百ナノ秒かかり、小さいバッチでは処理時間の 1% を超えるため、
+        sample_every 個ごとに1個のバッチだけを記録する（ヒストグラムの件数は記録したバッチの数）。
+        記録しない呼び出しはカウンタを減らして比べるだけにする。
+        """
+        values = self.batch_seconds.series()
+        buckets = self.batch_seconds.buckets
+        clock = time.perf_counter
+        every = self.sample_every
+        remaining = every
+        last = 0.0
+
+        def tick():
+            nonlocal remaining, last
+            remaining -= 1
+            if remaining > 1:
+                return
+            if remaining == 1:
+                # 次のバッチの開始時刻
+                last = clock()
+                return
+            elapsed = clock() - last
+            remaining = every
+            values[bisect_left(buckets, elapsed)] += 1
+            values[-1] += elapsed
+
+        if every == 1:
+
+            def tick_every():
+                nonlocal last
+                now = clock()
+                if last:
+                    values[bisect_left(buckets, now - last)] += 1
+                    values[-1] += now - last
+                last = now
+
+            return tick_every
+        return tick
+
+    def record_shard(self, status: str, rows: int, nbytes: int, written: int, seconds: float):
+        """シャード1件の処理結果を加算する"""
+        self.shards.inc(status=status)
+        self.rows.inc(rows)
+        self.bytes_read.inc(nbytes)
+        self.bytes_written.inc(written)
+        self.compute_seconds.inc(seconds)
+
+    def snapshot(self):
+        """終了時の値（処理速度・メモリ使用量・経過時間）を計算する"""
+        compute_seconds = self.compute_seconds.value()
+        if compute_seconds > 0:
+            self.rows_per_second.set(round(self.rows.value() / compute_seconds, 3))
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.rss.set(rss)
+        # ru_maxrss は Linux ではキロバイト、macOS ではバイト
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.max_rss.set(max_rss if sys.platform == "darwin" else max_rss * 1024)
+        self.seconds.set(round(time.perf_counter() - self._started, 3))
+
+    def grouping(self) -> Dict[str, str]:
+        """Pushgateway のグループ（ジョブIDと試行回数ごとに分け、リトライで前の試行の値を消さない）"""
+        return {
+            "instance": os.environ.get("AWS_BATCH_JOB_ID", f"local-{os.getpid()}"),
+            "attempt": os.environ.get("AWS_BATCH_JOB_ATTEMPT", "1"),
+        }
+
+    def finish(self):
+        """最終的な値を計算して送る。送信先がなければログに出力する"""
+        self.snapshot()
+        if not self.pushgateway:
+            print("\n=== メトリクス ===")
+            print(self.registry.render(), end="", flush=True)
+            return
+        push(self.pushgateway, self.job, self.grouping(), self.registry.render(openmetrics=False))
+        print(f"メトリクスを送信しました: {self.pushgateway}")
+
+
+# 実行中のメトリクス（無効な場合は None）
+_active: Optional[JobMetrics] = None
+
+
+def start_from_env() -> Optional[JobMetrics]:
+    """PUSHGATEWAY_URL または METRICS が有効ならメトリクスの集計を開始する"""
+    global _active
+    _active = JobMetrics.from_env()
+    return _active
+
+
+def active() -> Optional[JobMetrics]:
+    """実行中のメトリクス。無効なら None"""
+    return _active
+
+
+def finish():
+    """実行中のメトリクスの最終的な値を送る"""
+    global _active
+    if _active is None:
+        return
+    job_metrics, _active = _active, None
+    try:
+        job_metrics.finish()
+    except Exception as e:
+        # メトリクスの送信に失敗してもジョブは失敗させない
+        print(f"メトリクスの送信に失敗しました: {e}", file=sys.stderr)
+
+
+def benchmark(rows: int = 1_000_000, batch_size: int = 64, repeat: int = 31) -> Dict[str, float]:
+    """
+    process_batches と同じ形のループで、バッチの処理時間を記録する場合としない場合を比べる
+
+    入力は一時ファイルに書き、MmapRecordReader で読み、出力は /dev/null に書く。
+    判定に使う tickOverhead は、記録の関数1回の時間（timeit の最小値）をバッチ1個の処理時間で割ったもの。
+    ループの中ではバッチごとに1回だけ呼ぶため、ループ全体の時間を比べるよりぶれが小さい。
+    ループ全体の時間は実行ごとに数十 % ぶれることがあるため、計測ありとなしを隣り合わせで
+    repeat 組実行し（組ごとに順番を入れ替えて先に実行した側の有利・不利を打ち消す）、
+    組ごとの時間の比の中央値も参考として overhead で返す。
+    """
+    import statistics
+    import tempfile
+    import timeit
+
+    from reader import MmapRecordReader
+
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"id,value,label\n")
+        for start in range(0, rows, 100_000):
+            f.write(b"".join(b"%d,%d,label-%d\n" % (i, i * 7, i % 13) for i in range(start, min(rows, start + 100_000))))
+
+    def run(tick: Optional[Callable[[], None]]) -> Tuple[float, int]:
+        batches = 0
+        with MmapRecordReader(path, skip_header=True) as reader, open(os.devnull, "wb") as out:
+            started = time.perf_counter()
+            batch = None
+            for batch in reader.iter_batches(batch_size):
+                out.write(batch.data)
+                batches += 1
+                if tick is not None:
+                    tick()
+            batch = None
+            return time.perf_counter() - started, batches
+
+    try:
+        job_metrics = JobMetrics()
+        baseline, instrumented, ratios = [], [], []
+        batches = 0
+        # 1回目はページキャッシュを温めるために捨てる
+        run(None)
+        for index in range(repeat):
+            if index % 2:
+                plain, batches = run(None)
+                timed = run(job_metrics.batch_timer())[0]
+            else:
+                timed = run(job_metrics.batch_timer())[0]
+                plain, batches = run(None)
+            baseline.append(plain)
+            instrumented.append(timed)
+            ratios.append(timed / plain - 1)
+    finally:
+        os.remove(path)
+    tick = JobMetrics().batch_timer()
+    tick_seconds = min(timeit.repeat(tick, number=100_000, repeat=7)) / 100_000
+    batch_seconds = statistics.median(baseline) / batches
+    quartiles = statistics.quantiles(ratios, n=4)
+    return {
+        "rows": rows,
+        "batchSize": batch_size,
+        "batches": batches,
+        "repeat": repeat,
+        "batchMicroseconds": round(batch_seconds * 1e6, 3),
+        "tickNanoseconds": round(tick_seconds * 1e9, 1),
+        "tickOverhead": round(tick_seconds / batch_seconds, 5),
+        "baselineSeconds": round(statistics.median(baseline), 4),
+        "instrumentedSeconds": round(statistics.median(instrumented), 4),
+        "overhead": round(statistics.median(ratios), 4),
+        "overheadQuartiles": [round(quartiles[0], 4), round(quartiles[2], 4)],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="メトリクスの計測のオーバーヘッドを確認する")
+    parser.add_argument("--benchmark", action="store_true", help="ホットループのオーバーヘッドを計測する")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="ベンチマークの行数")
+    parser.add_argument("--batch-size", type=int, default=64, help="ベンチマークのバッチサイズ")
+    parser.add_argument("--repeat", type=int, default=31, help="計測ありとなしのループを実行する組数")
+    args = parser.parse_args()
+    if not args.benchmark:
+        parser.error("--benchmark を指定してください")
+    result = benchmark(args.rows, args.batch_size, args.repeat)
+    print(json.dumps(result))
+    # バッチ1個あたりの記録の時間が、バッチの処理時間の 1% 未満であること
+    sys.exit(0 if result["tickOverhead"] < 0.01 else 1)
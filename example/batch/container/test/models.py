@@ -0,0 +1,95 @@
+"""
+CONFIG の設定モデル
+
+pydantic のモデルがスキーマの定義元。fastconfig.py は import 時にこのモデルから軽量な検証関数を作る。
+"""
+import json
+import os
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+
+# デフォルト値は送信側（memo_keys.normalize_config）と共有する
+from memo_keys import LOOKUP_DEFAULTS, SETTINGS_DEFAULTS
+
+
+# CONFIG パラメータ
+# {
+#   "inputFile": "s3://example-bucket/input/data.csv",
+#   "outputPath": "s3://example-bucket/output/",
+#   "settings": {
+#     "batchSize": 64,
+#     "modelType": "classification",
+#     "maxIterations": 100,
+#     "learningRate": 0.01
+#   },
+#   "metadata": {
+#     "jobType": "batch-processing",
+#     "version": "1.0.0",
+#     "description": "サンプルバッチ処理ジョブ"
+#   }
+# }
+
+
+class JobSettings(BaseModel):
+    """バッチジョブの処理設定"""
+    batchSize: int = SETTINGS_DEFAULTS["batchSize"]
+    modelType: Literal["classification"] = SETTINGS_DEFAULTS["modelType"]
+    maxIterations: int = SETTINGS_DEFAULTS["maxIterations"]
+    learningRate: float = SETTINGS_DEFAULTS["learningRate"]
+
+
+class Metadata(BaseModel):
+    """ジョブのメタデータ情報"""
+    jobType: str
+    version: str
+    description: str
+
+
+class LookupSettings(BaseModel):
+    """ルックアップ結合の設定（参照テーブルの列を入力の各行に付け加える）"""
+    referenceFile: str
+    key: str
+    inputColumn: int = LOOKUP_DEFAULTS["inputColumn"]
+    columns: List[str] = LOOKUP_DEFAULTS["columns"]
+    missing: Literal["empty", "drop"] = LOOKUP_DEFAULTS["missing"]
+    delimiter: str = LOOKUP_DEFAULTS["delimiter"]
+
+
+class BatchJobConfig(BaseSettings):
+    """バッチ処理ジョブの設定"""
+    inputFile: str
+    outputPath: str
+    settings: JobSettings
+    metadata: Metadata
+    referenceFiles: List[str] = []
+    lookup: Optional[LookupSettings] = None
+    # 入力ファイルもホスト共有キャッシュに置くか（省略時は環境変数 CACHE_INPUTS）
+    cacheInput: Optional[bool] = None
+    
+    @classmethod
+    def from_env(cls, env_var_name: str = "CONFIG"):
+        """
+        環境変数からJSONを読み込んでモデルを生成する
+        
+        Args:
+            env_var_name: JSONを含む環境変数名
+            
+        Returns:
+            BatchJobConfig: 設定モデル
+            
+        Raises:
+            ValueError: 環境変数が見つからないか、JSONとして無効な場合
+        """
+        json_str = os.environ.get(env_var_name)
+        if not json_str:
+            raise ValueError(f"環境変数 {env_var_name} が設定されていません")
+            
+        try:
+            config_dict = json.loads(json_str)
+            return cls(**config_dict)
+        except json.JSONDecodeError:
+            raise ValueError(f"環境変数 {env_var_name} に有効なJSONが含まれていません")
+        except Exception as e:
+            raise ValueError(f"設定の解析中にエラーが発生しました: {str(e)}")
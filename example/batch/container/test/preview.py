@@ -0,0 +1,224 @@
+"""
+プレビュー実行モジュール
+
+新しい parameters.json を確かめるために入力全体を処理すると時間がかかる。
+環境変数 PREVIEW が設定されていれば、入力の決まった一部（標本）だけを処理し、
+標本での処理速度と RSS から、入力全体を処理した場合の実行時間とメモリを見積もる。
+
+PREVIEW の形式（同じ入力と設定からは常に同じ標本を取る）:
+    head:N       先頭の N 行
+    reservoir:N  入力全体から N 行（リザーバーサンプリング。PREVIEW_SEED で乱数の種を変えられる）
+    every:K      入力を PREVIEW_PIECES 個（デフォルト 256）のバイト範囲に分け、K 個ごとに1つ処理する
+                 （圧縮された入力ではバッチ番号が K の倍数のバッチ）
+
+送信側 preview_job.py が PREVIEW_RESULT 行から見積もりを読み取る。
+"""
+import math
+import random
+import time
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from metrics import current_rss_bytes
+from reader import MmapRecordReader, RecordBatch, StreamRecordReader
+
+PREVIEW_MODES = ("head", "reservoir", "every")
+
+# every:K で入力を分けるバイト範囲の数
+DEFAULT_PIECES = 256
+
+# リザーバーサンプリングで入力を走査するバッチのレコード数
+SCAN_BATCH_SIZE = 4096
+
+# 標本の後半の RSS の増加がこれより小さければ、入力に比例して増えないとみなす
+GROWTH_NOISE_BYTES = 4 * 1024 * 1024
+
+
+def parse_spec(spec: str) -> Tuple[str, int]:
+    """
+    PREVIEW の値を (モード, 数) に変換する
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    mode, _, value = spec.partition(":")
+    if mode not in PREVIEW_MODES:
+        raise ValueError(f"PREVIEW のモードは {PREVIEW_MODES} のいずれかである必要があります: {spec}")
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"PREVIEW は <モード>:<正の整数> の形式である必要があります: {spec}")
+    if number <= 0:
+        raise ValueError(f"PREVIEW は <モード>:<正の整数> の形式である必要があります: {spec}")
+    return mode, number
+
+
+def head_batches(batches: Iterator[RecordBatch], rows: int) -> Iterator[RecordBatch]:
+    """先頭の rows 行だけを返す（最後のバッチは途中で切る）"""
+    remaining = rows
+    for batch in batches:
+        if len(batch) >= remaining:
+            end = batch.offsets[remaining]
+            yield RecordBatch(batch.data[:end], batch.offsets[:remaining + 1], batch.start)
+            return
+        yield batch
+        remaining -= len(batch)
+
+
+def reservoir_batches(
+    batches: Iterator[RecordBatch], rows: int, batch_size: int, seed: int = 0
+) -> List[RecordBatch]:
+    """
+    入力全体から rows 行を一様に選び、入力での順序のまま batch_size 行ずつのバッチにする
+
+    次に置き換える行の番号を乱数で飛ばして決める（Algorithm L）ため、置き換えない行は
+    取り出さない。選んだ行はコピーする（標本は小さい前提）。同じ入力と種からは同じ行を選ぶ。
+    """
+    rng = random.Random(seed)
+    sample: List[Tuple[int, bytes]] = []
+    weight = math.exp(math.log(rng.random()) / rows)
+    next_index = rows + int(math.log(rng.random()) / math.log(1 - weight))
+    seen = 0
+    for batch in batches:
+        count = len(batch)
+        for index in range(min(count, rows - seen) if seen < rows else 0):
+            sample.append((seen + index, bytes(batch[index])))
+        while next_index < seen + count:
+            sample[rng.randrange(rows)] = (next_index, bytes(batch[next_index - seen]))
+            weight *= math.exp(math.log(rng.random()) / rows)
+            next_index += int(math.log(rng.random()) / math.log(1 - weight)) + 1
+        seen += count
+    sample.sort()
+
+    result = []
+    for begin in range(0, len(sample), batch_size):
+        records = [record for _, record in sample[begin:begin + batch_size]]
+        offsets = array("Q", [0])
+        for record in records:
+            offsets.append(offsets[-1] + len(record) + 1)
+        data = b"".join(record + b"\n" for record in records)
+        result.append(RecordBatch(memoryview(data), offsets, sample[begin][0]))
+    return result
+
+
+def sample_mmap(
+    reader: MmapRecordReader, mode: str, number: int, batch_size: int, seed: int = 0, pieces: int = DEFAULT_PIECES
+) -> Iterator[RecordBatch]:
+    """メモリマップした入力から標本のバッチを返す"""
+    if mode == "head":
+        yield from head_batches(reader.iter_batches(batch_size), number)
+    elif mode == "every":
+        for piece in range(0, pieces, number):
+            start, end = reader.shard_range(piece, pieces)
+            yield from reader.iter_batches(batch_size, start, end)
+    else:
+        yield from reservoir_batches(reader.iter_batches(SCAN_BATCH_SIZE), number, batch_size, seed)
+
+
+def sample_stream(
+    reader: StreamRecordReader, mode: str, number: int, batch_size: int, seed: int = 0
+) -> Iterator[RecordBatch]:
+    """展開しながら読む入力から標本のバッチを返す"""
+    if mode == "head":
+        yield from head_batches(reader.iter_batches(batch_size), number)
+    elif mode == "every":
+        yield from reader.iter_batches(batch_size, 0, number)
+    else:
+        yield from reservoir_batches(reader.iter_batches(SCAN_BATCH_SIZE), number, batch_size, seed)
+
+
+class SampleMeter:
+    """
+    標本の処理量・処理時間・RSS を記録し、入力全体を処理した場合を見積もる
+
+    処理時間は、入力の読み込み（標本を取るために走査したバイト数に比例）と、
+    標本の変換・書き出し（標本のバイト数に比例）に分けて見積もる。
+    every:K の圧縮された入力やリザーバーサンプリングでは入力全体を走査するため。
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.nbytes = 0
+        self.seconds = 0.0
+        self.compute_seconds = 0.0
+        self.scanned = 0
+        # (処理済みバイト数, RSS) の列
+        self.rss: List[Tuple[int, int]] = []
+        self.started = time.monotonic()
+
+    def observe(self, batch: RecordBatch, seconds: float):
+        """標本のバッチ1つの処理（seconds は変換と書き出しにかかった時間）を記録する"""
+        self.rows += len(batch)
+        self.nbytes += batch.nbytes
+        self.compute_seconds += seconds
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.rss.append((self.nbytes, rss))
+
+    def finish(self, scanned: Optional[int] = None):
+        """計測を終える。scanned は標本を取るために走査したバイト数（省略時は標本のバイト数）"""
+        self.seconds = time.monotonic() - self.started
+        self.scanned = max(scanned or 0, self.nbytes)
+
+    def seconds_per_byte(self) -> float:
+        """入力1バイトあたりの処理時間（読み込み + 変換と書き出し）"""
+        read_seconds = max(0.0, self.seconds - self.compute_seconds)
+        return read_seconds / self.scanned + self.compute_seconds / self.nbytes
+
+    def growth_per_byte(self) -> float:
+        """
+        処理したバイトあたりの RSS の増加
+
+        標本の前半は入力の読み込みや初期化による増加を含むため、後半の増加だけを使う。
+        増加が小さければ、メモリは入力の大きさによらないとみなして 0 を返す。
+        """
+        if len(self.rss) < 4:
+            return 0.0
+        middle_bytes, middle_rss = self.rss[len(self.rss) // 2]
+        last_bytes, last_rss = self.rss[-1]
+        if last_bytes <= middle_bytes or last_rss - middle_rss < GROWTH_NOISE_BYTES:
+            return 0.0
+        return (last_rss - middle_rss) / (last_bytes - middle_bytes)
+
+    def projection(self, input_bytes: Optional[int], shard_count: int = 1) -> Dict[str, Any]:
+        """
+        標本の計測値と、入力全体（input_bytes）を shard_count 個のシャードで処理した場合の見積もり
+
+        input_bytes が分からない場合、見積もりの項目は None になる。
+        """
+        seconds = max(self.seconds, 1e-9)
+        peak = max((rss for _, rss in self.rss), default=0)
+        result: Dict[str, Any] = {
+            "rows": self.rows,
+            "bytes": self.nbytes,
+            "seconds": round(self.seconds, 3),
+            "compute_seconds": round(self.compute_seconds, 3),
+            "scanned_bytes": self.scanned,
+            "rows_per_second": round(self.rows / seconds, 1),
+            "bytes_per_second": round(self.nbytes / seconds, 1),
+            "peak_rss_mb": round(peak / 1024 / 1024, 1),
+            "input_bytes": input_bytes,
+            "shard_count": shard_count,
+            "fraction": None,
+            "seconds_per_byte": None,
+            "projected_rows": None,
+            "projected_seconds": None,
+            "projected_shard_seconds": None,
+            "projected_shard_memory_mb": None,
+        }
+        if not input_bytes or not self.nbytes:
+            return result
+        seconds_per_byte = self.seconds_per_byte()
+        shard_bytes = input_bytes / shard_count
+        shard_memory = peak + self.growth_per_byte() * max(0.0, shard_bytes - self.nbytes)
+        result.update(
+            {
+                "fraction": round(self.nbytes / input_bytes, 6),
+                "seconds_per_byte": seconds_per_byte,
+                "projected_rows": round(self.rows * input_bytes / self.nbytes),
+                "projected_seconds": round(seconds_per_byte * input_bytes, 1),
+                "projected_shard_seconds": round(seconds_per_byte * shard_bytes, 1),
+                "projected_shard_memory_mb": round(shard_memory / 1024 / 1024, 1),
+            }
+        )
+        return result
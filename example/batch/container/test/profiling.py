@@ -0,0 +1,338 @@
+"""
+プロファイリングモジュール
+
+ジョブが遅いときに、設定の読み込み・ダウンロード・計算・アップロードのどこに時間が
+かかっているかを、イメージを作り直さずに調べるための計測フック。
+containerOverrides の環境変数 PROFILE で有効にする。
+
+- ステージごとの経過時間と CPU 時間を集計する（stage コンテキストマネージャ）
+- PROFILE=sample の場合は、別スレッドで定期的に全スレッドのスタックを記録する。
+  記録にかかった時間が経過時間の PROFILE_OVERHEAD を超えないよう、間隔を自動で広げる
+- 終了時に集計結果と、collapsed 形式（flamegraph.pl 用）・speedscope 形式のファイルを
+  ジョブの出力の隣（<outputPath>/_profile/<ジョブID>-attempt-<試行回数>/）に書き出す
+
+環境変数:
+    PROFILE              off（デフォルト）/ stages（ステージの計測のみ）/ sample（サンプリングも行う）
+    PROFILE_INTERVAL_MS  サンプリング間隔の初期値（ミリ秒。デフォルト 10）
+    PROFILE_OVERHEAD     サンプリングにかけてよい時間の割合（デフォルト 0.02）
+    PROFILE_OUTPUT       出力先（省略時は最初に処理した設定の outputPath の下）
+
+使用例:
+    PROFILE=sample CONFIG='{...}' python run_batch.py
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage import join_uri, write_bytes
+
+PROFILE_MODES = ("off", "stages", "sample")
+
+# 記録に時間がかかりすぎる場合にサンプリング間隔を広げる上限（秒）
+MAX_INTERVAL_SECONDS = 1.0
+
+# 1サンプルに記録するスタックの深さの上限
+MAX_STACK_DEPTH = 128
+
+
+class _StageStats:
+    """1つのステージの集計"""
+
+    __slots__ = ("count", "seconds", "cpu_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+
+
+class Sampler:
+    """
+    全スレッドのスタックを定期的に記録するサンプリングプロファイラ
+
+    sys._current_frames() で各スレッドの実行中のフレームを取得する。
+    スタックの先頭には、メインスレッドなら実行中のステージ、それ以外はスレッド名を付ける。
+    サンプルの重みは前回の記録からの経過時間（秒）で、間隔を変えても合計が実時間に一致する。
+    """
+
+    def __init__(self, profiler: "Profiler", interval: float, overhead_budget: float):
+        self.profiler = profiler
+        self.base_interval = interval
+        self.interval = interval
+        self.overhead_budget = overhead_budget
+        self.overhead = 0.0
+        self.samples = 0
+        self.weights: Dict[Tuple[str, Tuple[Tuple[str, str, int], ...]], float] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._started = 0.0
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        main = threading.main_thread().ident
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            begin = time.perf_counter()
+            weight = begin - last
+            last = begin
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                if ident == main:
+                    root = ";".join(f"[{name}]" for name in self.profiler.current_stages()) or "main"
+                else:
+                    root = f"thread:{names.get(ident, ident)}"
+                key = (root, tuple(stack))
+                self.weights[key] = self.weights.get(key, 0.0) + weight
+            self.samples += 1
+
+            # 記録にかかった時間が予算を超えたら間隔を広げ、余裕があれば元に戻す
+            self.overhead += time.perf_counter() - begin
+            budget = self.overhead_budget * (time.perf_counter() - self._started)
+            if self.overhead > budget:
+                self.interval = min(self.interval * 2, MAX_INTERVAL_SECONDS)
+            elif self.interval > self.base_interval and self.overhead < budget / 2:
+                self.interval = max(self.interval / 2, self.base_interval)
+
+    def overhead_ratio(self) -> float:
+        elapsed = time.perf_counter() - self._started
+        return self.overhead / elapsed if elapsed > 0 else 0.0
+
+    def collapsed(self) -> str:
+        """collapsed 形式（1行に「フレーム;フレーム;... 重み」。重みはミリ秒の整数）"""
+        lines = []
+        for (root, stack), weight in sorted(self.weights.items(), key=lambda item: -item[1]):
+            milliseconds = round(weight * 1000)
+            if milliseconds == 0:
+                continue
+            frames = [root] + [
+                f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack
+            ]
+            lines.append(f"{';'.join(frame.replace(';', ':') for frame in frames)} {milliseconds}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str) -> dict:
+        """speedscope 形式（スタックの先頭ごとに1つのプロファイル。同じスタックは1サンプルにまとめる）"""
+        frames: List[dict] = []
+        index: Dict[Tuple[str, str, int], int] = {}
+
+        def frame_id(frame: Tuple[str, str, int]) -> int:
+            if frame not in index:
+                index[frame] = len(frames)
+                name, filename, line = frame
+                entry = {"name": name}
+                if filename:
+                    entry.update(file=filename, line=line)
+                frames.append(entry)
+            return index[frame]
+
+        profiles: Dict[str, dict] = {}
+        for (root, stack), weight in self.weights.items():
+            profile = profiles.setdefault(
+                root,
+                {
+                    "type": "sampled",
+                    "name": root,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": 0.0,
+                    "samples": [],
+                    "weights": [],
+                },
+            )
+            roots = [frame_id((part, "", 0)) for part in root.split(";")]
+            profile["samples"].append(roots + [frame_id(frame) for frame in stack])
+            profile["weights"].append(round(weight, 6))
+            profile["endValue"] = round(profile["endValue"] + weight, 6)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "run_batch profiling",
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda profile: -profile["endValue"]),
+        }
+
+
+class Profiler:
+    """ステージの計測とサンプリングをまとめて管理する"""
+
+    def __init__(
+        self,
+        mode: str,
+        interval: float = 0.01,
+        overhead_budget: float = 0.02,
+        output: Optional[str] = None,
+    ):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"PROFILE が不正です: {mode}（{', '.join(PROFILE_MODES)} から選択）")
+        self.mode = mode
+        self.output = output
+        self.stats: Dict[str, _StageStats] = {}
+        self._stages: List[str] = []
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self.sampler = Sampler(self, interval, overhead_budget) if mode == "sample" else None
+
+    @classmethod
+    def from_env(cls) -> Optional["Profiler"]:
+        """環境変数 PROFILE が有効なら Profiler を作る。無効なら None"""
+        mode = os.environ.get("PROFILE", "off").lower() or "off"
+        if mode in ("off", "false", "0"):
+            return None
+        return cls(
+            mode,
+            interval=float(os.environ.get("PROFILE_INTERVAL_MS", "10")) / 1000,
+            overhead_budget=float(os.environ.get("PROFILE_OVERHEAD", "0.02")),
+            output=os.environ.get("PROFILE_OUTPUT"),
+        )
+
+    def start(self) -> "Profiler":
+        if self.sampler:
+            self.sampler.start()
+        return self
+
+    def current_stages(self) -> Tuple[str, ...]:
+        return tuple(self._stages)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """ステージの経過時間と CPU 時間を計測する（入れ子の場合は内側のステージ名を「外側/内側」で集計）"""
+        self._stages.append(name)
+        key = "/".join(self._stages)
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield
+        finally:
+            stats = self.stats.setdefault(key, _StageStats())
+            stats.count += 1
+            stats.seconds += time.perf_counter() - started
+            stats.cpu_seconds += time.process_time() - cpu_started
+            self._stages.pop()
+
+    def summary(self) -> dict:
+        """ステージごとの集計とサンプリングの情報"""
+        summary = {
+            "jobId": os.environ.get("AWS_BATCH_JOB_ID"),
+            "attempt": int(os.environ.get("AWS_BATCH_JOB_ATTEMPT", "1")),
+            "mode": self.mode,
+            "seconds": round(time.perf_counter() - self._started, 3),
+            "cpuSeconds": round(time.process_time() - self._cpu_started, 3),
+            # Linux の ru_maxrss は KB 単位（送信側 export_job_history.py --usage がメモリ使用率に使う）
+            "maxRssMb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "stages": {
+                name: {
+                    "count": stats.count,
+                    "seconds": round(stats.seconds, 3),
+                    "cpuSeconds": round(stats.cpu_seconds, 3),
+                }
+                for name, stats in self.stats.items()
+            },
+        }
+        if self.sampler:
+            summary["sampling"] = {
+                "samples": self.sampler.samples,
+                "intervalSeconds": round(self.sampler.interval, 4),
+                "overheadRatio": round(self.sampler.overhead_ratio(), 4),
+            }
+        return summary
+
+    def finish(self):
+        """サンプリングを止め、集計を表示して出力先に書き出す"""
+        if self.sampler:
+            self.sampler.stop()
+        summary = self.summary()
+
+        print("\n=== プロファイル ===")
+        for name, stats in summary["stages"].items():
+            print(
+                f"  {name:<24} {stats['seconds']:>9.3f} 秒 "
+                f"(CPU {stats['cpuSeconds']:.3f} 秒, {stats['count']} 回)"
+            )
+        print(f"  {'合計':<24} {summary['seconds']:>9.3f} 秒 (CPU {summary['cpuSeconds']:.3f} 秒)")
+        if self.sampler:
+            sampling = summary["sampling"]
+            print(
+                f"  サンプル {sampling['samples']} 件, 間隔 {sampling['intervalSeconds'] * 1000:.0f} ミリ秒, "
+                f"オーバーヘッド {sampling['overheadRatio']:.2%}"
+            )
+        print(f"PROFILE_RESULT {json.dumps(summary, ensure_ascii=False)}", flush=True)
+
+        if not self.output:
+            print("出力先が決まらないため、プロファイルは書き出しません")
+            return
+        job_id = (summary["jobId"] or f"local-{os.getpid()}").replace(":", "-")
+        base = join_uri(self.output, "_profile", f"{job_id}-attempt-{summary['attempt']}")
+        write_bytes(
+            join_uri(base, "stages.json"),
+            json.dumps(summary, ensure_ascii=False, indent=2).encode("utf-8"),
+        )
+        if self.sampler:
+            write_bytes(join_uri(base, "profile.collapsed"), self.sampler.collapsed().encode("utf-8"))
+            write_bytes(
+                join_uri(base, "profile.speedscope.json"),
+                json.dumps(self.sampler.speedscope(job_id)).encode("utf-8"),
+            )
+        print(f"プロファイルを書き出しました: {base}")
+
+
+# 実行中のプロファイラ（無効な場合は None）
+_active: Optional[Profiler] = None
+
+
+def start_from_env() -> Optional[Profiler]:
+    """環境変数 PROFILE が有効ならプロファイラを開始する"""
+    global _active
+    _active = Profiler.from_env()
+    if _active:
+        _active.start()
+    return _active
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """実行中のプロファイラでステージを計測する。プロファイラが無効なら何もしない"""
+    if _active is None:
+        yield
+        return
+    with _active.stage(name):
+        yield
+
+
+def set_output_path(output_path: str):
+    """出力先が未設定なら、ジョブの outputPath を出力先にする"""
+    if _active is not None and not _active.output:
+        _active.output = output_path
+
+
+def finish():
+    """実行中のプロファイラを終了して結果を書き出す"""
+    global _active
+    if _active is None:
+        return
+    profiler, _active = _active, None
+    try:
+        profiler.finish()
+    except Exception as e:
+        # プロファイルの書き出しに失敗してもジョブは失敗させない
+        print(f"プロファイルの書き出しに失敗しました: {e}", file=sys.stderr)
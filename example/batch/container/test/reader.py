@@ -0,0 +1,316 @@
+"""
+メモリマップ入力リーダーモジュール
+
+ローカル（またはキャッシュ済み）の入力ファイルをメモリマップし、
+レコード（行）をバッチ単位にコピーせず memoryview として渡す。
+配列ジョブのインデックスに対応するバイト範囲のシャードにも分割できる。
+圧縮された入力は StreamRecordReader で展開しながら同じ形式のバッチとして読む。
+"""
+import mmap
+import os
+from array import array
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from storage import object_size, open_stream
+
+# shard_scope() で切り替えたシャード（未設定なら環境変数から決める）
+_shard_override: Optional[Tuple[int, int]] = None
+
+
+class RecordBatch:
+    """
+    連続したレコードのバッチ
+
+    data はファイル上の連続領域の memoryview、offsets は data 内での各レコードの
+    開始位置（末尾にバッチ全体の長さを加えたもの）。どちらもファイル内容をコピーしない。
+    """
+
+    __slots__ = ("data", "offsets", "start")
+
+    def __init__(self, data: memoryview, offsets: array, start: int):
+        self.data = data
+        self.offsets = offsets
+        self.start = start
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> memoryview:
+        """レコードを改行を含めずに返す"""
+        begin = self.offsets[index]
+        end = self.offsets[index + 1]
+        if end > begin and self.data[end - 1] == 0x0A:
+            end -= 1
+        return self.data[begin:end]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self) -> int:
+        """バッチのバイト数"""
+        return len(self.data)
+
+
+class MmapRecordReader:
+    """入力ファイルをメモリマップして改行区切りのレコードを読むリーダー"""
+
+    def __init__(self, path: str, skip_header: bool = False):
+        self.path = path
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            # 順番に読み進めるため先読みを有効にする
+            if hasattr(self._mmap, "madvise"):
+                self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+            self.view = memoryview(self._mmap)
+        else:
+            self._mmap = None
+            self.view = memoryview(b"")
+
+        # ヘッダー行を読み飛ばす場合、データはヘッダーの次の行から始まる
+        self.data_start = 0
+        if skip_header:
+            self.data_start = self._next_record_start(0)
+
+    def close(self):
+        """メモリマップとファイルを閉じる（返したバッチを参照し終えてから呼ぶこと）"""
+        self.view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "MmapRecordReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _next_record_start(self, pos: int) -> int:
+        """pos を含むレコードの次のレコードの開始位置"""
+        if self._mmap is None:
+            return 0
+        newline = self._mmap.find(b"\n", pos)
+        return self.size if newline < 0 else newline + 1
+
+    def _align(self, pos: int) -> int:
+        """pos 以降で最初のレコード開始位置"""
+        if pos <= self.data_start:
+            return self.data_start
+        if pos >= self.size:
+            return self.size
+        return self._next_record_start(pos - 1)
+
+    def shard_range(self, index: int, count: int) -> Tuple[int, int]:
+        """
+        データ部分を count 個に分けた index 番目のシャードのバイト範囲を返す
+
+        各レコードは先頭バイトを含むシャードに属する。境界はレコードの開始位置に
+        揃えるため、全シャードを合わせると各レコードをちょうど1回ずつ処理する。
+
+        Args:
+            index: シャード番号（配列ジョブのインデックス）
+            count: シャード数（配列サイズ）
+
+        Returns:
+            (開始位置, 終了位置)
+        """
+        if not 0 <= index < count:
+            raise ValueError(f"シャード番号が範囲外です: {index} / {count}")
+        length = self.size - self.data_start
+        start = self._align(self.data_start + length * index // count)
+        end = self._align(self.data_start + length * (index + 1) // count)
+        return start, end
+
+    def iter_batches(
+        self, batch_size: int, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[RecordBatch]:
+        """
+        [start, end) のレコードを batch_size 件ずつのバッチで返す
+
+        Args:
+            batch_size: 1バッチあたりのレコード数
+            start: 開始位置（レコードの開始位置に揃っていること）。省略時はデータの先頭
+            end: 終了位置。省略時はファイルの末尾
+        """
+        pos = self.data_start if start is None else start
+        end = self.size if end is None else end
+        while pos < end:
+            offsets = array("Q", [0])
+            record_end = pos
+            while len(offsets) <= batch_size and record_end < end:
+                record_end = min(self._next_record_start(record_end), end)
+                offsets.append(record_end - pos)
+            yield RecordBatch(self.view[pos:record_end], offsets, pos)
+            pos = record_end
+
+
+class StreamRecordReader:
+    """
+    シークできないストリーム（展開中の圧縮ファイルなど）から改行区切りのレコードを読むリーダー
+
+    チャンク単位で読み込み、MmapRecordReader と同じ RecordBatch を返す。
+    バッチの境界はレコード番号だけで決まる（batch_size 件ごと）ため、
+    ストリームの読み込み単位が変わってもシャードへの割り当ては変わらない。
+    """
+
+    def __init__(self, stream: BinaryIO, skip_header: bool = False, chunk_size: int = 4 * 1024 * 1024):
+        self.stream = stream
+        self.skip_header = skip_header
+        self.chunk_size = chunk_size
+        # 展開後のデータでの読み込み済み位置
+        self.position = 0
+
+    def iter_batches(
+        self, batch_size: int, shard_index: int = 0, shard_count: int = 1
+    ) -> Iterator[RecordBatch]:
+        """
+        レコードを batch_size 件ずつのバッチで返す
+
+        ストリームはバイト範囲で分割できないため、シャードは先頭から数えた
+        バッチ番号を shard_count で割った余りで割り当てる。各シャードはストリーム全体を
+        読むが、担当外のバッチは改行を探すだけで読み飛ばす。
+
+        Args:
+            batch_size: 1バッチあたりのレコード数
+            shard_index: シャード番号
+            shard_count: シャード数
+        """
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"シャード番号が範囲外です: {shard_index} / {shard_count}")
+        pending = b""
+        batch_number = 0
+        skip_header = self.skip_header
+        eof = False
+        while not eof:
+            chunk = self.stream.read(self.chunk_size)
+            eof = not chunk
+            data = pending + chunk if pending else chunk
+            pos = 0
+            if skip_header:
+                newline = data.find(b"\n")
+                if newline < 0 and not eof:
+                    pending = data
+                    continue
+                pos = len(data) if newline < 0 else newline + 1
+                skip_header = False
+
+            view = memoryview(data)
+            while True:
+                offsets = array("Q", [0])
+                record_end = pos
+                while len(offsets) <= batch_size:
+                    newline = data.find(b"\n", record_end)
+                    if newline < 0:
+                        # 末尾の改行がない最後のレコード
+                        if eof and record_end < len(data):
+                            record_end = len(data)
+                            offsets.append(record_end - pos)
+                        break
+                    record_end = newline + 1
+                    offsets.append(record_end - pos)
+                complete = len(offsets) > batch_size
+                # バッチが埋まらなければ次のチャンクを待つ（終端では残りを最後のバッチにする）
+                if len(offsets) == 1 or (not complete and not eof):
+                    break
+                if batch_number % shard_count == shard_index:
+                    yield RecordBatch(view[pos:record_end], offsets, self.position + pos)
+                batch_number += 1
+                pos = record_end
+                if not complete:
+                    break
+            pending = data[pos:]
+            self.position += pos
+
+
+def download_shard(
+    uri: str, index: int, count: int, fileobj: BinaryIO, chunk_size: int = 8 * 1024 * 1024
+) -> Tuple[int, int]:
+    """
+    ヘッダー付きの非圧縮の入力のうち、シャードのレコードだけを fileobj に書き出す
+
+    MmapRecordReader(skip_header=True).shard_range() と同じ境界を、ファイル全体を取得せずに決める。
+    ヘッダー行を先頭から読み、シャードの境界の直前から範囲指定で読み進めて、
+    終了位置を含むレコードを書き終えた時点でストリームを閉じる（残りは転送しない）。
+
+    Returns:
+        入力ファイル上の (開始位置, 終了位置)
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"シャード番号が範囲外です: {index} / {count}")
+    size = object_size(uri)
+    with open_stream(uri) as stream:
+        header = stream.readline()
+    data_start = len(header) if header.endswith(b"\n") else size
+    length = size - data_start
+    low = data_start + length * index // count
+    high = data_start + length * (index + 1) // count
+    if low >= size:
+        return size, size
+
+    # 開始位置: low 以降で最初のレコードの先頭（low - 1 から読んで改行まで飛ばす）
+    position = data_start if low <= data_start else low - 1
+    with open_stream(uri, start=position) as stream:
+        if low > data_start:
+            position += len(stream.readline())
+        start = position
+        if high >= size:
+            # 最後のシャードは末尾まで
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                fileobj.write(chunk)
+                position += len(chunk)
+            return start, position
+        # 終了位置: high - 1 から始まる改行の次（high を含むレコードの末尾）
+        while position < high - 1:
+            chunk = stream.read(min(chunk_size, high - 1 - position))
+            if not chunk:
+                return start, position
+            fileobj.write(chunk)
+            position += len(chunk)
+        if position > high - 1:
+            # 開始位置が high を越えていればシャードは空
+            return start, start
+        tail = stream.readline()
+        fileobj.write(tail)
+        return start, position + len(tail)
+
+
+def shard_from_env() -> Tuple[int, int]:
+    """
+    環境変数からシャード番号とシャード数を返す
+
+    配列ジョブでは AWS_BATCH_JOB_ARRAY_INDEX をシャード番号、送信スクリプトが設定する
+    SHARD_COUNT（配列サイズ）をシャード数とする。配列ジョブでなければ (0, 1)。
+    SHARD_INDEX が設定されていれば（投機的な重複実行など、配列ジョブの外で
+    特定のシャードを処理する場合）それをシャード番号とする。
+    shard_scope() の中ではそのシャードを返す。
+    """
+    if _shard_override is not None:
+        return _shard_override
+    index = int(
+        os.environ.get("SHARD_INDEX") or os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX", "0")
+    )
+    count = int(os.environ.get("SHARD_COUNT", "1"))
+    return index, count
+
+
+@contextmanager
+def shard_scope(index: int, count: int) -> Iterator[None]:
+    """
+    shard_from_env() が返すシャードを一時的に切り替える
+
+    リース実行のように、1つのプロセスが入力を1回だけ取得して複数のシャードを順番に処理する場合に使う。
+    """
+    global _shard_override
+    previous = _shard_override
+    _shard_override = (index, count)
+    try:
+        yield
+    finally:
+        _shard_override = previous
@@ -4,80 +4,747 @@ AWS Batchコンテナ内でパラメータを取得するスクリプト - Pydan
 """
 import sys
 import os
+import itertools
 import json
-from typing import Optional, Literal
-from pydantic import BaseModel, Field
-from pydantic_settings import BaseSettings
-
-
-# CONFIG パラメータ
-# {
-#   "inputFile": "s3://example-bucket/input/data.csv",
-#   "outputPath": "s3://example-bucket/output/",
-#   "settings": {
-#     "batchSize": 64,
-#     "modelType": "classification",
-#     "maxIterations": 100,
-#     "learningRate": 0.01
-#   },
-#   "metadata": {
-#     "jobType": "batch-processing",
-#     "version": "1.0.0",
-#     "description": "サンプルバッチ処理ジョブ"
-#   }
-# }
-
-
-class JobSettings(BaseModel):
-    """バッチジョブの処理設定"""
-    batchSize: int = 64
-    modelType: Literal["classification"] = "classification"
-    maxIterations: int = 100
-    learningRate: float = 0.01
-
-
-class Metadata(BaseModel):
-    """ジョブのメタデータ情報"""
-    jobType: str
-    version: str
-    description: str
-
-
-class BatchJobConfig(BaseSettings):
-    """バッチ処理ジョブの設定"""
-    inputFile: str
-    outputPath: str
-    settings: JobSettings
-    metadata: Metadata
-    
-    @classmethod
-    def from_env(cls, env_var_name: str = "CONFIG"):
-        """
-        環境変数からJSONを読み込んでモデルを生成する
-        
-        Args:
-            env_var_name: JSONを含む環境変数名
-            
-        Returns:
-            BatchJobConfig: 設定モデル
-            
-        Raises:
-            ValueError: 環境変数が見つからないか、JSONとして無効な場合
-        """
-        json_str = os.environ.get(env_var_name)
-        if not json_str:
-            raise ValueError(f"環境変数 {env_var_name} が設定されていません")
-            
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional, Tuple, Union
+
+from bundle import load_bundle, run_bundle
+from cache import ContentCache
+from committer import ShardCommitter, finalize, manifest_uri, run_id
+from fastconfig import FastJobConfig, config_from_dict, config_from_env, parse_config
+from lease_table import lease_group, open_lease_table, run_leases
+from lookup_index import LookupJoin, open_join
+from memo import ResultIndex
+from models import BatchJobConfig
+import metrics
+import preview
+import profiling
+from reader import (
+    MmapRecordReader,
+    RecordBatch,
+    StreamRecordReader,
+    download_shard,
+    shard_from_env,
+    shard_scope,
+)
+from storage import download_to, is_s3_uri, join_uri, open_stream, upload_file
+from stream_codecs import (
+    EXTENSIONS,
+    MAGIC_SIZE,
+    detect_codec,
+    open_compressed,
+    open_decompressed,
+    output_codec,
+    output_level,
+)
+from shutdown import Checkpoint, GracefulShutdown
+import sweep
+from worker import open_queue, run_worker
+
+
+def process_config(
+    config: Union[BatchJobConfig, FastJobConfig], shutdown: Optional[GracefulShutdown] = None
+):
+    """
+    検証済みの設定で1件分の処理を実行する
+
+    shutdown を渡した場合、SIGTERM を受けるとシャードの処理をバッチの区切りで中断し、
+    進捗をチェックポイントに記録してから終了コード 75 で終了する（リトライで続きから処理する）。
+    """
+    print("\nPydanticモデルで解析:")
+    print(f"入力ファイル: {config.inputFile}")
+    print(f"出力パス: {config.outputPath}")
+    print(f"バッチサイズ: {config.settings.batchSize}")
+    print(f"モデルタイプ: {config.settings.modelType}")
+    print(f"最大イテレーション: {config.settings.maxIterations}")
+    print(f"学習率: {config.settings.learningRate}")
+    print(f"ジョブタイプ: {config.metadata.jobType}")
+    print(f"バージョン: {config.metadata.version}")
+    print(f"説明: {config.metadata.description}")
+
+    # 検証済みモデルをJSON形式で出力
+    print("\n検証済みモデル（JSON形式）:")
+    print(config.model_dump_json(indent=2, ensure_ascii=False))
+
+    # PROFILE が有効な場合、プロファイルは outputPath の下に書き出す
+    profiling.set_output_path(config.outputPath)
+
+    # MEMO_INDEX が設定されていれば、前回から変わっていないシャードは処理せず前回の出力を再利用する
+    memo = None
+    memo_index = ResultIndex.from_env()
+    if memo_index is not None:
+        shard_index, shard_count = shard_from_env()
+        with profiling.stage("memo"):
+            memo_key = memo_index.key_for(config_dict(config), shard_index, shard_count)
+            entry = memo_index.lookup(memo_key) if memo_key else None
+        if entry is not None:
+            commit_memoized(config, entry)
+            return
+        if memo_key:
+            memo = (memo_index, memo_key)
+
+    # 参照ファイルは CACHE_DIR が設定されていればホスト共有キャッシュ経由で取得し、
+    # 処理が終わるまで別のジョブの evict で削除されないよう共有ロックを保持する
+    cache = ContentCache.from_env()
+    with ExitStack() as references:
+        if config.referenceFiles:
+            print("\n参照ファイル:")
+            with profiling.stage("reference"):
+                for uri in config.referenceFiles:
+                    path = references.enter_context(cache.fetch(uri)).path if cache else uri
+                    print(f"  {uri} -> {path}")
+        process_input_file(config, memo, shutdown)
+
+
+def process_input_file(
+    config: Union[BatchJobConfig, FastJobConfig],
+    memo: Optional[Tuple[ResultIndex, str]] = None,
+    shutdown: Optional[GracefulShutdown] = None,
+):
+    """入力ファイルの形式と取得方法（キャッシュ・範囲指定・ストリーム）を選んで処理する"""
+    # 入力ファイルをバッチ単位で処理する
+    print("\n入力ファイルの処理:")
+    # 入力は cacheInput で指定された場合だけキャッシュする
+    cache = input_cache(config)
+    if is_s3_uri(config.inputFile) and cache is None:
+        stream = open_stream(config.inputFile)
+        codec = detect_codec(stream.peek(MAGIC_SIZE)[:MAGIC_SIZE])
+        if codec != "none":
+            # 圧縮された入力は一時ファイルに保存せず、ダウンロードしながら展開する
+            with stream:
+                process_stream(config, stream, codec, memo, shutdown)
+            return
+        stream.close()
+        # 非圧縮の入力は、キャッシュしないのであればシャードの範囲だけを取得する
+        process_ranged_input(config, memo, shutdown)
+        return
+    with local_input(config.inputFile, cache) as input_path:
+        process_input(config, input_path, memo, shutdown)
+
+
+def input_cache(config: Union[BatchJobConfig, FastJobConfig]) -> Optional[ContentCache]:
+    """
+    入力ファイルに使うキャッシュを返す
+
+    一度しか読まない大きな入力をキャッシュすると参照ファイルが押し出されるため、
+    cacheInput（省略時は環境変数 CACHE_INPUTS）で指定された入力だけをキャッシュする。
+    """
+    enabled = config.cacheInput
+    if enabled is None:
+        enabled = os.environ.get("CACHE_INPUTS", "false").lower() == "true"
+    return ContentCache.from_env() if enabled else None
+
+
+@contextmanager
+def local_input(uri: str, cache: Optional[ContentCache]) -> Iterator[str]:
+    """
+    入力ファイルのローカルパスを返す（with ブロックの間だけ有効）
+
+    S3 の場合、キャッシュがあればキャッシュ経由で（使用中は削除されない）、なければ一時ファイルにダウンロードする。
+    """
+    if not is_s3_uri(uri):
+        yield uri
+        return
+    with ExitStack() as stack:
+        with profiling.stage("download"):
+            if cache is not None:
+                path = stack.enter_context(cache.pinned(uri))
+            else:
+                fd, path = tempfile.mkstemp(suffix=os.path.basename(uri))
+                stack.callback(os.remove, path)
+                with os.fdopen(fd, "wb") as f:
+                    download_to(uri, f)
+        yield path
+
+
+def process_ranged_input(
+    config: Union[BatchJobConfig, FastJobConfig],
+    memo: Optional[Tuple[ResultIndex, str]] = None,
+    shutdown: Optional[GracefulShutdown] = None,
+):
+    """
+    S3 の非圧縮の入力から、担当シャードのバイト範囲だけを範囲指定で取得して処理する
+
+    配列の子ジョブがそれぞれ入力全体をダウンロードしないようにする。一時ファイルには
+    シャードのレコードだけが入る（ヘッダー行は含まない）。
+    """
+    shard_index, shard_count = shard_from_env()
+    fd, path = tempfile.mkstemp(suffix=os.path.basename(config.inputFile))
+    try:
+        with profiling.stage("download"), os.fdopen(fd, "wb") as f:
+            start, end = download_shard(config.inputFile, shard_index, shard_count, f)
+        with MmapRecordReader(path) as reader:
+            process_batches(
+                config,
+                "none",
+                lambda progress: reader.iter_batches(config.settings.batchSize, progress.get("offset")),
+                f"バイト範囲 [{start}, {end})（範囲指定で取得）",
+                memo,
+                shutdown,
+            )
+    finally:
+        os.remove(path)
+
+
+def config_dict(config: Union[BatchJobConfig, FastJobConfig]) -> Dict[str, Any]:
+    """設定を辞書に変換する（BatchJobConfig と FastJobConfig で同じ形式）"""
+    return json.loads(config.model_dump_json())
+
+
+def commit_memoized(config: Union[BatchJobConfig, FastJobConfig], entry: Dict[str, Any]):
+    """
+    結果インデックスに記録された前回の出力ファイルを参照するマニフェストをコミットする
+
+    入力のダウンロードも処理も行わない。出力ファイルはコピーせず、前回の URI をそのまま載せる。
+    """
+    shard_index, shard_count = shard_from_env()
+    committer = ShardCommitter(config_dict(config), shard_index, shard_count)
+    if committer.is_committed():
+        print(f"シャード {shard_index}/{shard_count} は別のジョブがコミット済みのため処理しません")
+        return
+
+    committer.reuse(entry["files"])
+    result = dict(entry["result"], seconds=0.0, reusedFrom=entry["jobId"])
+    result.pop("status", None)
+    with profiling.stage("commit"):
+        committed = committer.commit(result)
+    result["status"] = "REUSED" if committed else "LOST"
+    job_metrics = metrics.active()
+    if job_metrics is not None:
+        job_metrics.shards.inc(status=result["status"])
+    if committed:
+        print(
+            f"シャード {shard_index}/{shard_count} は前回から変わっていないため、"
+            f"{entry['outputPath']} の出力を再利用しました"
+        )
+    print(f"SHARD_RESULT {json.dumps(result)}", flush=True)
+
+
+def process_input(
+    config: Union[BatchJobConfig, FastJobConfig],
+    path: str,
+    memo: Optional[Tuple[ResultIndex, str]] = None,
+    shutdown: Optional[GracefulShutdown] = None,
+):
+    """
+    ローカルの入力ファイルのうち担当シャードのレコードを処理する
+
+    非圧縮のファイルはメモリマップで読み、担当するバイト範囲だけを処理する。
+    圧縮されたファイルは展開しながら読む。
+    """
+    with open(path, "rb") as f:
+        codec = detect_codec(f.read(MAGIC_SIZE))
+        if codec != "none":
+            f.seek(0)
+            process_stream(config, f, codec, memo, shutdown)
+            return
+
+    shard_index, shard_count = shard_from_env()
+    with MmapRecordReader(path, skip_header=True) as reader:
+        start, end = reader.shard_range(shard_index, shard_count)
+        process_batches(
+            config,
+            "none",
+            # 中断後のリトライでは、処理済みのバッチの直後から読む
+            lambda progress: reader.iter_batches(
+                config.settings.batchSize, progress.get("offset", start), end
+            ),
+            f"バイト範囲 [{start}, {end})",
+            memo,
+            shutdown,
+        )
+
+
+def process_stream(
+    config: Union[BatchJobConfig, FastJobConfig],
+    fileobj: BinaryIO,
+    codec: str,
+    memo: Optional[Tuple[ResultIndex, str]] = None,
+    shutdown: Optional[GracefulShutdown] = None,
+):
+    """
+    圧縮された入力を展開しながら担当シャードのレコードを処理する
+
+    展開後のデータはバイト範囲で分割できないため、batchSize 件ごとのバッチを
+    シャード数で割った余りで担当シャードに割り当てる。
+    """
+    shard_index, shard_count = shard_from_env()
+    with open_decompressed(fileobj, codec) as stream:
+        reader = StreamRecordReader(stream, skip_header=True)
+        process_batches(
+            config,
+            codec,
+            # 展開後の位置へはシークできないため、中断後のリトライでは処理済みのバッチを読み飛ばす
+            lambda progress: itertools.islice(
+                reader.iter_batches(config.settings.batchSize, shard_index, shard_count),
+                progress.get("batches", 0),
+                None,
+            ),
+            f"{codec} 圧縮の入力のバッチ（番号 mod {shard_count} = {shard_index}）",
+            memo,
+            shutdown,
+        )
+
+
+def output_extension(input_file: str, input_codec: str, codec: str) -> str:
+    """出力ファイルの拡張子（入力の圧縮拡張子を除き、出力の圧縮形式の拡張子を付ける）"""
+    name = os.path.basename(input_file)
+    if input_codec != "none" and name.endswith(EXTENSIONS[input_codec]):
+        name = name[: -len(EXTENSIONS[input_codec])]
+    return (os.path.splitext(name)[1] or ".txt") + EXTENSIONS[codec]
+
+
+def write_batch(out: BinaryIO, batch: RecordBatch, join: Optional[LookupJoin] = None):
+    """バッチを変換して書き出す（lookup があれば参照テーブルの列を付け加える）"""
+    if join is not None:
+        out.write(join.apply(batch))
+        return
+    out.write(batch.data)
+    if batch.nbytes and batch.data[-1] != 0x0A:
+        out.write(b"\n")
+
+
+def process_batches(
+    config: Union[BatchJobConfig, FastJobConfig],
+    input_codec: str,
+    make_batches: Callable[[Dict[str, Any]], Iterator[RecordBatch]],
+    scope: str,
+    memo: Optional[Tuple[ResultIndex, str]] = None,
+    shutdown: Optional[GracefulShutdown] = None,
+):
+    """
+    担当シャードのバッチを処理して出力をコミットする
+
+    出力は OUTPUT_CODEC の形式で圧縮しながら書き、ジョブIDと試行回数ごとの
+    ステージング領域に置いてから、シャードのマニフェストをコミットする。
+    同じシャードを別のジョブ（投機的な重複実行）が先にコミットした場合は、
+    処理を打ち切って出力を破棄し、正常終了する。
+    memo（結果インデックスとキー）が指定されていれば、コミットした出力を記録する。
+
+    shutdown が指定されていれば、SIGTERM を受けた時点でバッチの区切りで処理を止め、
+    そこまでの出力をステージング領域に書き出して、処理済みの位置（mmap はバイト位置、
+    ストリームはバッチ数）とファイルをチェックポイントに記録し、終了コード 75 で終了する。
+    リトライでは make_batches に記録した進捗を渡して続きから処理し、前の試行の出力と合わせてコミットする。
+    """
+    shard_index, shard_count = shard_from_env()
+    committer = ShardCommitter(config_dict(config), shard_index, shard_count)
+    if committer.is_committed():
+        print(f"シャード {shard_index}/{shard_count} は別のジョブがコミット済みのため処理しません")
+        return
+
+    checkpoint = Checkpoint.for_job(config.outputPath) if shutdown is not None else None
+    progress: Dict[str, Any] = {}
+    if checkpoint is not None:
+        progress = checkpoint.progress.get(committer.manifest_uri, {})
+    if progress:
+        # 前の試行がステージング領域に書いた出力は、書き出し直さずにこの試行のマニフェストに含める
+        committer.reuse(progress["files"])
+        print(
+            f"シャード {shard_index}/{shard_count} をチェックポイントから再開します"
+            f"（処理済み {progress['rows']} 行 / {progress['bytes']} バイト）"
+        )
+
+    # lookup が設定されていれば、参照テーブルのインデックスをメモリマップして各行に列を付け加える
+    join = None
+    if config.lookup is not None:
+        with profiling.stage("lookup"):
+            join = open_join(config_dict(config)["lookup"])
+
+    codec = output_codec(input_codec)
+    extension = output_extension(config.inputFile, input_codec, codec)
+    rows = 0
+    nbytes = 0
+    batches = 0
+    offset = progress.get("offset")
+    lost = False
+    interrupted = False
+    # METRICS が有効ならバッチの処理時間を記録する（無効ならループ内で何もしない）
+    job_metrics = metrics.active()
+    tick = job_metrics.batch_timer() if job_metrics is not None else None
+    started = time.monotonic()
+    fd, part_path = tempfile.mkstemp(suffix=extension)
+    try:
+        with profiling.stage("compute"), os.fdopen(fd, "wb") as raw, open_compressed(
+            raw, codec, output_level()
+        ) as out:
+            batch = None
+            for batch in make_batches(progress):
+                if shutdown is not None and shutdown.requested:
+                    interrupted = True
+                    break
+                # 実際の変換処理はここでバッチ単位に行う（サンプルではバッチをそのまま書き出す）
+                write_batch(out, batch, join)
+                rows += len(batch)
+                nbytes += batch.nbytes
+                batches += 1
+                offset = batch.start + batch.nbytes
+                if tick is not None:
+                    tick()
+                if committer.lost():
+                    lost = True
+                    break
+            # メモリマップを閉じる前にバッチへの参照を外す
+            batch = None
+        compute_seconds = time.monotonic() - started
+        written = os.path.getsize(part_path)
+        # 前の試行までに処理した分を合わせる
+        rows += progress.get("rows", 0)
+        nbytes += progress.get("bytes", 0)
+        batches += progress.get("batches", 0)
+        if join is not None:
+            join.matched += progress.get("matched", 0)
+            join.missed += progress.get("missed", 0)
+        print(
+            f"シャード {shard_index}/{shard_count}: {scope} から "
+            f"{rows} 行 / {nbytes} バイトを処理しました"
+        )
+        result = {
+            "shard": shard_index,
+            "count": shard_count,
+            "rows": rows,
+            "bytes": nbytes,
+            "seconds": round(compute_seconds, 3),
+        }
+        output_rows = rows
+        if join is not None:
+            result["lookup"] = {"matched": join.matched, "missed": join.missed}
+            print(f"ルックアップ結合: 一致 {join.matched} 行 / 不一致 {join.missed} 行")
+            if join.missing == "drop":
+                output_rows -= join.missed
+        # 中断・再開した場合、試行ごとの出力は別のファイルにする
+        segment = len(progress.get("files", []))
+        name = f"part-{shard_index:05d}"
+        if segment or interrupted:
+            name += f"-{segment:03d}"
+        if interrupted:
+            if rows > progress.get("rows", 0):
+                with profiling.stage("upload"):
+                    committer.add_file(
+                        f"{name}{extension}",
+                        part_path,
+                        rows=output_rows - progress.get("outputRows", 0),
+                        codec=codec,
+                    )
+            state = {
+                "batches": batches,
+                "rows": rows,
+                "bytes": nbytes,
+                "outputRows": output_rows,
+                "matched": join.matched if join is not None else 0,
+                "missed": join.missed if join is not None else 0,
+                "files": committer.reused + committer.files,
+            }
+            if offset is not None:
+                state["offset"] = offset
+            checkpoint.save_progress(committer.manifest_uri, state)
+        elif not lost:
+            with profiling.stage("upload"):
+                committer.add_file(
+                    f"{name}{extension}",
+                    part_path,
+                    rows=output_rows - progress.get("outputRows", 0),
+                    codec=codec,
+                )
+    finally:
+        os.remove(part_path)
+
+    if interrupted:
+        print(
+            f"シャード {shard_index}/{shard_count} の処理を {batches} バッチで中断し、進捗をチェックポイントに記録しました"
+        )
+        shutdown.exit_interrupted()
+
+    with profiling.stage("commit"):
+        committed = not lost and committer.commit(result)
+        if not committed:
+            committer.abort()
+    if not committed:
+        result["status"] = "LOST"
+        print(f"シャード {shard_index}/{shard_count} は別のジョブが先にコミットしたため結果を破棄します")
+    else:
+        result["status"] = "COMMITTED"
+        print(f"シャードのマニフェストをコミットしました: {committer.manifest_uri}")
+        if checkpoint is not None:
+            checkpoint.clear_progress(committer.manifest_uri)
+        if memo is not None:
+            memo_index, memo_key = memo
+            memo_index.record(memo_key, config_dict(config), result, committer.reused + committer.files)
+    if job_metrics is not None:
+        job_metrics.record_shard(result["status"], rows, nbytes, written, compute_seconds)
+    # 送信側 history.py が処理速度の履歴として取り込む
+    print(f"SHARD_RESULT {json.dumps(result)}", flush=True)
+
+
+def run_finalize_mode(config: Union[BatchJobConfig, FastJobConfig]):
+    """
+    全シャードのマニフェストからジョブ全体のマニフェストを作る
+
+    配列ジョブに依存するファイナライズ用ジョブ（FINALIZE_OUTPUT=true）で実行する。
+    対象の実行は RUN_ID（送信側が配列ジョブと同じ値を渡す）。
+    コミットされていないシャードがあれば終了コード 1 で終了する。
+    """
+    _, shard_count = shard_from_env()
+    cleanup = os.environ.get("FINALIZE_CLEANUP", "true").lower() != "false"
+    if os.environ.get("AWS_BATCH_JOB_ID") and not os.environ.get("RUN_ID"):
+        # ファイナライズ用ジョブ自身のジョブIDは配列ジョブの実行IDと異なる
+        print("ファイナライズできません: RUN_ID が設定されていません", file=sys.stderr)
+        sys.exit(1)
+    run = run_id(config.inputFile)
+    print(f"\n=== 出力のファイナライズ（実行 {run}, {shard_count} シャード）===")
+    profiling.set_output_path(config.outputPath)
+    try:
+        with profiling.stage("finalize"):
+            manifest = finalize(config_dict(config), shard_count, cleanup=cleanup, run=run)
+    except RuntimeError as e:
+        print(f"ファイナライズできません: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"マニフェストを書き込みました: {manifest_uri(config_dict(config))}, ファイル {len(manifest['files'])} 件, "
+        f"{manifest['rows']} 行, {manifest['bytes']} バイト"
+    )
+    if cleanup:
+        print(f"参照されないステージングファイルを {manifest['removed']} 件削除しました")
+
+
+def run_lease_mode(config: Union[BatchJobConfig, FastJobConfig], table_url: str, shutdown: GracefulShutdown):
+    """
+    リーステーブルから小さなシャードを取得し、テーブルが空になるまで処理する
+
+    入力は最初に1回だけ取得し、取得したシャードごとに担当範囲だけを処理する。
+    停止が要求された場合は処理中のシャードを終えてから終了コード 75 で終了し、
+    残りのシャードは他の子ジョブが取得する。シャードの処理が上限回数まで失敗した場合は終了コード 1。
+    """
+    count = int(os.environ.get("LEASE_SHARDS") or os.environ.get("SHARD_COUNT", "1"))
+    group = lease_group()
+    table = open_lease_table(table_url)
+    # 送信側が登録していない場合（ローカルでの実行など）は自分で登録する
+    if not table.counts(group):
+        table.register(group, count)
+    print(f"\n=== リース実行（グループ: {group}, {count} シャード）===")
+
+    profiling.set_output_path(config.outputPath)
+    with local_input(config.inputFile, input_cache(config)) as input_path:
+
+        def process_shard(index: int):
+            with shard_scope(index, count):
+                process_input(config, input_path)
+
+        results = run_leases(table, group, count, process_shard, shutdown=shutdown)
+    failed = [result for result in results if result["status"] == "FAILED"]
+    print(
+        f"\nリース実行結果: 処理 {len(results)} / 失敗 {len(failed)} / "
+        f"再試行待ち {sum(result['status'] == 'RELEASED' for result in results)}"
+    )
+    if shutdown.requested:
+        shutdown.exit_interrupted()
+    if failed:
+        sys.exit(1)
+
+
+def run_sweep_mode(spec_json: str):
+    """
+    パラメータスイープの1点を処理する
+
+    CONFIG を基本の設定とし、配列インデックスから計算した SWEEP_SPEC の点の
+    パラメータを上書きする。出力は outputPath/sweep-<番号>/ に書く。
+    """
+    index = sweep.index_from_env()
+    with profiling.stage("config"):
         try:
-            config_dict = json.loads(json_str)
-            return cls(**config_dict)
+            spec = json.loads(spec_json)
+            base = json.loads(os.environ.get("CONFIG", "{}"))
         except json.JSONDecodeError:
-            raise ValueError(f"環境変数 {env_var_name} に有効なJSONが含まれていません")
-        except Exception as e:
-            raise ValueError(f"設定の解析中にエラーが発生しました: {str(e)}")
+            raise ValueError("SWEEP_SPEC または CONFIG に有効なJSONが含まれていません")
+        params = sweep.point(spec, index)
+        config = config_from_dict(sweep.apply(base, params, index))
+    print(f"\n=== パラメータスイープ（点 {index} / {sweep.sweep_size(spec)}）===")
+    # 送信側で結果と組み合わせを突き合わせるための行
+    print(f"SWEEP_POINT {json.dumps({'index': index, 'params': params}, ensure_ascii=False)}", flush=True)
+    process_config(config)
+
+
+def run_preview_mode(config: Union[BatchJobConfig, FastJobConfig], spec: str):
+    """
+    入力の標本だけを処理し、入力全体を処理した場合の実行時間とメモリの見積もりを出力する
+
+    出力は outputPath/_preview/ に書き、シャードのマニフェストはコミットしない（結果インデックスも使わない）。
+    見積もりのシャード数は SHARD_COUNT（本番の配列サイズ）。
+    """
+    _, shard_count = shard_from_env()
+    print(f"\n=== プレビュー実行（{spec}）===")
+    profiling.set_output_path(config.outputPath)
+    try:
+        mode, number = preview.parse_spec(spec)
+        seed = int(os.environ.get("PREVIEW_SEED", "0"))
+        pieces = int(os.environ.get("PREVIEW_PIECES", str(preview.DEFAULT_PIECES)))
+        with local_input(config.inputFile, input_cache(config)) as input_path:
+            result = preview_input(config, input_path, mode, number, seed, pieces, shard_count)
+    except Exception as e:
+        # 送信側は PREVIEW_RESULT 行の status で設定の誤りを判定する
+        print(f"PREVIEW_RESULT {json.dumps({'status': 'FAILED', 'error': str(e)}, ensure_ascii=False)}", flush=True)
+        raise
+
+    result = {"status": "SUCCEEDED", "mode": spec, **result}
+    print(f"標本: {result['rows']} 行 / {result['bytes']} バイトを {result['seconds']} 秒で処理しました")
+    if result["projected_seconds"] is not None:
+        print(
+            f"見積もり: 入力全体 {result['input_bytes']} バイト（約 {result['projected_rows']} 行）の処理に "
+            f"{result['projected_seconds']} 秒、{shard_count} シャードでは1シャードあたり "
+            f"{result['projected_shard_seconds']} 秒・{result['projected_shard_memory_mb']} MB"
+        )
+    print(f"PREVIEW_RESULT {json.dumps(result, ensure_ascii=False)}", flush=True)
+
+
+def preview_input(
+    config: Union[BatchJobConfig, FastJobConfig],
+    path: str,
+    mode: str,
+    number: int,
+    seed: int,
+    pieces: int,
+    shard_count: int,
+) -> Dict[str, Any]:
+    """ローカルの入力ファイルから標本を取って処理し、計測値と見積もりを返す"""
+    join = None
+    if config.lookup is not None:
+        with profiling.stage("lookup"):
+            join = open_join(config_dict(config)["lookup"])
+    batch_size = config.settings.batchSize
+
+    with open(path, "rb") as f:
+        input_codec = detect_codec(f.read(MAGIC_SIZE))
+        f.seek(0)
+        codec = output_codec(input_codec)
+        extension = output_extension(config.inputFile, input_codec, codec)
+        output_uri = join_uri(config.outputPath, "_preview", f"part-00000{extension}")
+        fd, part_path = tempfile.mkstemp(suffix=extension)
+        try:
+            with profiling.stage("compute"), os.fdopen(fd, "wb") as raw, open_compressed(
+                raw, codec, output_level()
+            ) as out:
+                if input_codec == "none":
+                    with MmapRecordReader(path, skip_header=True) as reader:
+                        batches = preview.sample_mmap(reader, mode, number, batch_size, seed, pieces)
+                        meter = process_sample(out, batches, mode, join)
+                        batches = None
+                        input_bytes = reader.size - reader.data_start
+                        meter.finish(input_bytes if mode == "reservoir" else None)
+                else:
+                    with open_decompressed(f, input_codec) as stream:
+                        reader = StreamRecordReader(stream, skip_header=True)
+                        batches = preview.sample_stream(reader, mode, number, batch_size, seed)
+                        meter = process_sample(out, batches, mode, join)
+                        if mode == "head":
+                            # 入力の途中までしか展開していないため、展開前と展開後の読み込み量の比から見積もる
+                            consumed = f.tell()
+                            total = os.fstat(f.fileno()).st_size
+                            input_bytes = stream.tell() * total // consumed if consumed else None
+                            meter.finish()
+                        else:
+                            # 担当外のバッチも改行を探しながら最後まで展開している
+                            input_bytes = reader.position
+                            meter.finish(input_bytes)
+            with profiling.stage("upload"):
+                upload_file(part_path, output_uri)
+        finally:
+            os.remove(part_path)
+
+    print(f"プレビューの出力: {output_uri}")
+    result = meter.projection(input_bytes, shard_count)
+    result["output"] = output_uri
+    if join is not None:
+        result["lookup"] = {"matched": join.matched, "missed": join.missed}
+    return result
+
+
+def process_sample(
+    out: BinaryIO, batches: Iterator[RecordBatch], mode: str, join: Optional[LookupJoin]
+) -> preview.SampleMeter:
+    """標本のバッチを処理し、処理量と時間を計測する（計測を終えるのは呼び出し側）"""
+    meter = preview.SampleMeter()
+    batch = None
+    for batch in batches:
+        started = time.perf_counter()
+        write_batch(out, batch, join)
+        meter.observe(batch, time.perf_counter() - started)
+    # メモリマップを閉じる前にバッチへの参照を外す
+    batch = None
+    return meter
+
+
+def process_item(item: dict):
+    """バンドル実行の1アイテムを処理する"""
+    # アイテム数が多いため、pydantic ではなく軽量な fastconfig で検証する
+    with profiling.stage("config"):
+        config = config_from_dict(item)
+    process_config(config)
+
+
+def run_bundle_mode(items: list, shutdown: GracefulShutdown):
+    """
+    BUNDLE 環境変数の作業アイテムを順番に処理する
+
+    完了したアイテムはチェックポイントに記録するため、中断後のリトライでは
+    未完了のアイテムだけが処理される。中断時は終了コード 75、
+    失敗があれば終了コード 1 で終了する。
+    """
+    print(f"\n=== バンドル実行（{len(items)} アイテム）===")
+    output_path = items[0].get("outputPath") if items and isinstance(items[0], dict) else None
+    checkpoint = Checkpoint.for_job(output_path)
+    if checkpoint.completed:
+        print(f"チェックポイントから {len(checkpoint.completed)} 件の完了済みアイテムを読み込みました")
+
+    results = run_bundle(
+        items,
+        process_item,
+        shutdown=shutdown,
+        checkpoint=checkpoint,
+    )
+    failed = [result for result in results if result.status == "FAILED"]
+    print(f"\nバンドル実行結果: 処理 {len(results)} / 失敗 {len(failed)} / 全 {len(items)}")
+    if shutdown.requested and len(results) < len(items):
+        shutdown.exit_interrupted()
+    if failed:
+        sys.exit(1)
+
+
+def run_worker_mode(queue_url: str, shutdown: GracefulShutdown):
+    """
+    作業キューからアイテムを取り出して処理し続ける
+
+    WORKER_IDLE_SECONDS の間アイテムが1件も成功しなければ（キューが空か失敗が続けば）終了する。
+    停止が要求された場合は処理中のアイテムを終えてから終了コード 75 で終了する（未処理のアイテムはキューに残る）。
+    """
+    print(f"\n=== ワーカー実行（キュー: {queue_url}）===")
+
+    def process_whole_item(config: FastJobConfig):
+        # ワーカーは配列ジョブとして起動されるが、各アイテムは入力全体を1シャードとして処理する
+        with shard_scope(0, 1):
+            process_config(config)
+
+    # メッセージ本文はそのまま fastconfig で解析する（再配信された同じ本文はキャッシュから返る）
+    results = run_worker(
+        open_queue(queue_url),
+        process_whole_item,
+        shutdown=shutdown,
+        decode=parse_config,
+    )
+    failed = [result for result in results if result.status == "FAILED"]
+    print(f"\nワーカー実行結果: 処理 {len(results)} / 失敗 {len(failed)}")
+    if shutdown.requested:
+        shutdown.exit_interrupted()
 
 
 def main():
+    # Spot 回収時の SIGTERM を捕捉する
+    shutdown = GracefulShutdown().install()
+    # PROFILE が設定されていればステージの計測とサンプリングを開始する
+    profiling.start_from_env()
+    # PUSHGATEWAY_URL または METRICS が設定されていればメトリクスを集計し、終了時に送る
+    metrics.start_from_env()
     try:
         print("=== バッチジョブ開始 ===")
         print("version: 1.0.6")
@@ -89,6 +756,18 @@ def main():
         print(f"AWS_BATCH_JOB_ATTEMPT: {os.environ.get('AWS_BATCH_JOB_ATTEMPT', '未設定')}")
         print(f"AWS_BATCH_JOB_QUEUE: {os.environ.get('AWS_BATCH_JOB_QUEUE', '未設定')}")
         
+        # 作業キューが指定されている場合はワーカーとして処理し続ける
+        queue_url = os.environ.get("WORK_QUEUE_URL")
+        if queue_url:
+            run_worker_mode(queue_url, shutdown)
+            return
+
+        # バンドルが指定されている場合は複数アイテムをまとめて処理
+        bundle_items = load_bundle()
+        if bundle_items is not None:
+            run_bundle_mode(bundle_items, shutdown)
+            return
+        
         # JSONパラメータの取得とPydanticモデル化
         print("\n=== JSONパラメータの取得（Pydanticモデル使用）===")
         try:
@@ -97,31 +776,40 @@ def main():
             print("生のJSON:")
             print(config_json)
  
+            # スイープの場合は配列インデックスの組み合わせを CONFIG に上書きして処理
+            spec_json = os.environ.get("SWEEP_SPEC")
+            if spec_json:
+                run_sweep_mode(spec_json)
+                return
+
             # Pydanticモデルで処理
-            config = BatchJobConfig.from_env()
-            print("\nPydanticモデルで解析:")
-            print(f"入力ファイル: {config.inputFile}")
-            print(f"出力パス: {config.outputPath}")
-            print(f"バッチサイズ: {config.settings.batchSize}")
-            print(f"モデルタイプ: {config.settings.modelType}")
-            print(f"最大イテレーション: {config.settings.maxIterations}")
-            print(f"学習率: {config.settings.learningRate}")
-            print(f"ジョブタイプ: {config.metadata.jobType}")
-            print(f"バージョン: {config.metadata.version}")
-            print(f"説明: {config.metadata.description}")
-            
-            # 検証済みモデルをJSON形式で出力
-            print("\n検証済みモデル（JSON形式）:")
-            print(config.model_dump_json(indent=2, ensure_ascii=False))
+            with profiling.stage("config"):
+                # BatchJobConfig と同じスキーマを fastconfig で検証する（orjson があればデコードに使う）
+                config = config_from_env()
+            if os.environ.get("FINALIZE_OUTPUT", "").lower() == "true":
+                run_finalize_mode(config)
+            elif os.environ.get("PREVIEW"):
+                # 入力の標本だけを処理して、実行時間とメモリを見積もる
+                run_preview_mode(config, os.environ["PREVIEW"])
+            elif os.environ.get("LEASE_TABLE"):
+                # 小さなシャードをリーステーブルから取得して処理する
+                run_lease_mode(config, os.environ["LEASE_TABLE"], shutdown)
+            else:
+                process_config(config, shutdown)
             
         except ValueError as e:
             print(f"設定の読み込み中にエラーが発生しました: {e}", file=sys.stderr)
+            sys.exit(1)
         except Exception as e:
             print(f"予期しないエラーが発生しました: {e}", file=sys.stderr)
+            sys.exit(1)
             
     except Exception as e:
         print(f"実行中にエラーが発生しました: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        profiling.finish()
+        metrics.finish()
 
 
 if __name__ == "__main__":
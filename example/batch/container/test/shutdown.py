@@ -0,0 +1,122 @@
+"""
+グレースフルシャットダウンモジュール
+
+Fargate Spot / EC2 Spot の回収時に送られる SIGTERM を捕捉し、
+新しい作業の取り出しを止めて、完了済みの作業をチェックポイントに記録してから
+リトライ可能な終了コードで終了するための部品を提供する。
+"""
+import json
+import os
+import signal
+import sys
+import time
+from typing import Any, Dict, Optional, Set
+
+from storage import join_uri, read_bytes, write_bytes
+
+# 中断によるリトライ可能な終了を表す終了コード（EX_TEMPFAIL）
+# Terraform の retry_exit_conditions でこの値を RETRY に設定している
+EXIT_CODE_INTERRUPTED = 75
+
+# SIGTERM 受信後に処理を続けてよい時間（秒）
+# Spot 回収の通知から強制終了までは最大2分。ただし Fargate では
+# タスクの停止タイムアウトで先に SIGKILL される場合があるため、必要に応じて短くする
+DEFAULT_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "110"))
+
+
+class GracefulShutdown:
+    """SIGTERM の受信状態を保持し、処理ループから参照するためのフラグ"""
+
+    def __init__(self, grace_seconds: float = DEFAULT_GRACE_SECONDS):
+        self.grace_seconds = grace_seconds
+        self.received_at: Optional[float] = None
+
+    def install(self) -> "GracefulShutdown":
+        """SIGTERM ハンドラを登録する"""
+        signal.signal(signal.SIGTERM, self._handle)
+        return self
+
+    def _handle(self, signum, frame):
+        if self.received_at is None:
+            self.received_at = time.monotonic()
+            print(
+                f"SIGTERM を受信しました。新しい作業の取り出しを停止し、"
+                f"{self.grace_seconds:.0f} 秒以内に終了します",
+                file=sys.stderr,
+                flush=True,
+            )
+
+    @property
+    def requested(self) -> bool:
+        """停止が要求されているかどうか"""
+        return self.received_at is not None
+
+    def exit_interrupted(self):
+        """バッファを書き出してリトライ可能な終了コードで終了する"""
+        print("中断のため終了します（リトライ対象）", file=sys.stderr)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.exit(EXIT_CODE_INTERRUPTED)
+
+
+class Checkpoint:
+    """
+    完了済み作業アイテムのキーと、途中まで処理した作業の進捗を記録するチェックポイント
+
+    進捗はシャードの処理ループが中断時に書く（処理済みの位置・書き出し済みの出力ファイルなど）。
+    """
+
+    def __init__(self, uri: Optional[str]):
+        self.uri = uri
+        self.completed: Set[str] = set()
+        self.progress: Dict[str, Dict[str, Any]] = {}
+        if uri:
+            data = read_bytes(uri)
+            if data:
+                state = json.loads(data)
+                self.completed = set(state["completed"])
+                self.progress = state.get("progress", {})
+
+    @classmethod
+    def for_job(cls, output_path: Optional[str]) -> "Checkpoint":
+        """
+        ジョブのチェックポイントを開く
+
+        CHECKPOINT_URI が設定されていればそれを使う。未設定の場合は出力パス配下の
+        ジョブIDごとのファイルを使う。ジョブIDはリトライ間で変わらないため、
+        再実行時には前回の試行が完了した作業を引き継げる。
+        """
+        uri = os.environ.get("CHECKPOINT_URI")
+        job_id = os.environ.get("AWS_BATCH_JOB_ID")
+        if not uri and output_path and job_id:
+            uri = join_uri(output_path, "_checkpoints", f"{job_id}.json")
+        return cls(uri)
+
+    def is_done(self, key: str) -> bool:
+        """作業が完了済みかどうか"""
+        return key in self.completed
+
+    def mark_done(self, key: str):
+        """作業の完了を記録し、チェックポイントを書き込む"""
+        self.completed.add(key)
+        self.commit()
+
+    def save_progress(self, key: str, state: Dict[str, Any]):
+        """途中まで処理した作業の進捗を記録し、チェックポイントを書き込む"""
+        self.progress[key] = state
+        self.commit()
+
+    def clear_progress(self, key: str):
+        """作業の進捗を削除する（記録がなければ何もしない）"""
+        if self.progress.pop(key, None) is not None:
+            self.commit()
+
+    def commit(self):
+        """チェックポイントを書き込む"""
+        if not self.uri:
+            return
+        state: Dict[str, Any] = {"completed": sorted(self.completed)}
+        if self.progress:
+            state["progress"] = self.progress
+        payload = json.dumps(state, ensure_ascii=False)
+        write_bytes(self.uri, payload.encode("utf-8"))
@@ -0,0 +1,261 @@
+"""
+ストレージアクセスモジュール
+
+ローカルパスと s3:// URI を同じインターフェースで読み書きする。
+S3 を使う場合のみ boto3 を遅延インポートする。
+"""
+import io
+import os
+import random
+import shutil
+import time
+from functools import lru_cache
+from typing import BinaryIO, Iterable, List, Optional
+
+import memo_keys
+# 送信側と共有する URI の規則（このモジュールから import しているモジュールのために公開する）
+from memo_keys import join_uri, split_s3_uri  # noqa: F401
+
+
+def is_s3_uri(uri: str) -> bool:
+    """URI が S3 を指しているかどうか"""
+    return uri.startswith("s3://")
+
+
+# 条件付き書き込みが同じキーへの書き込みと競合した場合に試す回数の上限と、待ち時間（秒）の基準・上限
+CONDITIONAL_WRITE_ATTEMPTS = 8
+CONDITIONAL_WRITE_BACKOFF = 0.05
+CONDITIONAL_WRITE_MAX_BACKOFF = 2.0
+
+
+@lru_cache(maxsize=1)
+def s3_client():
+    """S3 クライアントを返す（プロセス内で1つを共有）"""
+    try:
+        import boto3
+    except ImportError:
+        raise RuntimeError("S3 にアクセスするには boto3 のインストールが必要です")
+    return boto3.client("s3")
+
+
+def read_bytes(uri: str) -> Optional[bytes]:
+    """
+    オブジェクトを読み込む
+
+    Returns:
+        オブジェクトの内容。存在しない場合は None
+    """
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        client = s3_client()
+        try:
+            return client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except client.exceptions.NoSuchKey:
+            return None
+
+    try:
+        with open(uri, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_bytes(uri: str, data: bytes):
+    """
+    オブジェクトを書き込む
+
+    ローカルパスの場合は一時ファイルに書いてから置き換えるため、
+    読み手が書き込み途中の内容を見ることはない。
+    """
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        s3_client().put_object(Bucket=bucket, Key=key, Body=data)
+        return
+
+    directory = os.path.dirname(uri)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{uri}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, uri)
+
+
+def write_bytes_if_absent(uri: str, data: bytes) -> bool:
+    """
+    オブジェクトが存在しない場合だけ書き込む（最初に書いた1つだけが成功する）
+
+    同じシャードを複数のジョブ（投機的な重複実行など）が同時に書き込んでも、
+    内容が混ざったり後から上書きされたりしない。S3 では条件付き書き込み
+    （If-None-Match）、ローカルパスではハードリンクの作成で原子的に判定する。
+    S3 で同じキーへの書き込みと競合した（ConditionalRequestConflict）場合は、
+    ジッター付きの指数バックオフで待ってから CONDITIONAL_WRITE_ATTEMPTS 回まで試す。
+
+    Returns:
+        書き込んだ場合は True、既に存在した場合は False
+
+    Raises:
+        botocore.exceptions.ClientError: 競合が上限の回数まで続いた場合や、その他のエラーの場合
+    """
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        client = s3_client()
+        for attempt in range(CONDITIONAL_WRITE_ATTEMPTS):
+            try:
+                client.put_object(Bucket=bucket, Key=key, Body=data, IfNoneMatch="*")
+                return True
+            except client.exceptions.ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code == "PreconditionFailed":
+                    return False
+                # 同じキーへの書き込みが競合した場合は、結果が確定してから判定し直す
+                if code != "ConditionalRequestConflict" or attempt == CONDITIONAL_WRITE_ATTEMPTS - 1:
+                    raise
+            # 競合したジョブどうしが同時に再試行しないよう、待ち時間をずらす（full jitter）
+            backoff = min(CONDITIONAL_WRITE_MAX_BACKOFF, CONDITIONAL_WRITE_BACKOFF * 2 ** attempt)
+            time.sleep(random.uniform(0, backoff))
+
+    directory = os.path.dirname(uri)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{uri}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.link(tmp_path, uri)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+
+
+def head_etag(uri: str) -> Optional[str]:
+    """
+    オブジェクトのバージョンを識別する値を返す
+
+    S3 では ETag、ローカルパスではサイズと更新時刻から作る。存在しない場合は None
+    規則は送信側と共有する memo_keys.head_etag にある。
+    """
+    return memo_keys.head_etag(uri, s3_client)
+
+
+def object_size(uri: str) -> int:
+    """オブジェクトのサイズ（バイト）"""
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        return s3_client().head_object(Bucket=bucket, Key=key)["ContentLength"]
+    return os.path.getsize(uri)
+
+
+def download_to(uri: str, fileobj: BinaryIO, chunk_size: int = 8 * 1024 * 1024):
+    """オブジェクトの内容をチャンク単位でファイルオブジェクトに書き出す"""
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        body = s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+        for chunk in body.iter_chunks(chunk_size):
+            fileobj.write(chunk)
+        return
+
+    with open(uri, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            fileobj.write(chunk)
+
+
+class _BodyReader(io.RawIOBase):
+    """S3 のレスポンスボディを io.BufferedReader で包めるようにするアダプター"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.body.close()
+        super().close()
+
+
+def open_stream(uri: str, buffer_size: int = 1024 * 1024, start: int = 0) -> io.BufferedReader:
+    """
+    オブジェクトを start バイト目から順に読むストリームを開く
+
+    ファイル全体をダウンロードせずに読み始められる。peek() で先頭のバイト列を
+    消費せずに確認できる。S3 では start 以降の範囲指定 GET になり、途中で閉じれば残りは転送されない。
+    """
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        params = {"Bucket": bucket, "Key": key}
+        if start:
+            params["Range"] = f"bytes={start}-"
+        body = s3_client().get_object(**params)["Body"]
+        return io.BufferedReader(_BodyReader(body), buffer_size=buffer_size)
+    f = open(uri, "rb", buffering=buffer_size)
+    if start:
+        f.seek(start)
+    return f
+
+
+def upload_file(path: str, uri: str):
+    """ローカルファイルをアップロード（ローカルパスの場合はコピー）する"""
+    if is_s3_uri(uri):
+        bucket, key = split_s3_uri(uri)
+        # 大きなファイルはマルチパートで転送される
+        s3_client().upload_file(path, bucket, key)
+        return
+
+    directory = os.path.dirname(uri)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    shutil.copyfile(path, uri)
+
+
+def list_uris(prefix: str) -> List[str]:
+    """プレフィックス（ディレクトリ）配下のすべてのオブジェクトの URI を返す"""
+    if is_s3_uri(prefix):
+        bucket, key = split_s3_uri(prefix.rstrip("/") + "/")
+        paginator = s3_client().get_paginator("list_objects_v2")
+        return [
+            f"s3://{bucket}/{item['Key']}"
+            for page in paginator.paginate(Bucket=bucket, Prefix=key)
+            for item in page.get("Contents", [])
+        ]
+
+    uris = []
+    for directory, _, names in os.walk(prefix):
+        uris.extend(os.path.join(directory, name) for name in names)
+    return sorted(uris)
+
+
+def delete_uris(uris: Iterable[str]):
+    """オブジェクトをまとめて削除する（存在しないものは無視する）"""
+    s3_keys = {}
+    for uri in uris:
+        if is_s3_uri(uri):
+            bucket, key = split_s3_uri(uri)
+            s3_keys.setdefault(bucket, []).append(key)
+            continue
+        try:
+            os.remove(uri)
+        except FileNotFoundError:
+            pass
+
+    for bucket, keys in s3_keys.items():
+        # delete_objects は1回に1000件まで
+        for i in range(0, len(keys), 1000):
+            s3_client().delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True},
+            )
@@ -0,0 +1,217 @@
+"""
+圧縮コーデックモジュール
+
+入力ファイルの先頭のマジックバイトから圧縮形式を判定し、ファイル全体を展開せずに
+少しずつ展開しながら読めるストリームを返す。出力も書き込みながら圧縮する。
+
+対応形式: gzip, zstd（zstandard。コンテナの依存関係に含まれる）, bz2, xz
+
+環境変数:
+    OUTPUT_CODEC              出力の圧縮形式（auto は入力と同じ形式。デフォルト auto）
+    OUTPUT_COMPRESSION_LEVEL  出力の圧縮レベル（省略時は形式ごとの既定値）
+    ZSTD_THREADS              zstd の圧縮スレッド数（-1 は CPU 数。デフォルト -1）
+
+ベンチマーク:
+    python stream_codecs.py --bench --size-mb 200
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+from typing import BinaryIO, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 判定に使う先頭のバイト数
+MAGIC_SIZE = 6
+
+# 圧縮形式ごとのマジックバイト
+MAGIC_BYTES = {
+    "gzip": b"\x1f\x8b",
+    "zstd": b"\x28\xb5\x2f\xfd",
+    "bz2": b"BZh",
+    "xz": b"\xfd7zXZ\x00",
+}
+
+# 圧縮形式ごとのファイル拡張子
+EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst", "bz2": ".bz2", "xz": ".xz"}
+
+# 圧縮形式ごとの既定の圧縮レベル
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3, "bz2": 9, "xz": 6}
+
+CODECS = tuple(EXTENSIONS)
+
+
+def detect_codec(head: bytes) -> str:
+    """先頭のバイト列から圧縮形式を判定する。非圧縮なら "none" """
+    for codec, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return codec
+    return "none"
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd を扱うには zstandard のインストールが必要です")
+
+
+def open_decompressed(fileobj: BinaryIO, codec: str) -> BinaryIO:
+    """
+    圧縮されたストリームを展開しながら読むストリームを返す
+
+    fileobj は先頭から順に読むだけなので、S3 のレスポンスボディのような
+    シークできないストリームも渡せる。
+    """
+    if codec == "none":
+        return fileobj
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if codec == "zstd":
+        _require_zstd()
+        # 複数フレームを連結したファイル（並列圧縮の出力など）も最後まで読む
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    if codec == "bz2":
+        return bz2.BZ2File(fileobj, mode="rb")
+    if codec == "xz":
+        return lzma.LZMAFile(fileobj, mode="rb")
+    raise ValueError(f"未対応の圧縮形式です: {codec}")
+
+
+def open_compressed(
+    fileobj: BinaryIO, codec: str, level: Optional[int] = None, threads: Optional[int] = None
+) -> BinaryIO:
+    """
+    書き込んだ内容を圧縮しながら fileobj に書き出すストリームを返す
+
+    返したストリームを閉じると圧縮の終端が書き込まれる（fileobj は閉じない）。
+    zstd は threads が 0 以外であれば複数スレッドで圧縮する。
+    """
+    if codec == "none":
+        return _Unclosed(fileobj)
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level)
+    if codec == "zstd":
+        _require_zstd()
+        threads = int(os.environ.get("ZSTD_THREADS", "-1")) if threads is None else threads
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+        return compressor.stream_writer(fileobj, closefd=False)
+    if codec == "bz2":
+        return bz2.BZ2File(fileobj, mode="wb", compresslevel=level)
+    if codec == "xz":
+        return lzma.LZMAFile(fileobj, mode="wb", preset=level)
+    raise ValueError(f"未対応の圧縮形式です: {codec}")
+
+
+class _Unclosed(io.RawIOBase):
+    """close しても元のストリームを閉じない書き込み用ラッパー（非圧縮の出力用）"""
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self.fileobj.write(data)
+
+
+def output_codec(input_codec: str) -> str:
+    """環境変数 OUTPUT_CODEC から出力の圧縮形式を決める"""
+    codec = os.environ.get("OUTPUT_CODEC", "auto").lower()
+    if codec == "auto":
+        codec = input_codec
+    if codec not in CODECS:
+        raise ValueError(f"OUTPUT_CODEC が不正です: {codec}（{', '.join(CODECS)}, auto から選択）")
+    if codec == "zstd":
+        _require_zstd()
+    return codec
+
+
+def output_level() -> Optional[int]:
+    """環境変数 OUTPUT_COMPRESSION_LEVEL から出力の圧縮レベルを返す。未設定なら None"""
+    level = os.environ.get("OUTPUT_COMPRESSION_LEVEL")
+    return int(level) if level else None
+
+
+def _bench(size_mb: int, bandwidth_mb: float, batch_size: int):
+    """
+    圧縮形式ごとに転送バイト数と、転送 + 展開 + レコード読み込みの所要時間を比較する
+
+    転送時間は実測せず、bandwidth_mb（MB/秒）で転送したものとして計算する。
+    """
+    import random
+    import time
+
+    from reader import StreamRecordReader
+
+    rng = random.Random(0)
+    words = [f"item{i}" for i in range(5000)]
+    lines = [b"id,name,category,value,score\n"]
+    size = len(lines[0])
+    while size < size_mb * 1024 * 1024:
+        line = (
+            f"{len(lines)},{rng.choice(words)},{rng.choice(words[:50])},"
+            f"{rng.randint(0, 10 ** 6)},{rng.random():.6f}\n"
+        ).encode()
+        lines.append(line)
+        size += len(line)
+    raw = b"".join(lines)
+
+    variants = [("none", None, 0), ("gzip", 1, 0), ("gzip", 6, 0), ("bz2", 9, 0), ("xz", 1, 0)]
+    if zstandard is not None:
+        variants += [("zstd", 3, 0), ("zstd", 3, -1), ("zstd", 9, -1)]
+    else:
+        print("zstandard がインストールされていないため zstd は計測しません")
+
+    print(
+        f"入力 {len(raw) / 1e6:.0f} MB, {len(lines) - 1} 行, 転送速度 {bandwidth_mb:.0f} MB/秒 として計算"
+    )
+    print(
+        f"{'形式':<8}{'レベル':>6}{'スレッド':>8}{'転送 MB':>10}{'圧縮率':>8}"
+        f"{'圧縮 秒':>9}{'転送 秒':>9}{'展開+読込 秒':>13}{'合計 秒':>9}"
+    )
+    for codec, level, threads in variants:
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        with open_compressed(buffer, codec, level, threads) as writer:
+            writer.write(raw)
+        compress_seconds = time.perf_counter() - start
+        compressed = buffer.getvalue()
+
+        start = time.perf_counter()
+        rows = 0
+        stream = open_decompressed(io.BytesIO(compressed), detect_codec(compressed[:MAGIC_SIZE]))
+        for batch in StreamRecordReader(stream, skip_header=True).iter_batches(batch_size):
+            rows += len(batch)
+        read_seconds = time.perf_counter() - start
+        assert rows == len(lines) - 1
+
+        transfer_seconds = len(compressed) / (bandwidth_mb * 1e6)
+        print(
+            f"{codec:<8}{level if level is not None else '-':>6}{threads:>8}"
+            f"{len(compressed) / 1e6:>10.1f}{len(raw) / len(compressed):>8.1f}"
+            f"{compress_seconds:>9.2f}{transfer_seconds:>9.2f}{read_seconds:>13.2f}"
+            f"{transfer_seconds + read_seconds:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="圧縮形式ごとの転送量と処理時間のベンチマーク")
+    parser.add_argument("--bench", action="store_true", help="ベンチマークを実行する")
+    parser.add_argument("--size-mb", type=int, default=100, help="生成する入力のサイズ（MB）")
+    parser.add_argument(
+        "--bandwidth-mb", type=float, default=100, help="転送時間の計算に使う転送速度（MB/秒）"
+    )
+    parser.add_argument("--batch-size", type=int, default=64, help="1バッチあたりのレコード数")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.size_mb, args.bandwidth_mb, args.batch_size)
+    else:
+        parser.print_help()
@@ -0,0 +1,177 @@
+"""
+パラメータスイープモジュール
+
+送信側 submit_sweep_job.py は、全組み合わせの設定を送る代わりに、基本の CONFIG と
+スイープの定義（SWEEP_SPEC）だけを配列ジョブに渡す。各子ジョブは配列インデックスから
+自分が担当する組み合わせを計算し、CONFIG に上書きして処理する。
+
+SWEEP_SPEC の形式:
+    {
+      "mode": "grid",            # grid（全組み合わせ）/ random（ランダム）/ lhs（ラテン超方格）
+      "samples": 100,            # random / lhs のサンプル数
+      "seed": 0,
+      "fields": {
+        "settings.batchSize": [32, 64, 128],                                  # 値の一覧
+        "settings.maxIterations": {"start": 100, "stop": 500, "step": 100},   # 等差数列
+        "settings.learningRate": {"min": 0.0001, "max": 0.1, "num": 4, "log": true}
+      }
+    }
+
+{"min", "max"} の範囲は grid では num 個の等間隔（log なら対数で等間隔）の値になり、
+random / lhs では範囲内の連続値を取る（"type": "int" なら整数に丸める）。
+同じ規則を送信側 sweep.py でも実装しているため、変更する場合は両方をそろえること
+（送信側の tests/test_sweep_parity.py で同じ点になることを確認する）。
+
+環境変数:
+    SWEEP_SPEC    スイープの定義（JSON）
+    SWEEP_OFFSET  配列インデックスに足す値（配列サイズの上限で分割して送信した場合）
+"""
+import copy
+import math
+import os
+import random
+from typing import Any, Dict, List, Optional
+
+SWEEP_MODES = ("grid", "random", "lhs")
+
+
+def field_values(name: str, field: Any) -> Optional[List[Any]]:
+    """
+    フィールドの離散値の一覧を返す。連続値の範囲（num のない min / max）なら None
+
+    Raises:
+        ValueError: 定義が不正な場合
+    """
+    if isinstance(field, list):
+        if not field:
+            raise ValueError(f"{name}: 値の一覧が空です")
+        return field
+    if not isinstance(field, dict):
+        return [field]
+    if "step" in field:
+        start, stop, step = field["start"], field["stop"], field["step"]
+        if step <= 0 or stop < start:
+            raise ValueError(f"{name}: start / stop / step が不正です")
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        values = [round(start + i * step, 12) for i in range(count)]
+        return [int(v) for v in values] if all(isinstance(v, int) for v in (start, stop, step)) else values
+    if "num" in field:
+        num = int(field["num"])
+        if num < 1:
+            raise ValueError(f"{name}: num は1以上にしてください")
+        return [_scale(field, i / (num - 1) if num > 1 else 0.0) for i in range(num)]
+    if "min" in field and "max" in field:
+        return None
+    raise ValueError(f"{name}: 値の一覧、start / stop / step、min / max のいずれかで指定してください")
+
+
+def _scale(field: Dict[str, Any], u: float) -> Any:
+    """0〜1 の値 u を範囲 [min, max] の値に変換する"""
+    low, high = field["min"], field["max"]
+    if field.get("log"):
+        if low <= 0:
+            raise ValueError("log を指定する範囲の min は正の値にしてください")
+        value = math.exp(math.log(low) + u * (math.log(high) - math.log(low)))
+    else:
+        value = low + u * (high - low)
+    if field.get("type") == "int":
+        return int(min(max(round(value), math.ceil(low)), math.floor(high)))
+    return round(value, 12)
+
+
+def _pick(name: str, field: Any, u: float) -> Any:
+    """0〜1 の値 u からフィールドの値を選ぶ"""
+    values = field_values(name, field)
+    if values is None:
+        return _scale(field, u)
+    return values[min(int(u * len(values)), len(values) - 1)]
+
+
+def sweep_size(spec: Dict[str, Any]) -> int:
+    """
+    スイープの点の数を返す
+
+    Raises:
+        ValueError: 定義が不正な場合
+    """
+    mode = spec.get("mode", "grid")
+    if mode not in SWEEP_MODES:
+        raise ValueError(f"mode が不正です: {mode}（{', '.join(SWEEP_MODES)} から選択）")
+    fields = spec.get("fields") or {}
+    if not fields:
+        raise ValueError("fields が空です")
+    if mode != "grid":
+        samples = int(spec.get("samples", 0))
+        if samples < 1:
+            raise ValueError(f"{mode} には samples（1以上）が必要です")
+        return samples
+    size = 1
+    for name, field in fields.items():
+        values = field_values(name, field)
+        if values is None:
+            raise ValueError(f"{name}: grid では min / max の範囲に num が必要です")
+        size *= len(values)
+    return size
+
+
+def point(spec: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """
+    index 番目の点のパラメータ（フィールド名 → 値）を返す
+
+    他の点を列挙せずに計算する（lhs だけはフィールドごとにサンプル数の長さの順列を作る）。
+
+    Raises:
+        ValueError: index が範囲外、または定義が不正な場合
+    """
+    size = sweep_size(spec)
+    if not 0 <= index < size:
+        raise ValueError(f"インデックス {index} がスイープの範囲（0〜{size - 1}）外です")
+    mode = spec.get("mode", "grid")
+    seed = spec.get("seed", 0)
+    fields = list(spec["fields"].items())
+
+    params = {}
+    if mode == "grid":
+        # 最後のフィールドが最も速く変わる混合基数で分解する
+        remainder = index
+        for name, field in reversed(fields):
+            values = field_values(name, field)
+            remainder, position = divmod(remainder, len(values))
+            params[name] = values[position]
+        return {name: params[name] for name, _ in fields}
+
+    for number, (name, field) in enumerate(fields):
+        u = random.Random(f"{seed}:{index}:{number}").random()
+        if mode == "lhs":
+            # フィールドごとに区間の順列を作り、各点が各区間を1回ずつ使うようにする
+            strata = list(range(size))
+            random.Random(f"{seed}:lhs:{number}").shuffle(strata)
+            u = (strata[index] + u) / size
+        params[name] = _pick(name, field, u)
+    return params
+
+
+def apply(config: Dict[str, Any], params: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """
+    基本の設定にパラメータを上書きした設定を返す
+
+    フィールド名は "settings.learningRate" のようにドット区切りで入れ子のキーを表す。
+    出力が他の点と混ざらないよう、outputPath の下に点ごとのディレクトリを切る。
+    """
+    result = copy.deepcopy(config)
+    for name, value in params.items():
+        target = result
+        keys = name.split(".")
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    if result.get("outputPath"):
+        result["outputPath"] = f"{result['outputPath'].rstrip('/')}/sweep-{index:05d}/"
+    return result
+
+
+def index_from_env() -> int:
+    """配列インデックスと SWEEP_OFFSET から点の番号を返す"""
+    return int(os.environ.get("SWEEP_OFFSET", "0")) + int(
+        os.environ.get("AWS_BATCH_JOB_ARRAY_INDEX", "0")
+    )
@@ -0,0 +1,43 @@
+"""
+コンテナのテストの共通設定
+
+コンテナのモジュールは /app に平置きで import される前提のため、このディレクトリを import パスに加える。
+テストは tests/ に置き、memo.code_version が対象にする *.py には含めない。
+"""
+import os
+import sys
+
+import pytest
+
+CONTAINER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, CONTAINER_DIR)
+
+# ジョブの実行環境から渡され、テストの結果を変える環境変数
+JOB_ENVIRONMENT = (
+    "AWS_BATCH_JOB_ID",
+    "AWS_BATCH_JOB_ATTEMPT",
+    "AWS_BATCH_JOB_ARRAY_INDEX",
+    "RUN_ID",
+    "SHARD_INDEX",
+    "SHARD_COUNT",
+    "CHECKPOINT_URI",
+    "CACHE_DIR",
+    "CACHE_INPUTS",
+    "MEMO_INDEX",
+    "CODE_VERSION",
+    "OUTPUT_CODEC",
+    "OUTPUT_COMPRESSION_LEVEL",
+    "METRICS",
+    "PUSHGATEWAY_URL",
+    "PROFILE",
+    "LEASE_TABLE",
+    "WORK_QUEUE_URL",
+)
+
+
+@pytest.fixture(autouse=True)
+def job_environment(monkeypatch):
+    """ホストの環境変数がジョブの動作に影響しないようにする"""
+    for name in JOB_ENVIRONMENT:
+        monkeypatch.delenv(name, raising=False)
@@ -0,0 +1,62 @@
+"""同じ入力を設定を変えて処理するバンドル内のアイテムが、チェックポイントとマニフェストで区別されることの確認"""
+import json
+
+import run_batch
+from bundle import RESULT_MARKER, item_key
+from committer import finalize, item_id, load_manifest, run_id, shard_manifest_uri
+from fastconfig import config_from_dict
+from shutdown import Checkpoint, GracefulShutdown
+
+ROWS = 200
+
+
+def make_items(input_file, output_path):
+    base = {
+        "inputFile": input_file,
+        "outputPath": output_path,
+        "metadata": {"jobType": "test", "version": "1", "description": "bundle"},
+    }
+    return [
+        dict(base, settings={"batchSize": 50}),
+        dict(base, settings={"batchSize": 50, "maxIterations": 10}),
+    ]
+
+
+def bundle_results(output):
+    return [json.loads(line.split(" ", 1)[1]) for line in output.splitlines() if line.startswith(RESULT_MARKER)]
+
+
+def test_items_sharing_input_are_processed_and_committed_separately(tmp_path, monkeypatch, capsys):
+    input_file = str(tmp_path / "input.csv")
+    with open(input_file, "w", encoding="utf-8") as f:
+        f.write("id,value\n" + "".join(f"{i},{i * i}\n" for i in range(ROWS)))
+    output_path = str(tmp_path / "output")
+    checkpoint_uri = str(tmp_path / "checkpoint.json")
+    monkeypatch.setenv("CHECKPOINT_URI", checkpoint_uri)
+    items = make_items(input_file, output_path)
+    # キーの順序が違っても同じアイテムとして扱う
+    assert item_key(dict(reversed(list(items[0].items())))) == item_key(items[0])
+    assert item_key(items[0]) != item_key(items[1])
+
+    run_batch.run_bundle_mode(items, GracefulShutdown())
+
+    results = bundle_results(capsys.readouterr().out)
+    assert [(result["key"], result["status"]) for result in results] == [
+        (item_key(items[0]), "SUCCEEDED"),
+        (item_key(items[1]), "SUCCEEDED"),
+    ]
+    assert Checkpoint(checkpoint_uri).completed == {item_key(item) for item in items}
+
+    configs = [run_batch.config_dict(config_from_dict(item)) for item in items]
+    assert item_id(configs[0]) != item_id(configs[1])
+    run = run_id(input_file)
+    for config in configs:
+        with open(shard_manifest_uri(config, run, 0, 1), "r", encoding="utf-8") as f:
+            assert json.load(f)["result"]["rows"] == ROWS
+        finalize(config, 1, run=run)
+        manifest = load_manifest(config)
+        assert (manifest["itemId"], manifest["rows"]) == (item_id(config), ROWS)
+
+    # リトライでは両方のアイテムが完了済みとしてスキップされる
+    run_batch.run_bundle_mode(items, GracefulShutdown())
+    assert [result["status"] for result in bundle_results(capsys.readouterr().out)] == ["SKIPPED", "SKIPPED"]
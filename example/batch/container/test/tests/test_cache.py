@@ -0,0 +1,117 @@
+"""複数のプロセスからの同時取得でダウンロードが1回になることと、使用中のファイルが evict で削除されないことの確認"""
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import cache
+from cache import ContentCache
+
+# 子プロセスに monkeypatch した関数を引き継ぐため fork で起動する
+CONTEXT = multiprocessing.get_context("fork")
+
+
+@pytest.fixture
+def objects(tmp_path, monkeypatch):
+    """s3://bucket/<名前> を tmp_path/s3/<名前> として読み、ダウンロードの回数を記録するストレージ"""
+    root = tmp_path / "s3"
+    root.mkdir()
+    downloads = tmp_path / "downloads.log"
+
+    def local_path(uri):
+        return root / uri.split("/", 3)[3]
+
+    def head_etag(uri):
+        path = local_path(uri)
+        return f"{path.stat().st_size}-{path.stat().st_mtime_ns}" if path.exists() else None
+
+    def download_to(uri, fileobj):
+        with open(downloads, "a", encoding="utf-8") as f:
+            f.write(uri + "\n")
+        # 同時に要求したプロセスがダウンロード中に重なるよう時間をかける
+        time.sleep(0.2)
+        fileobj.write(local_path(uri).read_bytes())
+
+    monkeypatch.setattr(cache, "head_etag", head_etag)
+    monkeypatch.setattr(cache, "download_to", download_to)
+
+    def put(name, data):
+        path = local_path(f"s3://bucket/{name}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return f"s3://bucket/{name}"
+
+    put.downloads = lambda: downloads.read_text(encoding="utf-8").splitlines() if downloads.exists() else []
+    return put
+
+
+def fetch_and_read(root, uri, start, results):
+    start.wait()
+    with ContentCache(root).fetch(uri) as pinned:
+        with open(pinned.path, "rb") as f:
+            results.put((pinned.path, f.read()))
+
+
+def hold_pinned(root, uri, pinned_event, release):
+    with ContentCache(root).pinned(uri):
+        pinned_event.set()
+        release.wait(30)
+
+
+def test_concurrent_fetch_downloads_once(tmp_path, objects):
+    root = str(tmp_path / "cache")
+    uri = objects("ref/table.csv", b"id,name\n1,a\n" * 1000)
+    start = CONTEXT.Event()
+    results = CONTEXT.Queue()
+    processes = [CONTEXT.Process(target=fetch_and_read, args=(root, uri, start, results)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    start.set()
+    fetched = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    assert objects.downloads() == [uri]
+    assert len({path for path, _ in fetched}) == 1
+    assert all(data == b"id,name\n1,a\n" * 1000 for _, data in fetched)
+
+
+def test_evict_keeps_file_pinned_by_other_process(tmp_path, objects):
+    root = str(tmp_path / "cache")
+    old = objects("ref/old.bin", b"o" * 1000)
+    new = objects("ref/new.bin", b"n" * 1000)
+    pinned_event = CONTEXT.Event()
+    release = CONTEXT.Event()
+    holder = CONTEXT.Process(target=hold_pinned, args=(root, old, pinned_event, release))
+    holder.start()
+    try:
+        assert pinned_event.wait(30)
+        # 上限を1ファイル分にして新しいオブジェクトを取得すると、古いオブジェクトが削除の対象になる
+        content_cache = ContentCache(root, max_bytes=1000)
+        old_file = content_cache.fetch(old)
+        old_file.close()
+        with content_cache.fetch(new) as pinned:
+            assert os.path.exists(old_file.path)
+            assert os.path.exists(pinned.path)
+    finally:
+        release.set()
+        holder.join(30)
+    assert holder.exitcode == 0
+
+    # ロックが外れた後は削除できる（取得中の new は keep で残る）
+    with content_cache.fetch(new) as pinned:
+        content_cache.evict(keep=pinned.path)
+        assert not os.path.exists(old_file.path)
+        assert os.path.exists(pinned.path)
+
+
+def test_fetch_holds_pin_until_closed(tmp_path, objects):
+    content_cache = ContentCache(str(tmp_path / "cache"), max_bytes=0)
+    pinned = content_cache.fetch(objects("ref/model.bin", b"m" * 100))
+    content_cache.evict()
+    assert os.path.exists(pinned.path)
+    pinned.close()
+    content_cache.evict()
+    assert not os.path.exists(pinned.path)
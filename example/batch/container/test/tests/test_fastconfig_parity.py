@@ -0,0 +1,109 @@
+"""fastconfig.config_from_dict と pydantic の BatchJobConfig が同じ CONFIG を同じように受け付けることの確認"""
+import copy
+
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from fastconfig import config_from_dict  # noqa: E402
+from models import BatchJobConfig  # noqa: E402
+
+BASE = {
+    "inputFile": "s3://example-bucket/input/data.csv",
+    "outputPath": "s3://example-bucket/output/",
+    "settings": {"batchSize": 64, "modelType": "classification", "maxIterations": 100, "learningRate": 0.01},
+    "metadata": {"jobType": "batch-processing", "version": "1.0.0", "description": "サンプル"},
+}
+LOOKUP = {"referenceFile": "s3://example-bucket/ref/users.csv", "key": "user_id"}
+
+
+def variant(**changes):
+    """BASE の一部を変えた CONFIG（キーは "settings.batchSize" のように . で区切る。値 None はキーを消す）"""
+    config = copy.deepcopy(BASE)
+    for dotted, value in changes.items():
+        *parents, name = dotted.split(".")
+        target = config
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        if value is None:
+            target.pop(name, None)
+        else:
+            target[name] = value
+    return config
+
+
+CASES = {
+    "base": BASE,
+    "defaults": variant(settings={}),
+    "lookup": variant(lookup=LOOKUP, referenceFiles=["s3://example-bucket/ref/a.csv"]),
+    "lookup_options": variant(lookup={**LOOKUP, "inputColumn": "2", "columns": ["name"], "missing": "drop"}),
+    "null_lookup": variant(lookup=None),
+    # 入れ子のモデルの未知のキーは無視される
+    "nested_extra_settings": variant(**{"settings.extra": 1}),
+    "nested_extra_metadata": variant(**{"metadata.owner": "team-a"}),
+    "nested_extra_lookup": variant(lookup={**LOOKUP, "comment": "x"}),
+    # 最上位（BaseSettings）の未知のキーはエラー
+    "top_extra": variant(unknown=1),
+    # 文字列や小数部のない数値から整数・小数への変換
+    "int_string": variant(**{"settings.batchSize": "64"}),
+    "int_string_spaces": variant(**{"settings.batchSize": " +64 "}),
+    "int_string_underscore": variant(**{"settings.batchSize": "6_4"}),
+    "int_string_zero_fraction": variant(**{"settings.batchSize": "64.00"}),
+    "int_float": variant(**{"settings.batchSize": 64.0}),
+    "int_bool": variant(**{"settings.batchSize": True}),
+    "int_fraction": variant(**{"settings.batchSize": 64.5}),
+    "int_string_fraction": variant(**{"settings.batchSize": "64.5"}),
+    "int_string_exponent": variant(**{"settings.batchSize": "1e2"}),
+    "int_string_hex": variant(**{"settings.batchSize": "0x40"}),
+    "int_string_empty": variant(**{"settings.batchSize": ""}),
+    "int_null": variant(**{"settings.batchSize": None, "settings.maxIterations": 100}),
+    "int_list": variant(**{"settings.batchSize": [64]}),
+    "float_int": variant(**{"settings.learningRate": 1}),
+    "float_string": variant(**{"settings.learningRate": "0.01"}),
+    "float_string_exponent": variant(**{"settings.learningRate": " 1e-3 "}),
+    "float_string_infinity": variant(**{"settings.learningRate": "Infinity"}),
+    "float_string_bad": variant(**{"settings.learningRate": "fast"}),
+    "float_string_empty": variant(**{"settings.learningRate": ""}),
+    # 真偽値
+    "bool_true": variant(cacheInput=True),
+    "bool_string": variant(cacheInput="yes"),
+    "bool_string_upper": variant(cacheInput="OFF"),
+    "bool_int": variant(cacheInput=0),
+    "bool_bad_int": variant(cacheInput=2),
+    "bool_bad_string": variant(cacheInput="maybe"),
+    # 文字列・リテラル・配列は変換しない
+    "str_int": variant(**{"metadata.version": 1}),
+    "str_bool": variant(inputFile=True),
+    "literal_bad": variant(**{"settings.modelType": "regression"}),
+    "list_item_int": variant(referenceFiles=["a", 1]),
+    "list_string": variant(referenceFiles="a"),
+    "missing_required": variant(inputFile=None),
+    "missing_nested_required": variant(**{"metadata.jobType": None}),
+    "settings_not_object": variant(settings=[]),
+}
+
+
+def pydantic_result(config):
+    try:
+        return BatchJobConfig(**config).model_dump()
+    except Exception:
+        return "ERROR"
+
+
+def fast_result(config):
+    try:
+        return config_from_dict(config).to_dict()
+    except ValueError:
+        return "ERROR"
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_same_result_as_pydantic(name):
+    config = CASES[name]
+    assert fast_result(config) == pydantic_result(config)
+
+
+def test_cases_cover_both_outcomes():
+    results = [pydantic_result(config) for config in CASES.values()]
+    assert "ERROR" in results
+    assert sum(result != "ERROR" for result in results) >= 20
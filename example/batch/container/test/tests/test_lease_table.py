@@ -0,0 +1,145 @@
+"""SqliteLeaseTable のリースの取得・延長・期限切れと、run_leases の再処理の確認"""
+import time
+
+import pytest
+
+from lease_table import (
+    DONE,
+    FAILED,
+    LEASED,
+    PENDING,
+    DynamoLeaseTable,
+    LeaseHeartbeat,
+    SqliteLeaseTable,
+    open_lease_table,
+    run_leases,
+)
+
+LEASE = 0.3
+
+
+@pytest.fixture
+def table_path(tmp_path):
+    return str(tmp_path / "lease.db")
+
+
+@pytest.fixture
+def table(table_path):
+    table = SqliteLeaseTable(table_path)
+    table.register("group", 4)
+    return table
+
+
+def test_register_does_not_reset_progress(table):
+    lease = table.claim("group", "a", LEASE)
+    table.complete(lease)
+    table.register("group", 4)
+    assert table.counts("group") == {PENDING: 3, DONE: 1}
+
+
+def test_claim_starts_at_start_and_wraps(table):
+    shards = [table.claim("group", "a", 60, start=2).shard for _ in range(4)]
+    assert shards == [2, 3, 0, 1]
+    assert table.claim("group", "a", 60) is None
+    assert table.counts("group") == {LEASED: 4}
+
+
+def test_groups_are_independent(table):
+    table.register("other", 1)
+    assert table.claim("other", "a", 60).shard == 0
+    assert table.claim("other", "a", 60) is None
+    assert table.counts("group") == {PENDING: 4}
+
+
+def test_expired_lease_is_claimed_by_another_owner(table_path):
+    table = SqliteLeaseTable(table_path)
+    other = open_lease_table(f"sqlite://{table_path}")
+    table.register("group", 1)
+
+    lease = table.claim("group", "a", LEASE)
+    assert lease.attempts == 1
+    assert other.claim("group", "b", LEASE) is None
+
+    time.sleep(LEASE + 0.05)
+    taken = other.claim("group", "b", LEASE)
+    assert (taken.shard, taken.owner, taken.attempts) == (0, "b", 2)
+    # 期限切れで取られた元の所有者は、延長も完了もできない
+    assert not table.renew(lease, LEASE)
+    assert not table.complete(lease)
+    assert other.complete(taken)
+    assert table.counts("group") == {DONE: 1}
+
+
+def test_renew_extends_lease(table):
+    lease = table.claim("group", "a", LEASE, start=0)
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert table.renew(lease, LEASE)
+    # 最初の期限を過ぎても延長した分だけ取られない
+    assert [table.claim("group", "b", 60).shard for _ in range(3)] == [1, 2, 3]
+    assert table.claim("group", "b", 60) is None
+
+
+def test_release_returns_shard_or_marks_failed(table):
+    first = table.claim("group", "a", 60, start=0)
+    second = table.claim("group", "a", 60, start=0)
+    assert table.release(first)
+    assert table.release(second, FAILED)
+
+    again = table.claim("group", "b", 60, start=0)
+    assert (again.shard, again.attempts) == (0, 2)
+    assert table.counts("group") == {PENDING: 2, LEASED: 1, FAILED: 1}
+
+
+def test_heartbeat_keeps_lease_past_expiry(table):
+    lease = table.claim("group", "a", LEASE, start=3)
+    with LeaseHeartbeat(table, lease, LEASE) as heartbeat:
+        time.sleep(LEASE * 3)
+        assert [table.claim("group", "b", 60).shard for _ in range(3)] == [0, 1, 2]
+        assert table.claim("group", "b", 60) is None
+    assert not heartbeat.lost
+
+
+def test_heartbeat_reports_lost_lease(table):
+    lease = table.claim("group", "a", LEASE, start=0)
+    # 延長が間に合わず別の子ジョブが取得した状態にする
+    time.sleep(LEASE + 0.05)
+    table.claim("group", "b", 60, start=0)
+    with LeaseHeartbeat(table, lease, LEASE) as heartbeat:
+        time.sleep(LEASE / 3 + 0.1)
+    assert heartbeat.lost
+
+
+def test_run_leases_recovers_expired_and_failed_shards(table, monkeypatch):
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "parent:1")
+    # 別の子ジョブがシャード 0 を取得したまま停止した
+    table.claim("group", "stopped#1", LEASE, start=0)
+    processed = []
+
+    def process(shard):
+        processed.append(shard)
+        if shard == 1 and processed.count(1) == 1:
+            raise RuntimeError("一時的な失敗")
+        if shard == 2:
+            raise RuntimeError("常に失敗")
+
+    results = run_leases(table, "group", 4, process, lease_seconds=LEASE, idle_seconds=LEASE * 4, max_attempts=2)
+
+    assert sorted(processed) == [0, 1, 1, 2, 2, 3]
+    statuses = {}
+    for result in results:
+        statuses.setdefault(result["shard"], []).append(result["status"])
+    assert statuses == {
+        0: ["SUCCEEDED"],
+        1: ["RELEASED", "SUCCEEDED"],
+        2: ["RELEASED", "FAILED"],
+        3: ["SUCCEEDED"],
+    }
+    assert table.counts("group") == {DONE: 3, FAILED: 1}
+
+
+def test_dynamo_names_only_include_used_placeholders():
+    # 使われていない名前を渡すと DynamoDB はエラーにする。#g と #gs は別の名前として扱う
+    assert DynamoLeaseTable._names("attribute_not_exists(#k)") == {"#k": "shard"}
+    assert DynamoLeaseTable._names("#gs = :gs", "#e < :now") == {"#gs": "group_state", "#e": "expires_at"}
+    assert DynamoLeaseTable._names("#g = :g AND #s = :s") == {"#g": "lease_group", "#s": "lease_state"}
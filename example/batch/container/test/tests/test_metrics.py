@@ -0,0 +1,51 @@
+"""バッチの処理時間の記録が、間引いたバッチでだけ時刻を取得し、ヒストグラムに正しく数えることの確認"""
+import pytest
+
+import metrics
+from metrics import JobMetrics
+
+
+class FakeClock:
+    """呼ばれるたびに step 秒進む時計（呼び出し回数を数える）"""
+
+    def __init__(self, step):
+        self.step = step
+        self.now = 0.0
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.now += self.step
+        return self.now
+
+
+def make_timer(monkeypatch, sample_every, clock):
+    job_metrics = JobMetrics(sample_every=sample_every)
+    # batch_timer は作成時に時計を束縛する
+    with monkeypatch.context() as patch:
+        patch.setattr(metrics.time, "perf_counter", clock)
+        tick = job_metrics.batch_timer()
+    return job_metrics, tick
+
+
+@pytest.mark.parametrize("sample_every", [1, 4, 16])
+def test_tick_reads_clock_only_for_sampled_batches(monkeypatch, sample_every):
+    clock = FakeClock(0.003)
+    job_metrics, tick = make_timer(monkeypatch, sample_every, clock)
+    batches = 1600
+    for _ in range(batches):
+        tick()
+
+    samples = job_metrics.registry.render().splitlines()
+    if sample_every == 1:
+        # すべてのバッチで時刻を取り、前のバッチとの差を記録する（最初のバッチは開始時刻だけ）
+        assert clock.calls == batches
+        recorded = batches - 1
+    else:
+        # sample_every 個に1個のバッチの前後で2回だけ時刻を取る
+        assert clock.calls == 2 * batches // sample_every
+        recorded = batches // sample_every
+    assert f"batch_job_batch_seconds_count {recorded}" in samples
+    # 記録した処理時間は時計の1刻み分で、0.0025 < x <= 0.005 のバケットに入る
+    assert 'batch_job_batch_seconds_bucket{le="0.0025"} 0' in samples
+    assert f'batch_job_batch_seconds_bucket{{le="0.005"}} {recorded}' in samples
@@ -0,0 +1,129 @@
+"""SIGTERM を受けたシャードの処理が、進捗をチェックポイントに記録して終了コード 75 で終了し、リトライで続きから処理することの確認"""
+import gzip
+import json
+import os
+import signal
+
+import pytest
+
+import run_batch
+from committer import shard_manifest_uri, run_id
+from fastconfig import parse_config
+from shutdown import EXIT_CODE_INTERRUPTED, Checkpoint, GracefulShutdown
+
+ROWS = 1000
+BATCH_SIZE = 50
+
+
+@pytest.fixture
+def sigterm_handler():
+    """テストで登録した SIGTERM ハンドラを元に戻す"""
+    previous = signal.getsignal(signal.SIGTERM)
+    yield
+    signal.signal(signal.SIGTERM, previous)
+
+
+def write_input(path, compressed):
+    body = "id,value\n" + "".join(f"{i},{i * i}\n" for i in range(ROWS))
+    opener = gzip.open if compressed else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        f.write(body)
+    return body.split("\n", 1)[1].encode("utf-8")
+
+
+def make_config(input_file, output_path):
+    return parse_config(
+        json.dumps(
+            {
+                "inputFile": input_file,
+                "outputPath": output_path,
+                "settings": {"batchSize": BATCH_SIZE},
+                "metadata": {"jobType": "test", "version": "1", "description": "shutdown"},
+            }
+        )
+    )
+
+
+def terminate_after(monkeypatch, batches):
+    """batches 個目のバッチを書き出した直後に自分自身に SIGTERM を送る"""
+    write_batch = run_batch.write_batch
+    written = []
+
+    def write_then_terminate(out, batch, join=None):
+        write_batch(out, batch, join)
+        written.append(len(batch))
+        if len(written) == batches:
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    monkeypatch.setattr(run_batch, "write_batch", write_then_terminate)
+    return written
+
+
+def read_output(manifest):
+    data = b""
+    for entry in manifest["files"]:
+        with open(entry["uri"], "rb") as f:
+            content = f.read()
+        data += gzip.decompress(content) if entry["codec"] == "gzip" else content
+    return data
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["mmap", "gzip"])
+def test_sigterm_checkpoints_and_resumes(tmp_path, monkeypatch, sigterm_handler, compressed):
+    input_file = str(tmp_path / ("input.csv.gz" if compressed else "input.csv"))
+    output_path = str(tmp_path / "output")
+    expected = write_input(input_file, compressed)
+    checkpoint_uri = str(tmp_path / "checkpoint.json")
+    monkeypatch.setenv("CHECKPOINT_URI", checkpoint_uri)
+    config = make_config(input_file, output_path)
+    manifest_uri = shard_manifest_uri(run_batch.config_dict(config), run_id(input_file), 0, 1)
+
+    # 1回目・2回目の試行: 3バッチ・5バッチを書き出した後に SIGTERM を受けて中断する
+    processed = 0
+    for attempt, batches in enumerate([3, 5], start=1):
+        monkeypatch.setenv("AWS_BATCH_JOB_ATTEMPT", str(attempt))
+        written = terminate_after(monkeypatch, batches)
+        with pytest.raises(SystemExit) as exited:
+            run_batch.process_config(config, GracefulShutdown(grace_seconds=60).install())
+        assert exited.value.code == EXIT_CODE_INTERRUPTED
+        assert written == [BATCH_SIZE] * batches
+        processed += batches * BATCH_SIZE
+
+        assert not os.path.exists(manifest_uri)
+        progress = Checkpoint(checkpoint_uri).progress[manifest_uri]
+        assert progress["rows"] == processed
+        assert progress["batches"] == processed // BATCH_SIZE
+        assert len(progress["files"]) == attempt
+        if not compressed:
+            header = len(b"id,value\n")
+            assert progress["offset"] == header + len(b"".join(expected.splitlines(keepends=True)[:processed]))
+
+    # 3回目の試行: 続きから処理してコミットする
+    monkeypatch.setenv("AWS_BATCH_JOB_ATTEMPT", "3")
+    written = terminate_after(monkeypatch, None)
+    run_batch.process_config(config, GracefulShutdown(grace_seconds=60).install())
+    assert sum(written) == ROWS - processed
+
+    with open(manifest_uri, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["result"]["rows"] == ROWS
+    assert [entry["rows"] for entry in manifest["files"]] == [150, 250, ROWS - processed]
+    # 中断前の試行の出力が先に並び、つなげると入力と同じになる
+    assert read_output(manifest) == expected
+    assert Checkpoint(checkpoint_uri).progress == {}
+
+
+def test_no_sigterm_commits_in_one_attempt(tmp_path, monkeypatch, sigterm_handler):
+    input_file = str(tmp_path / "input.csv")
+    output_path = str(tmp_path / "output")
+    expected = write_input(input_file, False)
+    monkeypatch.setenv("CHECKPOINT_URI", str(tmp_path / "checkpoint.json"))
+
+    config = make_config(input_file, output_path)
+    run_batch.process_config(config, GracefulShutdown().install())
+
+    manifest_uri = shard_manifest_uri(run_batch.config_dict(config), run_id(input_file), 0, 1)
+    with open(manifest_uri, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert len(manifest["files"]) == 1
+    assert read_output(manifest) == expected
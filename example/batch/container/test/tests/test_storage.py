@@ -0,0 +1,70 @@
+"""S3 の条件付き書き込みが競合した場合に、バックオフを挟んで上限の回数まで試すことの確認"""
+import pytest
+from botocore.exceptions import ClientError
+
+import storage
+
+
+class ConflictingS3:
+    """最初の conflicts 回は ConditionalRequestConflict を返し、その後は書き込むか PreconditionFailed を返す"""
+
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self, conflicts, exists=False):
+        self.conflicts = conflicts
+        self.exists = exists
+        self.calls = 0
+
+    def put_object(self, **kwargs):
+        assert kwargs["IfNoneMatch"] == "*"
+        self.calls += 1
+        if self.calls <= self.conflicts:
+            raise ClientError({"Error": {"Code": "ConditionalRequestConflict"}}, "PutObject")
+        if self.exists:
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.exists = True
+        return {}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(storage.time, "sleep", recorded.append)
+    return recorded
+
+
+def use_client(monkeypatch, client):
+    monkeypatch.setattr(storage, "s3_client", lambda: client)
+
+
+@pytest.mark.parametrize("exists, expected", [(False, True), (True, False)])
+def test_conflicts_are_retried_with_backoff(monkeypatch, sleeps, exists, expected):
+    client = ConflictingS3(conflicts=3, exists=exists)
+    use_client(monkeypatch, client)
+
+    assert storage.write_bytes_if_absent("s3://bucket/_shards/a.json", b"{}") is expected
+    assert client.calls == 4
+    # 待ち時間は試行ごとに上限が倍になる範囲からランダムに選ぶ
+    assert len(sleeps) == 3
+    for attempt, seconds in enumerate(sleeps):
+        assert 0 <= seconds <= storage.CONDITIONAL_WRITE_BACKOFF * 2 ** attempt
+
+
+def test_conflicts_give_up_after_max_attempts(monkeypatch, sleeps):
+    client = ConflictingS3(conflicts=100)
+    use_client(monkeypatch, client)
+
+    with pytest.raises(ClientError, match="ConditionalRequestConflict"):
+        storage.write_bytes_if_absent("s3://bucket/_shards/a.json", b"{}")
+    assert client.calls == storage.CONDITIONAL_WRITE_ATTEMPTS
+    assert len(sleeps) == storage.CONDITIONAL_WRITE_ATTEMPTS - 1
+    assert all(seconds <= storage.CONDITIONAL_WRITE_MAX_BACKOFF for seconds in sleeps)
+
+
+def test_local_write_succeeds_once(tmp_path):
+    uri = str(tmp_path / "shards" / "a.json")
+    assert storage.write_bytes_if_absent(uri, b"first") is True
+    assert storage.write_bytes_if_absent(uri, b"second") is False
+    with open(uri, "rb") as f:
+        assert f.read() == b"first"
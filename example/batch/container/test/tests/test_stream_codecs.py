@@ -0,0 +1,62 @@
+"""圧縮形式ごとの圧縮・展開の往復と、zstd の入力をジョブとして処理できることの確認"""
+import io
+import json
+
+import pytest
+import zstandard
+
+import run_batch
+from committer import run_id, shard_manifest_uri
+from fastconfig import parse_config
+from stream_codecs import CODECS, EXTENSIONS, MAGIC_SIZE, detect_codec, open_compressed, open_decompressed
+
+BODY = b"id,value\n" + b"".join(f"{i},{i * i}\n".encode() for i in range(5000))
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(codec):
+    buffer = io.BytesIO()
+    with open_compressed(buffer, codec, threads=0) as writer:
+        writer.write(BODY)
+    data = buffer.getvalue()
+
+    assert detect_codec(data[:MAGIC_SIZE]) == codec
+    assert open_decompressed(io.BytesIO(data), codec).read() == BODY
+
+
+def test_zstd_reads_concatenated_frames():
+    # 並列圧縮や追記で複数フレームになったファイルも最後まで読む
+    half = len(BODY) // 2
+    data = zstandard.ZstdCompressor().compress(BODY[:half]) + zstandard.ZstdCompressor().compress(BODY[half:])
+    assert open_decompressed(io.BytesIO(data), "zstd").read() == BODY
+
+
+def test_job_processes_zstd_input(tmp_path):
+    input_file = str(tmp_path / f"input.csv{EXTENSIONS['zstd']}")
+    with open(input_file, "wb") as f:
+        f.write(zstandard.ZstdCompressor().compress(BODY))
+    output_path = str(tmp_path / "output")
+    config = parse_config(
+        json.dumps(
+            {
+                "inputFile": input_file,
+                "outputPath": output_path,
+                "settings": {"batchSize": 500},
+                "metadata": {"jobType": "test", "version": "1", "description": "zstd"},
+            }
+        )
+    )
+
+    run_batch.process_config(config)
+
+    manifest_uri = shard_manifest_uri(run_batch.config_dict(config), run_id(input_file), 0, 1)
+    with open(manifest_uri, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["result"]["rows"] == 5000
+    output = b""
+    for entry in manifest["files"]:
+        # 出力は入力と同じ形式で圧縮される（OUTPUT_CODEC=auto）
+        assert entry["codec"] == "zstd"
+        with open(entry["uri"], "rb") as f:
+            output += open_decompressed(f, "zstd").read()
+    assert output == BODY.split(b"\n", 1)[1]
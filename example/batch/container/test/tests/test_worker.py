@@ -0,0 +1,179 @@
+"""SqliteWorkQueue の可視性タイムアウト・ハートビート・再配信と、ワーカーの失敗時の再処理の確認"""
+import json
+import time
+
+import pytest
+
+from bundle import item_key
+from worker import Heartbeat, SqliteWorkQueue, SqsWorkQueue, open_queue, run_worker
+
+VISIBILITY = 0.3
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.db")
+
+
+def dead_letters(queue):
+    return [body for (body,) in queue.db.execute("SELECT body FROM dead_letters ORDER BY id")]
+
+
+def test_received_message_is_hidden_until_timeout(queue_path):
+    queue = SqliteWorkQueue(queue_path)
+    other = open_queue(f"sqlite://{queue_path}")
+    queue.send(["a"])
+
+    [message] = queue.receive(0, VISIBILITY)
+    assert (message.body, message.receive_count) == ("a", 1)
+    # 別のワーカー（同じファイルを開いた別の接続）からは見えない
+    assert other.receive(0, VISIBILITY) == []
+
+    time.sleep(VISIBILITY + 0.05)
+    [redelivered] = other.receive(0, VISIBILITY)
+    assert (redelivered.body, redelivered.receive_count) == ("a", 2)
+    assert redelivered.receipt != message.receipt
+
+
+def test_stale_receipt_cannot_delete_or_extend(queue_path):
+    queue = SqliteWorkQueue(queue_path)
+    queue.send(["a"])
+    [first] = queue.receive(0, VISIBILITY)
+    time.sleep(VISIBILITY + 0.05)
+    [second] = queue.receive(0, VISIBILITY)
+
+    # タイムアウト後に別のワーカーが受信したため、最初の受信ハンドルは無効
+    queue.delete(first)
+    queue.extend(first, 60)
+    time.sleep(VISIBILITY + 0.05)
+    [third] = queue.receive(0, VISIBILITY)
+    assert third.receive_count == 3
+
+    queue.delete(third)
+    assert queue.receive(0, VISIBILITY) == []
+    assert second.receive_count == 2
+
+
+def test_heartbeat_keeps_message_invisible(queue_path):
+    queue = SqliteWorkQueue(queue_path)
+    other = SqliteWorkQueue(queue_path)
+    queue.send(["a"])
+    [message] = queue.receive(0, VISIBILITY)
+
+    with Heartbeat(queue, message, VISIBILITY):
+        # 可視性タイムアウトの数倍の間、延長し続けて他のワーカーに取られない
+        deadline = time.monotonic() + VISIBILITY * 4
+        while time.monotonic() < deadline:
+            assert other.receive(0, VISIBILITY) == []
+            time.sleep(0.05)
+
+    # 止めた後はタイムアウトの経過で再配信される
+    time.sleep(VISIBILITY + 0.05)
+    [redelivered] = other.receive(0, VISIBILITY)
+    assert redelivered.receive_count == 2
+
+
+def test_message_moves_to_dead_letters_after_max_receives(queue_path):
+    queue = SqliteWorkQueue(queue_path, max_receive_count=2)
+    queue.send(["poison", "ok"])
+
+    for receive_count in (1, 2):
+        [message] = queue.receive(0, VISIBILITY)
+        assert (message.body, message.receive_count) == ("poison", receive_count)
+        time.sleep(VISIBILITY + 0.05)
+
+    [message] = queue.receive(0, VISIBILITY)
+    assert message.body == "ok"
+    assert dead_letters(queue) == ["poison"]
+
+
+def test_worker_redelivers_failed_item(queue_path):
+    queue = SqliteWorkQueue(queue_path)
+    items = [{"inputFile": "s3://bucket/a.csv"}, {"inputFile": "s3://bucket/b.csv"}]
+    queue.send([json.dumps(item) for item in items])
+    attempts = []
+
+    def process(item):
+        attempts.append(item["inputFile"])
+        if attempts.count(item["inputFile"]) == 1 and item["inputFile"].endswith("a.csv"):
+            raise RuntimeError("一時的な失敗")
+
+    results = run_worker(queue, process, idle_seconds=VISIBILITY * 4, visibility_seconds=VISIBILITY)
+
+    assert [(result.key, result.status) for result in results] == [
+        (item_key(items[0]), "FAILED"),
+        (item_key(items[1]), "SUCCEEDED"),
+        (item_key(items[0]), "SUCCEEDED"),
+    ]
+    assert "受信 1 回目" in results[0].error
+    assert queue.receive(0, VISIBILITY) == []
+
+
+def test_worker_keeps_long_item_with_heartbeat(queue_path):
+    queue = SqliteWorkQueue(queue_path)
+    other = SqliteWorkQueue(queue_path)
+    queue.send([json.dumps({"inputFile": "s3://bucket/slow.csv"})])
+    stolen = []
+
+    def process(item):
+        # 可視性タイムアウトより長い処理の間、別のワーカーは受信できない
+        deadline = time.monotonic() + VISIBILITY * 3
+        while time.monotonic() < deadline:
+            stolen.extend(other.receive(0, VISIBILITY))
+            time.sleep(0.05)
+
+    results = run_worker(queue, process, idle_seconds=0.5, visibility_seconds=VISIBILITY)
+
+    assert [result.status for result in results] == ["SUCCEEDED"]
+    assert stolen == []
+    time.sleep(VISIBILITY + 0.05)
+    assert other.receive(0, VISIBILITY) == []
+
+
+class FlakySqs:
+    """send_message_batch で指定した回数だけエントリーの一部を Failed で返す SQS クライアント"""
+
+    def __init__(self, failures, sender_fault=False):
+        self.failures = failures
+        self.sender_fault = sender_fault
+        self.sent = []
+        self.calls = 0
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            failed, accepted = Entries[:1], Entries[1:]
+        else:
+            failed, accepted = [], Entries
+        self.sent += [entry["MessageBody"] for entry in accepted]
+        return {
+            "Successful": [{"Id": entry["Id"]} for entry in accepted],
+            "Failed": [
+                {"Id": entry["Id"], "SenderFault": self.sender_fault, "Code": "InternalError"} for entry in failed
+            ],
+        }
+
+
+def test_sqs_send_retries_failed_entries(monkeypatch):
+    monkeypatch.setattr("worker.time.sleep", lambda seconds: None)
+    client = FlakySqs(failures=2)
+    bodies = [f"item-{number}" for number in range(12)]
+
+    SqsWorkQueue("https://sqs.example/queue", client=client).send(bodies)
+
+    assert sorted(client.sent) == sorted(bodies)
+    assert client.calls == 4
+
+
+def test_sqs_send_raises_when_entries_cannot_be_sent(monkeypatch):
+    monkeypatch.setattr("worker.time.sleep", lambda seconds: None)
+    queue = SqsWorkQueue("https://sqs.example/queue", client=FlakySqs(failures=100))
+    with pytest.raises(RuntimeError, match="1 件を送信できませんでした"):
+        queue.send(["a", "b"])
+
+    client = FlakySqs(failures=1, sender_fault=True)
+    with pytest.raises(RuntimeError):
+        SqsWorkQueue("https://sqs.example/queue", client=client).send(["a", "b"])
+    # 再送しても成功しないエラーは送り直さない
+    assert client.calls == 1
@@ -0,0 +1,289 @@
+"""
+ワーカー実行モジュール
+
+1ジョブ1アイテムで実行すると、アイテムごとにイメージの取得、インタプリタの起動、
+モジュールの読み込みのコストがかかる。ワーカーモードでは1つのコンテナが作業キューから
+アイテム（CONFIG と同じ形式のJSON）を取り出し続け、起動済みのインタプリタで処理する。
+
+- キューは SQS 互換の API（https://sqs... の URL）か、テスト用の SQLite キュー（sqlite:///path）
+- 処理中のメッセージは可視性タイムアウトを延長し続け、他のワーカーに取られないようにする
+- アイテムを処理できないまま（キューが空か、失敗が続いて）一定時間たつと終了する
+- 失敗し続けるメッセージは、SQS では送信側 submit_workers.py が作るデッドレターキュー（<キュー名>-dlq）へ移る
+- アイテムごとの結果は BUNDLE_ITEM_RESULT 行として出力する（送信側 history.py が取り込む）
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, NamedTuple, Optional
+
+from bundle import RESULT_MARKER, BundleItemResult, item_key
+from shutdown import GracefulShutdown
+
+# キューが空のまま待つ時間（秒）。超えたらワーカーを終了する
+DEFAULT_IDLE_SECONDS = float(os.environ.get("WORKER_IDLE_SECONDS", "60"))
+
+# 取り出したメッセージを他のワーカーから見えなくする時間（秒）
+DEFAULT_VISIBILITY_SECONDS = int(os.environ.get("WORKER_VISIBILITY_SECONDS", "300"))
+
+# SQS のロングポーリングの最大待ち時間（秒）
+MAX_WAIT_SECONDS = 20
+
+# send_message_batch の1回の件数の上限と、送信に失敗したエントリーを送り直す回数の上限
+SEND_BATCH_SIZE = 10
+SEND_ATTEMPTS = 5
+
+
+class Message(NamedTuple):
+    """キューから取り出したメッセージ"""
+    body: str
+    receipt: str
+    receive_count: int
+
+
+class SqsWorkQueue:
+    """SQS の作業キュー（client を省略すると boto3 の SQS クライアントを作る）"""
+
+    def __init__(self, queue_url: str, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("SQS を使うには boto3 のインストールが必要です")
+            client = boto3.client("sqs")
+        self.queue_url = queue_url
+        self.client = client
+
+    def receive(self, wait_seconds: float, visibility_seconds: int) -> List[Message]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=int(min(wait_seconds, MAX_WAIT_SECONDS)),
+            VisibilityTimeout=visibility_seconds,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        return [
+            Message(
+                message["Body"],
+                message["ReceiptHandle"],
+                int(message["Attributes"]["ApproximateReceiveCount"]),
+            )
+            for message in response.get("Messages", [])
+        ]
+
+    def extend(self, message: Message, visibility_seconds: int):
+        self.client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=message.receipt,
+            VisibilityTimeout=visibility_seconds,
+        )
+
+    def delete(self, message: Message):
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message.receipt)
+
+    def send(self, bodies: List[str]):
+        """
+        メッセージを送る（send_message_batch の Failed のエントリーは待ってから送り直す）
+
+        Raises:
+            RuntimeError: 送り直しても送れなかったか、再送しても成功しないエラー（SenderFault）の場合
+        """
+        for i in range(0, len(bodies), SEND_BATCH_SIZE):
+            entries = [
+                {"Id": str(n), "MessageBody": body}
+                for n, body in enumerate(bodies[i:i + SEND_BATCH_SIZE])
+            ]
+            for attempt in range(SEND_ATTEMPTS):
+                failed = self.client.send_message_batch(
+                    QueueUrl=self.queue_url, Entries=entries
+                ).get("Failed", [])
+                if not failed:
+                    break
+                if attempt + 1 == SEND_ATTEMPTS or any(entry.get("SenderFault") for entry in failed):
+                    raise RuntimeError(
+                        f"メッセージ {len(failed)} 件を送信できませんでした: "
+                        f"{failed[0].get('Code')} {failed[0].get('Message', '')}"
+                    )
+                retry = {entry["Id"] for entry in failed}
+                entries = [entry for entry in entries if entry["Id"] in retry]
+                # full jitter
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+
+
+class SqliteWorkQueue:
+    """
+    SQLite で SQS の動作を模した作業キュー（ローカルでの動作確認用）
+
+    複数のプロセスから同じファイルを開いて使える。receive_count が max_receive_count を
+    超えたメッセージは dead_letters テーブルに移す（SQS の再処理ポリシーに相当）。
+    """
+
+    def __init__(self, path: str, max_receive_count: int = 5):
+        self.path = path
+        self.max_receive_count = max_receive_count
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY, body TEXT NOT NULL, "
+            "visible_at REAL NOT NULL DEFAULT 0, receive_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters (id INTEGER PRIMARY KEY, body TEXT NOT NULL)"
+        )
+
+    def receive(self, wait_seconds: float, visibility_seconds: int) -> List[Message]:
+        deadline = time.monotonic() + min(wait_seconds, MAX_WAIT_SECONDS)
+        while True:
+            with self._lock:
+                message = self._receive_one(visibility_seconds)
+            if message is not None:
+                return [message]
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(0.2)
+
+    def _receive_one(self, visibility_seconds: int) -> Optional[Message]:
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                row = self.db.execute(
+                    "SELECT id, body, receive_count FROM messages WHERE visible_at <= ? "
+                    "ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+                message_id, body, receive_count = row
+                if receive_count >= self.max_receive_count:
+                    self.db.execute("INSERT INTO dead_letters VALUES (?, ?)", (message_id, body))
+                    self.db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                    continue
+                self.db.execute(
+                    "UPDATE messages SET visible_at = ?, receive_count = ? WHERE id = ?",
+                    (now + visibility_seconds, receive_count + 1, message_id),
+                )
+                # 受信ごとに変わる受信ハンドル（古いハンドルでは削除・延長できない）
+                return Message(body, f"{message_id}:{receive_count + 1}", receive_count + 1)
+        finally:
+            self.db.execute("COMMIT")
+
+    def _where(self, message: Message):
+        message_id, receive_count = message.receipt.split(":")
+        return int(message_id), int(receive_count)
+
+    def extend(self, message: Message, visibility_seconds: int):
+        with self._lock:
+            self.db.execute(
+                "UPDATE messages SET visible_at = ? WHERE id = ? AND receive_count = ?",
+                (time.time() + visibility_seconds, *self._where(message)),
+            )
+
+    def delete(self, message: Message):
+        with self._lock:
+            self.db.execute(
+                "DELETE FROM messages WHERE id = ? AND receive_count = ?", self._where(message)
+            )
+
+    def send(self, bodies: List[str]):
+        with self._lock:
+            self.db.executemany("INSERT INTO messages (body) VALUES (?)", [(body,) for body in bodies])
+
+
+def open_queue(url: str):
+    """URL から作業キューを開く（sqlite:///path または SQS のキュー URL）"""
+    if url.startswith("sqlite://"):
+        return SqliteWorkQueue(url[len("sqlite://"):])
+    return SqsWorkQueue(url)
+
+
+class Heartbeat:
+    """処理中のメッセージの可視性タイムアウトを定期的に延長するスレッド"""
+
+    def __init__(self, queue, message: Message, visibility_seconds: int):
+        self.queue = queue
+        self.message = message
+        self.visibility_seconds = visibility_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        # タイムアウトの3分の1ごとに延長し、1回失敗しても間に合うようにする
+        while not self._stop.wait(self.visibility_seconds / 3):
+            try:
+                self.queue.extend(self.message, self.visibility_seconds)
+            except Exception as e:
+                print(f"可視性タイムアウトの延長に失敗しました: {e}", flush=True)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(
+    queue,
+    process: Callable[[Any], None],
+    shutdown: Optional[GracefulShutdown] = None,
+    idle_seconds: float = DEFAULT_IDLE_SECONDS,
+    visibility_seconds: int = DEFAULT_VISIBILITY_SECONDS,
+    decode: Callable[[str], Any] = json.loads,
+) -> List[BundleItemResult]:
+    """
+    キューが空になるか停止が要求されるまでアイテムを処理する
+
+    成功したメッセージは削除する。失敗したメッセージは削除せず、可視性タイムアウトの
+    経過後に別のワーカーが再処理する（SQS では再処理ポリシーの上限でデッドレターキューへ移る）。
+    メッセージ本文は decode で変換してから process に渡す（解析の失敗もアイテムの失敗として扱う）。
+    最後にアイテムが成功してから idle_seconds たつと終了するため、失敗し続けるメッセージだけが
+    残っていてもワーカーは終了する。
+
+    Returns:
+        処理したアイテムの結果のリスト
+    """
+    results = []
+    idle_since = time.monotonic()
+    while not (shutdown and shutdown.requested):
+        remaining = idle_seconds - (time.monotonic() - idle_since)
+        if remaining <= 0:
+            print(f"{idle_seconds:.0f} 秒間処理できるアイテムがないため終了します")
+            break
+        messages = queue.receive(remaining, visibility_seconds)
+        if not messages:
+            continue
+
+        for message in messages:
+            started = time.monotonic()
+            key = message.body[:200]
+            try:
+                # キーは解析前の JSON から作る（送信側 history.item_key と同じ値にする）
+                key = item_key(json.loads(message.body))
+                item = decode(message.body)
+                with Heartbeat(queue, message, visibility_seconds):
+                    process(item)
+                queue.delete(message)
+                idle_since = time.monotonic()
+                result = BundleItemResult(
+                    index=len(results),
+                    key=key,
+                    status="SUCCEEDED",
+                    seconds=round(time.monotonic() - started, 3),
+                )
+            except Exception as e:
+                result = BundleItemResult(
+                    index=len(results),
+                    key=key,
+                    status="FAILED",
+                    seconds=round(time.monotonic() - started, 3),
+                    error=f"{e}（受信 {message.receive_count} 回目）",
+                )
+            results.append(result)
+            print(f"{RESULT_MARKER} {result.model_dump_json()}", flush=True)
+    return results
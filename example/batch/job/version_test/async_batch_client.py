@@ -0,0 +1,853 @@
+#!/usr/bin/env python3
+"""
+asyncio のサービスに組み込む AWS Batch の送信クライアント
+
+送信スクリプトの boto3 クライアントは同期的なため、asyncio のサービスからはスレッドで呼ぶことになり、
+負荷が高いとスレッドと待ち時間が増える。ここでは submit / describe / cancel / terminate と
+ログの取得を asyncio のストリームで直接呼ぶ。署名は botocore（boto3 の依存）の SigV4 を使う。
+
+- 接続プール: エンドポイントごとに HTTP/1.1 の接続を保持して再利用する（config.ASYNC_CLIENT_CONFIG["max_connections"]）
+- 同時実行数の上限: 同時に実行中の API 呼び出しを max_concurrency に制限する
+- 再試行: スロットリング（429）・5xx・接続エラーは、待ち時間を回数ごとに倍にした範囲の乱数（full jitter）で再試行する。
+  submit_job は重複して送信しないよう、リクエストを送った後に接続が切れた場合は再試行しない
+- キャンセル: 呼び出し元のタスクがキャンセルされると、再試行の待ちも含めてすぐに中断する。
+  途中まで読み書きした接続は再利用せずに閉じる
+- describe_job: 同時に呼ばれたジョブIDを describe_delay_seconds の間まとめ、100件ずつの describe_jobs にする。
+  多数のジョブの完了を並行して待つ場合（wait_for_job）の呼び出し回数が減る
+
+    async with AsyncBatchClient() as client:
+        response = await client.submit_job(**submit_params("fargate", parameters=config_data))
+        job = await client.wait_for_job(response["jobId"])
+
+Batch API の代わりにローカルで応答する HTTP サーバー（--standin）と、それを使ったベンチマーク
+（スレッドから呼ぶ boto3 との比較、--bench）を単体で起動できる:
+    python async_batch_client.py --standin --port 9092
+    python async_batch_client.py --bench --jobs 2000 --latency 0.02 --throttle 0.02
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import random
+import ssl
+import threading
+import time
+import urllib.parse
+import uuid
+import config
+from job_records import job_platform
+from metrics import LATENCY_BUCKETS, THROTTLE_CODES
+from resources import container_resource_overrides
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+# describe_jobs に一度に渡せるジョブIDの上限
+DESCRIBE_BATCH_SIZE = 100
+
+# ジョブの終了後のステータス
+FINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+# CloudWatch Logs の API（JSON 1.1 プロトコル）の X-Amz-Target の接頭辞
+LOGS_TARGET_PREFIX = "Logs_20140328"
+
+# 操作ごとの Batch の REST API のパス
+BATCH_PATHS = {
+    "SubmitJob": "/v1/submitjob",
+    "DescribeJobs": "/v1/describejobs",
+    "CancelJob": "/v1/canceljob",
+    "TerminateJob": "/v1/terminatejob",
+}
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    """API がエラーを返した場合の例外"""
+
+    def __init__(self, operation, status, code, message):
+        super().__init__(f"{operation}: {status} {code}: {message}")
+        self.operation = operation
+        self.status = status
+        self.code = code
+
+    @property
+    def throttled(self):
+        return self.status == 429 or self.code in THROTTLE_CODES
+
+    @property
+    def retryable(self):
+        return self.throttled or self.status >= 500
+
+
+class ConnectionFailed(Exception):
+    """
+    接続・送受信の失敗（タイムアウトを含む）
+
+    sent はリクエストを送り終えていたか。送っていた場合、サーバーが処理したかは分からない。
+    """
+
+    def __init__(self, error, sent):
+        super().__init__(f"{type(error).__name__}: {error}")
+        self.sent = sent
+
+
+async def read_head(reader):
+    """HTTP の開始行とヘッダー（名前は小文字）を読む。接続が閉じられていれば (None, None)"""
+    start = await reader.readline()
+    if not start:
+        return None, None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return start.decode("latin-1").rstrip("\r\n"), headers
+
+
+async def read_body(reader, headers):
+    """Content-Length か chunked の本文を読む"""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+                # トレーラーを読み飛ばす
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    return await reader.readexactly(int(headers.get("content-length", 0)))
+
+
+class ConnectionPool:
+    """
+    1つのエンドポイントへの HTTP/1.1 の接続プール
+
+    同時に使う接続は max_connections まで。使い終わった接続は idle_seconds の間だけ再利用する。
+    """
+
+    def __init__(self, url, max_connections, timeout_seconds, idle_seconds):
+        parsed = urllib.parse.urlsplit(url)
+        self.url = url.rstrip("/")
+        self.secure = parsed.scheme == "https"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.secure else 80)
+        # 既定のポートは Host ヘッダーに含めない（署名する Host と同じ）
+        self.host_header = parsed.netloc
+        self.ssl = ssl.create_default_context() if self.secure else None
+        self.timeout = timeout_seconds
+        self.idle_seconds = idle_seconds
+        self.slots = asyncio.Semaphore(max_connections)
+        self.idle = []
+        self.opened = 0
+
+    def _take_idle(self):
+        now = time.monotonic()
+        while self.idle:
+            reader, writer, released = self.idle.pop()
+            if now - released < self.idle_seconds and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def _open(self):
+        self.opened += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout
+        )
+
+    async def request(self, method, path, headers, body):
+        """
+        リクエストを送り、(ステータス, ヘッダー, 本文) を返す
+
+        Raises:
+            ConnectionFailed: 接続・送受信に失敗した場合（接続は閉じる）
+        """
+        async with self.slots:
+            sent = False
+            writer = None
+            try:
+                connection = self._take_idle()
+                reused = connection is not None
+                reader, writer = connection or await self._open()
+                lines = [f"{method} {path} HTTP/1.1"]
+                lines += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+                await asyncio.wait_for(writer.drain(), self.timeout)
+                sent = True
+                start, response_headers = await asyncio.wait_for(read_head(reader), self.timeout)
+                if start is None:
+                    # 再利用した接続がサーバー側で閉じられていた場合は、リクエストは処理されていない
+                    sent = not reused
+                    raise ConnectionResetError("応答の前に接続が閉じられました")
+                data = await asyncio.wait_for(read_body(reader, response_headers), self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                if writer is not None:
+                    writer.close()
+                raise ConnectionFailed(e, sent) from e
+            except BaseException:
+                # キャンセルされた場合も、応答を読み終えていない接続は再利用できない
+                if writer is not None:
+                    writer.close()
+                raise
+            if response_headers.get("connection", "").lower() == "close":
+                writer.close()
+            else:
+                self.idle.append((reader, writer, time.monotonic()))
+            return int(start.split(" ", 2)[1]), response_headers, data
+
+    def close(self):
+        for _, writer, _ in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+class AsyncBatchClient:
+    """
+    asyncio から AWS Batch と CloudWatch Logs の API を呼ぶクライアント
+
+    Args:
+        region: AWS リージョン
+        endpoint_url: Batch の API のエンドポイント（省略時はリージョンのエンドポイント。スタンドインの URL など）
+        logs_endpoint_url: CloudWatch Logs の API のエンドポイント（省略時はリージョンのエンドポイント）
+        credentials: botocore の認証情報（省略時は boto3 と同じ方法で取得する）
+        registry: 呼び出しを記録する metrics.Registry（送信側 metrics.py と同じメトリクス名）
+        settings: config.ASYNC_CLIENT_CONFIG の値を変える場合に指定する
+    """
+
+    def __init__(self, region=config.DEFAULT_REGION, endpoint_url=None, logs_endpoint_url=None,
+                 credentials=None, registry=None, **settings):
+        self.region = region
+        self.settings = {**config.ASYNC_CLIENT_CONFIG, **settings}
+        self.endpoints = {
+            "batch": endpoint_url or f"https://batch.{region}.amazonaws.com",
+            "logs": logs_endpoint_url or f"https://logs.{region}.amazonaws.com",
+        }
+        self.credentials = credentials
+        self.registry = registry
+        self.pools = {}
+        self.limit = asyncio.Semaphore(self.settings["max_concurrency"])
+        self.random = random.Random()
+        # describe_job でまとめる (ジョブID, Future) の列
+        self.pending = []
+        self.flush_handle = None
+        self.tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """まとめている describe_job を中断し、接続を閉じる"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for pool in self.pools.values():
+            pool.close()
+        self.pools.clear()
+
+    def _pool(self, service):
+        pool = self.pools.get(service)
+        if pool is None:
+            pool = ConnectionPool(
+                self.endpoints[service],
+                self.settings["max_connections"],
+                self.settings["timeout_seconds"],
+                self.settings["idle_seconds"],
+            )
+            self.pools[service] = pool
+        return pool
+
+    async def _frozen_credentials(self):
+        """署名に使う認証情報。取得と更新は同期的な処理のため、スレッドで行う"""
+        if self.credentials is None:
+            import botocore.session
+
+            self.credentials = await asyncio.to_thread(botocore.session.get_session().get_credentials)
+            if self.credentials is None:
+                raise RuntimeError("AWS の認証情報が見つかりません")
+        refresh_needed = getattr(self.credentials, "refresh_needed", None)
+        if refresh_needed is not None and refresh_needed():
+            return await asyncio.to_thread(self.credentials.get_frozen_credentials)
+        return self.credentials.get_frozen_credentials()
+
+    async def _signed_headers(self, service, pool, path, headers, body):
+        from botocore.auth import SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        headers = {"Host": pool.host_header, "Content-Length": str(len(body)), **headers}
+        request = AWSRequest(method="POST", url=pool.url + path, data=body, headers=headers)
+        SigV4Auth(await self._frozen_credentials(), service, self.region).add_auth(request)
+        return dict(request.headers.items())
+
+    def _record(self, service, operation, started, outcome, throttles):
+        if self.registry is None or service != "batch":
+            return
+        self.registry.observe(
+            "batch_api_latency_seconds",
+            "AWS Batch API の呼び出しにかかった時間（再試行を含む、秒）",
+            LATENCY_BUCKETS,
+            time.perf_counter() - started,
+            operation=operation,
+        )
+        self.registry.inc("batch_api_calls", "AWS Batch API の呼び出し数", operation=operation, outcome=outcome)
+        if operation == "SubmitJob":
+            self.registry.inc("batch_submissions", "submit_job の呼び出し数", outcome=outcome)
+        if throttles:
+            self.registry.inc(
+                "batch_api_throttles", "スロットリングされた AWS Batch API の呼び出し数", throttles, operation=operation
+            )
+
+    async def _call(self, service, operation, params, idempotent=True):
+        """
+        API を呼び、応答の JSON を返す（再試行を含む）
+
+        idempotent でない操作は、送った後に接続が切れた場合（サーバーが処理したか分からない）は再試行しない。
+
+        Raises:
+            ApiError: API がエラーを返した場合（再試行しても成功しなかった場合を含む）
+            ConnectionFailed: 接続・送受信に失敗した場合
+        """
+        pool = self._pool(service)
+        body = json.dumps(params, separators=(",", ":")).encode("utf-8")
+        if service == "batch":
+            path = BATCH_PATHS[operation]
+            headers = {"Content-Type": "application/json"}
+        else:
+            path = "/"
+            headers = {
+                "Content-Type": "application/x-amz-json-1.1",
+                "X-Amz-Target": f"{LOGS_TARGET_PREFIX}.{operation}",
+            }
+        started = time.perf_counter()
+        throttles = 0
+        outcome = "error"
+        try:
+            for attempt in range(self.settings["max_attempts"]):
+                async with self.limit:
+                    signed = await self._signed_headers(service, pool, path, headers, body)
+                    try:
+                        status, response_headers, data = await pool.request("POST", path, signed, body)
+                    except ConnectionFailed as e:
+                        if e.sent and not idempotent:
+                            raise
+                        error = e
+                    else:
+                        if status < 300:
+                            outcome = "ok"
+                            return json.loads(data) if data else {}
+                        error = api_error(operation, status, response_headers, data)
+                        throttles += error.throttled
+                        if not error.retryable:
+                            raise error
+                if attempt + 1 == self.settings["max_attempts"]:
+                    raise error
+                # full jitter（待ちの間は同時実行数の枠を使わない）
+                ceiling = min(self.settings["max_delay_seconds"], self.settings["base_delay_seconds"] * 2 ** attempt)
+                await asyncio.sleep(self.random.uniform(0, ceiling))
+        finally:
+            self._record(service, operation, started, outcome, throttles)
+
+    async def submit_job(self, **params):
+        """submit_job と同じ引数でジョブを送信する"""
+        return await self._call("batch", "SubmitJob", params, idempotent=False)
+
+    async def describe_jobs(self, job_ids):
+        """ジョブの詳細のリストを返す（100件ずつ並行して describe_jobs を呼ぶ）"""
+        chunks = [job_ids[i:i + DESCRIBE_BATCH_SIZE] for i in range(0, len(job_ids), DESCRIBE_BATCH_SIZE)]
+        responses = await asyncio.gather(*(self._call("batch", "DescribeJobs", {"jobs": chunk}) for chunk in chunks))
+        return [job for response in responses for job in response["jobs"]]
+
+    async def describe_job(self, job_id):
+        """
+        1つのジョブの詳細を返す（存在しなければ None）
+
+        同時に呼ばれた describe_job は describe_delay_seconds の間まとめて、1回の describe_jobs にする。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((job_id, future))
+        if len(self.pending) >= DESCRIBE_BATCH_SIZE:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.settings["describe_delay_seconds"], self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        while self.pending:
+            batch, self.pending = self.pending[:DESCRIBE_BATCH_SIZE], self.pending[DESCRIBE_BATCH_SIZE:]
+            task = asyncio.ensure_future(self._describe_batch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _describe_batch(self, batch):
+        # 待っている呼び出し元がキャンセルしたジョブは問い合わせない
+        job_ids = list(dict.fromkeys(job_id for job_id, future in batch if not future.done()))
+        if not job_ids:
+            return
+        try:
+            response = await self._call("batch", "DescribeJobs", {"jobs": job_ids})
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        jobs = {job["jobId"]: job for job in response["jobs"]}
+        for job_id, future in batch:
+            if not future.done():
+                future.set_result(jobs.get(job_id))
+
+    async def wait_for_job(self, job_id, poll_seconds=10, timeout_seconds=None):
+        """
+        ジョブの終了を待ち、describe_jobs の結果を返す
+
+        Raises:
+            asyncio.TimeoutError: timeout_seconds 以内に終わらなかった場合
+            LookupError: ジョブが見つからない場合
+        """
+        async def poll():
+            while True:
+                job = await self.describe_job(job_id)
+                if job is None:
+                    raise LookupError(f"ジョブが見つかりません: {job_id}")
+                if job["status"] in FINAL_STATUSES:
+                    return job
+                await asyncio.sleep(poll_seconds)
+
+        return await asyncio.wait_for(poll(), timeout_seconds)
+
+    async def cancel_job(self, job_id, reason):
+        """RUNNABLE までのジョブをキャンセルする"""
+        return await self._call("batch", "CancelJob", {"jobId": job_id, "reason": reason})
+
+    async def terminate_job(self, job_id, reason):
+        """STARTING / RUNNING のジョブも含めて停止する"""
+        return await self._call("batch", "TerminateJob", {"jobId": job_id, "reason": reason})
+
+    async def get_log_events(self, **params):
+        """get_log_events と同じ引数でログのイベントを取得する"""
+        return await self._call("logs", "GetLogEvents", params)
+
+    async def fetch_log_stream(self, log_group, stream, accept=None):
+        """
+        1本のログストリームを先頭から最後まで取得する（collect_array_logs.fetch_stream と同じ）
+
+        Returns:
+            accept（省略時はすべて）を満たすイベントのリスト
+        """
+        events = []
+        params = {"logGroupName": log_group, "logStreamName": stream, "startFromHead": True}
+        while True:
+            response = await self.get_log_events(**params)
+            events.extend(event for event in response["events"] if accept is None or accept(event["message"]))
+            # 末尾に達すると同じトークンが返される
+            next_token = response.get("nextForwardToken")
+            if not next_token or next_token == params.get("nextToken"):
+                return events
+            params["nextToken"] = next_token
+
+    async def fetch_job_logs(self, job, accept=None):
+        """ジョブ（describe_jobs の結果）のログストリームを取得する。ログストリームがなければ空のリスト"""
+        stream = job.get("container", {}).get("logStreamName")
+        if not stream:
+            return []
+        return await self.fetch_log_stream(PLATFORM_CONFIG[job_platform(job)]["log_group"], stream, accept)
+
+
+def api_error(operation, status, headers, data):
+    """エラーの応答を ApiError にする（REST-JSON は x-amzn-ErrorType、JSON 1.1 は __type にコードがある）"""
+    try:
+        payload = json.loads(data) if data else {}
+    except ValueError:
+        payload = {"message": data.decode("utf-8", "replace")}
+    code = headers.get("x-amzn-errortype") or payload.get("__type") or str(status)
+    # "TooManyRequestsException:http://..." や "com.amazonaws...#ThrottlingException" の形式がある
+    code = code.split(":", 1)[0].rsplit("#", 1)[-1]
+    message = payload.get("message") or payload.get("Message") or ""
+    return ApiError(operation, status, code, message)
+
+
+def submit_params(platform, job_name=None, parameters=None, vcpu=None, memory=None, array_size=None,
+                  environment=None, job_queue=None, job_definition=None):
+    """
+    送信スクリプトと同じ submit_job の引数を作る
+
+    Args:
+        platform: "ec2" または "fargate"（ジョブキュー・ジョブ定義・フェアシェアの設定を選ぶ）
+        job_name: ジョブ名（省略時は <プラットフォーム>-async-job-<時刻>-<UUID>）
+        parameters: 環境変数 CONFIG として渡すパラメータ（parameters.json と同じ形式）
+        vcpu / memory: リソースの指定（両方を指定した場合だけ containerOverrides に含める）
+        array_size: 配列ジョブのサイズ（SHARD_COUNT も渡す）
+        environment: 追加の環境変数 {名前: 値}
+        job_queue / job_definition: config の値を使わない場合に指定する
+    """
+    platform_config = PLATFORM_CONFIG[platform]
+    if job_name is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        job_name = f"{platform}-async-job-{timestamp}-{str(uuid.uuid4())[:8]}"
+    variables = []
+    if parameters is not None:
+        variables.append({"name": "CONFIG", "value": json.dumps(parameters, ensure_ascii=False)})
+    if array_size is not None:
+        variables.append({"name": "SHARD_COUNT", "value": str(array_size)})
+    variables += [{"name": name, "value": str(value)} for name, value in (environment or {}).items()]
+
+    overrides = {}
+    if variables:
+        overrides["environment"] = variables
+    if vcpu is not None and memory is not None:
+        overrides.update(container_resource_overrides(platform, vcpu, memory))
+    params = {
+        "jobName": job_name,
+        "jobQueue": job_queue or platform_config["array_job_queue" if array_size else "job_queue"],
+        "jobDefinition": job_definition or platform_config["job_definition"],
+    }
+    if overrides:
+        params["containerOverrides"] = overrides
+    if array_size is not None:
+        params["arrayProperties"] = {"size": array_size}
+
+    # フェアシェアスケジューリングを使用する場合、必要なパラメータを追加
+    fair_share = config.FAIR_SHARE_CONFIG[platform]
+    if fair_share["use_fair_share"]:
+        if fair_share["share_identifier"]:
+            params["shareIdentifier"] = fair_share["share_identifier"]
+        if fair_share["scheduling_priority"] is not None:
+            params["schedulingPriorityOverride"] = fair_share["scheduling_priority"]
+    return params
+
+
+class StandinBatch:
+    """
+    Batch と CloudWatch Logs の API の代わりにローカルで応答する HTTP サーバー（テスト・ベンチマーク用）
+
+    SubmitJob / DescribeJobs / CancelJob / TerminateJob と GetLogEvents に応答する。署名は確認しない。
+    ジョブは送信から start_seconds 後に RUNNING、さらに run_seconds 後に SUCCEEDED になる。
+    latency で1リクエストごとの遅延を、throttle でスロットリング（429）を返す割合を指定できる。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, throttle=0.0, start_seconds=0.5,
+                 run_seconds=1.0, log_events=250, log_page_size=100, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.throttle = throttle
+        self.start_seconds = start_seconds
+        self.run_seconds = run_seconds
+        self.log_events = log_events
+        self.log_page_size = log_page_size
+        self.random = random.Random(seed)
+        self.jobs = {}
+        # 操作ごとの呼び出し数・スロットリングの数・接続数
+        self.calls = {}
+        self.throttled = 0
+        self.connections = 0
+        self.server = None
+        self.loop = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def start_in_thread(self):
+        """別スレッドのイベントループで起動する（同期的な boto3 からも使うため）"""
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name="batch-standin", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    async def stop(self):
+        """待ち受けをやめ、保持されている接続の処理を終える"""
+        self.server.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    def shutdown(self):
+        """start_in_thread で起動したサーバーを止める"""
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                start, headers = await read_head(reader)
+                if start is None:
+                    return
+                body = await read_body(reader, headers)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, extra, payload = self.respond(start.split(" ")[1], headers, body)
+                data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+                lines = [
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(data)}",
+                    *(f"{name}: {value}" for name, value in extra.items()),
+                ]
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    def respond(self, path, headers, body):
+        """(ステータス, 追加のヘッダー, 応答の JSON) を返す"""
+        target = headers.get("x-amz-target", "")
+        operation = target.rsplit(".", 1)[-1] if target else next(
+            (name for name, candidate in BATCH_PATHS.items() if candidate == path), None
+        )
+        if operation is None:
+            return 404, {"x-amzn-ErrorType": "UnknownOperationException"}, {"message": path}
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.throttle and self.random.random() < self.throttle:
+            self.throttled += 1
+            return 429, {"x-amzn-ErrorType": "TooManyRequestsException"}, {"message": "Too Many Requests"}
+        params = json.loads(body or b"{}")
+        handler = getattr(self, f"op_{operation}", None)
+        if handler is None:
+            return 400, {"x-amzn-ErrorType": "ClientException"}, {"message": f"未対応の操作です: {operation}"}
+        try:
+            return 200, {}, handler(params)
+        except KeyError as e:
+            return 400, {"x-amzn-ErrorType": "ClientException"}, {"message": f"不正な引数です: {e}"}
+
+    def op_SubmitJob(self, params):
+        job_id = f"{uuid.UUID(int=self.random.getrandbits(128))}"
+        job = {
+            "jobId": job_id,
+            "jobArn": f"arn:aws:batch:{config.DEFAULT_REGION}:000000000000:job/{job_id}",
+            "jobName": params["jobName"],
+            "jobQueue": params["jobQueue"],
+            "jobDefinition": params["jobDefinition"],
+            "createdAt": int(time.time() * 1000),
+            "container": dict(params.get("containerOverrides", {})),
+            "platformCapabilities": ["FARGATE" if "fargate" in params["jobDefinition"] else "EC2"],
+            "attempts": [],
+        }
+        if "arrayProperties" in params:
+            job["arrayProperties"] = dict(params["arrayProperties"])
+        self.jobs[job_id] = job
+        return {"jobArn": job["jobArn"], "jobName": job["jobName"], "jobId": job_id}
+
+    def _status(self, job, now):
+        if "stoppedAt" in job and job["stoppedAt"] <= now:
+            return job.get("finalStatus", "SUCCEEDED")
+        elapsed = (now - job["createdAt"]) / 1000
+        if elapsed < self.start_seconds:
+            return "RUNNABLE"
+        if elapsed < self.start_seconds + self.run_seconds:
+            return "RUNNING"
+        return "SUCCEEDED"
+
+    def op_DescribeJobs(self, params):
+        now = int(time.time() * 1000)
+        jobs = []
+        for job_id in params["jobs"]:
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            status = self._status(job, now)
+            detail = {key: value for key, value in job.items() if key != "finalStatus"}
+            detail["status"] = status
+            started = job["createdAt"] + int(self.start_seconds * 1000)
+            # 開始前にキャンセルされたジョブは startedAt とログストリームを持たない
+            if started <= min(now, job.get("stoppedAt", now)):
+                detail["startedAt"] = started
+                detail["container"] = {**job["container"], "logStreamName": f"{job['jobDefinition']}/default/{job_id}"}
+            if status in FINAL_STATUSES:
+                detail.setdefault("stoppedAt", started + int(self.run_seconds * 1000))
+            jobs.append(detail)
+        return {"jobs": jobs}
+
+    def _stop(self, params, statuses):
+        job = self.jobs[params["jobId"]]
+        now = int(time.time() * 1000)
+        if self._status(job, now) in statuses:
+            job["stoppedAt"] = now
+            job["finalStatus"] = "FAILED"
+            job["statusReason"] = params["reason"]
+        return {}
+
+    def op_CancelJob(self, params):
+        return self._stop(params, ("SUBMITTED", "PENDING", "RUNNABLE"))
+
+    def op_TerminateJob(self, params):
+        return self._stop(params, ("SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING"))
+
+    def op_GetLogEvents(self, params):
+        offset = int(params.get("nextToken", "f/0").split("/", 1)[1])
+        end = min(offset + self.log_page_size, self.log_events)
+        base = int(time.time() * 1000)
+        events = [
+            {"timestamp": base + i, "message": f"{params['logStreamName']} line {i}", "ingestionTime": base + i}
+            for i in range(offset, end)
+        ]
+        return {"events": events, "nextForwardToken": f"f/{end}", "nextBackwardToken": f"b/{offset}"}
+
+
+async def bench_async(url, jobs, concurrency, poll_seconds):
+    """非同期クライアントで jobs 件を送信し、すべての完了を待つ。(送信の秒数, 完了までの秒数, 接続数)"""
+    from botocore.credentials import Credentials
+
+    client = AsyncBatchClient(
+        endpoint_url=url,
+        logs_endpoint_url=url,
+        credentials=Credentials("standin", "standin"),
+        max_concurrency=concurrency,
+        max_connections=concurrency,
+    )
+    async with client:
+        started = time.perf_counter()
+        responses = await asyncio.gather(
+            *(client.submit_job(**submit_params("fargate", job_name=f"bench-{i}")) for i in range(jobs))
+        )
+        submitted = time.perf_counter() - started
+        finished = await asyncio.gather(
+            *(client.wait_for_job(response["jobId"], poll_seconds) for response in responses)
+        )
+        waited = time.perf_counter() - started
+        await client.fetch_job_logs(finished[0])
+        return submitted, waited, client.pools["batch"].opened
+
+
+def bench_threads(url, jobs, threads):
+    """スレッドから boto3 で jobs 件を送信する（送信スクリプトを並行に呼ぶ場合）。送信の秒数を返す"""
+    import boto3
+    from botocore.config import Config
+    from concurrent.futures import ThreadPoolExecutor
+
+    batch = boto3.client(
+        "batch",
+        region_name=config.DEFAULT_REGION,
+        endpoint_url=url,
+        aws_access_key_id="standin",
+        aws_secret_access_key="standin",
+        config=Config(
+            max_pool_connections=threads,
+            retries={"mode": "standard", "max_attempts": config.ASYNC_CLIENT_CONFIG["max_attempts"]},
+        ),
+    )
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda i: batch.submit_job(**submit_params("fargate", job_name=f"bench-{i}")), range(jobs)))
+    return time.perf_counter() - started
+
+
+def run_bench(args, logger):
+    """スタンドインに対して非同期クライアントとスレッドの boto3 を比べる"""
+    standin = StandinBatch(
+        args.host, 0, args.latency, args.throttle, start_seconds=args.run_seconds / 2, run_seconds=args.run_seconds
+    ).start_in_thread()
+    try:
+        submitted, waited, opened = asyncio.run(bench_async(standin.url, args.jobs, args.concurrency, args.poll_seconds))
+        describes = standin.calls.get("DescribeJobs", 0)
+        logger.info(
+            f"非同期: 送信 {args.jobs} 件 {submitted:.2f} 秒（{args.jobs / submitted:.0f} 件/秒）, "
+            f"完了まで {waited:.2f} 秒, describe_jobs {describes} 回, 接続 {opened} 本, "
+            f"スロットリング {standin.throttled} 回"
+        )
+        threaded = bench_threads(standin.url, args.jobs, args.threads)
+        logger.info(
+            f"スレッド {args.threads} 本の boto3: 送信 {args.jobs} 件 {threaded:.2f} 秒（{args.jobs / threaded:.0f} 件/秒）"
+        )
+    finally:
+        standin.shutdown()
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(description="asyncio の送信クライアントのスタンドインとベンチマーク")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--standin", action="store_true", help="Batch API の代わりにローカルで応答する")
+    mode.add_argument("--bench", action="store_true", help="スタンドインに対して送信と完了待ちの速さを測る")
+    parser.add_argument("--host", default="127.0.0.1", help="スタンドインで待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=9092, help="--standin で待ち受けるポート")
+    parser.add_argument("--latency", type=float, default=0.02, help="スタンドインの1リクエストごとの遅延（秒）")
+    parser.add_argument("--throttle", type=float, default=0.0, help="スタンドインがスロットリングを返す割合")
+    parser.add_argument("--run-seconds", type=float, default=1.0, help="スタンドインのジョブの実行時間（秒）")
+    parser.add_argument("--jobs", type=int, default=1000, help="--bench で送信するジョブ数")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.ASYNC_CLIENT_CONFIG["max_concurrency"],
+        help="--bench の非同期クライアントの同時実行数",
+    )
+    parser.add_argument("--threads", type=int, default=16, help="--bench で比べる boto3 のスレッド数")
+    parser.add_argument("--poll-seconds", type=float, default=0.2, help="--bench で完了を確認する間隔（秒）")
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    if args.bench:
+        run_bench(args, logger)
+        return
+
+    async def serve():
+        standin = await StandinBatch(args.host, args.port, args.latency, args.throttle, run_seconds=args.run_seconds).start()
+        logger.info(f"Batch API の代わりに {standin.url} で応答します（endpoint_url に指定）")
+        async with standin.server:
+            await standin.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
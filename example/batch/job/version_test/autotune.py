@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+配列サイズの自動調整
+
+入力の総サイズ、子ジョブ1つあたりの起動オーバーヘッド、履歴から得た処理速度
+（1バイトあたりの秒数）、コンピュート環境の最大 vCPU から、メイクスパン
+（全体の完了時間）またはコストが最小になる配列サイズと子ジョブのリソースを選ぶ。
+
+配列送信スクリプトの --array-size auto から利用する。単体でも計画だけを表示できる:
+    python autotune.py --platform fargate --input-file data.csv --max-vcpus 256
+"""
+
+import argparse
+import math
+import os
+import config
+from history import JobHistory
+from resources import container_resource_overrides, fargate_size_for
+
+# Fargate は最低1分の課金
+FARGATE_MINIMUM_SECONDS = 60
+
+# AWS Batch の配列ジョブの最小サイズ
+MIN_ARRAY_SIZE = 2
+
+
+def child_resources(platform, vcpu, memory):
+    """プラットフォームで有効な子ジョブの (vCPU, メモリ MB) を返す。無効なら None"""
+    if platform == "fargate":
+        return fargate_size_for(vcpu, memory)
+    return vcpu, memory
+
+
+def plan(
+    platform,
+    total_bytes,
+    max_vcpus,
+    startup_seconds,
+    seconds_per_byte,
+    memory,
+    objective="makespan",
+    deadline_seconds=None,
+    pricing=None,
+):
+    """
+    配列サイズと子ジョブのリソースを決める
+
+    子ジョブ n 個を max_vcpus / vCPU 個ずつの波で実行するとみなし、
+    各子ジョブの実行時間を「起動オーバーヘッド + 担当バイト数 × 処理速度」で見積もる。
+
+    Args:
+        platform: "ec2" または "fargate"
+        total_bytes: 入力の総バイト数
+        max_vcpus: 同時に使える vCPU 数
+        startup_seconds: 子ジョブ1つあたりの起動オーバーヘッド（秒）
+        seconds_per_byte: 1 vCPU での1バイトあたりの処理時間（秒）
+        memory: 子ジョブに必要なメモリ（MB）
+        objective: "makespan"（完了時間最小、同じならコスト最小）または
+            "cost"（deadline_seconds 以内でコスト最小）
+        deadline_seconds: objective="cost" の完了時間の上限。省略時は最短完了時間の1.5倍
+        pricing: PRICE_TABLE の料金区分。省略時はプラットフォーム名
+
+    Returns:
+        {"array_size", "vcpu", "memory", "child_seconds", "makespan_seconds", "cost_usd"}
+
+    Raises:
+        ValueError: 有効な候補がない場合
+    """
+    tune = config.AUTOTUNE_CONFIG
+    prices = config.PRICE_TABLE[pricing or platform]
+    work_seconds = total_bytes * seconds_per_byte
+
+    candidates = []
+    for requested_vcpu in tune["vcpu_options"][platform]:
+        resources = child_resources(platform, requested_vcpu, memory)
+        if resources is None or resources[0] > max_vcpus:
+            continue
+        vcpu, child_memory = resources
+        slots = int(max_vcpus // vcpu)
+        speedup = 1 + tune["parallel_efficiency"] * (vcpu - 1)
+        hourly = vcpu * prices["vcpu_hour"] + child_memory / 1024 * prices["gb_hour"]
+        for size in range(MIN_ARRAY_SIZE, tune["max_array_size"] + 1):
+            child_seconds = startup_seconds + work_seconds / size / speedup
+            makespan = math.ceil(size / slots) * child_seconds
+            billed = child_seconds
+            if platform == "fargate":
+                billed = max(billed, FARGATE_MINIMUM_SECONDS)
+            cost = size * billed / 3600 * hourly
+            candidates.append((makespan, cost, size, vcpu, child_memory, child_seconds))
+
+    if not candidates:
+        raise ValueError(
+            f"メモリ {memory}MB・最大 {max_vcpus} vCPU で実行できる子ジョブのリソースがありません"
+        )
+
+    if objective == "cost":
+        if deadline_seconds is None:
+            deadline_seconds = 1.5 * min(candidate[0] for candidate in candidates)
+        feasible = [c for c in candidates if c[0] <= deadline_seconds]
+        if not feasible:
+            raise ValueError(f"{deadline_seconds:.0f} 秒以内に完了する配列サイズがありません")
+        best = min(feasible, key=lambda c: (c[1], c[0], c[2]))
+    else:
+        # 完了時間が同じ（波の数が同じ）なら、コストが安く子ジョブの少ない候補を選ぶ
+        best = min(candidates, key=lambda c: (round(c[0], 3), c[1], c[2]))
+
+    makespan, cost, size, vcpu, child_memory, child_seconds = best
+    return {
+        "array_size": size,
+        "vcpu": vcpu,
+        "memory": child_memory,
+        "child_seconds": round(child_seconds, 1),
+        "makespan_seconds": round(makespan, 1),
+        "cost_usd": round(cost, 4),
+    }
+
+
+def add_autotune_args(parser, platform):
+    """--array-size auto 用のコマンドライン引数を追加する"""
+    tune = config.AUTOTUNE_CONFIG
+    group = parser.add_argument_group("配列サイズの自動調整（--array-size auto）")
+    source = group.add_mutually_exclusive_group()
+    source.add_argument("--input-bytes", type=int, help="入力の総バイト数")
+    source.add_argument(
+        "--input-file", help="入力ファイル（s3:// URI またはローカルパス）。サイズを取得する"
+    )
+    group.add_argument(
+        "--startup-seconds",
+        type=float,
+        default=tune["startup_seconds"][platform],
+        help="子ジョブ1つあたりの起動オーバーヘッド（秒）",
+    )
+    group.add_argument(
+        "--seconds-per-byte",
+        type=float,
+        help="1バイトあたりの処理時間（秒）。省略時は履歴ファイルの値",
+    )
+    group.add_argument(
+        "--history-file", default=config.HISTORY_FILE, help="ジョブ実行履歴ファイルのパス"
+    )
+    group.add_argument(
+        "--max-vcpus",
+        type=float,
+        help="同時に使える vCPU 数。省略時はジョブキューのコンピュート環境の maxvCpus の合計",
+    )
+    group.add_argument(
+        "--child-memory", type=int, default=2048, help="子ジョブに必要なメモリ（MB）"
+    )
+    group.add_argument(
+        "--objective",
+        choices=["makespan", "cost"],
+        default="makespan",
+        help="最小化する指標",
+    )
+    group.add_argument(
+        "--deadline-seconds",
+        type=float,
+        help="--objective cost の完了時間の上限（秒）",
+    )
+
+
+def input_size(input_file):
+    """入力ファイルのサイズ（バイト）を返す"""
+    if input_file.startswith("s3://"):
+        import boto3
+
+        bucket, _, key = input_file[len("s3://"):].partition("/")
+        return boto3.client("s3").head_object(Bucket=bucket, Key=key)["ContentLength"]
+    return os.path.getsize(input_file)
+
+
+def queue_max_vcpus(batch, job_queue):
+    """ジョブキューに紐づく有効なコンピュート環境の maxvCpus の合計を返す"""
+    queues = batch.describe_job_queues(jobQueues=[job_queue])["jobQueues"]
+    if not queues:
+        raise ValueError(f"ジョブキューが見つかりません: {job_queue}")
+    environments = [
+        order["computeEnvironment"] for order in queues[0]["computeEnvironmentOrder"]
+    ]
+    response = batch.describe_compute_environments(computeEnvironments=environments)
+    return sum(
+        environment["computeResources"]["maxvCpus"]
+        for environment in response["computeEnvironments"]
+        if environment.get("state") == "ENABLED"
+    )
+
+
+def resolve_auto_array_size(args, platform, batch, logger):
+    """
+    --array-size auto の計画を立てる
+
+    Returns:
+        (配列サイズ, containerOverrides に追加するリソース指定)
+    """
+    if args.input_bytes is not None:
+        total_bytes = args.input_bytes
+    elif args.input_file:
+        total_bytes = input_size(args.input_file)
+    else:
+        raise ValueError("--array-size auto には --input-bytes か --input-file が必要です")
+
+    history = JobHistory(args.history_file)
+    seconds_per_byte = args.seconds_per_byte
+    if seconds_per_byte is None:
+        seconds_per_byte = history.seconds_per_byte(
+            args.job_definition, config.AUTOTUNE_CONFIG["seconds_per_byte"]
+        )
+    # 過去にメモリ不足で引き上げたことがあれば、最初からそのメモリを要求する
+    memory = max(args.child_memory, history.memory_floor(args.job_definition, 0))
+    if memory > args.child_memory:
+        logger.info(f"自動調整: メモリ不足の履歴により子ジョブのメモリを {memory}MB に引き上げます")
+    max_vcpus = args.max_vcpus or queue_max_vcpus(batch, args.job_queue)
+
+    result = plan(
+        platform,
+        total_bytes,
+        max_vcpus,
+        args.startup_seconds,
+        seconds_per_byte,
+        memory,
+        objective=args.objective,
+        deadline_seconds=args.deadline_seconds,
+        pricing=config.QUEUE_PRICING.get(args.job_queue, platform),
+    )
+    logger.info(
+        f"自動調整: 入力 {total_bytes} バイト, 処理速度 {seconds_per_byte:.3g} 秒/バイト, "
+        f"最大 {max_vcpus:g} vCPU"
+    )
+    logger.info(
+        f"自動調整: 配列サイズ {result['array_size']}, 子ジョブ {result['vcpu']} vCPU / "
+        f"{result['memory']}MB, 子ジョブ {result['child_seconds']} 秒, "
+        f"完了見込み {result['makespan_seconds']} 秒, 見込みコスト {result['cost_usd']} USD"
+    )
+    overrides = container_resource_overrides(platform, result["vcpu"], result["memory"])
+    return result["array_size"], overrides
+
+
+def array_size_arg(value):
+    """--array-size の値（整数または auto）を解釈する"""
+    if value == "auto":
+        return value
+    size = int(value)
+    if size < MIN_ARRAY_SIZE:
+        raise argparse.ArgumentTypeError(f"配列サイズは{MIN_ARRAY_SIZE}以上である必要があります")
+    return size
+
+
+def main():
+    """計画だけを表示する"""
+    import json
+    import logging
+
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    logger = logging.getLogger(__name__)
+    parser = argparse.ArgumentParser(description="配列サイズの自動調整ツール")
+    parser.add_argument("--platform", choices=["ec2", "fargate"], default="fargate")
+    known, _ = parser.parse_known_args()
+    platform_config = config.EC2_CONFIG if known.platform == "ec2" else config.FARGATE_CONFIG
+    parser.add_argument(
+        "--job-queue", default=platform_config["array_job_queue"], help="使用するジョブキュー名"
+    )
+    parser.add_argument(
+        "--job-definition", default=platform_config["job_definition"], help="使用するジョブ定義名"
+    )
+    parser.add_argument("--region", default=config.DEFAULT_REGION, help="AWS リージョン")
+    add_autotune_args(parser, known.platform)
+    args = parser.parse_args()
+
+    batch = None
+    if not args.max_vcpus:
+        import boto3
+
+        batch = boto3.client("batch", region_name=args.region)
+    try:
+        size, overrides = resolve_auto_array_size(args, args.platform, batch, logger)
+    except ValueError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+    print(json.dumps({"arraySize": size, "containerOverrides": overrides}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+ジョブの一括キャンセル・停止スクリプト
+
+誤った設定で大量のジョブを送信してしまった場合などに、ジョブキュー・ステータス・
+ジョブ名・配列ジョブ・送信時刻で対象を絞り込み、cancel_job / terminate_job を
+レート制限の範囲内で並行して呼び出す。
+
+配列ジョブは親ジョブを停止すれば子ジョブもすべて停止されるため、
+ジョブキューの一覧（親ジョブのみが返る）から選んだ場合は子ジョブを個別に扱わない。
+"""
+
+import argparse
+import boto3
+import datetime
+import fnmatch
+import logging
+import re
+import sys
+import threading
+import time
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import config
+
+# 停止対象にできるステータス
+ACTIVE_STATUSES = ["SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING"]
+
+# cancel_job で取り消せるステータス（これより先は terminate_job が必要）
+CANCELABLE_STATUSES = {"SUBMITTED", "PENDING", "RUNNABLE"}
+
+# 相対時刻の指定（例: 30m, 2h, 1d）
+RELATIVE_TIME = re.compile(r"^(\d+)([smhd])$")
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_time(value):
+    """ISO 8601 形式または相対時刻（30m, 2h など、現在からさかのぼる）をエポックミリ秒に変換する"""
+    match = RELATIVE_TIME.match(value)
+    if match:
+        seconds = int(match.group(1)) * TIME_UNITS[match.group(2)]
+        return int((time.time() - seconds) * 1000)
+    try:
+        return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"時刻の形式が不正です: {value}")
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(description="ジョブの一括キャンセル・停止ツール")
+    parser.add_argument(
+        "--job-queue",
+        nargs="+",
+        default=[config.EC2_CONFIG["job_queue"], config.FARGATE_CONFIG["job_queue"]],
+        help="対象のジョブキュー名（複数指定可）",
+    )
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--status",
+        nargs="+",
+        choices=ACTIVE_STATUSES,
+        default=ACTIVE_STATUSES,
+        help="対象のステータス（複数指定可）",
+    )
+    parser.add_argument(
+        "--name",
+        help="ジョブ名のパターン（例: 'fargate-*-job-20261019*'。* と ? が使える）",
+    )
+    parser.add_argument(
+        "--array-job-id", help="この配列ジョブの子ジョブだけを対象にする"
+    )
+    parser.add_argument(
+        "--created-after", type=parse_time, help="この時刻以降に送信されたジョブ（ISO 8601 または 30m, 2h など）"
+    )
+    parser.add_argument(
+        "--created-before", type=parse_time, help="この時刻より前に送信されたジョブ"
+    )
+    parser.add_argument(
+        "--action",
+        choices=["auto", "cancel", "terminate"],
+        default="auto",
+        help="auto は実行前のジョブを cancel、実行中のジョブを terminate する",
+    )
+    parser.add_argument(
+        "--reason", default="bulk_control による一括停止", help="停止理由"
+    )
+    parser.add_argument(
+        "--state-index",
+        help="list_jobs の代わりに job_state_index.py のインデックス（SQLite）から対象を選ぶ",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=40, help="1秒あたりの API 呼び出し数の上限"
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=16, help="API を並行して呼び出すスレッド数"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="対象のジョブを表示するだけで停止しない"
+    )
+    parser.add_argument(
+        "--yes", action="store_true", help="確認なしで停止する（--dry-run でない場合に必須）"
+    )
+    return parser.parse_args()
+
+
+class RateLimiter:
+    """スレッド間で共有するトークンバケット"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが1つ得られるまで待つ"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def name_prefix(pattern):
+    """ジョブ名のパターンのうち、list_jobs の JOB_NAME フィルタで使える先頭の固定部分"""
+    return re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+
+def list_jobs(batch, args, limiter):
+    """
+    条件に一致するジョブを列挙する
+
+    ジョブ名や送信時刻を指定した場合は list_jobs のフィルタで絞り込む
+    （フィルタ使用時はステータスを指定できないため、ステータスはこちらで絞り込む）。
+
+    Returns:
+        list_jobs のジョブ概要のリスト
+    """
+    filters = []
+    if args.name and name_prefix(args.name):
+        filters.append({"name": "JOB_NAME", "values": [name_prefix(args.name) + "*"]})
+    if args.created_after:
+        filters.append({"name": "AFTER_CREATED_AT", "values": [str(args.created_after)]})
+    if args.created_before:
+        filters.append({"name": "BEFORE_CREATED_AT", "values": [str(args.created_before)]})
+    # list_jobs はフィルタを1つしか受け付けないため、残りの条件はこちらで判定する
+    server_filters = filters[:1]
+
+    if args.array_job_id:
+        targets = [{"arrayJobId": args.array_job_id}]
+    else:
+        targets = [{"jobQueue": queue} for queue in args.job_queue]
+
+    statuses = set(args.status)
+    paginator = batch.get_paginator("list_jobs")
+    jobs = {}
+    for target in targets:
+        if server_filters:
+            requests = [{**target, "filters": server_filters}]
+        else:
+            requests = [{**target, "jobStatus": status} for status in args.status]
+        for request in requests:
+            pages = paginator.paginate(**request, PaginationConfig={"PageSize": 100})
+            while True:
+                limiter.acquire()
+                page = next(pages, None)
+                if page is None:
+                    break
+                for job in page["jobSummaryList"]:
+                    if job["status"] not in statuses:
+                        continue
+                    if args.name and not fnmatch.fnmatchcase(job["jobName"], args.name):
+                        continue
+                    created = job.get("createdAt", 0)
+                    if args.created_after and created < args.created_after:
+                        continue
+                    if args.created_before and created >= args.created_before:
+                        continue
+                    jobs[job["jobId"]] = job
+    return list(jobs.values())
+
+
+def indexed_jobs(path, args):
+    """
+    条件に一致するジョブをジョブの状態インデックスから選ぶ（API を呼び出さない）
+
+    ジョブキューから選ぶ場合は list_jobs と同じく配列の子ジョブを含めない。
+    """
+    from job_state_index import JobStateIndex
+
+    index = JobStateIndex(path)
+    try:
+        jobs = index.jobs(
+            statuses=args.status,
+            queues=None if args.array_job_id else args.job_queue,
+            array_parent=args.array_job_id,
+            name=args.name,
+            since=args.created_after,
+            until=args.created_before,
+        )
+    finally:
+        index.close()
+    if args.array_job_id:
+        return jobs
+    return [job for job in jobs if ":" not in job["jobId"]]
+
+
+def stop_job(batch, job, action, reason, limiter):
+    """ジョブを1件キャンセルまたは停止する"""
+    if action == "auto":
+        action = "cancel" if job["status"] in CANCELABLE_STATUSES else "terminate"
+    limiter.acquire()
+    if action == "cancel":
+        batch.cancel_job(jobId=job["jobId"], reason=reason)
+    else:
+        batch.terminate_job(jobId=job["jobId"], reason=reason)
+    return action
+
+
+def stop_jobs(batch, jobs, args, limiter, logger):
+    """
+    ジョブを並行して停止する
+
+    Returns:
+        失敗したジョブの数
+    """
+    total = len(jobs)
+    done = 0
+    failed = 0
+    start = time.monotonic()
+    last_report = start
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {
+            executor.submit(stop_job, batch, job, args.action, args.reason, limiter): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            done += 1
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"停止エラー: {futures[future]['jobId']}: {e}")
+            now = time.monotonic()
+            if now - last_report >= 1 or done == total:
+                last_report = now
+                elapsed = now - start
+                logger.info(
+                    f"進捗: {done}/{total} ({done / total:.0%}), "
+                    f"{done / elapsed if elapsed else 0:.0f} 件/秒, 失敗 {failed}"
+                )
+    return failed
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+
+    # AWS Batch クライアントを作成（並行数に合わせて接続プールを広げ、スロットリング時は待って再試行する）
+    try:
+        client_config = Config(
+            max_pool_connections=args.max_workers,
+            retries={"mode": "adaptive", "max_attempts": 10},
+        )
+        batch = boto3.client("batch", region_name=args.region, config=client_config)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        sys.exit(1)
+
+    limiter = RateLimiter(args.rate)
+    try:
+        if args.state_index:
+            jobs = indexed_jobs(args.state_index, args)
+        else:
+            jobs = list_jobs(batch, args, limiter)
+    except Exception as e:
+        logger.error(f"ジョブ一覧取得エラー: {e}")
+        sys.exit(1)
+
+    by_status = {}
+    for job in jobs:
+        by_status[job["status"]] = by_status.get(job["status"], 0) + 1
+    arrays = sum(1 for job in jobs if "size" in job.get("arrayProperties", {}))
+    logger.info(
+        f"対象ジョブ: {len(jobs)} 件（うち配列ジョブ {arrays} 件）: "
+        + ", ".join(f"{status} {count}" for status, count in sorted(by_status.items()))
+    )
+    if args.dry_run:
+        for job in jobs:
+            print(f"{job['jobId']}\t{job['status']}\t{job['jobName']}")
+        return
+    if not jobs:
+        return
+    if not args.yes:
+        logger.error("停止するには --yes を指定してください（対象の確認は --dry-run）")
+        sys.exit(1)
+
+    failed = stop_jobs(batch, jobs, args, limiter, logger)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+EC2 コンピュート環境の事前ウォームアップ計画スクリプト
+
+夜間・毎時のように周期的に到着するジョブに対して、インスタンスの起動待ちをなくしつつ
+一日中 min_vcpus を確保し続けるコストを払わないよう、時間帯ごとの minvCpus を計画する。
+
+1. export_job_history.py が書き出したジョブ履歴から、ジョブの到着時刻と実行時間・vCPU を取り出し、
+   周期（日次または週次）のスロットごとに、同時に必要だった vCPU のピークを日ごとに求める
+2. スロットごとに、過去のピークの分位点を需要の予測値とし、インスタンス起動にかかる時間だけ
+   前倒しした minvCpus のスケジュールを作る
+3. --apply で、現在のスロットの minvCpus を update_compute_environment で反映する
+   （cron や EventBridge Scheduler からスロットごとに実行する）
+"""
+
+import argparse
+import boto3
+import json
+import logging
+import math
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import config
+from job_records import job_platform, job_resources, load_jobs, resource_name
+
+# 周期ごとの長さ（秒）
+PERIOD_SECONDS = {"daily": 86400, "weekly": 7 * 86400}
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    settings = config.CAPACITY_CONFIG
+    parser = argparse.ArgumentParser(description="EC2 コンピュート環境の minvCpus スケジュール計画ツール")
+    parser.add_argument("--history", help="export_job_history.py が書き出したジョブ履歴（JSON Lines）")
+    parser.add_argument("--output", help="計画したスケジュールを書き出す JSON ファイル")
+    parser.add_argument("--schedule", help="--apply で使うスケジュールの JSON ファイル")
+    parser.add_argument(
+        "--apply", action="store_true", help="現在のスロットの minvCpus をコンピュート環境に反映する"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="--apply で変更内容を表示するだけで反映しない"
+    )
+    parser.add_argument(
+        "--job-queue", default=config.EC2_CONFIG["job_queue"], help="対象の EC2 ジョブキュー名"
+    )
+    parser.add_argument(
+        "--compute-environment",
+        help="反映先のコンピュート環境（省略時はジョブキューの優先度が最も高いコンピュート環境）",
+    )
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--period", choices=list(PERIOD_SECONDS), default=settings["period"], help="需要の周期"
+    )
+    parser.add_argument(
+        "--slot-minutes", type=int, default=settings["slot_minutes"], help="スロットの長さ（分）"
+    )
+    parser.add_argument(
+        "--quantile",
+        type=float,
+        default=settings["quantile"],
+        help="スロットごとの過去のピークのうち、確保する分位点（0〜1）",
+    )
+    parser.add_argument(
+        "--lead-minutes",
+        type=int,
+        default=settings["lead_minutes"],
+        help="インスタンスの起動にかかる時間。この分だけ前倒しで minvCpus を上げる（分）",
+    )
+    parser.add_argument(
+        "--vcpu-step", type=int, default=settings["vcpu_step"], help="minvCpus の刻み（インスタンスの vCPU 数）"
+    )
+    parser.add_argument(
+        "--baseline-vcpus",
+        type=int,
+        default=settings["baseline_vcpus"],
+        help="どのスロットでも確保する minvCpus",
+    )
+    parser.add_argument(
+        "--max-vcpus", type=int, help="minvCpus の上限（省略時はコンピュート環境の maxvCpus）"
+    )
+    parser.add_argument(
+        "--timezone", default=settings["timezone"], help="スロットの基準にするタイムゾーン"
+    )
+    args = parser.parse_args()
+    if not args.apply and not args.history:
+        parser.error("--history（計画）か --apply（反映）のどちらかが必要です")
+    if args.apply and not (args.schedule or args.history):
+        parser.error("--apply には --schedule か --history が必要です")
+    if not 0 < args.quantile <= 1:
+        parser.error("--quantile は 0 より大きく 1 以下で指定してください")
+    if (PERIOD_SECONDS[args.period] // 60) % args.slot_minutes:
+        parser.error("--slot-minutes は周期を割り切れる長さにしてください")
+    return args
+
+
+# 配列ジョブの親の statusSummary のうち、子ジョブが実行まで進んだステータス
+RAN_STATUSES = ("SUCCEEDED", "FAILED")
+
+
+def demand_intervals(jobs, job_queue):
+    """
+    ジョブ履歴から (到着時刻, 終了時刻, vCPU) の区間を取り出す
+
+    待ち時間は容量不足の結果なので需要に含めず、到着時刻から実行時間だけ vCPU を使ったものとする。
+    配列ジョブは子ジョブごとに、それぞれの開始・終了時刻から求めた実行時間の区間にする
+    （export_job_history.py --array-children で書き出した履歴）。親の startedAt〜stoppedAt は
+    最初の子の開始から最後の子の終了までのため、子ジョブの記録がない親は、実行まで進んだ子ジョブの数
+    （statusSummary の SUCCEEDED と FAILED）が親の区間全体で同時に動いたものとする概算になる。
+
+    Returns:
+        (区間のリスト, 子ジョブの記録がなく概算した配列ジョブの数)
+    """
+    jobs = [
+        job for job in jobs
+        if job_platform(job) == "ec2" and resource_name(job.get("jobQueue")) == job_queue
+    ]
+    # 子ジョブのIDは <親のジョブID>:<配列インデックス>
+    with_children = {
+        job["jobId"].rsplit(":", 1)[0] for job in jobs if "index" in (job.get("arrayProperties") or {})
+    }
+    intervals = []
+    estimated = 0
+    for job in jobs:
+        created = job.get("createdAt"); started = job.get("startedAt"); stopped = job.get("stoppedAt")
+        if not created or not started or not stopped:
+            continue
+        vcpu, _ = job_resources(job, "ec2")
+        array_properties = job.get("arrayProperties") or {}
+        if "size" in array_properties and "index" not in array_properties:
+            if job["jobId"] in with_children:
+                continue
+            summary = array_properties.get("statusSummary") or {}
+            ran = sum(summary.get(status, 0) for status in RAN_STATUSES) if summary else array_properties["size"]
+            if not ran:
+                continue
+            vcpu *= ran
+            estimated += 1
+        arrival = created / 1000
+        intervals.append((arrival, arrival + max(stopped - started, 0) / 1000, vcpu))
+    return intervals, estimated
+
+
+class SlotClock:
+    """時刻と周期内のスロット番号の対応"""
+
+    def __init__(self, period, slot_minutes, timezone):
+        self.period_seconds = PERIOD_SECONDS[period]
+        self.slot_seconds = slot_minutes * 60
+        self.slots = self.period_seconds // self.slot_seconds
+        self.period = period
+        self.zone = ZoneInfo(timezone)
+
+    def local_seconds(self, timestamp):
+        """エポック秒を、同じタイムゾーンの月曜 0 時を起点とした通算秒に変換する"""
+        offset = datetime.fromtimestamp(timestamp, self.zone).utcoffset().total_seconds()
+        # 1970-01-01 は木曜日なので、3日ずらして月曜始まりにする
+        return timestamp + offset + 3 * 86400
+
+    def global_slot(self, timestamp):
+        return int(self.local_seconds(timestamp) // self.slot_seconds)
+
+    def position(self, global_slot):
+        """通算スロット番号から周期内のスロット番号を返す"""
+        return global_slot % self.slots
+
+    def label(self, position):
+        """周期内のスロット番号の表示名（例: 02:15、Tue 02:15）"""
+        minutes = position * self.slot_seconds // 60
+        text = f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+        if self.period == "weekly":
+            text = f"{WEEKDAYS[minutes // 1440]} {text}"
+        return text
+
+
+def slot_peaks(intervals, clock):
+    """
+    通算スロットごとに、同時に必要だった vCPU のピークを求める
+
+    Returns:
+        {通算スロット番号: ピーク vCPU}
+    """
+    events = []
+    for begin, end, vcpu in intervals:
+        events.append((begin, vcpu))
+        events.append((end, -vcpu))
+    # 同じ時刻では終了を先に処理する
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    peaks = {}
+    level = 0.0
+    for (time_a, delta), (time_b, _) in zip(events, events[1:] + [(None, 0)]):
+        level += delta
+        if time_b is None or level <= 1e-9:
+            continue
+        first = clock.global_slot(time_a)
+        last = clock.global_slot(max(time_a, time_b - 1e-6))
+        for slot in range(first, last + 1):
+            if level > peaks.get(slot, 0.0):
+                peaks[slot] = level
+    return peaks
+
+
+def quantile(values, q):
+    """昇順に並べた値の分位点（線形補間なし、q 以上を満たす最小の値）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def plan(intervals, clock, quantile_value, lead_minutes, vcpu_step, baseline, max_vcpus):
+    """
+    minvCpus のスケジュールを計画する
+
+    Returns:
+        (スロットごとの予測需要, スロットごとの minvCpus, 観測した周期数)
+    """
+    if not intervals:
+        return [0.0] * clock.slots, [baseline] * clock.slots, 0
+    peaks = slot_peaks(intervals, clock)
+    first_cycle = clock.global_slot(min(begin for begin, _, _ in intervals)) // clock.slots
+    last_cycle = clock.global_slot(max(end for _, end, _ in intervals)) // clock.slots
+    cycles = last_cycle - first_cycle + 1
+
+    forecast = []
+    for position in range(clock.slots):
+        # 需要がなかった周期も 0 として数える
+        values = sorted(
+            peaks.get((first_cycle + cycle) * clock.slots + position, 0.0) for cycle in range(cycles)
+        )
+        forecast.append(quantile(values, quantile_value))
+
+    required = []
+    for demand in forecast:
+        vcpus = math.ceil(demand / vcpu_step - 1e-9) * vcpu_step if demand > 0 else 0
+        if max_vcpus is not None:
+            vcpus = min(vcpus, max_vcpus)
+        required.append(max(vcpus, baseline))
+
+    # 起動時間の分だけ前倒しする（スロット s では s 〜 s + lead の最大値を確保する）
+    lead_slots = math.ceil(lead_minutes * 60 / clock.slot_seconds)
+    schedule = [
+        max(required[(position + ahead) % clock.slots] for ahead in range(lead_slots + 1))
+        for position in range(clock.slots)
+    ]
+    return forecast, schedule, cycles
+
+
+def evaluate(intervals, clock, schedule):
+    """
+    過去の需要に対してスケジュールを評価する
+
+    Returns:
+        (需要があったスロットのうち minvCpus がピーク以上だった割合, 1日あたりの確保 vCPU 時間)
+    """
+    peaks = slot_peaks(intervals, clock)
+    busy = [(slot, peak) for slot, peak in peaks.items() if peak > 0]
+    covered = sum(1 for slot, peak in busy if schedule[clock.position(slot)] >= peak - 1e-9)
+    vcpu_hours = sum(schedule) * clock.slot_seconds / 3600 * 86400 / clock.period_seconds
+    return (covered / len(busy) if busy else 1.0), vcpu_hours
+
+
+def resolve_compute_environment(batch, job_queue, name=None):
+    """反映先のコンピュート環境の情報を返す（省略時はジョブキューの優先度が最も高いもの）"""
+    if not name:
+        queues = batch.describe_job_queues(jobQueues=[job_queue])["jobQueues"]
+        if not queues:
+            raise ValueError(f"ジョブキューが見つかりません: {job_queue}")
+        orders = sorted(queues[0]["computeEnvironmentOrder"], key=lambda order: order["order"])
+        name = orders[0]["computeEnvironment"]
+    environments = batch.describe_compute_environments(computeEnvironments=[name])["computeEnvironments"]
+    if not environments:
+        raise ValueError(f"コンピュート環境が見つかりません: {name}")
+    environment = environments[0]
+    if environment["computeResources"]["type"] not in ("EC2", "SPOT"):
+        raise ValueError(f"EC2 のコンピュート環境ではありません: {environment['computeEnvironmentName']}")
+    return environment
+
+
+def current_value(schedule_data, now=None):
+    """スケジュールから現在のスロットの minvCpus を返す"""
+    clock = SlotClock(schedule_data["period"], schedule_data["slotMinutes"], schedule_data["timezone"])
+    position = clock.position(clock.global_slot(time.time() if now is None else now))
+    return position, clock.label(position), schedule_data["minvCpus"][position]
+
+
+def apply_schedule(batch, schedule_data, args, logger):
+    """現在のスロットの minvCpus をコンピュート環境に反映する"""
+    environment = resolve_compute_environment(
+        batch, args.job_queue, args.compute_environment or schedule_data.get("computeEnvironment")
+    )
+    name = environment["computeEnvironmentName"]
+    resources = environment["computeResources"]
+    position, label, value = current_value(schedule_data)
+    target = min(value, resources["maxvCpus"])
+    logger.info(
+        f"{name}: スロット {label}（{position}）の minvCpus = {target}"
+        f"（現在 {resources['minvCpus']}, desired {resources.get('desiredvCpus')}, max {resources['maxvCpus']}）"
+    )
+    if target == resources["minvCpus"]:
+        logger.info("変更はありません")
+        return
+    if args.dry_run:
+        logger.info("--dry-run のため反映しません")
+        return
+    # desiredvCpus は minvCpus 以上に自動で引き上げられる。下げた場合は空いたインスタンスから順に終了する
+    batch.update_compute_environment(
+        computeEnvironment=environment["computeEnvironmentArn"],
+        computeResources={"minvCpus": target},
+    )
+    logger.info(f"minvCpus を {resources['minvCpus']} から {target} に変更しました")
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+
+    batch = None
+    max_vcpus = args.max_vcpus
+    if args.apply or max_vcpus is None:
+        try:
+            batch = boto3.client("batch", region_name=args.region)
+        except Exception as e:
+            logger.error(f"AWS Batch クライアント作成エラー: {e}")
+            sys.exit(1)
+
+    if args.history:
+        if max_vcpus is None:
+            try:
+                environment = resolve_compute_environment(batch, args.job_queue, args.compute_environment)
+                max_vcpus = environment["computeResources"]["maxvCpus"]
+            except Exception as e:
+                logger.warning(f"maxvCpus を取得できないため上限なしで計画します: {e}")
+
+        intervals, estimated = demand_intervals(load_jobs(args.history), args.job_queue)
+        if estimated:
+            logger.warning(
+                f"子ジョブの記録がない配列ジョブ {estimated} 件は親の区間から概算しました"
+                "（export_job_history.py --array-children で子ジョブも書き出してください）"
+            )
+        clock = SlotClock(args.period, args.slot_minutes, args.timezone)
+        forecast, schedule, cycles = plan(
+            intervals,
+            clock,
+            args.quantile,
+            args.lead_minutes,
+            args.vcpu_step,
+            args.baseline_vcpus,
+            max_vcpus,
+        )
+        coverage, vcpu_hours = evaluate(intervals, clock, schedule)
+        always_on = max(schedule) * 24
+        price = config.PRICE_TABLE["ec2"]["vcpu_hour"]
+        logger.info(
+            f"{args.job_queue}: ジョブ {len(intervals)} 件, {cycles} 周期（{args.period}）の履歴から計画しました"
+        )
+        print(f"{'スロット':<12}{'予測 vCPU':>10}{'minvCpus':>10}")
+        previous = None
+        for position in range(clock.slots):
+            # 値が変わるスロットだけを表示する
+            if schedule[position] != previous or forecast[position] > 0:
+                print(f"{clock.label(position):<12}{forecast[position]:>10.1f}{schedule[position]:>10}")
+            previous = schedule[position]
+        print(
+            f"\n過去の需要スロットのうち起動待ちなしで開始できた割合: {coverage:.0%}\n"
+            f"確保する vCPU 時間: {vcpu_hours:.1f} / 日（約 ${vcpu_hours * price:.2f}）、"
+            f"ピーク分を終日確保した場合: {always_on:.1f} / 日（約 ${always_on * price:.2f}）"
+        )
+
+        schedule_data = {
+            "jobQueue": args.job_queue,
+            "computeEnvironment": args.compute_environment,
+            "period": args.period,
+            "slotMinutes": args.slot_minutes,
+            "timezone": args.timezone,
+            "quantile": args.quantile,
+            "leadMinutes": args.lead_minutes,
+            "cycles": cycles,
+            "coverage": round(coverage, 4),
+            "minvCpus": schedule,
+        }
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(schedule_data, f, ensure_ascii=False, indent=2)
+            logger.info(f"スケジュールを書き出しました: {args.output}")
+    else:
+        with open(args.schedule, encoding="utf-8") as f:
+            schedule_data = json.load(f)
+
+    if args.apply:
+        try:
+            apply_schedule(batch, schedule_data, args, logger)
+        except Exception as e:
+            logger.error(f"minvCpus の反映エラー: {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+配列ジョブのログ収集スクリプト
+
+配列ジョブの子ジョブを列挙し、各子ジョブの CloudWatch Logs ストリームを
+スレッドプールで並行して取得する。取得したログはタイムスタンプ順に1本に
+マージし、子ジョブのインデックスを付けて出力する。
+ログレベルや正規表現による絞り込みは取得しながら行う。
+"""
+
+import argparse
+import boto3
+import datetime
+import heapq
+import logging
+import re
+import sys
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import config
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+# list_jobs で子ジョブを列挙する際のステータス
+JOB_STATUSES = [
+    "SUBMITTED",
+    "PENDING",
+    "RUNNABLE",
+    "STARTING",
+    "RUNNING",
+    "SUCCEEDED",
+    "FAILED",
+]
+
+# ログレベルの順序（メッセージ中の最初に現れたレベル名で判定する）
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+LEVEL_PATTERN = re.compile(r"\b(DEBUG|INFO|WARN(?:ING)?|ERROR|CRITICAL)\b")
+
+# describe_jobs に一度に渡せるジョブIDの上限
+DESCRIBE_BATCH_SIZE = 100
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(
+        description="配列ジョブの子ジョブのログを並行取得してマージするツール"
+    )
+    parser.add_argument("--job-id", required=True, help="配列ジョブ（親ジョブ）のID")
+    parser.add_argument(
+        "--platform",
+        choices=sorted(PLATFORM_CONFIG),
+        default="fargate",
+        help="ジョブを実行したプラットフォーム（ロググループの既定値に使用）",
+    )
+    parser.add_argument("--log-group", help="ロググループ名")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=16, help="ログストリームを並行取得するスレッド数"
+    )
+    parser.add_argument(
+        "--level", choices=LEVELS, help="このレベル以上のログだけを出力する"
+    )
+    parser.add_argument("--pattern", help="メッセージが一致するログだけを出力する正規表現")
+    parser.add_argument(
+        "--endpoint-url",
+        help="CloudWatch Logs のエンドポイント（ローカルの互換サーバーで試す場合）",
+    )
+    return parser.parse_args()
+
+
+def list_child_job_ids(batch, array_job_id):
+    """配列ジョブの子ジョブIDをすべて列挙する"""
+    paginator = batch.get_paginator("list_jobs")
+    job_ids = []
+    for status in JOB_STATUSES:
+        for page in paginator.paginate(arrayJobId=array_job_id, jobStatus=status):
+            job_ids.extend(job["jobId"] for job in page["jobSummaryList"])
+    return job_ids
+
+
+def describe_log_streams(batch, job_ids):
+    """
+    子ジョブごとのログストリーム名を取得する
+
+    Returns:
+        (タグ, ログストリーム名) のリスト。リトライされた子ジョブは試行ごとに別のタグになる
+    """
+    streams = []
+    for i in range(0, len(job_ids), DESCRIBE_BATCH_SIZE):
+        response = batch.describe_jobs(jobs=job_ids[i:i + DESCRIBE_BATCH_SIZE])
+        for job in response["jobs"]:
+            index = job.get("arrayProperties", {}).get("index", "-")
+            attempt_streams = [
+                attempt["container"]["logStreamName"]
+                for attempt in job.get("attempts", [])
+                if attempt.get("container", {}).get("logStreamName")
+            ]
+            current = job.get("container", {}).get("logStreamName")
+            if current and current not in attempt_streams:
+                attempt_streams.append(current)
+            for attempt, stream in enumerate(attempt_streams):
+                tag = str(index) if len(attempt_streams) == 1 else f"{index}.{attempt}"
+                streams.append((tag, stream))
+    return streams
+
+
+def event_level(message):
+    """メッセージのログレベルを返す。判定できなければ None"""
+    match = LEVEL_PATTERN.search(message)
+    if not match:
+        return None
+    level = match.group(1)
+    return "WARNING" if level.startswith("WARN") else level
+
+
+def make_filter(min_level, pattern):
+    """ログイベントの絞り込み関数を作る"""
+    min_rank = LEVELS.index(min_level) if min_level else None
+    regex = re.compile(pattern) if pattern else None
+
+    def accept(message):
+        if min_rank is not None:
+            level = event_level(message)
+            if level is None or LEVELS.index(level) < min_rank:
+                return False
+        if regex is not None and not regex.search(message):
+            return False
+        return True
+
+    return accept
+
+
+def fetch_stream(logs, log_group, tag, stream, accept):
+    """
+    1本のログストリームを先頭から最後まで取得する
+
+    Returns:
+        (タイムスタンプ, タグ, メッセージ) のタイムスタンプ順のリスト
+    """
+    events = []
+    kwargs = {
+        "logGroupName": log_group,
+        "logStreamName": stream,
+        "startFromHead": True,
+    }
+    while True:
+        response = logs.get_log_events(**kwargs)
+        for event in response["events"]:
+            if accept(event["message"]):
+                events.append((event["timestamp"], tag, event["message"]))
+        # 末尾に達すると同じトークンが返される
+        next_token = response.get("nextForwardToken")
+        if not next_token or next_token == kwargs.get("nextToken"):
+            return events
+        kwargs["nextToken"] = next_token
+
+
+def collect(logs, log_group, streams, accept, max_workers, logger):
+    """ログストリームを並行取得し、タイムスタンプ順にマージしたイテレーターを返す"""
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_stream, logs, log_group, tag, stream, accept): stream
+            for tag, stream in streams
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"ログストリーム取得エラー: {futures[future]}: {e}")
+            if done % 100 == 0 or done == len(futures):
+                logger.info(f"ログストリーム取得: {done}/{len(futures)}")
+    return heapq.merge(*results)
+
+
+def main():
+    """メイン処理"""
+    # ロギング設定（標準出力はログ本体に使うため、進捗は標準エラー出力へ）
+    logger = configure_logging()
+    args = parse_args()
+    log_group = args.log_group or PLATFORM_CONFIG[args.platform]["log_group"]
+
+    # AWS クライアントを作成（並行数に合わせて接続プールを広げる）
+    try:
+        client_config = Config(
+            max_pool_connections=args.max_workers,
+            retries={"mode": "adaptive", "max_attempts": 10},
+        )
+        batch = boto3.client("batch", region_name=args.region, config=client_config)
+        logs = boto3.client(
+            "logs",
+            region_name=args.region,
+            endpoint_url=args.endpoint_url,
+            config=client_config,
+        )
+    except Exception as e:
+        logger.error(f"AWS クライアント作成エラー: {e}")
+        sys.exit(1)
+
+    try:
+        job_ids = list_child_job_ids(batch, args.job_id) or [args.job_id]
+        streams = describe_log_streams(batch, job_ids)
+    except Exception as e:
+        logger.error(f"ジョブ情報取得エラー: {e}")
+        sys.exit(1)
+    logger.info(f"子ジョブ {len(job_ids)} 件, ログストリーム {len(streams)} 本")
+
+    accept = make_filter(args.level, args.pattern)
+    for timestamp, tag, message in collect(
+        logs, log_group, streams, accept, args.max_workers, logger
+    ):
+        time_str = datetime.datetime.fromtimestamp(timestamp / 1000).strftime(
+            "%Y-%m-%d %H:%M:%S.%f"
+        )[:-3]
+        print(f"{time_str} [{tag}] {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@ EC2_CONFIG = {
     "job_queue": f"{NAME_PREFIX}-ec2",
     "job_definition": f"{NAME_PREFIX}-ec2-sample1",
     "array_job_queue": f"{NAME_PREFIX}-ec2", 
+    "log_group": f"/aws/batch/{NAME_PREFIX}-ec2",
 }
 
 # Fargate関連の設定
@@ -29,6 +30,7 @@ FARGATE_CONFIG = {
     "job_queue": f"{NAME_PREFIX}-fargate", # 
     "job_definition": f"{NAME_PREFIX}-fargate-sample",
     "array_job_queue": f"{NAME_PREFIX}-fargate",
+    "log_group": f"/aws/batch/{NAME_PREFIX}-fargate",
 }
 
 # デフォルトのリソース設定
@@ -87,3 +89,151 @@ FAIR_SHARE_CONFIG = {
 # ログフォーマット
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 小タスクのパッキング設定（submit_packed_job.py 用）
+PACKING_CONFIG = {
+    "target_seconds": 600,  # 1バンドルあたりの目標実行時間（秒）
+    "default_item_seconds": 5.0,  # 履歴がないアイテムの想定実行時間（秒）
+    "max_bundle_bytes": 20000,  # BUNDLE 環境変数の最大サイズ（submit_job のリクエスト上限対策）
+}
+
+# ジョブ実行履歴ファイル
+HISTORY_FILE = os.environ.get("AWS_BATCH_HISTORY_FILE", "job_history.json")
+
+# コスト計算用の単価（USD、ap-northeast-1 の参考値。最新の料金表で上書きすること）
+# EC2 はインスタンス単位の課金を vCPU 時間・メモリ時間に按分した近似値
+PRICE_TABLE = {
+    "fargate": {"vcpu_hour": 0.05056, "gb_hour": 0.00553},
+    "fargate_spot": {"vcpu_hour": 0.01517, "gb_hour": 0.00166},
+    "ec2": {"vcpu_hour": 0.0496, "gb_hour": 0.0062},
+    "ec2_spot": {"vcpu_hour": 0.0149, "gb_hour": 0.0019},
+}
+
+# ジョブキューごとの料金区分（PRICE_TABLE のキー）
+# export_job_history.py がコンピューティング環境の容量タイプから料金区分を付けたレコードには使わない。
+# スポットのコンピューティング環境だけを使うキューを手で指定する場合は "ec2_spot" / "fargate_spot" にする
+QUEUE_PRICING = {
+    EC2_CONFIG["job_queue"]: "ec2",
+    FARGATE_CONFIG["job_queue"]: "fargate",
+}
+
+# スポットの料金区分に対応するオンデマンドの料金区分
+ON_DEMAND_PRICING = {
+    "fargate_spot": "fargate",
+    "ec2_spot": "ec2",
+}
+
+# 配列サイズ自動調整の設定（--array-size auto 用）
+AUTOTUNE_CONFIG = {
+    "startup_seconds": {"ec2": 30.0, "fargate": 60.0},  # 子ジョブ1つあたりの起動オーバーヘッド（秒）
+    "seconds_per_byte": 1e-7,  # 履歴がない場合の処理速度（約10MB/秒）
+    "max_array_size": 10000,  # AWS Batch の配列サイズの上限
+    "vcpu_options": {"ec2": [1, 2, 4], "fargate": [0.25, 0.5, 1, 2, 4]},
+    "parallel_efficiency": 0.0,  # vCPU 追加1つあたりの速度向上率（単一スレッド処理なら0）
+}
+
+# 遅延子ジョブの検出と投機的再実行の設定（straggler_monitor.py 用）
+STRAGGLER_CONFIG = {
+    "interval_seconds": 30,  # 子ジョブの状態を確認する間隔（秒）
+    "mad_threshold": 3.0,  # 完了済み実行時間の中央値 + この倍数 × MAD を超えたら遅延とみなす
+    "min_ratio": 2.0,  # 中央値のこの倍数未満の実行時間は遅延とみなさない
+    "min_completed": 5,  # 判定に必要な完了済み子ジョブの最小数
+    "min_completed_fraction": 0.2,  # 判定に必要な完了済み子ジョブの割合
+    "max_speculative_fraction": 0.1,  # 投機的に重複実行する子ジョブの上限（配列サイズに対する割合）
+}
+
+# ワーカーモードの設定（submit_workers.py 用）
+WORKER_CONFIG = {
+    "workers": 4,  # 起動するワーカー（コンテナ）の数
+    "idle_seconds": 60,  # キューが空のままこの時間たつとワーカーが終了する（秒）
+    "visibility_seconds": 300,  # 処理中のメッセージを他のワーカーから隠す時間（秒）
+    "max_receive_count": 5,  # この回数受信しても成功しないメッセージはデッドレターキュー（<キュー名>-dlq）へ移す
+    "dead_letter_retention_days": 14,  # デッドレターキューにメッセージを残す日数（SQS の上限は 14 日）
+}
+
+# EC2 コンピュート環境の minvCpus スケジュールの設定（capacity_planner.py 用）
+CAPACITY_CONFIG = {
+    "period": "daily",  # 需要の周期（daily / weekly）
+    "slot_minutes": 15,  # スロットの長さ（分）
+    "quantile": 0.8,  # スロットごとの過去のピークのうち確保する分位点
+    "lead_minutes": 10,  # インスタンスの起動にかかる時間（この分だけ前倒しで確保する）
+    "vcpu_step": 2,  # minvCpus の刻み（インスタンスの vCPU 数）
+    "baseline_vcpus": 0,  # どのスロットでも確保する minvCpus
+    "timezone": "Asia/Tokyo",  # スロットの基準にするタイムゾーン
+}
+
+# 失敗したジョブの分類と再実行の設定（retry_controller.py 用）
+RETRY_CONFIG = {
+    "memory_growth": {"fargate": 1.0, "ec2": 1.5},  # メモリ不足時に引き上げる倍率（Fargate は次の有効な値以上）
+    "ec2_memory_step": 512,  # EC2 のメモリを切り上げる単位（MB）
+    "max_escalations": 3,  # 同じジョブのメモリを引き上げて再実行する最大回数
+    "interval_seconds": 60,  # --watch で失敗したジョブを確認する間隔（秒）
+}
+
+# 処理結果のメモ化の設定（submit_packed_job.py --memo-index 用）
+MEMO_CONFIG = {
+    "index": os.environ.get("AWS_BATCH_MEMO_INDEX"),  # 結果インデックスの場所（s3:// URI またはローカルのディレクトリ）
+    "source_dir": os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "container", "test"),  # コードのバージョンを計算するコンテナのソース
+    "workers": 16,  # 結果インデックスを並列に確認するスレッド数
+}
+
+# リース実行の設定（配列送信スクリプトの --lease-shards 用）
+LEASE_CONFIG = {
+    "table": f"{NAME_PREFIX}-lease-shards",  # シャードのリーステーブル（DynamoDB、なければ作成する）
+    "lease_seconds": 120,  # リースの有効期間（秒）。子ジョブはこの3分の1ごとに延長する
+    "retention_days": 7,  # 登録したシャードを TTL で削除するまでの日数
+}
+
+# ジョブの状態インデックスの設定（job_state_index.py と --state-index 用）
+JOB_STATE_CONFIG = {
+    "index_file": "job_state_index.db",  # インデックス（SQLite）のパス
+    "queue_names": [
+        f"{NAME_PREFIX}-job-state-events-ec2",  # Terraform の resources_ec2 が作るイベントのキュー
+        f"{NAME_PREFIX}-job-state-events-fargate",  # Terraform の resources_fargate が作るイベントのキュー
+    ],
+    "retention_days": 14,  # 終了してからこの日数を過ぎたジョブをインデックスから削除する
+}
+
+# 送信側のメトリクスの設定（metrics.py 用）
+METRICS_CONFIG = {
+    "pushgateway": os.environ.get("AWS_BATCH_PUSHGATEWAY"),  # 終了時にメトリクスを送る Pushgateway の URL
+    "textfile": os.environ.get("AWS_BATCH_METRICS_FILE"),  # メトリクスを書き出すファイル（node_exporter の textfile 用）
+    "job": "awa-batch-submitter",  # Pushgateway のグループのジョブ名
+}
+
+# プレビュー実行の設定（preview_job.py 用）
+PREVIEW_CONFIG = {
+    "sample": "head:100000",  # 標本の取り方（head:N / reservoir:N / every:K）
+    "resources": {  # プレビューのジョブに割り当てる最小限のリソース
+        "ec2": {"vcpu": 1, "memory": 1024},
+        "fargate": {"vcpu": 0.25, "memory": 512},
+    },
+    "timeout_seconds": 900,  # プレビューのジョブを打ち切るまでの時間（秒）
+    "poll_seconds": 10,  # 完了を待つ間に状態を確認する間隔（秒）
+    "memory_headroom": 1.25,  # 見積もった子ジョブのメモリに掛ける余裕
+    "container_dir": MEMO_CONFIG["source_dir"],  # --local で実行するコンテナのソース
+}
+
+# EC2 / Fargate のジョブキューの振り分けの設定（router.py と submit_routed_job.py 用）
+ROUTING_CONFIG = {
+    "platforms": ["ec2", "fargate"],  # 振り分け先の候補
+    "prefer": "ec2",  # 見込みの開始時刻が同程度なら選ぶプラットフォーム（安い方）
+    "switch_margin_seconds": 60,  # prefer よりこの秒数以上早く開始できる場合だけ別のプラットフォームに送る
+    "launch_seconds": {"ec2": 30, "fargate": 60},  # 空きがある場合にジョブが開始するまでの時間（秒）
+    "scale_up_seconds": {"ec2": 180, "fargate": 0},  # インスタンスの追加が必要な場合に加わる時間（秒）
+    "default_runtime_seconds": 600,  # 実行時間の記録がない場合のジョブの実行時間（秒）
+    "runtime_window_hours": 24,  # 平均実行時間の計算に使う、終了したジョブの期間（時間）
+    "max_describe": 300,  # API から状態を作る場合に、要求リソースを調べるジョブ数の上限（ステータスごと）
+}
+
+# asyncio のサービスから使う送信クライアントの設定（async_batch_client.py 用）
+ASYNC_CLIENT_CONFIG = {
+    "max_connections": 32,  # エンドポイントごとに保持する HTTP 接続の上限
+    "max_concurrency": 64,  # 同時に実行する API 呼び出しの上限（再試行の待ち時間は含まない）
+    "max_attempts": 5,  # スロットリングや一時的なエラーの場合の呼び出し回数の上限
+    "base_delay_seconds": 0.1,  # 再試行の待ち時間の基準（回数ごとに倍にし、0 からその値までの乱数で待つ）
+    "max_delay_seconds": 10.0,  # 再試行の待ち時間の上限（秒）
+    "timeout_seconds": 30,  # 接続と応答を待つ時間の上限（秒）
+    "idle_seconds": 20,  # 使っていない接続を再利用せずに閉じるまでの時間（秒）
+    "describe_delay_seconds": 0.01,  # describe_job をまとめて describe_jobs にするまでに待つ時間（秒）
+}
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+ジョブ履歴からのコスト・効率レポート生成スクリプト
+
+export_job_history.py が書き出したジョブ履歴（describe_jobs の JSON Lines）と
+要求リソース、config.PRICE_TABLE の単価を突き合わせ、ジョブ定義・キュー・
+シェア識別子ごとにコスト、キュー待ち時間、リソース使用率、スポットによる節約額を集計する。
+
+料金区分はレコードの pricing（export_job_history.py がコンピューティング環境の容量タイプから付ける）、
+なければ config.QUEUE_PRICING を使う。リソース使用率は usage（export_job_history.py --usage が
+コンテナのプロファイルから読み込む）を持つジョブだけで計算し、どのジョブも持たなければ列を出さない。
+
+数百万行の履歴でも数秒で処理できるよう、1パスで集計し、行ごとの中間結果は保持しない。
+"""
+
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+import config
+from job_records import job_platform, job_resources, load_jobs, resource_name
+
+# 集計キーごとの (レコードから値を取り出す関数, 表示用に変換する関数)
+# 集計中は生の値（ARN など）をキーにし、名前への変換は集計後にまとめて行う
+GROUP_FIELDS = {
+    "definition": (lambda job: job.get("jobDefinition"), resource_name),
+    "queue": (lambda job: job.get("jobQueue"), resource_name),
+    "share": (lambda job: job.get("shareIdentifier"), lambda value: value or "-"),
+    "status": (lambda job: job.get("status"), lambda value: value or "-"),
+}
+
+# Fargate は最低1分の課金
+FARGATE_MINIMUM_SECONDS = 60
+
+# 集計値のインデックス
+JOBS, RUN_HOURS, WAIT_SECONDS, COST, SAVINGS, USAGE_JOBS, REQ_CPU_H, USED_CPU_H, REQ_MEM, USED_MEM = range(10)
+
+# 使用量を持つジョブがない場合に出さない列
+USAGE_COLUMNS = ("cpu_util", "mem_util")
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(description="ジョブ履歴からのコスト・効率レポート生成ツール")
+    parser.add_argument(
+        "--history", nargs="+", required=True, help="ジョブ履歴（JSON Lines）のパス"
+    )
+    parser.add_argument(
+        "--group-by",
+        default="definition,queue,share",
+        help=f"集計キー（カンマ区切り、{', '.join(GROUP_FIELDS)} から選択）",
+    )
+    parser.add_argument(
+        "--prices-file", help="単価表のJSONファイル（省略時は config.PRICE_TABLE）"
+    )
+    parser.add_argument("--csv", help="集計結果をCSVで書き出すパス")
+    return parser.parse_args()
+
+
+def hourly_rate(prices, vcpu, memory_mb):
+    """vCPU とメモリの1時間あたりの単価"""
+    return vcpu * prices["vcpu_hour"] + memory_mb / 1024 * prices["gb_hour"]
+
+
+def aggregate(jobs, group_fields, price_table, queue_pricing):
+    """
+    ジョブ履歴をグループごとに集計する
+
+    実行されなかったジョブ（startedAt がない）と配列ジョブの親はコスト計算の対象外とする。
+    料金区分はレコードの pricing を優先し、なければ queue_pricing（キュー名 → 料金区分）を使う。
+    使用率は、コンテナのプロファイルから読み込んだ usage（cpuSeconds / maxRssMb）を持つジョブだけで計算する。
+    """
+    key_funcs = [GROUP_FIELDS[name][0] for name in group_fields]
+    raw_groups = {}
+    # (キュー, プラットフォーム) ごとの料金区分
+    pricing_cache = {}
+    for job in jobs:
+        started = job.get("startedAt")
+        stopped = job.get("stoppedAt")
+        if not started or not stopped:
+            continue
+        array_properties = job.get("arrayProperties")
+        if array_properties and "index" not in array_properties:
+            continue
+
+        key = tuple([func(job) for func in key_funcs])
+        acc = raw_groups.get(key)
+        if acc is None:
+            acc = raw_groups[key] = [0] * 10
+
+        platform = job_platform(job)
+        queue = job.get("jobQueue")
+        pricing = job.get("pricing")
+        if pricing is None:
+            pricing = pricing_cache.get((queue, platform))
+            if pricing is None:
+                pricing = queue_pricing.get(resource_name(queue), platform)
+                pricing_cache[(queue, platform)] = pricing
+        run_seconds = (stopped - started) / 1000
+        if platform == "fargate":
+            run_seconds = max(run_seconds, FARGATE_MINIMUM_SECONDS)
+        run_hours = run_seconds / 3600
+        vcpu, memory = job_resources(job, platform)
+
+        cost = run_hours * hourly_rate(price_table[pricing], vcpu, memory)
+        on_demand = config.ON_DEMAND_PRICING.get(pricing)
+        acc[JOBS] += 1
+        acc[RUN_HOURS] += run_hours
+        acc[WAIT_SECONDS] += (started - job.get("createdAt", started)) / 1000
+        acc[COST] += cost
+        if on_demand:
+            acc[SAVINGS] += run_hours * hourly_rate(price_table[on_demand], vcpu, memory) - cost
+
+        usage = job.get("usage")
+        if usage:
+            acc[USAGE_JOBS] += 1
+            acc[REQ_CPU_H] += vcpu * run_hours
+            acc[USED_CPU_H] += usage["cpuSeconds"] / 3600
+            acc[REQ_MEM] += memory
+            acc[USED_MEM] += usage["maxRssMb"]
+
+    # 生の値のキーを表示用の名前に変換し、同じ名前になったグループをまとめる
+    display_funcs = [GROUP_FIELDS[name][1] for name in group_fields]
+    groups = {}
+    for raw_key, acc in raw_groups.items():
+        key = tuple(func(value) for func, value in zip(display_funcs, raw_key))
+        merge_into(groups, key, acc)
+    return groups
+
+
+def merge_into(groups, key, acc):
+    """集計値をグループに加算する"""
+    if key in groups:
+        groups[key] = [a + b for a, b in zip(groups[key], acc)]
+    else:
+        groups[key] = acc
+
+
+def report_rows(groups, group_fields):
+    """集計結果を表示用の行（コストの高い順）に変換する（使用量を持つジョブがなければ使用率の列は除く）"""
+    with_usage = any(acc[USAGE_JOBS] for acc in groups.values())
+    rows = []
+    for key, acc in sorted(groups.items(), key=lambda item: item[1][COST], reverse=True):
+        row = dict(zip(group_fields, key))
+        row.update(
+            {
+                "jobs": acc[JOBS],
+                "run_hours": round(acc[RUN_HOURS], 3),
+                "avg_wait_sec": round(acc[WAIT_SECONDS] / acc[JOBS], 1),
+                "cost_usd": round(acc[COST], 4),
+                "cost_per_job_usd": round(acc[COST] / acc[JOBS], 6),
+                "spot_savings_usd": round(acc[SAVINGS], 4),
+                "cpu_util": round(acc[USED_CPU_H] / acc[REQ_CPU_H], 3) if acc[REQ_CPU_H] else None,
+                "mem_util": round(acc[USED_MEM] / acc[REQ_MEM], 3) if acc[REQ_MEM] else None,
+            }
+        )
+        if not with_usage:
+            for column in USAGE_COLUMNS:
+                del row[column]
+        rows.append(row)
+    return rows
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    group_fields = [name.strip() for name in args.group_by.split(",") if name.strip()]
+    unknown = [name for name in group_fields if name not in GROUP_FIELDS]
+    if unknown:
+        logger.error(f"不明な集計キーです: {', '.join(unknown)}")
+        sys.exit(1)
+
+    price_table = config.PRICE_TABLE
+    if args.prices_file:
+        with open(args.prices_file, "r", encoding="utf-8") as f:
+            price_table = {**price_table, **json.load(f)}
+
+    start = time.perf_counter()
+    groups = {}
+    for path in args.history:
+        for key, acc in aggregate(
+            load_jobs(path), group_fields, price_table, config.QUEUE_PRICING
+        ).items():
+            merge_into(groups, key, acc)
+    rows = report_rows(groups, group_fields)
+    total_jobs = sum(row["jobs"] for row in rows)
+    logger.info(f"{total_jobs} 件のジョブを {time.perf_counter() - start:.2f} 秒で集計しました")
+    if not rows:
+        return
+
+    columns = list(rows[0])
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        logger.info(f"CSV を書き出しました: {args.csv}")
+
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+    print(
+        f"\n合計: {total_jobs} ジョブ, "
+        f"{sum(row['cost_usd'] for row in rows):.2f} USD, "
+        f"スポット節約 {sum(row['spot_savings_usd'] for row in rows):.2f} USD"
+    )
+
+
+if __name__ == "__main__":
+    main()
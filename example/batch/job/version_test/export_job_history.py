@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+ジョブ履歴のエクスポートスクリプト
+
+ジョブキューのジョブを list_jobs で列挙し、describe_jobs の結果を
+1行1ジョブの JSON Lines 形式で書き出す。コストレポートやキャパシティ計画の入力に使う。
+ジョブキューで列挙されるのは配列ジョブの親だけのため、--array-children を指定すると
+親に続けて終了済みの子ジョブ（arrayProperties.index を持つ）も書き出す。
+
+各レコードには、cost_report.py が使う次の項目を加える:
+- pricing: ジョブキューのコンピューティング環境がすべて同じ容量タイプ（EC2 / SPOT / FARGATE / FARGATE_SPOT）の場合の
+  料金区分（config.PRICE_TABLE のキー）。混在している場合は付けず、cost_report.py は config.QUEUE_PRICING を使う
+- usage: --usage を指定した場合、PROFILE を有効にして実行したジョブがコンテナ側で書き出した
+  <outputPath>/_profile/<ジョブID>-attempt-<試行回数>/stages.json の CPU 時間と最大 RSS
+"""
+
+import argparse
+import boto3
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import config
+from job_records import resource_name
+from memo import join_uri, read_json
+
+# エクスポート対象の終了済みステータス
+FINISHED_STATUSES = ["SUCCEEDED", "FAILED"]
+
+# describe_jobs に一度に渡せるジョブIDの上限
+DESCRIBE_BATCH_SIZE = 100
+
+# コンピューティング環境の容量タイプに対応する料金区分
+CAPACITY_PRICING = {
+    "EC2": "ec2",
+    "SPOT": "ec2_spot",
+    "FARGATE": "fargate",
+    "FARGATE_SPOT": "fargate_spot",
+}
+
+# stages.json を並行して読むスレッド数
+USAGE_WORKERS = 16
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(description="AWS Batch ジョブ履歴のエクスポートツール")
+    parser.add_argument(
+        "--job-queue",
+        nargs="+",
+        default=[config.EC2_CONFIG["job_queue"], config.FARGATE_CONFIG["job_queue"]],
+        help="対象のジョブキュー名",
+    )
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument("--output", required=True, help="出力する JSON Lines ファイルのパス")
+    parser.add_argument(
+        "--usage",
+        action="store_true",
+        help="PROFILE を有効にして実行したジョブのプロファイル（stages.json）から CPU 時間と最大 RSS を読み込む",
+    )
+    parser.add_argument(
+        "--array-children",
+        action="store_true",
+        help="配列ジョブの子ジョブも書き出す（子ごとの実行時間が必要な capacity_planner.py / cost_report.py 向け）",
+    )
+    return parser.parse_args()
+
+
+def queue_pricing(batch, job_queues, logger):
+    """
+    ジョブキューごとの料金区分をコンピューティング環境の容量タイプから求める
+
+    Returns:
+        {ジョブキュー名: 料金区分}（容量タイプが混在するキューは含めない）
+    """
+    queues = batch.describe_job_queues(jobQueues=job_queues)["jobQueues"]
+    environments = sorted({
+        entry["computeEnvironment"] for queue in queues for entry in queue["computeEnvironmentOrder"]
+    })
+    capacity = {}
+    for i in range(0, len(environments), DESCRIBE_BATCH_SIZE):
+        response = batch.describe_compute_environments(computeEnvironments=environments[i:i + DESCRIBE_BATCH_SIZE])
+        for environment in response["computeEnvironments"]:
+            capacity[environment["computeEnvironmentArn"]] = environment.get("computeResources", {}).get("type")
+            capacity[environment["computeEnvironmentName"]] = capacity[environment["computeEnvironmentArn"]]
+
+    pricing = {}
+    for queue in queues:
+        tiers = {
+            CAPACITY_PRICING.get(capacity.get(entry["computeEnvironment"]))
+            for entry in queue["computeEnvironmentOrder"]
+        }
+        if len(tiers) == 1 and None not in tiers:
+            pricing[queue["jobQueueName"]] = tiers.pop()
+        else:
+            logger.warning(
+                f"{queue['jobQueueName']}: コンピューティング環境の容量タイプが混在しているため、"
+                "料金区分は config.QUEUE_PRICING を使います"
+            )
+    return pricing
+
+
+def profile_uri(job):
+    """
+    ジョブの最後の試行のプロファイル（stages.json）の場所。PROFILE が無効なジョブは None
+
+    出力先はコンテナ側 profiling.py と同じく PROFILE_OUTPUT、なければ CONFIG の outputPath。
+    """
+    environment = {item["name"]: item["value"] for item in job.get("container", {}).get("environment", [])}
+    if environment.get("PROFILE", "off").lower() in ("", "off", "false", "0"):
+        return None
+    output = environment.get("PROFILE_OUTPUT")
+    if not output:
+        try:
+            output = json.loads(environment.get("CONFIG") or "{}").get("outputPath")
+        except ValueError:
+            return None
+    attempts = len(job.get("attempts") or [])
+    if not output or not attempts:
+        return None
+    return join_uri(output, "_profile", f"{job['jobId'].replace(':', '-')}-attempt-{attempts}", "stages.json")
+
+
+def job_usage(job):
+    """プロファイルから CPU 時間（秒）と最大 RSS（MB）を読み込む。読めなければ None"""
+    uri = profile_uri(job)
+    if uri is None:
+        return None
+    summary = read_json(uri)
+    if not summary or "maxRssMb" not in summary:
+        return None
+    return {"cpuSeconds": summary["cpuSeconds"], "maxRssMb": summary["maxRssMb"]}
+
+
+def child_job_ids(batch, parent):
+    """配列ジョブの終了済みの子ジョブのIDを列挙する。配列ジョブの親でなければ空"""
+    array_properties = parent.get("arrayProperties") or {}
+    if "size" not in array_properties or "index" in array_properties:
+        return []
+    paginator = batch.get_paginator("list_jobs")
+    return [
+        summary["jobId"]
+        for status in FINISHED_STATUSES
+        for page in paginator.paginate(arrayJobId=parent["jobId"], jobStatus=status)
+        for summary in page["jobSummaryList"]
+    ]
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        sys.exit(1)
+    try:
+        pricing = queue_pricing(batch, args.job_queue, logger)
+    except Exception as e:
+        logger.error(f"コンピューティング環境の取得エラー: {e}")
+        sys.exit(1)
+
+    paginator = batch.get_paginator("list_jobs")
+    counts = {"jobs": 0, "usage": 0}
+    with open(args.output, "w", encoding="utf-8") as f, ThreadPoolExecutor(USAGE_WORKERS) as executor:
+
+        def export(job_ids):
+            """ジョブIDの詳細を取得して書き出す（配列ジョブの親の後には子ジョブを続ける）"""
+            for i in range(0, len(job_ids), DESCRIBE_BATCH_SIZE):
+                jobs = batch.describe_jobs(jobs=job_ids[i:i + DESCRIBE_BATCH_SIZE])["jobs"]
+                usages = executor.map(job_usage, jobs) if args.usage else [None] * len(jobs)
+                for job, usage in zip(jobs, usages):
+                    tier = pricing.get(resource_name(job.get("jobQueue")))
+                    if tier:
+                        job["pricing"] = tier
+                    if usage:
+                        job["usage"] = usage
+                        counts["usage"] += 1
+                    f.write(json.dumps(job, ensure_ascii=False, default=str) + "\n")
+                    counts["jobs"] += 1
+                    if args.array_children:
+                        export(child_job_ids(batch, job))
+
+        for job_queue in args.job_queue:
+            for status in FINISHED_STATUSES:
+                for page in paginator.paginate(jobQueue=job_queue, jobStatus=status):
+                    export([job["jobId"] for job in page["jobSummaryList"]])
+            logger.info(f"{job_queue}: 累計 {counts['jobs']} 件をエクスポートしました")
+    if args.usage:
+        logger.info(f"プロファイルからリソース使用量を読み込んだジョブ: {counts['usage']} 件")
+    logger.info(f"ジョブ履歴を書き出しました: {args.output} ({counts['jobs']} 件)")
+
+
+if __name__ == "__main__":
+    main()
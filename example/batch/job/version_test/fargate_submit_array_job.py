@@ -10,6 +10,9 @@ import uuid
 import logging
 import sys
 import config
+import metrics
+from autotune import add_autotune_args, array_size_arg, resolve_auto_array_size
+from lease_table import add_lease_args, prepare_leases
 
 
 def configure_logging():
@@ -41,18 +44,60 @@ def parse_args():
     # 配列ジョブ設定用オプション
     parser.add_argument(
         "--array-size",
-        type=int,
+        type=array_size_arg,
         required=True,
-        help="配列ジョブのサイズ（実行するジョブの数）",
+        help="配列ジョブのサイズ（実行するジョブの数）。auto で入力サイズと履歴から自動で決める",
     )
+    parser.add_argument(
+        "--finalize",
+        action="store_true",
+        help="全子ジョブの完了後に出力のマニフェストを作るファイナライズ用ジョブも送信する",
+    )
+    add_autotune_args(parser, "fargate")
+    add_lease_args(parser)
     return parser.parse_args()
 
 
+def submit_finalize_job(batch, submit_params, array_job_id, shard_count, logger):
+    """
+    配列ジョブの全子ジョブの完了後に実行するファイナライズ用ジョブを送信する
+
+    コンテナは FINALIZE_OUTPUT=true のとき、RUN_ID の実行の各シャードのマニフェストをまとめて
+    outputPath にアイテムのマニフェスト（_manifests/<アイテムID>.json）を書く。
+    """
+    finalize_params = {
+        key: value
+        for key, value in submit_params.items()
+        if key in ("jobQueue", "jobDefinition", "shareIdentifier", "schedulingPriorityOverride")
+    }
+    finalize_params.update(
+        {
+            "jobName": f"{submit_params['jobName']}-finalize",
+            # 配列ジョブ全体に依存すると、すべての子ジョブが成功した後に実行される
+            "dependsOn": [{"jobId": array_job_id}],
+            "containerOverrides": {
+                "environment": [
+                    {"name": "FINALIZE_OUTPUT", "value": "true"},
+                    {"name": "SHARD_COUNT", "value": str(shard_count)},
+                    {"name": "RUN_ID", "value": submit_params["jobName"]},
+                ]
+            },
+        }
+    )
+    try:
+        response = batch.submit_job(**finalize_params)
+        logger.info(f"ファイナライズ用ジョブ送信成功: ID = {response['jobId']}")
+    except Exception as e:
+        logger.error(f"ファイナライズ用ジョブ送信エラー: {e}")
+
+
 def main():
     """メイン処理"""
     # ロギング設定
     logger = configure_logging()
     args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
 
     # ジョブ名を生成（タイムスタンプとUUIDを含む）
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -66,12 +111,45 @@ def main():
         logger.error(f"AWS Batch クライアント作成エラー: {e}")
         return
 
+    # 配列サイズと子ジョブのリソースを自動で決める
+    resource_overrides = {}
+    if args.array_size == "auto":
+        try:
+            args.array_size, resource_overrides = resolve_auto_array_size(
+                args, "fargate", batch, logger
+            )
+        except Exception as e:
+            logger.error(f"配列サイズ自動調整エラー: {e}")
+            return
+
+    # --lease-shards の場合、子ジョブはリーステーブルから小さなシャードを取得して処理する
+    shard_count = args.array_size
+    lease_environment = []
+    if args.lease_shards:
+        try:
+            lease_environment = prepare_leases(args, job_name, args.region, logger)
+        except Exception as e:
+            logger.error(f"リーステーブル準備エラー: {e}")
+            return
+        shard_count = args.lease_shards
+
     # 基本ジョブ送信パラメータ
     submit_params = {
         "jobName": job_name,
         "jobQueue": args.job_queue,
         "jobDefinition": args.job_definition,
         "arrayProperties": {"size": args.array_size},
+        # コンテナは SHARD_COUNT と AWS_BATCH_JOB_ARRAY_INDEX（リース実行では取得したシャード）で
+        # 担当する入力範囲を決める
+        "containerOverrides": {
+            # RUN_ID はシャードのマニフェストを実行ごとに分ける（ファイナライズ用ジョブ・重複実行にも引き継ぐ）
+            "environment": [
+                {"name": "SHARD_COUNT", "value": str(shard_count)},
+                {"name": "RUN_ID", "value": job_name},
+                *lease_environment,
+            ],
+            **resource_overrides,
+        },
         # shareIdentifier および schedulingPriority パラメータを使用しない
     }
 
@@ -92,6 +170,10 @@ def main():
         print(job_id)  # 標準出力にジョブIDを出力
     except Exception as e:
         logger.error(f"Fargate ジョブ送信エラー: {e}")
+        return
+
+    if args.finalize:
+        submit_finalize_job(batch, submit_params, job_id, shard_count, logger)
 
 
 if __name__ == "__main__":
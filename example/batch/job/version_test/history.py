@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+ジョブ実行履歴の管理モジュール
+
+コンテナが出力するアイテムごとの実行結果（BUNDLE_ITEM_RESULT 行）や
+シャードごとの処理量（SHARD_RESULT 行）を取り込み、パッキングや配列サイズの
+見積もりに利用できるようローカルJSONファイルに保存する。
+メモリ不足で失敗したジョブのメモリの引き上げ（retry_controller.py）も記録し、
+次回以降の送信で最初から十分なメモリを要求できるようにする。
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import config
+
+# コンテナ側 bundle.py が出力する結果行のマーカー
+RESULT_MARKER = "BUNDLE_ITEM_RESULT"
+
+# コンテナ側 run_batch.py が出力するシャード処理結果行のマーカー
+SHARD_MARKER = "SHARD_RESULT"
+
+# 新しい観測値の重み（指数移動平均）
+EWMA_ALPHA = 0.3
+
+
+def item_key(item):
+    """
+    作業アイテムを識別するキーを返す（コンテナ側 bundle.item_key と同じ規則）
+
+    入力ファイルの後ろにアイテム全体のハッシュを付けるため、同じ入力でも設定や出力先が違えば別のキーになる。
+    """
+    canonical = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    if isinstance(item, dict) and item.get("inputFile"):
+        digest = hashlib.blake2b(canonical.encode("utf-8"), digest_size=6).hexdigest()
+        return f"{item['inputFile']}#{digest}"
+    return canonical
+
+
+class JobHistory:
+    """ローカルJSONファイルに保存するジョブ実行履歴"""
+
+    def __init__(self, path=config.HISTORY_FILE):
+        self.path = path
+        self.data = {"items": {}, "throughput": {}, "memory": {}, "escalations": {}}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+
+    def item_seconds(self, key, default=None):
+        """アイテムの平均実行時間（秒）を返す。履歴がなければ default"""
+        entry = self.data["items"].get(key)
+        if entry is None:
+            return default
+        return entry["seconds"]
+
+    def record_item(self, key, seconds):
+        """アイテムの実行時間を指数移動平均で記録する"""
+        entry = self.data["items"].get(key)
+        if entry is None:
+            self.data["items"][key] = {"seconds": seconds, "count": 1}
+            return
+        entry["seconds"] = (1 - EWMA_ALPHA) * entry["seconds"] + EWMA_ALPHA * seconds
+        entry["count"] += 1
+
+    def seconds_per_byte(self, key, default=None):
+        """ジョブ定義ごとの1バイトあたりの平均処理時間（秒）を返す。履歴がなければ default"""
+        entry = self.data["throughput"].get(key)
+        if entry is None:
+            return default
+        return entry["seconds_per_byte"]
+
+    def record_throughput(self, key, nbytes, seconds):
+        """シャードの処理量と処理時間から1バイトあたりの処理時間を指数移動平均で記録する"""
+        if nbytes <= 0:
+            return
+        value = seconds / nbytes
+        entry = self.data["throughput"].get(key)
+        if entry is None:
+            self.data["throughput"][key] = {"seconds_per_byte": value, "count": 1}
+            return
+        entry["seconds_per_byte"] = (
+            (1 - EWMA_ALPHA) * entry["seconds_per_byte"] + EWMA_ALPHA * value
+        )
+        entry["count"] += 1
+
+    def memory_floor(self, key, default=None):
+        """ジョブ定義ごとに、メモリ不足を起こさなかったメモリ（MB）の下限を返す。履歴がなければ default"""
+        entry = self.data["memory"].get(key)
+        if entry is None:
+            return default
+        return entry["memory"]
+
+    def record_oom(self, key, failed_memory, next_memory):
+        """メモリ不足で失敗したメモリと、引き上げ後のメモリ（MB）を記録する"""
+        entry = self.data["memory"].setdefault(key, {"memory": 0, "failed": 0, "count": 0})
+        entry["memory"] = max(entry["memory"], next_memory)
+        entry["failed"] = max(entry["failed"], failed_memory)
+        entry["count"] += 1
+
+    def escalation(self, job_id):
+        """失敗したジョブに対して送信済みの再実行の記録を返す。未処理なら None"""
+        return self.data["escalations"].get(job_id)
+
+    def record_escalation(self, job_id, entry):
+        """失敗したジョブに対する再実行を記録する（同じ失敗を二重に再実行しないため）"""
+        self.data["escalations"][job_id] = entry
+
+    def ingest_lines(self, lines, throughput_key=None):
+        """
+        ログの行を取り込む
+
+        BUNDLE_ITEM_RESULT 行からは成功したアイテムの実行時間を、throughput_key
+        （ジョブ定義名）が指定されていれば SHARD_RESULT 行から処理速度を記録する。
+        """
+        count = 0
+        for line in lines:
+            for marker in (RESULT_MARKER, SHARD_MARKER):
+                marker_pos = line.find(marker)
+                if marker_pos >= 0:
+                    break
+            else:
+                continue
+            try:
+                result = json.loads(line[marker_pos + len(marker):])
+            except json.JSONDecodeError:
+                continue
+            if marker == SHARD_MARKER:
+                # 途中で打ち切ったシャード（LOST）は処理速度に含めない
+                if throughput_key and result.get("status", "COMMITTED") == "COMMITTED":
+                    self.record_throughput(throughput_key, result["bytes"], result["seconds"])
+                    count += 1
+                continue
+            if result.get("status") != "SUCCEEDED":
+                continue
+            self.record_item(result["key"], float(result["seconds"]))
+            count += 1
+        return count
+
+    def save(self):
+        """履歴ファイルを一時ファイル経由で書き込む"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(
+        description="ジョブログからアイテムごとの実行時間を履歴に取り込むツール"
+    )
+    parser.add_argument(
+        "--history-file", default=config.HISTORY_FILE, help="履歴ファイルのパス"
+    )
+    parser.add_argument(
+        "--ingest",
+        nargs="+",
+        required=True,
+        help="BUNDLE_ITEM_RESULT / SHARD_RESULT 行を含むログファイルのパス",
+    )
+    parser.add_argument(
+        "--job-definition",
+        help="SHARD_RESULT 行の処理速度を記録するジョブ定義名（省略時は記録しない）",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+
+    history = JobHistory(args.history_file)
+    total = 0
+    for path in args.ingest:
+        with open(path, "r", encoding="utf-8") as f:
+            total += history.ingest_lines(f, args.job_definition)
+    history.save()
+    logger.info(f"{total} 件の実行結果を履歴に取り込みました: {args.history_file}")
+
+
+if __name__ == "__main__":
+    main()
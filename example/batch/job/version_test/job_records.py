@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+ジョブ履歴レコードの共通処理
+
+describe_jobs の結果（1行1ジョブのJSON Lines）から、キュー名・ジョブ定義名・
+要求リソースなどを取り出すためのヘルパー関数群。
+"""
+
+import json
+from functools import lru_cache
+from resources import resources_from_overrides
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+def load_jobs(path):
+    """JSON Lines 形式のジョブ履歴を1件ずつ読み込む"""
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield _loads(line)
+
+
+@lru_cache(maxsize=4096)
+def resource_name(arn):
+    """ARN または名前からリソース名を返す（ジョブ定義のリビジョンは除く）"""
+    if not arn:
+        return "-"
+    return arn.rsplit("/", 1)[-1].split(":", 1)[0]
+
+
+def job_platform(job):
+    """ジョブの実行プラットフォーム（ec2 / fargate）を返す"""
+    if "FARGATE" in job.get("platformCapabilities", []):
+        return "fargate"
+    return "ec2"
+
+
+def job_resources(job, platform=None):
+    """
+    ジョブが要求した vCPU とメモリ（MB）を返す
+
+    resourceRequirements（Fargate および新しい EC2 形式）を優先し、
+    なければ vcpus / memory、それもなければ config.DEFAULT_RESOURCES を使う。
+    """
+    return resources_from_overrides(job.get("container", {}), platform or job_platform(job))
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+ジョブの状態インデックス
+
+list_jobs / describe_jobs をポーリングする代わりに、EventBridge の「Batch Job State Change」
+イベント（Terraform の batch_job_state_events.tf が SQS キューに送る）を受け取り、
+ジョブごとの最新の状態をローカルの SQLite に保持する。
+ステータス・ジョブキュー・ジョブ定義・配列ジョブの親・時刻の範囲で引けるため、
+bulk_control.py / retry_controller.py（--state-index）や集計はポーリングなしで一覧を得られる。
+
+イベントは順序どおりに届くとは限らず、同じイベントが重複して届くこともある。
+(試行回数, ステータスの順位, イベントの時刻) が保持している状態より新しいイベントだけを反映するため、
+同じイベントの列を順不同・重複ありで取り込んでも結果は同じになる。
+
+記録したイベント（1行に1イベントの JSON）は --ingest-file で取り込める:
+    python job_state_index.py --ingest-file job_state_events_sample.jsonl --query --status FAILED
+"""
+
+import argparse
+import boto3
+import datetime
+import fnmatch
+import json
+import logging
+import sqlite3
+import sys
+import time
+import config
+from bulk_control import parse_time
+
+# ステータスの順位（リトライでは試行回数が増えるため、同じ試行内の順序だけを表す）
+STATUS_RANK = {
+    "SUBMITTED": 0,
+    "PENDING": 1,
+    "RUNNABLE": 2,
+    "STARTING": 3,
+    "RUNNING": 4,
+    "SUCCEEDED": 5,
+    "FAILED": 5,
+}
+
+# 時刻の範囲で絞り込める項目
+TIME_FIELDS = ["created_at", "started_at", "stopped_at", "event_time"]
+
+# receive_message / delete_message_batch で一度に扱えるメッセージ数の上限
+SQS_BATCH_SIZE = 10
+
+COLUMNS = (
+    "job_id", "job_name", "status", "status_reason", "queue", "definition", "array_parent",
+    "array_index", "attempt_count", "status_rank", "event_time", "created_at", "started_at",
+    "stopped_at", "detail",
+)
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def arn_name(value):
+    """ARN（arn:aws:batch:...:job-queue/name や job-definition/name:rev）から名前を取り出す"""
+    if not value:
+        return None
+    return value.rsplit("/", 1)[-1].split(":", 1)[0]
+
+
+def event_millis(value):
+    """イベントの time（ISO 8601、例: 2026-10-19T01:02:03Z）をエポックミリ秒に変換する"""
+    if not value:
+        return 0
+    return int(datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def event_row(event):
+    """イベントをインデックスの行に変換する。Batch のジョブ状態変更でなければ None"""
+    if event.get("detail-type") != "Batch Job State Change":
+        return None
+    detail = event["detail"]
+    job_id = detail["jobId"]
+    array_properties = detail.get("arrayProperties") or {}
+    return {
+        "job_id": job_id,
+        "job_name": detail.get("jobName"),
+        "status": detail["status"],
+        "status_reason": detail.get("statusReason"),
+        "queue": arn_name(detail.get("jobQueue")),
+        "definition": arn_name(detail.get("jobDefinition")),
+        # 配列の子ジョブのIDは <親ジョブID>:<インデックス>
+        "array_parent": job_id.split(":", 1)[0] if ":" in job_id else None,
+        "array_index": array_properties.get("index"),
+        "attempt_count": len(detail.get("attempts") or []),
+        "status_rank": STATUS_RANK.get(detail["status"], 0),
+        "event_time": event_millis(event.get("time")),
+        "created_at": detail.get("createdAt"),
+        "started_at": detail.get("startedAt"),
+        "stopped_at": detail.get("stoppedAt"),
+        "detail": json.dumps(detail, ensure_ascii=False, separators=(",", ":")),
+    }
+
+
+class JobStateIndex:
+    """ジョブごとの最新の状態を保持する SQLite のインデックス"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, job_name TEXT, status TEXT NOT NULL, status_reason TEXT, "
+            "queue TEXT, definition TEXT, array_parent TEXT, array_index INTEGER, "
+            "attempt_count INTEGER NOT NULL, status_rank INTEGER NOT NULL, event_time INTEGER NOT NULL, "
+            "created_at INTEGER, started_at INTEGER, stopped_at INTEGER, detail TEXT NOT NULL)"
+        )
+        for columns in ("status, queue", "queue, created_at", "definition", "array_parent", "stopped_at"):
+            name = "jobs_" + columns.replace(", ", "_")
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON jobs ({columns})")
+
+    def close(self):
+        self.db.close()
+
+    def ingest(self, events):
+        """
+        イベントを取り込む（保持している状態より古いイベントは無視する）
+
+        Returns:
+            反映したイベントの数
+        """
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[1:])
+        statement = (
+            f"INSERT INTO jobs ({', '.join(COLUMNS)}) VALUES ({placeholders}) "
+            f"ON CONFLICT (job_id) DO UPDATE SET {updates} "
+            "WHERE (excluded.attempt_count, excluded.status_rank, excluded.event_time) "
+            "> (jobs.attempt_count, jobs.status_rank, jobs.event_time)"
+        )
+        applied = 0
+        self.db.execute("BEGIN")
+        try:
+            for event in events:
+                row = event_row(event)
+                if row is None:
+                    continue
+                applied += self.db.execute(statement, [row[column] for column in COLUMNS]).rowcount
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return applied
+
+    def query(self, statuses=None, queues=None, definition=None, array_parent=None, name=None,
+              since=None, until=None, time_field="created_at", limit=None):
+        """
+        条件に一致するジョブの行を返す
+
+        name は * と ? を使えるジョブ名のパターン、since / until はエポックミリ秒（until は含まない）。
+        """
+        if time_field not in TIME_FIELDS:
+            raise ValueError(f"時刻の項目が不正です: {time_field}")
+        conditions, values = [], []
+        for column, choices in (("status", statuses), ("queue", queues)):
+            if choices:
+                conditions.append(f"{column} IN ({', '.join('?' for _ in choices)})")
+                values += list(choices)
+        for column, value in (("definition", definition), ("array_parent", array_parent)):
+            if value:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        if since is not None:
+            conditions.append(f"{time_field} >= ?")
+            values.append(since)
+        if until is not None:
+            conditions.append(f"{time_field} < ?")
+            values.append(until)
+        sql = "SELECT * FROM jobs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY {time_field}, job_id"
+        rows = self.db.execute(sql, values)
+        if name:
+            rows = (row for row in rows if row["job_name"] and fnmatch.fnmatchcase(row["job_name"], name))
+        results = []
+        for row in rows:
+            results.append(row)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    def jobs(self, **conditions):
+        """条件に一致するジョブの詳細（describe_jobs と同じ形）を返す"""
+        return [json.loads(row["detail"]) for row in self.query(**conditions)]
+
+    def summary(self, group_by="queue"):
+        """(group_by の値, ステータス) ごとのジョブ数"""
+        if group_by not in ("queue", "definition", "array_parent"):
+            raise ValueError(f"集計の項目が不正です: {group_by}")
+        return self.db.execute(
+            f"SELECT {group_by} AS name, status, COUNT(*) AS count FROM jobs "
+            f"GROUP BY {group_by}, status ORDER BY {group_by}, status"
+        ).fetchall()
+
+    def prune(self, retention_days):
+        """終了してから retention_days 日以上たったジョブを削除し、削除した数を返す"""
+        cutoff = int((time.time() - retention_days * 86400) * 1000)
+        return self.db.execute(
+            "DELETE FROM jobs WHERE status_rank = ? AND event_time < ?",
+            (STATUS_RANK["SUCCEEDED"], cutoff),
+        ).rowcount
+
+
+def read_events(path):
+    """記録したイベント（1行に1イベントの JSON）を読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def consume(index, sqs, queue_urls, once, logger):
+    """
+    SQS キューのイベントを取り込み続ける（once なら空になったら終了する）
+
+    取り込みをコミットしてからメッセージを削除するため、途中で止まっても次の実行で取り込み直す。
+    """
+    total = 0
+    while True:
+        received = 0
+        for queue_url in queue_urls:
+            response = sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=SQS_BATCH_SIZE,
+                # 複数のキューを順に見るため、once でなければ1つのキューを長く待たない
+                WaitTimeSeconds=1 if once or len(queue_urls) > 1 else 20,
+            )
+            messages = response.get("Messages", [])
+            if not messages:
+                continue
+            received += len(messages)
+            total += index.ingest(json.loads(message["Body"]) for message in messages)
+            sqs.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=[
+                    {"Id": str(number), "ReceiptHandle": message["ReceiptHandle"]}
+                    for number, message in enumerate(messages)
+                ],
+            )
+        if received:
+            logger.info(f"イベント {received} 件を受信（累計で反映 {total} 件）")
+        elif once:
+            return total
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    settings = config.JOB_STATE_CONFIG
+    parser = argparse.ArgumentParser(description="ジョブの状態インデックス")
+    parser.add_argument(
+        "--index-file", default=settings["index_file"], help="インデックス（SQLite）のパス"
+    )
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument("--consume", action="store_true", help="SQS キューのイベントを取り込む")
+    parser.add_argument(
+        "--queue-name",
+        nargs="+",
+        default=settings["queue_names"],
+        help="イベントを受け取る SQS キュー名（--queue-url を指定しない場合）",
+    )
+    parser.add_argument("--queue-url", nargs="+", help="イベントを受け取る SQS キューの URL")
+    parser.add_argument("--once", action="store_true", help="--consume でキューが空になったら終了する")
+    parser.add_argument("--ingest-file", help="記録したイベント（JSON Lines）を取り込む")
+    parser.add_argument("--query", action="store_true", help="条件に一致するジョブを表示する")
+    parser.add_argument("--summary", action="store_true", help="ジョブキューとステータスごとの件数を表示する")
+    parser.add_argument("--status", nargs="+", choices=sorted(STATUS_RANK), help="ステータス（複数指定可）")
+    parser.add_argument("--job-queue", nargs="+", help="ジョブキュー名（複数指定可）")
+    parser.add_argument("--job-definition", help="ジョブ定義名（リビジョンなし）")
+    parser.add_argument("--array-job-id", help="この配列ジョブの子ジョブだけを対象にする")
+    parser.add_argument("--name", help="ジョブ名のパターン（* と ? が使える）")
+    parser.add_argument("--since", type=parse_time, help="この時刻以降（ISO 8601 または 30m, 2h など）")
+    parser.add_argument("--until", type=parse_time, help="この時刻より前")
+    parser.add_argument(
+        "--time-field", choices=TIME_FIELDS, default="created_at", help="--since / --until で比べる時刻"
+    )
+    parser.add_argument("--limit", type=int, help="表示する最大件数")
+    parser.add_argument("--json", action="store_true", help="--query の結果をジョブの詳細の JSON Lines で出力する")
+    parser.add_argument(
+        "--retention-days",
+        type=int,
+        default=settings["retention_days"],
+        help="取り込み後、終了してからこの日数を過ぎたジョブを削除する",
+    )
+    args = parser.parse_args()
+    if not (args.consume or args.ingest_file or args.query or args.summary):
+        parser.error("--consume / --ingest-file / --query / --summary のいずれかが必要です")
+    return args
+
+
+def format_millis(value):
+    """エポックミリ秒を表示用の時刻にする"""
+    if not value:
+        return "-"
+    return datetime.datetime.fromtimestamp(value / 1000).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    index = JobStateIndex(args.index_file)
+
+    try:
+        if args.ingest_file:
+            events = read_events(args.ingest_file)
+            applied = index.ingest(events)
+            logger.info(f"{args.ingest_file}: イベント {len(events)} 件, 反映 {applied} 件")
+        if args.consume:
+            sqs = boto3.client("sqs", region_name=args.region)
+            queue_urls = args.queue_url or [
+                sqs.get_queue_url(QueueName=name)["QueueUrl"] for name in args.queue_name
+            ]
+            logger.info(f"イベントを取り込みます: {', '.join(queue_urls)}")
+            try:
+                consume(index, sqs, queue_urls, args.once, logger)
+            except KeyboardInterrupt:
+                logger.info("取り込みを終了します")
+        if args.ingest_file or args.consume:
+            pruned = index.prune(args.retention_days)
+            if pruned:
+                logger.info(f"{args.retention_days} 日より前に終了したジョブ {pruned} 件を削除しました")
+
+        if args.summary:
+            for row in index.summary():
+                print(f"{row['name'] or '-'}\t{row['status']}\t{row['count']}")
+        if args.query:
+            rows = index.query(
+                statuses=args.status,
+                queues=args.job_queue,
+                definition=args.job_definition,
+                array_parent=args.array_job_id,
+                name=args.name,
+                since=args.since,
+                until=args.until,
+                time_field=args.time_field,
+                limit=args.limit,
+            )
+            for row in rows:
+                if args.json:
+                    print(row["detail"])
+                    continue
+                print(
+                    f"{row['job_id']}\t{row['job_name']}\t{row['status']}\t{row['queue']}\t"
+                    f"{format_millis(row['created_at'])}\t{row['status_reason'] or ''}"
+                )
+            logger.info(f"一致したジョブ: {len(rows)} 件")
+    except Exception as e:
+        logger.error(f"状態インデックスの処理エラー: {e}")
+        sys.exit(1)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+シャードのリーステーブルの準備（送信側）
+
+リース実行では、入力を配列サイズより多い小さなシャードに分けてリーステーブル（DynamoDB）に
+登録し、配列の子ジョブがリースで取得しながら処理する（コンテナ側 lease_table.py）。
+送信前にテーブルを用意してシャードを登録し、子ジョブに渡す環境変数を作る。
+
+テーブル:
+    パーティションキー lease_group (S)、ソートキー shard (N)。グループは配列ジョブ名
+    子ジョブが取得できるシャードだけを読むための状態インデックス（group_state = "<グループ>#<状態>"、expires_at）
+    古いグループは purge_at 属性の TTL で削除される
+"""
+
+import time
+import config
+
+# batch_write_item に一度に渡せる項目数の上限
+WRITE_BATCH_SIZE = 25
+
+# 状態インデックスの名前（コンテナ側 lease_table.STATE_INDEX と同じ）
+STATE_INDEX = "group_state-expires_at-index"
+
+STATE_INDEX_DEFINITION = {
+    "IndexName": STATE_INDEX,
+    "KeySchema": [
+        {"AttributeName": "group_state", "KeyType": "HASH"},
+        {"AttributeName": "expires_at", "KeyType": "RANGE"},
+    ],
+    "Projection": {"ProjectionType": "KEYS_ONLY"},
+}
+
+# 古いグループを削除する TTL の属性
+TTL_ATTRIBUTE = "purge_at"
+
+
+def add_lease_args(parser):
+    """リース実行用のコマンドライン引数を追加する"""
+    lease = config.LEASE_CONFIG
+    group = parser.add_argument_group("リース実行（--lease-shards）")
+    group.add_argument(
+        "--lease-shards",
+        type=int,
+        help="入力を分けるシャード数（配列サイズより大きくする）。指定すると子ジョブがシャードをリースで取得する",
+    )
+    group.add_argument(
+        "--lease-table", default=lease["table"], help="リーステーブル（DynamoDB）の名前"
+    )
+    group.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=lease["lease_seconds"],
+        help="リースの有効期間（秒）",
+    )
+
+
+def wait_for_index(dynamodb, table_name):
+    """状態インデックスが使えるようになるまで待つ"""
+    while True:
+        table = dynamodb.describe_table(TableName=table_name)["Table"]
+        statuses = [
+            index["IndexStatus"]
+            for index in table.get("GlobalSecondaryIndexes", [])
+            if index["IndexName"] == STATE_INDEX
+        ]
+        if statuses == ["ACTIVE"]:
+            return
+        time.sleep(5)
+
+
+def ensure_table(dynamodb, table_name, logger):
+    """リーステーブル（と状態インデックス）がなければ作成し、使えるようになるまで待つ"""
+    attributes = [
+        {"AttributeName": "lease_group", "AttributeType": "S"},
+        {"AttributeName": "shard", "AttributeType": "N"},
+        {"AttributeName": "group_state", "AttributeType": "S"},
+        {"AttributeName": "expires_at", "AttributeType": "N"},
+    ]
+    try:
+        table = dynamodb.describe_table(TableName=table_name)["Table"]
+    except dynamodb.exceptions.ResourceNotFoundException:
+        table = None
+    if table is not None:
+        if not any(index["IndexName"] == STATE_INDEX for index in table.get("GlobalSecondaryIndexes", [])):
+            # 状態インデックスのない古いテーブル
+            logger.info(f"リーステーブルに状態インデックスを追加します: {table_name}")
+            dynamodb.update_table(
+                TableName=table_name,
+                AttributeDefinitions=attributes,
+                GlobalSecondaryIndexUpdates=[{"Create": STATE_INDEX_DEFINITION}],
+            )
+        wait_for_index(dynamodb, table_name)
+        ensure_ttl(dynamodb, table_name, logger)
+        return
+    logger.info(f"リーステーブルを作成します: {table_name}")
+    dynamodb.create_table(
+        TableName=table_name,
+        AttributeDefinitions=attributes,
+        KeySchema=[
+            {"AttributeName": "lease_group", "KeyType": "HASH"},
+            {"AttributeName": "shard", "KeyType": "RANGE"},
+        ],
+        GlobalSecondaryIndexes=[STATE_INDEX_DEFINITION],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.get_waiter("table_exists").wait(TableName=table_name)
+    wait_for_index(dynamodb, table_name)
+    ensure_ttl(dynamodb, table_name, logger)
+
+
+def ensure_ttl(dynamodb, table_name, logger):
+    """
+    purge_at の TTL が有効でなければ有効にする
+
+    既存のテーブルでも、作成時に TTL の設定が失敗した場合や手動で作られた場合に有効にする。
+    TTL の属性は1つだけで、別の属性で有効な場合や無効化の処理中は変更できないため警告だけ出す。
+    """
+    description = dynamodb.describe_time_to_live(TableName=table_name)["TimeToLiveDescription"]
+    status = description.get("TimeToLiveStatus", "DISABLED")
+    if status in ("ENABLED", "ENABLING") and description.get("AttributeName") == TTL_ATTRIBUTE:
+        return
+    if status != "DISABLED":
+        logger.warning(
+            f"リーステーブルの TTL を {TTL_ATTRIBUTE} で有効にできません（状態 {status}、"
+            f"属性 {description.get('AttributeName')}）。古いグループは削除されません: {table_name}"
+        )
+        return
+    logger.info(f"リーステーブルの TTL（{TTL_ATTRIBUTE}）を有効にします: {table_name}")
+    dynamodb.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": TTL_ATTRIBUTE},
+    )
+
+
+def register_shards(dynamodb, table_name, group, count):
+    """グループのシャードを未処理として登録する（グループは配列ジョブ名で、送信ごとに新しい）"""
+    purge_at = str(int(time.time() + config.LEASE_CONFIG["retention_days"] * 86400))
+    requests = [
+        {
+            "PutRequest": {
+                "Item": {
+                    "lease_group": {"S": group},
+                    "shard": {"N": str(shard)},
+                    "lease_state": {"S": "PENDING"},
+                    "group_state": {"S": f"{group}#PENDING"},
+                    "expires_at": {"N": "0"},
+                    "attempts": {"N": "0"},
+                    TTL_ATTRIBUTE: {"N": purge_at},
+                }
+            }
+        }
+        for shard in range(count)
+    ]
+    for i in range(0, len(requests), WRITE_BATCH_SIZE):
+        pending = {table_name: requests[i:i + WRITE_BATCH_SIZE]}
+        # スロットリングで書き込まれなかった項目は再送する
+        while pending:
+            pending = dynamodb.batch_write_item(RequestItems=pending).get("UnprocessedItems")
+            if pending:
+                time.sleep(0.5)
+
+
+def prepare_leases(args, group, region, logger):
+    """
+    リーステーブルを用意してシャードを登録し、子ジョブとファイナライズ用ジョブに渡す環境変数を返す
+
+    Raises:
+        ValueError: シャード数が配列サイズ以下の場合
+    """
+    import boto3
+
+    if args.lease_shards <= args.array_size:
+        raise ValueError(
+            f"シャード数（{args.lease_shards}）は配列サイズ（{args.array_size}）より大きくしてください"
+        )
+    dynamodb = boto3.client("dynamodb", region_name=region)
+    ensure_table(dynamodb, args.lease_table, logger)
+    register_shards(dynamodb, args.lease_table, group, args.lease_shards)
+    logger.info(
+        f"リース実行: {args.lease_shards} シャードを {args.lease_table} に登録しました（グループ {group}）"
+    )
+    return [
+        {"name": "LEASE_TABLE", "value": f"dynamodb://{args.lease_table}"},
+        {"name": "LEASE_GROUP", "value": group},
+        {"name": "LEASE_SHARDS", "value": str(args.lease_shards)},
+        {"name": "LEASE_SECONDS", "value": str(args.lease_seconds)},
+    ]
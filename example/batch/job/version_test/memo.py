@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+処理結果のメモ化（送信側）
+
+コンテナ側 memo.py が記録する結果インデックスを送信前に確認し、
+入力・設定・コードのいずれも前回から変わっていないアイテムは、ジョブを送らずに
+前回の出力ファイルを参照するシャードのマニフェストをコミットする。
+変わったアイテムだけを送信するため、夜間の処理量は変更のあった入力の分だけになる。
+
+キーの規則（設定のハッシュ・フィンガープリント・ETag・シャードのマニフェストの場所）と設定のデフォルト値は、
+コンテナのソース（config.MEMO_CONFIG["source_dir"]）の memo_keys.py をそのまま読み込んで使うため、両側でずれない。
+設定のハッシュはコンテナが検証後の設定（省略した項目はデフォルト値）から計算するため、送信側では
+memo_keys.normalize_config で同じ形にしてから計算する。キーが一致しなかったアイテムもコンテナ側で改めて確認される。
+
+単体では、アイテムごとの判定だけを表示できる:
+    python memo.py --items-file items.json --memo-index s3://example-bucket/memo/
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import config
+
+
+def _load_memo_keys(source_dir):
+    """コンテナのソースの memo_keys.py を読み込む（同じ名前の送信側のモジュールと混ざらないようパスから読む）"""
+    path = os.path.join(os.path.abspath(source_dir), "memo_keys.py")
+    spec = importlib.util.spec_from_file_location("memo_keys", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+memo_keys = _load_memo_keys(config.MEMO_CONFIG["source_dir"])
+join_uri = memo_keys.join_uri
+split_s3_uri = memo_keys.split_s3_uri
+reference_uris = memo_keys.reference_uris
+fingerprint = memo_keys.fingerprint
+normalize_config = memo_keys.normalize_config
+
+# バンドル実行のアイテムは配列ジョブではないため、シャードは常に (0, 1)
+SHARD_INDEX, SHARD_COUNT = 0, 1
+
+_s3 = None
+
+
+def s3_client():
+    """S3 クライアントを返す（プロセス内で1つを共有）"""
+    global _s3
+    if _s3 is None:
+        import boto3
+
+        _s3 = boto3.client("s3")
+    return _s3
+
+
+def head_etag(uri):
+    """オブジェクトのバージョンを識別する値（コンテナ側 storage.head_etag と同じ規則）。存在しない場合は None"""
+    return memo_keys.head_etag(uri, s3_client)
+
+
+def read_json(uri):
+    """JSONオブジェクトを読み込む。存在しない場合は None"""
+    if uri.startswith("s3://"):
+        bucket, key = split_s3_uri(uri)
+        client = s3_client()
+        try:
+            return json.loads(client.get_object(Bucket=bucket, Key=key)["Body"].read())
+        except client.exceptions.NoSuchKey:
+            return None
+    try:
+        with open(uri, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json_if_absent(uri, data):
+    """JSONオブジェクトが存在しない場合だけ書き込む。書き込んだ場合は True"""
+    body = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    if uri.startswith("s3://"):
+        bucket, key = split_s3_uri(uri)
+        client = s3_client()
+        try:
+            client.put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch="*")
+            return True
+        except client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return False
+            raise
+    os.makedirs(os.path.dirname(uri), exist_ok=True)
+    try:
+        with open(uri, "xb") as f:
+            f.write(body)
+        return True
+    except FileExistsError:
+        return False
+
+
+def code_version(source_dir=None):
+    """コンテナのソースの *.py のファイル名と内容のハッシュ（コンテナ側 memo.code_version と同じ規則）"""
+    return memo_keys.source_version(source_dir or config.MEMO_CONFIG["source_dir"])
+
+
+def config_hash(item):
+    """入力と出力先を除いた設定のハッシュを返す（コンテナが検証後の設定から計算する値と同じ）"""
+    return memo_keys.config_hash(normalize_config(item))
+
+
+def item_id(item):
+    """作業アイテムの識別子（コンテナ側 committer.item_id と同じ）"""
+    return memo_keys.item_id(normalize_config(item))
+
+
+def shard_manifest_uri(item, run_id):
+    """バンドル実行のアイテムのシャードのマニフェストの URI（コンテナ側 committer と同じレイアウト）"""
+    return memo_keys.shard_manifest_uri(normalize_config(item), run_id, SHARD_INDEX, SHARD_COUNT)
+
+
+class MemoIndex:
+    """送信前に結果インデックスを確認し、変更のないアイテムを判定する"""
+
+    def __init__(self, root, version=None, options=None):
+        self.root = root
+        # バージョンを指定した場合はコンテナにも CODE_VERSION として渡す
+        self.pinned = version is not None
+        self.version = version or code_version()
+        # コンテナに OUTPUT_CODEC などを渡さない場合のデフォルト
+        self.options = options or {"codec": "auto", "level": ""}
+
+    def key_for(self, item):
+        """アイテムのキーを返す。入力か参照ファイルが存在しなければ None"""
+        input_etag = head_etag(item["inputFile"])
+        reference_etags = [head_etag(uri) for uri in reference_uris(item)]
+        if input_etag is None or None in reference_etags:
+            return None
+        return fingerprint(
+            input_etag,
+            config_hash(item),
+            self.version,
+            SHARD_INDEX,
+            SHARD_COUNT,
+            reference_etags,
+            self.options,
+        )
+
+    def lookup(self, item):
+        """
+        変更のないアイテムの記録を返す
+
+        記録がない、または出力ファイルが削除されていて再利用できない場合は None
+        """
+        if not isinstance(item, dict) or not item.get("inputFile") or not item.get("outputPath"):
+            return None
+        key = self.key_for(item)
+        if key is None:
+            return None
+        entry = read_json(join_uri(self.root, key[:2], f"{key}.json"))
+        if entry is None or any(head_etag(file["uri"]) is None for file in entry["files"]):
+            return None
+        return entry
+
+    def partition(self, items, workers=None):
+        """
+        アイテムを変更のないもの（アイテムと記録の組）と処理が必要なものに分ける
+
+        入力ごとの確認は S3 への往復が数回あるため、スレッドで並列に行う。
+        """
+        if self.root.startswith("s3://"):
+            # クライアントの作成はスレッドセーフでないため、先に作っておく
+            s3_client()
+        with ThreadPoolExecutor(max_workers=workers or config.MEMO_CONFIG["workers"]) as executor:
+            entries = list(executor.map(self.lookup, items))
+        unchanged = [(item, entry) for item, entry in zip(items, entries) if entry is not None]
+        changed = [item for item, entry in zip(items, entries) if entry is None]
+        return unchanged, changed
+
+    def commit(self, item, entry, run_id):
+        """
+        前回の出力ファイルを参照するシャードのマニフェストを、実行 run_id（RUN_ID）にコミットする
+
+        Returns:
+            コミットした場合は True、既にコミットされていた場合は False
+        """
+        result = dict(entry["result"], seconds=0.0, reusedFrom=entry["jobId"])
+        result.pop("status", None)
+        manifest = {
+            "shard": SHARD_INDEX,
+            "count": SHARD_COUNT,
+            "jobId": None,
+            "runId": run_id,
+            "attempt": 0,
+            "speculativeOf": None,
+            "result": result,
+            "files": entry["files"],
+            "committedAt": datetime.now(timezone.utc).isoformat(),
+        }
+        return write_json_if_absent(shard_manifest_uri(item, run_id), manifest)
+
+    def environment(self):
+        """ジョブに渡す環境変数（コンテナ側でも同じインデックスを使い、結果を記録させる）"""
+        environment = [{"name": "MEMO_INDEX", "value": self.root}]
+        if self.pinned:
+            environment.append({"name": "CODE_VERSION", "value": self.version})
+        return environment
+
+
+def main():
+    """アイテムごとに前回の出力を再利用できるかを表示する"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    logger = logging.getLogger(__name__)
+    parser = argparse.ArgumentParser(description="処理結果のメモ化の確認ツール")
+    parser.add_argument("--items-file", required=True, help="作業アイテムの配列を含むファイルのパス")
+    parser.add_argument(
+        "--memo-index", default=config.MEMO_CONFIG["index"], help="結果インデックスの場所"
+    )
+    parser.add_argument("--code-version", help="コードのバージョン。省略時はコンテナのソースのハッシュ")
+    args = parser.parse_args()
+    if not args.memo_index:
+        parser.error("--memo-index（または AWS_BATCH_MEMO_INDEX）が必要です")
+
+    with open(args.items_file, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    index = MemoIndex(args.memo_index, args.code_version)
+    unchanged, changed = index.partition(items)
+    logger.info(f"コードのバージョン: {index.version}")
+    for item, entry in unchanged:
+        logger.info(f"変更なし: {item['inputFile']}（{entry['outputPath']} の出力を再利用）")
+    for item in changed:
+        logger.info(f"要処理: {item.get('inputFile', item) if isinstance(item, dict) else item}")
+    logger.info(f"変更なし {len(unchanged)} 件 / 要処理 {len(changed)} 件")
+
+
+if __name__ == "__main__":
+    main()
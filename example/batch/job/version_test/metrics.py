@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""
+送信側のメトリクス
+
+送信スクリプトの AWS Batch API 呼び出し（submit_job の件数・スロットリングの回数・レイテンシ）と、
+ジョブの状態インデックス（job_state_index.py）から求めたジョブキューの深さを
+OpenMetrics 形式で出力する。
+
+- install_from_env(): boto3 のデフォルトセッションのイベントに計測を登録する。
+  送信スクリプトの boto3.client はすべてこのセッションから作られるため、スクリプトごとの変更は1行で済む。
+  終了時に Pushgateway（config.METRICS_CONFIG["pushgateway"]）に送るか、ファイルに書き出す
+- queue_depth(): 状態インデックスのジョブキューとステータスごとのジョブ数と、
+  RUNNABLE のまま待っている最も古いジョブの待ち時間
+
+コンテナ側 metrics.py とは同じ形式（カウンタは _total、Pushgateway には Prometheus のテキスト形式）で、
+同じ Pushgateway に送る。
+
+単体では、ジョブキューの深さの出力と、テスト用の Pushgateway の代わり（--standin）を起動できる:
+    python metrics.py --queue-depth
+    python metrics.py --queue-depth --serve 9100
+    python metrics.py --standin --port 9091
+"""
+
+import argparse
+import atexit
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+
+# API 呼び出しのレイテンシのヒストグラムの境界（秒）
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# スロットリングを表すエラーコード
+THROTTLE_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "SlowDown",
+}
+
+# 実行前のステータス（キューの深さとして数える）
+QUEUED_STATUSES = ["SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING"]
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# サンプルの行（名前、ラベル、値）
+SAMPLE_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(.+)$")
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    カウンタ・ゲージ・ヒストグラムの登録と出力（コンテナ側 metrics.Registry と同じ形式）
+
+    botocore のイベントは複数のスレッドから呼ばれるため、更新はロックの中で行う。
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _series(self, kind, name, help_text, labels, buckets=None):
+        metric = self.metrics.setdefault(
+            name, {"kind": kind, "help": help_text, "buckets": buckets, "values": {}}
+        )
+        return metric, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, help_text, amount=1, **labels):
+        with self.lock:
+            metric, key = self._series("counter", name, help_text, labels)
+            metric["values"][key] = metric["values"].get(key, 0) + amount
+
+    def set(self, name, help_text, value, **labels):
+        with self.lock:
+            metric, key = self._series("gauge", name, help_text, labels)
+            metric["values"][key] = value
+
+    def observe(self, name, help_text, buckets, value, **labels):
+        with self.lock:
+            metric, key = self._series("histogram", name, help_text, labels, tuple(buckets))
+            values = metric["values"].setdefault(key, [0] * (len(buckets) + 1) + [0.0])
+            values[bisect_left(metric["buckets"], value)] += 1
+            values[-1] += value
+
+    def value(self, name, **labels):
+        metric = self.metrics.get(name)
+        if metric is None:
+            return 0
+        return metric["values"].get(tuple(sorted((key, str(value)) for key, value in labels.items())), 0)
+
+    def render(self, openmetrics=True):
+        """テキスト形式で出力する（openmetrics=False は Pushgateway 用の Prometheus のテキスト形式）"""
+        lines = []
+        with self.lock:
+            for name, metric in self.metrics.items():
+                if not metric["values"]:
+                    continue
+                kind = metric["kind"]
+                family = f"{name}_total" if kind == "counter" and not openmetrics else name
+                lines.append(f"# HELP {family} {metric['help']}")
+                lines.append(f"# TYPE {family} {kind}")
+                for key, value in metric["values"].items():
+                    if kind == "counter":
+                        lines.append(f"{name}_total{_labels(key)} {_number(value)}")
+                    elif kind == "gauge":
+                        lines.append(f"{name}{_labels(key)} {_number(value)}")
+                    else:
+                        cumulative = 0
+                        for bound, count in zip(metric["buckets"] + (float("inf"),), value[:-1]):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{_labels(key, [('le', _number(bound))])} {cumulative}")
+                        lines.append(f"{name}_count{_labels(key)} {cumulative}")
+                        lines.append(f"{name}_sum{_labels(key)} {_number(value[-1])}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def push(url, job, grouping, body, timeout=10):
+    """Pushgateway 互換のエンドポイントにグループの値を送る（コンテナ側 metrics.push と同じ）"""
+    path = "/metrics/job/" + urllib.parse.quote(job, safe="")
+    for name, value in grouping.items():
+        path += f"/{name}/{urllib.parse.quote(str(value), safe='')}"
+    request = urllib.request.Request(
+        url.rstrip("/") + path,
+        data=body.encode("utf-8"),
+        method="PUT",
+        headers={"Content-Type": TEXT_CONTENT_TYPE},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+class ApiMetrics:
+    """
+    botocore のイベントで AWS Batch の API 呼び出しを計測する
+
+    before-call / after-call は再試行を含めた1回の呼び出しを囲むため、レイテンシには
+    スロットリング後の待ち時間も含まれる。スロットリングは再試行の判定（needs-retry）で数える。
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def register(self, events):
+        events.register("before-call.batch", self.before_call)
+        events.register("after-call.batch", self.after_call)
+        events.register("after-call-error.batch", self.after_call_error)
+        events.register("needs-retry.batch", self.needs_retry)
+
+    def before_call(self, model, context, **kwargs):
+        context["metrics_operation"] = model.name
+        context["metrics_started"] = time.perf_counter()
+
+    def _finish(self, context, outcome):
+        started = context.get("metrics_started")
+        if started is None:
+            return
+        operation = context["metrics_operation"]
+        self.registry.observe(
+            "batch_api_latency_seconds",
+            "AWS Batch API の呼び出しにかかった時間（再試行を含む、秒）",
+            LATENCY_BUCKETS,
+            time.perf_counter() - started,
+            operation=operation,
+        )
+        self.registry.inc(
+            "batch_api_calls", "AWS Batch API の呼び出し数", operation=operation, outcome=outcome
+        )
+        if operation == "SubmitJob":
+            self.registry.inc("batch_submissions", "submit_job の呼び出し数", outcome=outcome)
+
+    def after_call(self, http_response, context, **kwargs):
+        self._finish(context, "ok" if http_response.status_code < 300 else "error")
+
+    def after_call_error(self, context, **kwargs):
+        self._finish(context, "error")
+
+    def needs_retry(self, response=None, operation=None, **kwargs):
+        # 再試行の判定は botocore の既定のハンドラに任せるため、必ず None を返す
+        if response is None or operation is None:
+            return None
+        http_response, parsed = response
+        code = (parsed or {}).get("Error", {}).get("Code")
+        if code in THROTTLE_CODES or http_response.status_code == 429:
+            self.registry.inc(
+                "batch_api_throttles", "スロットリングされた AWS Batch API の呼び出し数", operation=operation.name
+            )
+        return None
+
+
+def install(registry=None, session=None):
+    """
+    boto3 のセッション（省略時はデフォルトセッション）に API の計測を登録する
+
+    登録後に作ったクライアントだけが計測されるため、boto3.client を呼ぶ前に呼ぶこと。
+    """
+    import boto3
+
+    registry = registry or Registry()
+    if session is None:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        session = boto3.DEFAULT_SESSION
+    ApiMetrics(registry).register(session.events)
+    return registry
+
+
+def install_from_env(name=None):
+    """
+    config.METRICS_CONFIG に送信先か出力ファイルがあれば計測を登録し、終了時に書き出す
+
+    Args:
+        name: Pushgateway のグループのインスタンス名（省略時はスクリプト名）
+    Returns:
+        Registry。無効な場合は None
+    """
+    settings = config.METRICS_CONFIG
+    if not settings["pushgateway"] and not settings["textfile"]:
+        return None
+    registry = install()
+    instance = name or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    atexit.register(flush, registry, instance)
+    return registry
+
+
+def flush(registry, instance):
+    """Pushgateway に送り、出力ファイルに書き出す（失敗してもスクリプトは失敗させない）"""
+    settings = config.METRICS_CONFIG
+    logger = logging.getLogger(__name__)
+    try:
+        if settings["textfile"]:
+            # node_exporter の textfile コレクタが途中の内容を読まないよう、置き換えで書く
+            temporary = f"{settings['textfile']}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                f.write(registry.render(openmetrics=False))
+            os.replace(temporary, settings["textfile"])
+        if settings["pushgateway"]:
+            push(
+                settings["pushgateway"],
+                settings["job"],
+                {"instance": instance},
+                registry.render(openmetrics=False),
+            )
+    except Exception as e:
+        logger.warning(f"メトリクスの書き出しに失敗しました: {e}")
+
+
+def queue_depth(index_path, registry=None, now=None):
+    """
+    ジョブの状態インデックスからジョブキューの深さのゲージを作る
+
+    - batch_queue_jobs{queue, status}: 実行前・実行中のステータスごとのジョブ数（配列の子ジョブを含む）
+    - batch_queue_oldest_runnable_seconds{queue}: RUNNABLE のまま待っている最も古いジョブの待ち時間
+    """
+    from job_state_index import JobStateIndex
+
+    registry = registry or Registry()
+    now = now if now is not None else time.time() * 1000
+    index = JobStateIndex(index_path)
+    try:
+        depth = {}
+        oldest = {}
+        for row in index.query(statuses=QUEUED_STATUSES, time_field="event_time"):
+            queue = row["queue"] or "unknown"
+            depth[(queue, row["status"])] = depth.get((queue, row["status"]), 0) + 1
+            if row["status"] == "RUNNABLE":
+                oldest[queue] = min(oldest.get(queue, now), row["event_time"])
+    finally:
+        index.close()
+    for (queue, status), count in sorted(depth.items()):
+        registry.set("batch_queue_jobs", "ジョブキューのステータスごとのジョブ数", count, queue=queue, status=status)
+    for queue, since in sorted(oldest.items()):
+        registry.set(
+            "batch_queue_oldest_runnable_seconds",
+            "RUNNABLE のまま待っている最も古いジョブの待ち時間（秒）",
+            round((now - since) / 1000, 3),
+            queue=queue,
+        )
+    return registry
+
+
+class StandinPushgateway:
+    """
+    Pushgateway の代わりにローカルで受け取る HTTP サーバー（テスト用）
+
+    PUT / POST / DELETE /metrics/job/<ジョブ名>/<ラベル>/<値>... でグループの値を置き換え・削除し、
+    GET /metrics で受け取った値にグループのラベルを付けて返す（Pushgateway と同じ）。
+    POST も同じグループの値を置き換える（Pushgateway はメトリクス名ごとに置き換える）。
+    """
+
+    def __init__(self, host="127.0.0.1", port=9091):
+        self.groups = {}
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logging.getLogger(__name__).info(f"{self.command} {self.path} {args[1] if len(args) > 1 else ''}")
+
+            def _grouping(self):
+                parts = [urllib.parse.unquote(part) for part in self.path.split("?")[0].strip("/").split("/")]
+                if len(parts) < 3 or parts[:2] != ["metrics", "job"] or len(parts) % 2 != 1:
+                    return None
+                labels = [("job", parts[2])] + list(zip(parts[3::2], parts[4::2]))
+                return tuple(labels)
+
+            def _reply(self, status, body=b"", content_type="text/plain; charset=utf-8"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_PUT(self):
+                grouping = self._grouping()
+                if grouping is None:
+                    self._reply(400, b"invalid grouping key\n")
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                with standin.lock:
+                    standin.groups[grouping] = {"body": body, "pushed": time.time()}
+                self._reply(200)
+
+            do_POST = do_PUT
+
+            def do_DELETE(self):
+                grouping = self._grouping()
+                with standin.lock:
+                    standin.groups.pop(grouping, None)
+                self._reply(202)
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self._reply(404, b"not found\n")
+                    return
+                self._reply(200, standin.render().encode("utf-8"), TEXT_CONTENT_TYPE)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def render(self):
+        """受け取った値にグループのラベルを付け、メトリクスごとにまとめて返す"""
+        families = {}
+        with self.lock:
+            groups = sorted(self.groups.items())
+        for grouping, group in groups:
+            extra = ",".join(f'{key}="{_escape(value)}"' for key, value in grouping)
+            family = None
+            for line in group["body"].splitlines():
+                if line.startswith(("# HELP ", "# TYPE ")):
+                    family = families.setdefault(line.split()[2], {"header": [], "samples": []})
+                    if line not in family["header"]:
+                        family["header"].append(line)
+                    continue
+                match = SAMPLE_LINE.match(line)
+                if line.startswith("#") or not match:
+                    continue
+                name, labels, value = match.groups()
+                if family is None:
+                    family = families.setdefault(name, {"header": [], "samples": []})
+                pairs = labels[1:-1] if labels else ""
+                family["samples"].append(f"{name}{{{extra}{',' if pairs else ''}{pairs}}} {value}")
+            push_time = families.setdefault(
+                "push_time_seconds",
+                {"header": ["# HELP push_time_seconds 最後に送られた時刻", "# TYPE push_time_seconds gauge"], "samples": []},
+            )
+            push_time["samples"].append(f"push_time_seconds{_labels(grouping)} {group['pushed']:.3f}")
+        lines = []
+        for family in families.values():
+            lines += family["header"] + family["samples"]
+        return "\n".join(lines) + "\n"
+
+    def serve_in_thread(self):
+        """別スレッドで起動する（スクリプトの中で使う場合）"""
+        thread = threading.Thread(target=self.server.serve_forever, name="pushgateway-standin", daemon=True)
+        thread.start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def serve_queue_depth(index_path, port, logger):
+    """GET /metrics でジョブキューの深さを返す HTTP サーバー（Prometheus からスクレイプする）"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+            body = queue_depth(index_path).render(openmetrics=openmetrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    logger.info(f"ジョブキューの深さを http://0.0.0.0:{port}/metrics で公開します")
+    server.serve_forever()
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    settings = config.METRICS_CONFIG
+    parser = argparse.ArgumentParser(description="送信側のメトリクスの出力ツール")
+    parser.add_argument("--queue-depth", action="store_true", help="状態インデックスからジョブキューの深さを出力する")
+    parser.add_argument(
+        "--state-index", default=config.JOB_STATE_CONFIG["index_file"], help="ジョブの状態インデックスのパス"
+    )
+    parser.add_argument("--serve", type=int, metavar="PORT", help="--queue-depth を HTTP で公開する")
+    parser.add_argument("--push", action="store_true", help="--queue-depth を Pushgateway に送る")
+    parser.add_argument("--pushgateway", default=settings["pushgateway"], help="Pushgateway の URL")
+    parser.add_argument("--standin", action="store_true", help="Pushgateway の代わりにローカルで受け取る")
+    parser.add_argument("--host", default="127.0.0.1", help="--standin で待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=9091, help="--standin で待ち受けるポート")
+    args = parser.parse_args()
+    if not (args.queue_depth or args.standin):
+        parser.error("--queue-depth または --standin が必要です")
+    if args.push and not args.pushgateway:
+        parser.error("--push には --pushgateway（または AWS_BATCH_PUSHGATEWAY）が必要です")
+    return args
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+
+    if args.standin:
+        standin = StandinPushgateway(args.host, args.port)
+        logger.info(f"Pushgateway の代わりに {standin.url} で受け取ります（GET {standin.url}/metrics で確認）")
+        try:
+            standin.server.serve_forever()
+        except KeyboardInterrupt:
+            standin.shutdown()
+        return
+
+    if args.serve:
+        serve_queue_depth(args.state_index, args.serve, logger)
+        return
+    try:
+        registry = queue_depth(args.state_index)
+        if args.push:
+            push(
+                args.pushgateway,
+                config.METRICS_CONFIG["job"],
+                {"instance": "queue-depth"},
+                registry.render(openmetrics=False),
+            )
+            logger.info(f"ジョブキューの深さを送信しました: {args.pushgateway}")
+        else:
+            print(registry.render(), end="")
+    except Exception as e:
+        logger.error(f"メトリクスの出力エラー: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
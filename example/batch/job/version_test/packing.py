@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+小タスクのパッキングモジュール
+
+実行時間の短い作業アイテムを、目標実行時間に収まるバンドルへ
+First-Fit Decreasing 法でまとめる。
+"""
+
+import json
+
+
+def encoded_size(item):
+    """アイテムを BUNDLE 環境変数にエンコードしたときのバイト数"""
+    return len(json.dumps(item, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def pack_items(items, estimate_seconds, target_seconds, max_bundle_bytes):
+    """
+    作業アイテムをバンドルにまとめる
+
+    Args:
+        items: 作業アイテム（CONFIG と同じ形式の辞書）のリスト
+        estimate_seconds: アイテムを受け取り想定実行時間（秒）を返す関数
+        target_seconds: 1バンドルあたりの目標実行時間（秒）
+        max_bundle_bytes: 1バンドルをエンコードしたときの最大バイト数
+
+    Returns:
+        list: {"items": [...], "seconds": 想定実行時間, "bytes": エンコード後サイズ} のリスト
+
+    Raises:
+        ValueError: 単独でも max_bundle_bytes を超えるアイテムがある場合
+    """
+    # JSON配列の括弧 "[]" の分
+    overhead = 2
+    sized = []
+    for item in items:
+        size = encoded_size(item) + 1  # 区切りのカンマ
+        if size + overhead > max_bundle_bytes:
+            raise ValueError(
+                f"アイテムが大きすぎてバンドルに収まりません ({size} バイト): {item}"
+            )
+        sized.append((estimate_seconds(item), size, item))
+
+    # 実行時間の長い順に、最初に収まるバンドルへ詰める
+    sized.sort(key=lambda entry: entry[0], reverse=True)
+    bundles = []
+    for seconds, size, item in sized:
+        for bundle in bundles:
+            if (
+                bundle["seconds"] + seconds <= target_seconds
+                and bundle["bytes"] + size <= max_bundle_bytes
+            ):
+                bundle["items"].append(item)
+                bundle["seconds"] += seconds
+                bundle["bytes"] += size
+                break
+        else:
+            bundles.append({"items": [item], "seconds": seconds, "bytes": size + overhead})
+    return bundles
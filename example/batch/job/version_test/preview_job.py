@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+プレビュー実行のジョブ送信スクリプト
+
+新しい parameters.json を本番の配列ジョブで試す前に、入力の決まった一部（標本）だけを
+最小限のリソースで処理するジョブを送信し、完了を待って結果を表示する。
+コンテナは PREVIEW が設定されていると標本だけを処理し（テスト用コンテナの README の「プレビュー実行」を参照）、
+PREVIEW_RESULT 行に標本の処理速度・RSS と、入力全体を処理した場合の実行時間とメモリの見積もりを出力する。
+
+設定の誤りはジョブの失敗として数秒〜数分で分かり、見積もりから本番の配列サイズと子ジョブの
+リソースを autotune.plan で提案する。--local ではジョブを送信せずにコンテナのコードをローカルで実行する。
+"""
+
+import argparse
+import boto3
+import datetime
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+import time
+import uuid
+import config
+import metrics
+from autotune import plan, queue_max_vcpus
+from collect_array_logs import fetch_stream
+from fargate_submit_job_with_params import load_params_file
+from history import JobHistory
+from resources import container_resource_overrides, fargate_size_for
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+# コンテナ側 run_batch.py が出力するプレビュー結果行のマーカー
+PREVIEW_MARKER = "PREVIEW_RESULT"
+
+# 終了したジョブのステータス
+FINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    preview = config.PREVIEW_CONFIG
+    parser = argparse.ArgumentParser(description="標本だけを処理するプレビュー実行のジョブ送信ツール")
+    parser.add_argument(
+        "--platform",
+        choices=sorted(PLATFORM_CONFIG),
+        default="fargate",
+        help="送信先のプラットフォーム",
+    )
+    parser.add_argument("--job-queue", help="使用するジョブキュー名")
+    parser.add_argument("--job-definition", help="使用するジョブ定義名")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--params-file", default="parameters.json", help="設定（CONFIG）を含むJSONファイルのパス"
+    )
+    parser.add_argument(
+        "--sample",
+        default=preview["sample"],
+        help="標本の取り方（head:N / reservoir:N / every:K）",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="reservoir の乱数シード")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="本番の配列サイズ（1シャードあたりの実行時間とメモリの見積もりに使う）",
+    )
+    parser.add_argument("--vcpu", type=float, help="プレビューのジョブの vCPU（省略時は最小限）")
+    parser.add_argument("--memory", type=int, help="プレビューのジョブのメモリ（MB、省略時は最小限）")
+    parser.add_argument(
+        "--timeout-seconds",
+        type=int,
+        default=preview["timeout_seconds"],
+        help="プレビューのジョブを打ち切るまでの時間（秒）",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="ジョブを送信せず、コンテナのコード（run_batch.py）をローカルで実行する",
+    )
+    parser.add_argument(
+        "--no-wait", action="store_true", help="送信だけを行い、完了を待たない"
+    )
+    parser.add_argument(
+        "--max-vcpus",
+        type=float,
+        help="提案に使う同時に使える vCPU 数。省略時はジョブキューのコンピュート環境の maxvCpus の合計",
+    )
+    parser.add_argument(
+        "--record-history",
+        action="store_true",
+        help="標本の処理速度を履歴ファイルに記録する（--array-size auto の見積もりに使われる）",
+    )
+    parser.add_argument(
+        "--history-file", default=config.HISTORY_FILE, help="ジョブ実行履歴ファイルのパス"
+    )
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards は1以上である必要があります")
+    platform_config = PLATFORM_CONFIG[args.platform]
+    args.job_queue = args.job_queue or platform_config["job_queue"]
+    args.job_definition = args.job_definition or platform_config["job_definition"]
+    return args
+
+
+def preview_environment(base_config, args):
+    """プレビューのジョブに渡す環境変数"""
+    return [
+        {"name": "CONFIG", "value": json.dumps(base_config, ensure_ascii=False, separators=(",", ":"))},
+        {"name": "PREVIEW", "value": args.sample},
+        {"name": "PREVIEW_SEED", "value": str(args.seed)},
+        # 見積もりのシャード数（プレビュー自体は配列ジョブではないため、シャード番号は 0）
+        {"name": "SHARD_INDEX", "value": "0"},
+        {"name": "SHARD_COUNT", "value": str(args.shards)},
+    ]
+
+
+def preview_params(job_name, args, environment):
+    """プレビューのジョブの送信パラメータを作る"""
+    resources = config.PREVIEW_CONFIG["resources"][args.platform]
+    vcpu = args.vcpu or resources["vcpu"]
+    memory = args.memory or resources["memory"]
+    if args.platform == "fargate":
+        size = fargate_size_for(vcpu, memory)
+        if size is None:
+            raise ValueError(f"Fargate で有効なリソースの組み合わせがありません: {vcpu} vCPU / {memory}MB")
+        vcpu, memory = size
+    params = {
+        "jobName": job_name,
+        "jobQueue": args.job_queue,
+        "jobDefinition": args.job_definition,
+        "containerOverrides": {
+            "environment": environment,
+            **container_resource_overrides(args.platform, vcpu, memory),
+        },
+        # 標本の処理が終わらない場合（標本の取り方や設定の誤り）に打ち切る
+        "timeout": {"attemptDurationSeconds": args.timeout_seconds},
+        # 設定の誤りは再試行しても直らない
+        "retryStrategy": {"attempts": 1},
+    }
+
+    fair_share = config.FAIR_SHARE_CONFIG[args.platform]
+    if fair_share["use_fair_share"]:
+        if fair_share["share_identifier"]:
+            params["shareIdentifier"] = fair_share["share_identifier"]
+        if fair_share["scheduling_priority"] is not None:
+            params["schedulingPriorityOverride"] = fair_share["scheduling_priority"]
+    return params
+
+
+def wait_for_job(batch, job_id, timeout_seconds, logger):
+    """ジョブの終了を待ち、describe_jobs の結果を返す。時間内に終わらなければ None"""
+    deadline = time.monotonic() + timeout_seconds
+    status = None
+    while time.monotonic() < deadline:
+        job = batch.describe_jobs(jobs=[job_id])["jobs"][0]
+        if job["status"] != status:
+            status = job["status"]
+            logger.info(f"プレビューのジョブ: {status}")
+        if status in FINAL_STATUSES:
+            return job
+        time.sleep(config.PREVIEW_CONFIG["poll_seconds"])
+    return None
+
+
+def job_log_lines(job, args):
+    """ジョブの CloudWatch Logs のメッセージを返す"""
+    stream = job.get("container", {}).get("logStreamName")
+    if not stream:
+        return []
+    logs = boto3.client("logs", region_name=args.region)
+    log_group = PLATFORM_CONFIG[args.platform]["log_group"]
+    return [message for _, _, message in fetch_stream(logs, log_group, "preview", stream, lambda message: True)]
+
+
+def run_local(environment, logger):
+    """コンテナのコードをローカルで実行し、標準出力の行を返す"""
+    container_dir = os.path.abspath(config.PREVIEW_CONFIG["container_dir"])
+    env = dict(os.environ)
+    env.update({item["name"]: item["value"] for item in environment})
+    logger.info(f"ローカルで実行します: {container_dir}/run_batch.py")
+    completed = subprocess.run(
+        [sys.executable, "run_batch.py"],
+        cwd=container_dir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    for line in completed.stderr.splitlines():
+        logger.error(f"コンテナ: {line}")
+    return completed.stdout.splitlines()
+
+
+def read_result(lines):
+    """ログの行から最後の PREVIEW_RESULT を返す。なければ None"""
+    result = None
+    for line in lines:
+        marker_pos = line.find(PREVIEW_MARKER)
+        if marker_pos < 0:
+            continue
+        try:
+            result = json.loads(line[marker_pos + len(PREVIEW_MARKER):])
+        except json.JSONDecodeError:
+            continue
+    return result
+
+
+def suggest(result, args, batch, logger):
+    """見積もりから本番の配列サイズと子ジョブのリソースを提案する"""
+    max_vcpus = args.max_vcpus
+    if max_vcpus is None:
+        if batch is None:
+            logger.info("提案には --max-vcpus が必要です（--local ではジョブキューを参照しません）")
+            return
+        max_vcpus = queue_max_vcpus(batch, PLATFORM_CONFIG[args.platform]["array_job_queue"])
+    memory = int(math.ceil(result["projected_shard_memory_mb"] * config.PREVIEW_CONFIG["memory_headroom"]))
+    proposal = plan(
+        args.platform,
+        result["input_bytes"],
+        max_vcpus,
+        config.AUTOTUNE_CONFIG["startup_seconds"][args.platform],
+        result["seconds_per_byte"],
+        max(memory, 1),
+    )
+    logger.info(
+        f"提案: 配列サイズ {proposal['array_size']}, 子ジョブ {proposal['vcpu']} vCPU / {proposal['memory']}MB, "
+        f"子ジョブ {proposal['child_seconds']} 秒, 完了まで {proposal['makespan_seconds']} 秒, "
+        f"コスト ${proposal['cost_usd']}"
+    )
+    logger.info(
+        f"  python {args.platform}_submit_array_job.py --array-size auto --input-bytes {result['input_bytes']} "
+        f"--seconds-per-byte {result['seconds_per_byte']:.3e} --child-memory {memory}"
+    )
+
+
+def report(result, args, logger):
+    """プレビューの結果を表示する"""
+    logger.info(
+        f"標本（{result['mode']}）: {result['rows']} 行 / {result['bytes']} バイトを {result['seconds']} 秒で処理, "
+        f"{result['rows_per_second']} 行/秒, 最大 RSS {result['peak_rss_mb']} MB"
+    )
+    if result.get("lookup"):
+        logger.info(f"ルックアップ結合: 一致 {result['lookup']['matched']} 行 / 不一致 {result['lookup']['missed']} 行")
+    logger.info(f"プレビューの出力: {result['output']}")
+    if result["projected_seconds"] is None:
+        logger.info("入力全体の大きさが分からないため見積もりはありません（every / reservoir を使ってください）")
+        return
+    logger.info(
+        f"見積もり: 入力全体 {result['input_bytes']} バイト（約 {result['projected_rows']} 行、標本はその "
+        f"{result['fraction'] * 100:.2f}%）の処理に {result['projected_seconds']} 秒"
+    )
+    logger.info(
+        f"  {result['shard_count']} シャードでは1シャードあたり {result['projected_shard_seconds']} 秒・"
+        f"{result['projected_shard_memory_mb']} MB"
+    )
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+
+    try:
+        base_config = load_params_file(args.params_file)
+    except Exception as e:
+        logger.error(f"パラメータファイル読み込みエラー: {e}")
+        sys.exit(1)
+    environment = preview_environment(base_config, args)
+
+    batch = None
+    if args.local:
+        lines = run_local(environment, logger)
+    else:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        job_id_suffix = str(uuid.uuid4())[:8]
+        job_name = f"{args.platform}-preview-job-{timestamp}-{job_id_suffix}"
+        try:
+            batch = boto3.client("batch", region_name=args.region)
+            response = batch.submit_job(**preview_params(job_name, args, environment))
+        except Exception as e:
+            logger.error(f"プレビューのジョブ送信エラー: {e}")
+            sys.exit(1)
+        job_id = response["jobId"]
+        logger.info(f"プレビューのジョブ送信成功: ID = {job_id}（{args.sample}, {args.job_queue}）")
+        print(f"Job ID: {job_id}")
+        if args.no_wait:
+            return
+        # キューでの待ち時間の分だけ、ジョブのタイムアウトより長く待つ
+        job = wait_for_job(batch, job_id, args.timeout_seconds * 2, logger)
+        if job is None:
+            logger.error("プレビューのジョブが時間内に終了しませんでした")
+            sys.exit(1)
+        if job["status"] == "FAILED":
+            logger.error(f"プレビューのジョブが失敗しました: {job.get('statusReason', '')}")
+        lines = job_log_lines(job, args)
+
+    result = read_result(lines)
+    if result is None:
+        logger.error("PREVIEW_RESULT 行が見つかりません（CONFIG の検証で失敗した可能性があります）")
+        sys.exit(1)
+    if result["status"] != "SUCCEEDED":
+        logger.error(f"プレビューが失敗しました: {result.get('error')}")
+        sys.exit(1)
+
+    report(result, args, logger)
+    if result["projected_seconds"] is None:
+        return
+    if args.record_history:
+        history = JobHistory(args.history_file)
+        history.record_throughput(
+            args.job_definition, result["bytes"], result["seconds_per_byte"] * result["bytes"]
+        )
+        history.save()
+        logger.info(f"処理速度を履歴に記録しました: {args.history_file}")
+    try:
+        suggest(result, args, batch, logger)
+    except Exception as e:
+        logger.error(f"提案エラー: {e}")
+
+
+if __name__ == "__main__":
+    main()
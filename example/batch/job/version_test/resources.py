@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+リソース設定の共通処理
+
+Fargate の vCPU とメモリの組み合わせ規則や、containerOverrides の
+リソース指定の組み立てを扱う。
+"""
+
+import math
+import config
+
+# Fargate の vCPU ごとの有効なメモリ範囲（MB）: (最小, 最大, 刻み)
+FARGATE_MEMORY_RANGES = {
+    0.25: (512, 2048, None),
+    0.5: (1024, 4096, 1024),
+    1: (2048, 8192, 1024),
+    2: (4096, 16384, 1024),
+    4: (8192, 30720, 1024),
+    8: (16384, 61440, 4096),
+    16: (32768, 122880, 8192),
+}
+
+
+def fargate_memory_options(vcpu):
+    """Fargate で vCPU と組み合わせられるメモリ値（MB）の一覧"""
+    minimum, maximum, step = FARGATE_MEMORY_RANGES[vcpu]
+    if step is None:
+        return [512, 1024, 2048]
+    return list(range(minimum, maximum + 1, step))
+
+
+def fargate_size_for(vcpu, memory):
+    """
+    要求 vCPU・メモリを満たす最小の有効な Fargate の組み合わせを返す
+
+    メモリが vCPU の範囲を超える場合は vCPU を引き上げる。
+
+    Returns:
+        (vCPU, メモリ MB)。どの組み合わせでも満たせない場合は None
+    """
+    for candidate in config.VALID_FARGATE_VCPU:
+        if candidate < vcpu:
+            continue
+        for option in fargate_memory_options(candidate):
+            if option >= memory:
+                return candidate, option
+    return None
+
+
+def next_memory_size(platform, vcpu, memory, growth=1.0, floor=0):
+    """
+    メモリ不足で失敗したジョブを再実行するときの、1段階大きいリソースを返す
+
+    Fargate は VALID_FARGATE_MEMORY のうち memory × growth 以上の最小の値を選び、
+    その値と組み合わせられる vCPU まで引き上げる。EC2 は memory × growth を
+    config.RETRY_CONFIG["ec2_memory_step"] 単位に切り上げる。
+
+    Returns:
+        (vCPU, メモリ MB)。Fargate でより大きい組み合わせがない場合は None
+    """
+    target = max(memory * growth, memory + 1, floor)
+    if platform == "fargate":
+        tiers = [option for option in config.VALID_FARGATE_MEMORY if option >= target]
+        return fargate_size_for(vcpu, tiers[0] if tiers else target)
+    step = config.RETRY_CONFIG["ec2_memory_step"]
+    return vcpu, int(math.ceil(target / step) * step)
+
+
+def container_resource_overrides(platform, vcpu, memory):
+    """プラットフォームに合わせた containerOverrides のリソース指定を返す"""
+    if platform == "fargate":
+        return {
+            "resourceRequirements": [
+                {"type": "VCPU", "value": str(vcpu)},
+                {"type": "MEMORY", "value": str(memory)},
+            ]
+        }
+    return {"vcpus": int(vcpu), "memory": int(memory)}
+
+
+def resources_from_overrides(overrides, platform):
+    """
+    containerOverrides（EC2 の vcpus / memory、または resourceRequirements）から (vCPU, メモリ MB) を返す
+
+    指定がなければ config.DEFAULT_RESOURCES のプラットフォームの値を使う。
+    """
+    default = config.DEFAULT_RESOURCES[platform]
+    vcpu = overrides.get("vcpus") or default["vcpu"]
+    memory = overrides.get("memory") or default["memory"]
+    for requirement in overrides.get("resourceRequirements", []):
+        if requirement["type"] == "VCPU":
+            vcpu = float(requirement["value"])
+        elif requirement["type"] == "MEMORY":
+            memory = int(requirement["value"])
+    return float(vcpu), int(memory)
+
+
+def translate_resources(platform, vcpu, memory):
+    """
+    要求 vCPU・メモリを、platform で指定できるリソースに変換する
+
+    Fargate は要求を満たす最小の有効な組み合わせに切り上げ、EC2 は vCPU を整数に切り上げる。
+
+    Returns:
+        (vCPU, メモリ MB)。Fargate でどの組み合わせでも満たせない場合は None
+    """
+    if platform == "fargate":
+        return fargate_size_for(vcpu, memory)
+    return max(1, int(math.ceil(vcpu))), int(memory)
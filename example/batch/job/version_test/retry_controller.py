@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+失敗したジョブの分類とメモリ不足時の再実行スクリプト
+
+ジョブ定義の retry_strategy は同じリソースのまま再試行するため、メモリ不足（OOM）で
+失敗したジョブは同じ原因で失敗を繰り返す。Terraform ではメモリ不足をリトライせずに終了させ
+（EC2 は OutOfMemoryError を EXIT、Fargate は既定の「その他の理由は EXIT」で終了する）、
+このスクリプトが失敗理由を分類して、メモリ不足のジョブだけを1段階大きいメモリで再送信する。
+
+- 分類: oom（メモリ不足）/ spot（Spot 回収・中断）/ timeout / infrastructure（イメージ取得失敗など）/
+  application（その他の終了コード）/ unknown
+- oom: Fargate は VALID_FARGATE_MEMORY の次の値（vCPU との組み合わせが必要なら vCPU も引き上げ）、
+  EC2 は memory を config.RETRY_CONFIG["memory_growth"] 倍にして再送信する
+- 配列ジョブは、失敗した子ジョブのシャードだけを SHARD_INDEX を指定した別ジョブとして再送信する
+- 引き上げたメモリは履歴ファイルに記録し、autotune.py などの次回の送信で最初から使う
+"""
+
+import argparse
+import boto3
+import logging
+import sys
+import time
+import config
+import metrics
+from bulk_control import parse_time
+from history import JobHistory
+from job_records import job_platform, job_resources, resource_name
+from job_state_index import JobStateIndex
+from resources import next_memory_size
+from straggler_monitor import speculative_params
+
+FAILURE_CLASSES = ["oom", "spot", "timeout", "infrastructure", "application", "unknown"]
+
+# コンテナを起動できなかったことを表す理由の接頭辞
+INFRASTRUCTURE_REASONS = (
+    "CannotPullContainerError",
+    "CannotStartContainerError",
+    "CannotInspectContainerError",
+    "CannotCreateContainerError",
+    "ResourceInitializationError",
+    "TaskFailedToStart",
+    "DockerTimeoutError",
+)
+
+# コンテナ側 shutdown.py の EXIT_CODE_INTERRUPTED
+EXIT_CODE_INTERRUPTED = 75
+
+# describe_jobs に一度に渡せるジョブIDの上限
+DESCRIBE_BATCH_SIZE = 100
+
+# 再送信したジョブに付けるタグ
+ESCALATION_TAG = "MemoryEscalation"
+ESCALATED_FROM_TAG = "EscalatedFrom"
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    settings = config.RETRY_CONFIG
+    parser = argparse.ArgumentParser(description="失敗したジョブの分類とメモリ不足時の再実行ツール")
+    parser.add_argument("--job-id", nargs="+", help="対象のジョブID（省略時はジョブキューの失敗したジョブ）")
+    parser.add_argument(
+        "--job-queue",
+        nargs="+",
+        default=[config.EC2_CONFIG["job_queue"], config.FARGATE_CONFIG["job_queue"]],
+        help="失敗したジョブを探すジョブキュー名",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_time,
+        default="1h",
+        help="この時刻以降に終了したジョブを対象にする（ISO 8601 または 30m, 2h など）",
+    )
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--history-file", default=config.HISTORY_FILE, help="ジョブ実行履歴ファイルのパス"
+    )
+    parser.add_argument(
+        "--max-escalations",
+        type=int,
+        default=settings["max_escalations"],
+        help="同じジョブのメモリを引き上げて再実行する最大回数",
+    )
+    parser.add_argument(
+        "--state-index",
+        help="list_jobs / describe_jobs の代わりに job_state_index.py のインデックス（SQLite）から失敗したジョブを選ぶ",
+    )
+    parser.add_argument(
+        "--watch", action="store_true", help="一定間隔で失敗したジョブを確認し続ける"
+    )
+    parser.add_argument(
+        "--interval", type=int, default=settings["interval_seconds"], help="--watch の確認間隔（秒）"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="分類と再送信の内容を表示するだけで送信しない"
+    )
+    return parser.parse_args()
+
+
+def classify(job):
+    """
+    失敗したジョブ（または配列の子ジョブ）の失敗理由を分類する
+
+    最後の試行のコンテナの reason・終了コードと、statusReason から判定する。
+    """
+    attempts = job.get("attempts") or []
+    last = attempts[-1] if attempts else {}
+    container = last.get("container") or job.get("container") or {}
+    reason = container.get("reason") or ""
+    exit_code = container.get("exitCode")
+    status_reason = last.get("statusReason") or job.get("statusReason") or ""
+
+    if "OutOfMemory" in reason or "OutOfMemory" in status_reason:
+        return "oom"
+    if "timeout" in status_reason.lower():
+        return "timeout"
+    if (
+        exit_code == EXIT_CODE_INTERRUPTED
+        or "Spot" in status_reason
+        or ("Host EC2" in status_reason and "terminated" in status_reason)
+    ):
+        return "spot"
+    if reason.startswith(INFRASTRUCTURE_REASONS) or status_reason.startswith(INFRASTRUCTURE_REASONS):
+        return "infrastructure"
+    if exit_code not in (None, 0):
+        return "application"
+    return "unknown"
+
+
+def escalation_count(job):
+    """ジョブがメモリを引き上げて再送信された回数（タグから読む）"""
+    return int((job.get("tags") or {}).get(ESCALATION_TAG, "0"))
+
+
+def resource_override(job, vcpu, memory):
+    """
+    containerOverrides のリソース指定を作る
+
+    resourceRequirements を使うジョブは VCPU と MEMORY だけを置き換え、GPU などの指定は残す。
+    """
+    container = job.get("container", {})
+    requirements = container.get("resourceRequirements")
+    if not requirements and job_platform(job) == "ec2":
+        return {"vcpus": int(vcpu), "memory": int(memory)}
+    value = str(int(vcpu)) if job_platform(job) == "ec2" else str(vcpu)
+    kept = [r for r in requirements or [] if r["type"] not in ("VCPU", "MEMORY")]
+    return {
+        "resourceRequirements": kept
+        + [{"type": "VCPU", "value": value}, {"type": "MEMORY", "value": str(int(memory))}]
+    }
+
+
+def resubmit_params(job, overrides, count):
+    """単独のジョブを、設定を引き継いで再送信するパラメータを作る"""
+    container = job.get("container", {})
+    container_overrides = {
+        "environment": [
+            variable
+            for variable in container.get("environment", [])
+            if not variable["name"].startswith("AWS_BATCH_")
+        ],
+        **overrides,
+    }
+    # 失敗したジョブと同じ実行としてシャードのマニフェストを書く
+    if not any(variable["name"] == "RUN_ID" for variable in container_overrides["environment"]):
+        container_overrides["environment"].append({"name": "RUN_ID", "value": job["jobId"]})
+    if container.get("command"):
+        container_overrides["command"] = container["command"]
+    params = {
+        "jobName": f"{job['jobName']}-oom{count}"[:128],
+        "jobQueue": job["jobQueue"],
+        "jobDefinition": job["jobDefinition"],
+        "containerOverrides": container_overrides,
+    }
+    if job.get("parameters"):
+        params["parameters"] = job["parameters"]
+    if job.get("timeout"):
+        params["timeout"] = job["timeout"]
+    if job.get("shareIdentifier"):
+        params["shareIdentifier"] = job["shareIdentifier"]
+    if job.get("schedulingPriority") is not None:
+        params["schedulingPriorityOverride"] = job["schedulingPriority"]
+    return params
+
+
+def describe_jobs(batch, job_ids):
+    """ジョブIDの一覧を describe_jobs でまとめて取得する"""
+    jobs = []
+    for i in range(0, len(job_ids), DESCRIBE_BATCH_SIZE):
+        jobs += batch.describe_jobs(jobs=job_ids[i:i + DESCRIBE_BATCH_SIZE])["jobs"]
+    return jobs
+
+
+def failed_jobs(batch, job_queues, since, index=None):
+    """
+    ジョブキューから since 以降に終了した失敗ジョブを取得する
+
+    index（job_state_index.JobStateIndex）を指定した場合は、インデックスに保持している
+    イベントの詳細（describe_jobs と同じ形）を返す。配列の子ジョブは親ジョブから辿るため含めない。
+    """
+    if index is not None:
+        jobs = index.jobs(statuses=["FAILED"], queues=job_queues, since=since, time_field="stopped_at")
+        return [job for job in jobs if ":" not in job["jobId"]]
+    paginator = batch.get_paginator("list_jobs")
+    job_ids = []
+    for job_queue in job_queues:
+        for page in paginator.paginate(jobQueue=job_queue, jobStatus="FAILED"):
+            job_ids += [
+                job["jobId"] for job in page["jobSummaryList"] if job.get("stoppedAt", 0) >= since
+            ]
+    return describe_jobs(batch, job_ids)
+
+
+def failed_children(batch, parent, index=None):
+    """配列ジョブの失敗した子ジョブを取得する（index を指定した場合はインデックスから）"""
+    if index is not None:
+        return index.jobs(statuses=["FAILED"], array_parent=parent["jobId"])
+    paginator = batch.get_paginator("list_jobs")
+    job_ids = []
+    for page in paginator.paginate(arrayJobId=parent["jobId"], jobStatus="FAILED"):
+        job_ids += [job["jobId"] for job in page["jobSummaryList"]]
+    return describe_jobs(batch, job_ids)
+
+
+class RetryController:
+    """失敗したジョブを分類し、メモリ不足のジョブを大きいメモリで再送信する"""
+
+    def __init__(self, batch, history, max_escalations, dry_run, logger, index=None):
+        self.batch = batch
+        self.index = index
+        self.history = history
+        self.max_escalations = max_escalations
+        self.dry_run = dry_run
+        self.logger = logger
+        self.counts = {name: 0 for name in FAILURE_CLASSES}
+
+    def next_resources(self, job):
+        """メモリ不足のジョブの次のリソース（vCPU, メモリ MB）を返す。引き上げられなければ None"""
+        platform = job_platform(job)
+        vcpu, memory = job_resources(job, platform)
+        key = resource_name(job["jobDefinition"])
+        growth = config.RETRY_CONFIG["memory_growth"][platform]
+        return next_memory_size(
+            platform, vcpu, memory, growth, floor=self.history.memory_floor(key, 0)
+        )
+
+    def handle(self, job):
+        """
+        失敗したジョブを1件処理する
+
+        Returns:
+            再送信したジョブの数
+        """
+        if self.history.escalation(job["jobId"]):
+            return 0
+        array_properties = job.get("arrayProperties") or {}
+        if "size" in array_properties and "index" not in array_properties:
+            return self.handle_array(job)
+
+        failure = classify(job)
+        self.counts[failure] += 1
+        if failure != "oom":
+            self.logger.info(f"{job['jobName']} ({job['jobId']}): {failure}（再送信しません）")
+            return 0
+        return self.escalate(job, job, lambda overrides, count: resubmit_params(job, overrides, count))
+
+    def handle_array(self, parent):
+        """配列ジョブの失敗した子ジョブのうち、メモリ不足のシャードを再送信する"""
+        submitted = 0
+        children = failed_children(self.batch, parent, self.index)
+        for child in children:
+            if self.history.escalation(child["jobId"]):
+                continue
+            failure = classify(child)
+            self.counts[failure] += 1
+            if failure != "oom":
+                continue
+            index = child["arrayProperties"]["index"]
+
+            def build(overrides, count, index=index, child=child):
+                params = speculative_params(
+                    parent, index, child["jobId"], origin_variable="ESCALATED_FROM", suffix=f"oom{count}"
+                )
+                params["containerOverrides"].update(overrides)
+                return params
+
+            try:
+                submitted += self.escalate(child, parent, build)
+            except ValueError as e:
+                self.logger.warning(f"{child['jobId']}: シャードを再送信できません: {e}")
+        self.logger.info(
+            f"{parent['jobName']} ({parent['jobId']}): 失敗した子ジョブ {len(children)} 件, "
+            f"再送信 {submitted} 件"
+        )
+        if not self.dry_run:
+            self.history.record_escalation(parent["jobId"], {"class": "array", "children": len(children)})
+            self.history.save()
+        return submitted
+
+    def escalate(self, job, source, build):
+        """
+        メモリを引き上げて再送信する
+
+        Args:
+            job: メモリ不足で失敗したジョブ（配列の場合は子ジョブ）
+            source: 引き上げ回数のタグを読むジョブ（配列の場合は親ジョブ）
+            build: (リソース指定, 引き上げ回数) から送信パラメータを作る関数
+        """
+        count = escalation_count(source) + 1
+        platform = job_platform(job)
+        vcpu, memory = job_resources(job, platform)
+        if count > self.max_escalations:
+            self.logger.warning(
+                f"{job['jobId']}: メモリの引き上げが上限（{self.max_escalations} 回）に達したため再送信しません"
+            )
+            return 0
+        resources = self.next_resources(job)
+        if resources is None:
+            self.logger.warning(f"{job['jobId']}: {memory}MB より大きい {platform} のメモリがありません")
+            return 0
+        next_vcpu, next_memory = resources
+
+        params = build(resource_override(job, next_vcpu, next_memory), count)
+        params["tags"] = {ESCALATION_TAG: str(count), ESCALATED_FROM_TAG: job["jobId"]}
+        self.logger.info(
+            f"{job['jobName']} ({job['jobId']}): oom, {vcpu:g} vCPU / {memory}MB → "
+            f"{next_vcpu:g} vCPU / {next_memory}MB で再送信します（{count} 回目）"
+        )
+        if self.dry_run:
+            return 1
+        response = self.batch.submit_job(**params)
+        self.logger.info(f"再送信しました: {response['jobName']} ({response['jobId']})")
+        key = resource_name(job["jobDefinition"])
+        self.history.record_oom(key, memory, next_memory)
+        self.history.record_escalation(
+            job["jobId"],
+            {
+                "class": "oom",
+                "jobId": response["jobId"],
+                "memory": [memory, next_memory],
+                "vcpu": [vcpu, next_vcpu],
+                "count": count,
+            },
+        )
+        self.history.save()
+        return 1
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        sys.exit(1)
+
+    index = JobStateIndex(args.state_index) if args.state_index else None
+    controller = RetryController(
+        batch, JobHistory(args.history_file), args.max_escalations, args.dry_run, logger, index
+    )
+    since = args.since
+    while True:
+        checked_at = int(time.time() * 1000)
+        try:
+            if args.job_id:
+                jobs = describe_jobs(batch, args.job_id)
+            else:
+                jobs = failed_jobs(batch, args.job_queue, since, index)
+            submitted = sum(controller.handle(job) for job in jobs if job["status"] == "FAILED")
+        except Exception as e:
+            logger.error(f"失敗したジョブの処理エラー: {e}")
+            sys.exit(1)
+        summary = ", ".join(f"{name} {count}" for name, count in controller.counts.items() if count)
+        logger.info(f"失敗の分類: {summary or 'なし'} / 再送信 {submitted} 件")
+        if not args.watch or args.job_id:
+            break
+        # 前回の確認より少し前から見直し、終了時刻の記録の遅れで取りこぼさないようにする
+        since = checked_at - args.interval * 1000
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
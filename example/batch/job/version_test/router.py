@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+EC2 / Fargate のジョブキューの振り分け
+
+EC2 と Fargate のどちらに送るかは、これまで送信スクリプト（ec2_* / fargate_*）で決めていた。
+EC2 のコンピュート環境が maxvCpus に達してジョブが待っている間も Fargate は空いている（逆も同じ）。
+ここでは、ジョブキューごとの実行中・待機中のジョブの vCPU、RUNNABLE のまま待っている最も古いジョブの待ち時間、
+コンピュート環境の maxvCpus（EC2 は確保済みの desiredvCpus も）と、ジョブの大きさから、
+プラットフォームごとにジョブが開始するまでの見込みの時間を計算し、最も早いキューを選ぶ。
+リソースの指定は、選んだプラットフォームの形式（EC2 は vcpus / memory、Fargate は resourceRequirements）に変換する。
+
+キューの状態は、ジョブの状態インデックス（job_state_index.py）があればそこから、なければ list_jobs / describe_jobs で作る。
+現在の見込みだけを表示する:
+    python router.py --vcpu 1 --memory 2048 --state-index job_state_index.db
+"""
+
+import argparse
+import boto3
+import json
+import logging
+import time
+import config
+from job_records import job_resources
+from resources import translate_resources
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+# 開始を待っているジョブのステータス
+WAITING_STATUSES = ["SUBMITTED", "PENDING", "RUNNABLE"]
+
+# コンピュート環境の vCPU を使っているジョブのステータス
+ACTIVE_STATUSES = ["STARTING", "RUNNING"]
+
+# describe_jobs に一度に渡せるジョブIDの上限
+DESCRIBE_BATCH_SIZE = 100
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+class QueueState:
+    """ジョブキューの負荷（見込みの開始時刻の計算に使う）"""
+
+    def __init__(self, platform, job_queue, max_vcpus, desired_vcpus=None):
+        self.platform = platform
+        self.job_queue = job_queue
+        self.max_vcpus = max_vcpus
+        # EC2 で確保済みの vCPU（インスタンスを追加せずに使える上限）。Fargate は None
+        self.desired_vcpus = desired_vcpus
+        self.active_vcpus = 0.0
+        self.waiting_vcpus = 0.0
+        self.waiting_jobs = 0
+        self.oldest_runnable_seconds = 0.0
+        self.runtime_seconds = config.ROUTING_CONFIG["default_runtime_seconds"]
+
+    def __repr__(self):
+        return (
+            f"QueueState({self.platform}, {self.job_queue}, max={self.max_vcpus}, desired={self.desired_vcpus}, "
+            f"active={self.active_vcpus}, waiting={self.waiting_vcpus}/{self.waiting_jobs}, "
+            f"oldest_runnable={self.oldest_runnable_seconds:.0f}s, runtime={self.runtime_seconds:.0f}s)"
+        )
+
+    def add_active(self, vcpu, count=1):
+        self.active_vcpus += vcpu * count
+
+    def add_waiting(self, vcpu, count=1, runnable_seconds=None):
+        self.waiting_vcpus += vcpu * count
+        self.waiting_jobs += count
+        if runnable_seconds is not None:
+            self.oldest_runnable_seconds = max(self.oldest_runnable_seconds, runnable_seconds)
+
+    def expected_start_seconds(self, vcpu):
+        """
+        vcpu のジョブを今送信した場合に開始するまでの見込みの時間（秒）。実行できない大きさなら None
+
+        - 実行中と待機中のジョブの後に空きがあれば、起動時間だけで開始する
+          （EC2 で確保済みの vCPU に収まらなければ、インスタンスの追加の時間が加わる）
+        - 空きがなければ、実行中のジョブが平均実行時間で入れ替わる速さ（maxvCpus / 実行時間）で
+          足りない vCPU が空くまで待つ
+        - RUNNABLE のまま待っているジョブがあれば、その待ち時間を下限とする（観測した待ち時間）
+        """
+        settings = config.ROUTING_CONFIG
+        if vcpu > self.max_vcpus:
+            return None
+        launch = settings["launch_seconds"][self.platform]
+        free = self.max_vcpus - self.active_vcpus - self.waiting_vcpus
+        if free >= vcpu:
+            wait = launch
+            if self.desired_vcpus is not None and self.desired_vcpus - self.active_vcpus - self.waiting_vcpus < vcpu:
+                wait += settings["scale_up_seconds"][self.platform]
+        else:
+            drain_rate = self.max_vcpus / max(self.runtime_seconds, 1.0)
+            wait = launch + (vcpu - free) / drain_rate
+        if self.waiting_jobs:
+            wait = max(wait, self.oldest_runnable_seconds)
+        return wait
+
+
+def compute_capacity(batch, job_queue):
+    """
+    ジョブキューに紐づく有効なコンピュート環境の (maxvCpus の合計, desiredvCpus の合計) を返す
+
+    desiredvCpus は EC2（マネージドの EC2 / Spot）のコンピュート環境だけが持つ。Fargate のみなら None
+    """
+    queues = batch.describe_job_queues(jobQueues=[job_queue])["jobQueues"]
+    if not queues:
+        raise ValueError(f"ジョブキューが見つかりません: {job_queue}")
+    environments = [order["computeEnvironment"] for order in queues[0]["computeEnvironmentOrder"]]
+    response = batch.describe_compute_environments(computeEnvironments=environments)
+    max_vcpus = 0
+    desired_vcpus = None
+    for environment in response["computeEnvironments"]:
+        if environment.get("state") != "ENABLED":
+            continue
+        resources = environment.get("computeResources", {})
+        max_vcpus += resources.get("maxvCpus", 0)
+        if resources.get("type") in ("EC2", "SPOT"):
+            desired_vcpus = (desired_vcpus or 0) + resources.get("desiredvCpus", 0)
+    return max_vcpus, desired_vcpus
+
+
+def is_array_parent(job):
+    """配列ジョブの親か（子ジョブと二重に数えないため）"""
+    return "size" in (job.get("arrayProperties") or {})
+
+
+def fill_from_index(state, index, now_ms):
+    """ジョブの状態インデックスからキューの負荷を集計する（配列ジョブは子ジョブを数える）"""
+    for row in index.query(statuses=WAITING_STATUSES + ACTIVE_STATUSES, queues=[state.job_queue], time_field="event_time"):
+        job = index_detail(row)
+        if is_array_parent(job):
+            continue
+        vcpu, _ = job_resources(job, state.platform)
+        if row["status"] in ACTIVE_STATUSES:
+            state.add_active(vcpu)
+        else:
+            # RUNNABLE の行のイベントの時刻は RUNNABLE になった時刻
+            runnable = (now_ms - row["event_time"]) / 1000 if row["status"] == "RUNNABLE" else None
+            state.add_waiting(vcpu, runnable_seconds=runnable)
+
+    since = now_ms - config.ROUTING_CONFIG["runtime_window_hours"] * 3600 * 1000
+    durations = [
+        (row["stopped_at"] - row["started_at"]) / 1000
+        for row in index.query(statuses=["SUCCEEDED"], queues=[state.job_queue], since=since, time_field="stopped_at")
+        if row["started_at"] and row["stopped_at"] and not is_array_parent(index_detail(row))
+    ]
+    if durations:
+        state.runtime_seconds = sum(durations) / len(durations)
+
+
+def index_detail(row):
+    """状態インデックスの行の describe_jobs 形式のジョブ"""
+    return json.loads(row["detail"])
+
+
+def list_summaries(batch, job_queue, status):
+    """ジョブキューのステータスごとのジョブ（配列ジョブは親）の一覧"""
+    paginator = batch.get_paginator("list_jobs")
+    summaries = []
+    for page in paginator.paginate(jobQueue=job_queue, jobStatus=status):
+        summaries.extend(page["jobSummaryList"])
+    return summaries
+
+
+def describe_resources(batch, summaries, platform):
+    """
+    ジョブの要求 vCPU の平均を返す（ジョブが多い場合は先頭の max_describe 件から求める）
+
+    配列ジョブの親は子ジョブ1つあたりの要求を返す。
+    """
+    job_ids = [summary["jobId"] for summary in summaries[: config.ROUTING_CONFIG["max_describe"]]]
+    vcpus = []
+    for i in range(0, len(job_ids), DESCRIBE_BATCH_SIZE):
+        for job in batch.describe_jobs(jobs=job_ids[i:i + DESCRIBE_BATCH_SIZE])["jobs"]:
+            vcpus.append(job_resources(job, platform)[0])
+    if not vcpus:
+        return config.DEFAULT_RESOURCES[platform]["vcpu"]
+    return sum(vcpus) / len(vcpus)
+
+
+def fill_from_api(state, batch, now_ms):
+    """
+    list_jobs / describe_jobs からキューの負荷を集計する
+
+    list_jobs は配列ジョブの親だけを返すため、親は配列サイズ個の子ジョブとして数える
+    （一部の子ジョブが終わっていても数えるため、負荷は多めに見積もられる）。
+    """
+    for status in WAITING_STATUSES + ACTIVE_STATUSES:
+        summaries = list_summaries(batch, state.job_queue, status)
+        if not summaries:
+            continue
+        vcpu = describe_resources(batch, summaries, state.platform)
+        count = sum((summary.get("arrayProperties") or {}).get("size", 1) for summary in summaries)
+        if status in ACTIVE_STATUSES:
+            state.add_active(vcpu, count)
+            continue
+        runnable = None
+        if status == "RUNNABLE":
+            runnable = max((now_ms - summary["createdAt"]) / 1000 for summary in summaries)
+        state.add_waiting(vcpu, count, runnable)
+
+    response = batch.list_jobs(jobQueue=state.job_queue, jobStatus="SUCCEEDED", maxResults=100)
+    since = now_ms - config.ROUTING_CONFIG["runtime_window_hours"] * 3600 * 1000
+    durations = [
+        (summary["stoppedAt"] - summary["startedAt"]) / 1000
+        for summary in response["jobSummaryList"]
+        if summary.get("startedAt") and summary.get("stoppedAt", 0) >= since
+    ]
+    if durations:
+        state.runtime_seconds = sum(durations) / len(durations)
+
+
+def queue_states(batch, platforms=None, array=False, index_path=None, now=None):
+    """
+    プラットフォームごとのジョブキューの負荷を返す
+
+    Args:
+        batch: AWS Batch クライアント
+        platforms: 候補のプラットフォーム（省略時は config.ROUTING_CONFIG["platforms"]）
+        array: 配列ジョブ用のジョブキューの状態を作るか
+        index_path: ジョブの状態インデックスのパス（省略時は API から作る）
+        now: 現在時刻（エポック秒）
+
+    Returns:
+        {プラットフォーム: QueueState}
+    """
+    now_ms = (now if now is not None else time.time()) * 1000
+    index = None
+    if index_path:
+        from job_state_index import JobStateIndex
+
+        index = JobStateIndex(index_path)
+    try:
+        states = {}
+        for platform in platforms or config.ROUTING_CONFIG["platforms"]:
+            job_queue = PLATFORM_CONFIG[platform]["array_job_queue" if array else "job_queue"]
+            max_vcpus, desired_vcpus = compute_capacity(batch, job_queue)
+            state = QueueState(platform, job_queue, max_vcpus, desired_vcpus)
+            if index is not None:
+                fill_from_index(state, index, now_ms)
+            else:
+                fill_from_api(state, batch, now_ms)
+            states[platform] = state
+        return states
+    finally:
+        if index is not None:
+            index.close()
+
+
+def route(states, vcpu, memory, count=1):
+    """
+    ジョブ（配列ジョブなら子ジョブ1つ）の要求 vCPU・メモリから送信先を選び、選んだキューの負荷に加える
+
+    同程度（config.ROUTING_CONFIG["switch_margin_seconds"] 以内）なら prefer のプラットフォームを選ぶため、
+    負荷がわずかに変わるたびに送信先が入れ替わることはない。
+
+    Args:
+        states: queue_states() の結果（選んだキューの待機中のジョブに加える）
+        vcpu: 要求 vCPU
+        memory: 要求メモリ（MB）
+        count: 配列ジョブの子ジョブの数
+
+    Returns:
+        (プラットフォーム, 変換後の (vCPU, メモリ MB), {プラットフォーム: 見込みの開始時間（秒）})
+
+    Raises:
+        ValueError: どのプラットフォームでも実行できない場合
+    """
+    settings = config.ROUTING_CONFIG
+    estimates = {}
+    sizes = {}
+    for platform, state in states.items():
+        resources = translate_resources(platform, vcpu, memory)
+        if resources is None:
+            continue
+        wait = state.expected_start_seconds(resources[0])
+        if wait is None:
+            continue
+        estimates[platform] = wait
+        sizes[platform] = resources
+    if not estimates:
+        raise ValueError(f"{vcpu} vCPU / {memory}MB のジョブを実行できるジョブキューがありません")
+
+    best = min(estimates, key=estimates.get)
+    prefer = settings["prefer"]
+    if prefer in estimates and estimates[prefer] <= estimates[best] + settings["switch_margin_seconds"]:
+        best = prefer
+    states[best].add_waiting(sizes[best][0], count)
+    return best, sizes[best], estimates
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(description="EC2 / Fargate のジョブキューの見込みの開始時間を表示するツール")
+    parser.add_argument("--vcpu", type=float, default=1, help="ジョブの要求 vCPU")
+    parser.add_argument("--memory", type=int, default=2048, help="ジョブの要求メモリ（MB）")
+    parser.add_argument("--array", action="store_true", help="配列ジョブ用のジョブキューを調べる")
+    parser.add_argument("--state-index", help="ジョブの状態インデックス（省略時は API から負荷を集計する）")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    return parser.parse_args()
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    batch = boto3.client("batch", region_name=args.region)
+    states = queue_states(batch, array=args.array, index_path=args.state_index)
+    for state in states.values():
+        logger.info(repr(state))
+    platform, resources, estimates = route(states, args.vcpu, args.memory)
+    for name, wait in sorted(estimates.items()):
+        logger.info(f"{name}: 見込みの開始まで {wait:.0f} 秒")
+    logger.info(f"送信先: {platform}（{resources[0]} vCPU / {resources[1]}MB）")
+
+
+if __name__ == "__main__":
+    main()
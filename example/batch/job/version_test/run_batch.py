@@ -70,12 +70,14 @@ def main():
                 param_name = key[6:].lower()  # PARAM_を除去して小文字に変換
                 param_vars[param_name] = value
                 
-                # JSON形式の場合はパースを試みる
-                try:
-                    param_vars[param_name] = json.loads(value)
-                except:
-                    # パースできない場合は文字列のまま
-                    pass
+                # オブジェクトや配列の形をしている場合のみパースを試みる
+                # （送信側はネストされた辞書だけをJSON文字列にしている）
+                if value[:1] in ('{', '['):
+                    try:
+                        param_vars[param_name] = json.loads(value)
+                    except json.JSONDecodeError:
+                        # パースできない場合は文字列のまま
+                        pass
         
         if param_vars:
             print("\n個別のPARAM_環境変数:")
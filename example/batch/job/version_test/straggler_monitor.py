@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+配列ジョブの遅延子ジョブ検出と投機的再実行スクリプト
+
+配列ジョブの子ジョブを定期的に確認し、完了済み子ジョブの実行時間の分布
+（中央値と MAD）に比べて極端に長く実行中の子ジョブを遅延とみなす。
+遅延した子ジョブのシャードは SHARD_INDEX を指定した別ジョブとして重複実行し、
+先に終わった方の結果を採用する。
+
+コンテナ側はシャードの結果を条件付き書き込みで最初の1回だけコミットするため、
+重複実行しても結果は壊れない。重複ジョブが負けた場合はこのスクリプトが停止し、
+元の子ジョブが負けた場合は（停止すると配列ジョブ全体が失敗になるため）
+コンテナ自身がコミット済みを検出して正常終了する。
+
+シミュレーション:
+    python straggler_monitor.py --simulate --array-size 1000 --slots 200
+"""
+
+import argparse
+import boto3
+import logging
+import math
+import random
+import statistics
+import sys
+import time
+from collections import deque
+import config
+import metrics
+
+# 状態を確認する子ジョブのステータス
+CHILD_STATUSES = ["RUNNING", "SUCCEEDED"]
+
+# 終了済みのステータス
+FINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+# MAD を正規分布の標準偏差に換算する係数
+MAD_SCALE = 1.4826
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    straggler = config.STRAGGLER_CONFIG
+    parser = argparse.ArgumentParser(
+        description="配列ジョブの遅延子ジョブを検出して投機的に再実行するツール"
+    )
+    parser.add_argument("--job-id", help="監視する配列ジョブ（親ジョブ）のID")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=straggler["interval_seconds"],
+        help="子ジョブの状態を確認する間隔（秒）",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="検出結果だけを表示し、ジョブを送信・停止しない"
+    )
+    # シミュレーション用オプション
+    parser.add_argument(
+        "--simulate", action="store_true", help="AWS を使わずに投機的再実行の効果を試算する"
+    )
+    parser.add_argument("--array-size", type=int, default=1000, help="シミュレーションの配列サイズ")
+    parser.add_argument("--slots", type=int, default=200, help="シミュレーションの同時実行数")
+    parser.add_argument(
+        "--median-seconds", type=float, default=300, help="シミュレーションの子ジョブの実行時間の中央値"
+    )
+    parser.add_argument(
+        "--straggler-rate", type=float, default=0.02, help="シミュレーションの遅延発生率"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="シミュレーションの乱数シード")
+    args = parser.parse_args()
+    if not args.simulate and not args.job_id:
+        parser.error("--job-id か --simulate のどちらかが必要です")
+    return args
+
+
+def straggler_threshold(durations, settings=None):
+    """
+    完了済み実行時間の分布から遅延とみなす実行時間のしきい値を返す
+
+    外れ値に強い中央値と MAD を使い、「中央値 + k × MAD」と「中央値 × min_ratio」の
+    大きい方をしきい値とする。
+    """
+    settings = settings or config.STRAGGLER_CONFIG
+    median = statistics.median(durations)
+    mad = statistics.median(abs(value - median) for value in durations) * MAD_SCALE
+    return max(median * settings["min_ratio"], median + settings["mad_threshold"] * mad)
+
+
+def detect_stragglers(running, completed, array_size, settings=None):
+    """
+    遅延している子ジョブを検出する
+
+    Args:
+        running: {配列インデックス: 実行開始からの経過秒数}
+        completed: 完了済み子ジョブの実行時間（秒）のリスト
+        array_size: 配列サイズ
+        settings: 判定の設定（省略時は config.STRAGGLER_CONFIG）
+
+    Returns:
+        遅延しているインデックスのリスト（経過時間の長い順）
+    """
+    settings = settings or config.STRAGGLER_CONFIG
+    required = max(
+        settings["min_completed"],
+        math.ceil(array_size * settings["min_completed_fraction"]),
+    )
+    if len(completed) < required:
+        return []
+    threshold = straggler_threshold(completed, settings)
+    stragglers = [index for index, elapsed in running.items() if elapsed > threshold]
+    return sorted(stragglers, key=lambda index: running[index], reverse=True)
+
+
+def list_children(batch, array_job_id):
+    """
+    子ジョブの状態を取得する
+
+    Returns:
+        {配列インデックス: list_jobs のジョブ概要}
+    """
+    paginator = batch.get_paginator("list_jobs")
+    children = {}
+    for status in CHILD_STATUSES:
+        for page in paginator.paginate(arrayJobId=array_job_id, jobStatus=status):
+            for summary in page["jobSummaryList"]:
+                children[summary["arrayProperties"]["index"]] = summary
+    return children
+
+
+def speculative_params(parent, index, child_job_id, origin_variable="SPECULATIVE_OF", suffix="spec"):
+    """
+    親ジョブの設定を引き継ぎ、1つのシャードだけを処理するジョブの送信パラメータを作る
+
+    Args:
+        parent: 配列ジョブの親ジョブ（describe_jobs の結果）
+        index: 処理するシャードの番号
+        child_job_id: 元の子ジョブのID（origin_variable の環境変数で渡す）
+        origin_variable: 元の子ジョブのIDを渡す環境変数名
+        suffix: ジョブ名に付ける接尾辞
+
+    Raises:
+        ValueError: 親ジョブがシャードのコミット（SHARD_COUNT）を使っていない場合
+    """
+    container = parent.get("container", {})
+    environment = [
+        variable
+        for variable in container.get("environment", [])
+        if not variable["name"].startswith("AWS_BATCH_")
+    ]
+    if not any(variable["name"] == "SHARD_COUNT" for variable in environment):
+        raise ValueError(
+            "親ジョブに SHARD_COUNT がないため、シャードの出力が冪等か判断できません"
+        )
+    environment += [
+        {"name": "SHARD_INDEX", "value": str(index)},
+        {"name": origin_variable, "value": child_job_id},
+    ]
+    # RUN_ID を設定していない親ジョブでは、子ジョブの実行IDは親ジョブID（同じシャードのマニフェストに書く）
+    if not any(variable["name"] == "RUN_ID" for variable in environment):
+        environment.append({"name": "RUN_ID", "value": parent["jobId"]})
+    overrides = {"environment": environment}
+    if container.get("resourceRequirements"):
+        overrides["resourceRequirements"] = container["resourceRequirements"]
+
+    params = {
+        "jobName": f"{parent['jobName']}-{suffix}-{index}"[:128],
+        "jobQueue": parent["jobQueue"],
+        "jobDefinition": parent["jobDefinition"],
+        "containerOverrides": overrides,
+    }
+    if parent.get("shareIdentifier"):
+        params["shareIdentifier"] = parent["shareIdentifier"]
+    if parent.get("schedulingPriority") is not None:
+        params["schedulingPriorityOverride"] = parent["schedulingPriority"]
+    return params
+
+
+class SpeculationController:
+    """配列ジョブを監視し、遅延したシャードを重複実行して負けた方を止める"""
+
+    def __init__(self, batch, array_job_id, logger, dry_run=False, settings=None):
+        self.batch = batch
+        self.array_job_id = array_job_id
+        self.logger = logger
+        self.dry_run = dry_run
+        self.settings = settings or config.STRAGGLER_CONFIG
+        # {配列インデックス: {"original": 子ジョブID, "speculative": 重複ジョブID}}
+        self.speculations = {}
+
+    def describe(self, job_ids):
+        """ジョブの詳細を {ジョブID: 詳細} で返す"""
+        jobs = {}
+        for i in range(0, len(job_ids), 100):
+            for job in self.batch.describe_jobs(jobs=job_ids[i:i + 100])["jobs"]:
+                jobs[job["jobId"]] = job
+        return jobs
+
+    def terminate(self, job_id, reason):
+        """ジョブを停止する"""
+        self.logger.info(f"停止: {job_id} ({reason})")
+        if not self.dry_run:
+            self.batch.terminate_job(jobId=job_id, reason=reason)
+
+    def resolve(self, children):
+        """重複実行中のシャードのうち、決着したものの負けた方を止める"""
+        pending = [
+            entry["speculative"]
+            for entry in self.speculations.values()
+            if entry["speculative"] and not entry.get("resolved")
+        ]
+        if not pending:
+            return
+        speculative_jobs = self.describe(pending)
+        for index, entry in self.speculations.items():
+            if entry.get("resolved") or not entry["speculative"]:
+                continue
+            original = children.get(index, {})
+            speculative = speculative_jobs.get(entry["speculative"], {})
+            if original.get("status") == "SUCCEEDED":
+                entry["resolved"] = "original"
+                if speculative.get("status") not in FINAL_STATUSES:
+                    self.terminate(entry["speculative"], "元の子ジョブが先に完了したため")
+            elif speculative.get("status") == "SUCCEEDED":
+                # 元の子ジョブはコミット済みを検出して自分で正常終了する
+                entry["resolved"] = "speculative"
+                self.logger.info(f"インデックス {index}: 重複ジョブが先に完了しました")
+            elif speculative.get("status") == "FAILED":
+                entry["resolved"] = "failed"
+                self.logger.warning(f"インデックス {index}: 重複ジョブが失敗しました")
+
+    def speculate(self, parent, children):
+        """遅延している子ジョブを検出し、重複ジョブを送信する"""
+        now_ms = time.time() * 1000
+        completed = [
+            (summary["stoppedAt"] - summary["startedAt"]) / 1000
+            for summary in children.values()
+            if summary["status"] == "SUCCEEDED" and summary.get("startedAt")
+        ]
+        running = {
+            index: (now_ms - summary["startedAt"]) / 1000
+            for index, summary in children.items()
+            if summary["status"] == "RUNNING"
+            and summary.get("startedAt")
+            and index not in self.speculations
+        }
+        array_size = parent["arrayProperties"]["size"]
+        budget = (
+            math.ceil(array_size * self.settings["max_speculative_fraction"])
+            - len(self.speculations)
+        )
+        stragglers = detect_stragglers(running, completed, array_size, self.settings)
+        for index in stragglers[:max(budget, 0)]:
+            child_job_id = children[index]["jobId"]
+            params = speculative_params(parent, index, child_job_id)
+            self.logger.info(
+                f"インデックス {index}: 実行 {running[index]:.0f} 秒 "
+                f"（完了済み中央値 {statistics.median(completed):.0f} 秒）のため重複実行します"
+            )
+            speculative_job_id = None
+            if not self.dry_run:
+                speculative_job_id = self.batch.submit_job(**params)["jobId"]
+                self.logger.info(f"インデックス {index}: 重複ジョブ {speculative_job_id}")
+            self.speculations[index] = {
+                "original": child_job_id,
+                "speculative": speculative_job_id,
+            }
+
+    def run(self, interval):
+        """親ジョブが終了するまで監視する"""
+        while True:
+            parent = self.describe([self.array_job_id])[self.array_job_id]
+            if parent["status"] in FINAL_STATUSES:
+                for entry in self.speculations.values():
+                    if entry["speculative"] and not entry.get("resolved"):
+                        self.terminate(entry["speculative"], "配列ジョブが終了したため")
+                self.logger.info(
+                    f"配列ジョブ {parent['status']}: 重複実行 {len(self.speculations)} 件"
+                )
+                return parent["status"]
+            children = list_children(self.batch, self.array_job_id)
+            self.resolve(children)
+            self.speculate(parent, children)
+            time.sleep(interval)
+
+
+def simulate(array_size, slots, median_seconds, straggler_rate, speculate, seed, settings=None):
+    """
+    配列ジョブの実行を1秒刻みで模擬し、シャードごとの完了時刻を返す
+
+    子ジョブの実行時間は対数正規分布に従い、straggler_rate の割合で3〜5倍に遅延する。
+    重複ジョブは新しいホストで実行されるものとして実行時間を引き直す。
+
+    Returns:
+        (シャードごとの完了時刻（秒）のリスト, 使用したスロット秒の合計)
+    """
+    settings = settings or config.STRAGGLER_CONFIG
+    rng = random.Random(seed)
+
+    def draw():
+        seconds = rng.lognormvariate(math.log(median_seconds), 0.2)
+        if rng.random() < straggler_rate:
+            seconds *= rng.uniform(3, 5)
+        return seconds
+
+    durations = [draw() for _ in range(array_size)]
+    pending = deque((index, durations[index]) for index in range(array_size))
+    running = {}  # 実行ID -> (インデックス, 開始時刻, 実行時間, 重複かどうか)
+    finished = {}
+    completed = []
+    speculated = set()
+    busy_seconds = 0.0
+    next_id = 0
+    now = 0
+    interval = int(settings["interval_seconds"])
+    while len(finished) < array_size:
+        for run_id, (index, start, seconds, _) in list(running.items()):
+            if now >= start + seconds and index not in finished:
+                finished[index] = start + seconds
+                completed.append(seconds)
+        # 決着したシャードの残りの実行（負けた方）を止める
+        for run_id, (index, start, seconds, _) in list(running.items()):
+            if index in finished:
+                busy_seconds += min(now, start + seconds) - start
+                del running[run_id]
+
+        if speculate and now % interval == 0:
+            elapsed = {
+                index: now - start
+                for index, start, _, is_speculative in running.values()
+                if not is_speculative and index not in speculated
+            }
+            budget = math.ceil(array_size * settings["max_speculative_fraction"]) - len(speculated)
+            for index in detect_stragglers(elapsed, completed, array_size, settings)[:max(budget, 0)]:
+                speculated.add(index)
+                pending.appendleft((index, draw()))
+
+        while pending and len(running) < slots:
+            index, seconds = pending.popleft()
+            running[next_id] = (index, now, seconds, index in speculated)
+            next_id += 1
+        now += 1
+    return [finished[index] for index in range(array_size)], busy_seconds
+
+
+def percentile(values, fraction):
+    """値のパーセンタイル（最近傍法）"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_simulation(args):
+    """投機的再実行あり・なしのシミュレーション結果を比較表示する"""
+    print(
+        f"配列サイズ {args.array_size}, 同時実行 {args.slots}, 実行時間の中央値 "
+        f"{args.median_seconds:.0f} 秒, 遅延発生率 {args.straggler_rate:.1%}"
+    )
+    baseline_busy = None
+    for label, speculate in (("投機的再実行なし", False), ("投機的再実行あり", True)):
+        finished, busy = simulate(
+            args.array_size,
+            args.slots,
+            args.median_seconds,
+            args.straggler_rate,
+            speculate,
+            args.seed,
+        )
+        if baseline_busy is None:
+            baseline_busy = busy
+        print(
+            f"{label}: 完了時間 {max(finished):.0f} 秒, "
+            f"シャード完了時刻 p50 {percentile(finished, 0.5):.0f} 秒 / "
+            f"p99 {percentile(finished, 0.99):.0f} 秒, "
+            f"計算量 {busy / baseline_busy:.1%}"
+        )
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+    if args.simulate:
+        run_simulation(args)
+        return
+
+    # AWS Batch クライアントを作成
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        sys.exit(1)
+
+    controller = SpeculationController(batch, args.job_id, logger, dry_run=args.dry_run)
+    try:
+        status = controller.run(args.interval)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        logger.info("監視を中断しました（送信済みの重複ジョブは停止しません）")
+        return
+    print(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+小タスクをバンドルにまとめて送信する AWS Batch ジョブ送信スクリプト
+
+多数の短時間アイテムを1ジョブずつ送信すると、スケジューリングとコンテナ起動の
+オーバーヘッドが支配的になる。履歴の実行時間をもとにアイテムを目標実行時間ごとの
+バンドルにまとめ、1バンドルを1ジョブとして送信する。
+コンテナ側は環境変数 BUNDLE を受け取り、アイテムを順番に処理する。
+
+--memo-index を指定すると、入力・設定・コードが前回から変わっていないアイテムは
+送信せず、前回の出力を参照するマニフェストだけをコミットする（memo.py）。
+"""
+
+import argparse
+import boto3
+import datetime
+import uuid
+import logging
+import json
+import sys
+import os
+import config
+import metrics
+from history import JobHistory, item_key
+from memo import MemoIndex
+from packing import pack_items
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(
+        description="小タスクをバンドルにまとめて送信する AWS Batch ジョブ送信ツール"
+    )
+    parser.add_argument(
+        "--platform",
+        choices=sorted(PLATFORM_CONFIG),
+        default="fargate",
+        help="送信先のプラットフォーム",
+    )
+    parser.add_argument("--job-queue", help="使用するジョブキュー名")
+    parser.add_argument("--job-definition", help="使用するジョブ定義名")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--items-file",
+        required=True,
+        help="作業アイテム（CONFIG 形式のJSON）の配列を含むファイルのパス",
+    )
+    parser.add_argument(
+        "--history-file", default=config.HISTORY_FILE, help="実行履歴ファイルのパス"
+    )
+    parser.add_argument(
+        "--target-seconds",
+        type=float,
+        default=config.PACKING_CONFIG["target_seconds"],
+        help="1バンドルあたりの目標実行時間（秒）",
+    )
+    parser.add_argument(
+        "--default-item-seconds",
+        type=float,
+        default=config.PACKING_CONFIG["default_item_seconds"],
+        help="履歴がないアイテムの想定実行時間（秒）",
+    )
+    parser.add_argument(
+        "--memo-index",
+        default=config.MEMO_CONFIG["index"],
+        help="結果インデックスの場所（s3:// URI またはローカルのディレクトリ）。"
+        "指定すると変更のないアイテムを送信しない",
+    )
+    parser.add_argument(
+        "--code-version",
+        help="結果インデックスのキーに使うコードのバージョン。省略時はコンテナのソースのハッシュ",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="バンドル構成を表示するだけでジョブを送信しない",
+    )
+    return parser.parse_args()
+
+
+def load_items_file(file_path):
+    """作業アイテムのJSONファイルを読み込む"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"アイテムファイルが見つかりません: {file_path}")
+
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"アイテムファイルのJSON形式が不正です: {e}")
+    if not isinstance(items, list):
+        raise ValueError("アイテムファイルはJSON配列である必要があります")
+    return items
+
+
+def main():
+    """メイン処理"""
+    # ロギング設定
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+    platform_config = PLATFORM_CONFIG[args.platform]
+    job_queue = args.job_queue or platform_config["job_queue"]
+    job_definition = args.job_definition or platform_config["job_definition"]
+
+    # アイテムを読み込み、履歴の実行時間でバンドルにまとめる
+    try:
+        items = load_items_file(args.items_file)
+    except Exception as e:
+        logger.error(f"アイテムファイル読み込みエラー: {e}")
+        sys.exit(1)
+
+    # ジョブ名を生成（タイムスタンプとUUIDを含む）
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    job_id_suffix = str(uuid.uuid4())[:8]
+    # コンテナはシャードのマニフェストを実行IDごとに分ける。再利用のコミットとバンドルのジョブで同じ値を使う
+    run_id = f"{args.platform}-packed-job-{timestamp}-{job_id_suffix}"
+
+    # 前回から変わっていないアイテムは送信せず、前回の出力を再利用する
+    memo = None
+    if args.memo_index:
+        try:
+            memo = MemoIndex(args.memo_index, args.code_version)
+            unchanged, items = memo.partition(items)
+        except Exception as e:
+            logger.error(f"結果インデックスの確認エラー: {e}")
+            sys.exit(1)
+        logger.info(
+            f"結果インデックス（コードのバージョン {memo.version}）: "
+            f"変更なし {len(unchanged)} アイテム / 要処理 {len(items)} アイテム"
+        )
+        if not args.dry_run:
+            reused = sum(memo.commit(item, entry, run_id) for item, entry in unchanged)
+            logger.info(f"前回の出力を参照するマニフェストを {reused} 件コミットしました")
+        if not items:
+            logger.info("処理が必要なアイテムはありません")
+            return
+
+    try:
+        history = JobHistory(args.history_file)
+        bundles = pack_items(
+            items,
+            lambda item: history.item_seconds(item_key(item), args.default_item_seconds),
+            args.target_seconds,
+            config.PACKING_CONFIG["max_bundle_bytes"],
+        )
+    except Exception as e:
+        logger.error(f"バンドル作成エラー: {e}")
+        sys.exit(1)
+
+    logger.info(
+        f"{len(items)} アイテムを {len(bundles)} バンドルにまとめました"
+        f"（目標 {args.target_seconds} 秒/バンドル）"
+    )
+    for index, bundle in enumerate(bundles):
+        logger.info(
+            f"バンドル {index}: {len(bundle['items'])} アイテム, "
+            f"想定 {bundle['seconds']:.1f} 秒, {bundle['bytes']} バイト"
+        )
+    if args.dry_run:
+        return
+
+    # AWS Batch クライアントを作成
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        return
+
+    fair_share = config.FAIR_SHARE_CONFIG[args.platform]
+
+    failed = 0
+    for index, bundle in enumerate(bundles):
+        submit_params = {
+            "jobName": f"{run_id}-{index}",
+            "jobQueue": job_queue,
+            "jobDefinition": job_definition,
+            "containerOverrides": {
+                "environment": [
+                    {
+                        "name": "BUNDLE",
+                        "value": json.dumps(
+                            bundle["items"], separators=(",", ":"), ensure_ascii=False
+                        ),
+                    },
+                    {"name": "RUN_ID", "value": run_id},
+                ]
+            },
+        }
+        # コンテナ側でも結果インデックスを確認し、処理した結果を記録させる
+        if memo is not None:
+            submit_params["containerOverrides"]["environment"].extend(memo.environment())
+
+        # フェアシェアスケジューリングを使用する場合、必要なパラメータを追加
+        if fair_share["use_fair_share"]:
+            if fair_share["share_identifier"]:
+                submit_params["shareIdentifier"] = fair_share["share_identifier"]
+            if fair_share["scheduling_priority"] is not None:
+                submit_params["schedulingPriorityOverride"] = fair_share[
+                    "scheduling_priority"
+                ]
+
+        # ジョブを送信
+        try:
+            response = batch.submit_job(**submit_params)
+            job_id = response["jobId"]
+            logger.info(f"バンドル {index} 送信成功: ID = {job_id}")
+            print(job_id)  # 標準出力にジョブIDを出力
+        except Exception as e:
+            failed += 1
+            logger.error(f"バンドル {index} 送信エラー: {e}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
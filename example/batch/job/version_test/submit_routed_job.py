@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+EC2 / Fargate のうち早く開始できるキューに振り分けて送信する AWS Batch ジョブ送信スクリプト
+
+送信のたびにキューの負荷から見込みの開始時間を計算し（router.py）、最も早いプラットフォームの
+ジョブキュー・ジョブ定義に送信する。リソースの指定は送信先の形式に変換する。
+複数のジョブを送信する場合、送信したジョブは送信先のキューの待機中のジョブに加えてから次を振り分けるため、
+一方のキューが埋まると残りはもう一方に送られる。
+"""
+
+import argparse
+import boto3
+import datetime
+import uuid
+import logging
+import json
+import sys
+import os
+import config
+import metrics
+import router
+from resources import container_resource_overrides
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(
+        description="EC2 / Fargate のうち早く開始できるキューに振り分けて送信する AWS Batch ジョブ送信ツール"
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--params-file", help="ジョブに渡すパラメータ（CONFIG 形式のJSON）のファイルのパス")
+    source.add_argument(
+        "--items-file",
+        help="作業アイテム（CONFIG 形式のJSON）の配列を含むファイルのパス。アイテムごとに1ジョブを送信する",
+    )
+    parser.add_argument(
+        "--vcpu", type=float, default=config.DEFAULT_RESOURCES["ec2"]["vcpu"], help="ジョブの要求 vCPU"
+    )
+    parser.add_argument(
+        "--memory", type=int, default=config.DEFAULT_RESOURCES["ec2"]["memory"], help="ジョブの要求メモリ（MB）"
+    )
+    parser.add_argument(
+        "--array-size",
+        type=int,
+        help="配列ジョブとして送信する場合の子ジョブの数（SHARD_COUNT として渡す）",
+    )
+    parser.add_argument(
+        "--platforms",
+        nargs="+",
+        choices=sorted(router.PLATFORM_CONFIG),
+        default=config.ROUTING_CONFIG["platforms"],
+        help="送信先の候補のプラットフォーム",
+    )
+    parser.add_argument(
+        "--state-index", help="ジョブの状態インデックス（省略時は API からキューの負荷を集計する）"
+    )
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="振り分けの結果を表示するだけでジョブを送信しない",
+    )
+    args = parser.parse_args()
+    if args.array_size is not None and not 2 <= args.array_size <= 10000:
+        parser.error("--array-size は 2 以上 10000 以下である必要があります")
+    return args
+
+
+def load_json_file(file_path, description):
+    """JSONファイルを読み込む"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"{description}が見つかりません: {file_path}")
+
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"{description}のJSON形式が不正です: {e}")
+
+
+def main():
+    """メイン処理"""
+    # ロギング設定
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+
+    try:
+        if args.items_file:
+            items = load_json_file(args.items_file, "アイテムファイル")
+            if not isinstance(items, list):
+                raise ValueError("アイテムファイルはJSON配列である必要があります")
+        else:
+            items = [load_json_file(args.params_file, "パラメータファイル")]
+    except Exception as e:
+        logger.error(f"ファイル読み込みエラー: {e}")
+        sys.exit(1)
+
+    # AWS Batch クライアントを作成
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        return
+
+    # キューの負荷を集計する
+    array = args.array_size is not None
+    try:
+        states = router.queue_states(batch, args.platforms, array, args.state_index)
+    except Exception as e:
+        logger.error(f"キューの負荷の集計エラー: {e}")
+        sys.exit(1)
+    for state in states.values():
+        logger.info(repr(state))
+
+    # ジョブ名を生成（タイムスタンプとUUIDを含む）
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    job_id_suffix = str(uuid.uuid4())[:8]
+
+    failed = 0
+    for index, item in enumerate(items):
+        try:
+            platform, (vcpu, memory), estimates = router.route(
+                states, args.vcpu, args.memory, args.array_size or 1
+            )
+        except ValueError as e:
+            logger.error(f"ジョブ {index} の振り分けエラー: {e}")
+            failed += 1
+            continue
+        platform_config = router.PLATFORM_CONFIG[platform]
+        job_queue = platform_config["array_job_queue" if array else "job_queue"]
+        logger.info(
+            f"ジョブ {index}: {platform}（{vcpu} vCPU / {memory}MB, キュー: {job_queue}）, 見込みの開始時間: "
+            + ", ".join(f"{name} {wait:.0f} 秒" for name, wait in sorted(estimates.items()))
+        )
+        if args.dry_run:
+            continue
+
+        environment = [{"name": "CONFIG", "value": json.dumps(item, ensure_ascii=False)}]
+        submit_params = {
+            "jobName": f"{platform}-routed-job-{timestamp}-{job_id_suffix}-{index}",
+            "jobQueue": job_queue,
+            "jobDefinition": platform_config["job_definition"],
+            "containerOverrides": {
+                "environment": environment,
+                **container_resource_overrides(platform, vcpu, memory),
+            },
+        }
+        if array:
+            submit_params["arrayProperties"] = {"size": args.array_size}
+            # 子ジョブは AWS_BATCH_JOB_ARRAY_INDEX から担当するシャードを決める
+            environment.append({"name": "SHARD_COUNT", "value": str(args.array_size)})
+
+        # フェアシェアスケジューリングを使用する場合、必要なパラメータを追加
+        fair_share = config.FAIR_SHARE_CONFIG[platform]
+        if fair_share["use_fair_share"]:
+            if fair_share["share_identifier"]:
+                submit_params["shareIdentifier"] = fair_share["share_identifier"]
+            if fair_share["scheduling_priority"] is not None:
+                submit_params["schedulingPriorityOverride"] = fair_share[
+                    "scheduling_priority"
+                ]
+
+        # ジョブを送信
+        try:
+            response = batch.submit_job(**submit_params)
+            job_id = response["jobId"]
+            logger.info(f"ジョブ {index} 送信成功: ID = {job_id}")
+            print(job_id)  # 標準出力にジョブIDを出力
+        except Exception as e:
+            failed += 1
+            logger.error(f"ジョブ {index} 送信エラー: {e}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+パラメータスイープのジョブ送信スクリプト
+
+parameters.json の設定項目（settings.batchSize など）の値の一覧や範囲から、
+全組み合わせ（grid）、ランダムサンプル（random）、ラテン超方格サンプル（lhs）を
+1つの配列ジョブとして送信する。
+
+組み合わせごとの設定は送らず、基本の CONFIG とスイープの定義（SWEEP_SPEC）だけを渡し、
+コンテナが AWS_BATCH_JOB_ARRAY_INDEX から担当する組み合わせを計算する。
+送信回数とリクエストの大きさは点の数によらない（配列サイズの上限を超える場合のみ分割する）。
+"""
+
+import argparse
+import boto3
+import datetime
+import uuid
+import logging
+import json
+import sys
+import config
+import metrics
+from fargate_submit_job_with_params import load_params_file
+from sweep import SWEEP_MODES, load_sweep_file, parse_field_arg, point, sweep_size
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    parser = argparse.ArgumentParser(description="パラメータスイープのジョブ送信ツール")
+    parser.add_argument(
+        "--platform",
+        choices=sorted(PLATFORM_CONFIG),
+        default="fargate",
+        help="送信先のプラットフォーム",
+    )
+    parser.add_argument("--job-queue", help="使用するジョブキュー名")
+    parser.add_argument("--job-definition", help="使用するジョブ定義名")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    parser.add_argument(
+        "--params-file", default="parameters.json", help="基本の設定（CONFIG）を含むJSONファイルのパス"
+    )
+    parser.add_argument("--sweep-file", help="スイープの定義（SWEEP_SPEC）を含むJSONファイルのパス")
+    parser.add_argument(
+        "--field",
+        action="append",
+        default=[],
+        help="スイープする項目（例: settings.batchSize=32,64,128 / "
+        'settings.learningRate=\'{"min":0.0001,"max":0.1,"log":true}\'）。複数指定可',
+    )
+    parser.add_argument("--mode", choices=SWEEP_MODES, help="grid / random / lhs")
+    parser.add_argument("--samples", type=int, help="random / lhs のサンプル数")
+    parser.add_argument("--seed", type=int, help="random / lhs の乱数シード")
+    parser.add_argument(
+        "--preview", type=int, default=5, help="送信前に表示する点の数"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="点の数と先頭の点を表示するだけで送信しない"
+    )
+    args = parser.parse_args()
+    platform_config = PLATFORM_CONFIG[args.platform]
+    args.job_queue = args.job_queue or platform_config["array_job_queue"]
+    args.job_definition = args.job_definition or platform_config["job_definition"]
+    return args
+
+
+def build_spec(args):
+    """
+    スイープの定義を組み立てる（--sweep-file に --field / --mode などを上書き）
+
+    Raises:
+        ValueError: 定義が不正な場合
+    """
+    spec = load_sweep_file(args.sweep_file) if args.sweep_file else {}
+    spec.setdefault("fields", {})
+    for value in args.field:
+        name, field = parse_field_arg(value)
+        spec["fields"][name] = field
+    if args.mode:
+        spec["mode"] = args.mode
+    if args.samples is not None:
+        spec["samples"] = args.samples
+    if args.seed is not None:
+        spec["seed"] = args.seed
+    spec.setdefault("mode", "grid")
+    sweep_size(spec)
+    return spec
+
+
+def sweep_params(job_name, args, base_config, spec, offset, size):
+    """スイープの一部（offset から size 個の点）を処理する配列ジョブの送信パラメータを作る"""
+    environment = [
+        {"name": "CONFIG", "value": json.dumps(base_config, ensure_ascii=False, separators=(",", ":"))},
+        {"name": "SWEEP_SPEC", "value": json.dumps(spec, ensure_ascii=False, separators=(",", ":"))},
+        {"name": "SWEEP_OFFSET", "value": str(offset)},
+        # 各点は入力全体を処理する（配列インデックスをシャード番号として使わない）
+        {"name": "SHARD_INDEX", "value": "0"},
+        {"name": "SHARD_COUNT", "value": "1"},
+    ]
+    params = {
+        "jobName": job_name,
+        "jobQueue": args.job_queue,
+        "jobDefinition": args.job_definition,
+        "containerOverrides": {"environment": environment},
+    }
+    # 配列ジョブは2以上のサイズが必要なため、1点だけなら通常のジョブとして送信する
+    if size > 1:
+        params["arrayProperties"] = {"size": size}
+
+    fair_share = config.FAIR_SHARE_CONFIG[args.platform]
+    if fair_share["use_fair_share"]:
+        if fair_share["share_identifier"]:
+            params["shareIdentifier"] = fair_share["share_identifier"]
+        if fair_share["scheduling_priority"] is not None:
+            params["schedulingPriorityOverride"] = fair_share["scheduling_priority"]
+    return params
+
+
+def main():
+    """メイン処理"""
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+
+    try:
+        base_config = load_params_file(args.params_file)
+        spec = build_spec(args)
+    except Exception as e:
+        logger.error(f"スイープの定義エラー: {e}")
+        sys.exit(1)
+
+    total = sweep_size(spec)
+    logger.info(
+        f"スイープ: {spec['mode']}, 項目 {len(spec['fields'])} 個, 点の数 {total}"
+    )
+    for index in range(min(args.preview, total)):
+        logger.info(f"  点 {index}: {json.dumps(point(spec, index), ensure_ascii=False)}")
+
+    # 配列サイズの上限ごとに分割する
+    max_array_size = config.AUTOTUNE_CONFIG["max_array_size"]
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    job_id_suffix = str(uuid.uuid4())[:8]
+    base_name = f"{args.platform}-sweep-job-{timestamp}-{job_id_suffix}"
+    chunks = [
+        (offset, min(max_array_size, total - offset)) for offset in range(0, total, max_array_size)
+    ]
+    requests = []
+    for number, (offset, size) in enumerate(chunks):
+        job_name = base_name if len(chunks) == 1 else f"{base_name}-{number}"
+        requests.append(sweep_params(job_name, args, base_config, spec, offset, size))
+    request_bytes = sum(len(json.dumps(params, ensure_ascii=False).encode("utf-8")) for params in requests)
+    logger.info(
+        f"送信: ジョブ {len(requests)} 件（{args.job_queue}, {args.job_definition}）, "
+        f"リクエスト合計 {request_bytes} バイト"
+    )
+    if args.dry_run:
+        return
+
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS Batch クライアント作成エラー: {e}")
+        sys.exit(1)
+
+    for params, (offset, size) in zip(requests, chunks):
+        try:
+            response = batch.submit_job(**params)
+        except Exception as e:
+            logger.error(f"スイープジョブ送信エラー（点 {offset}〜{offset + size - 1}）: {e}")
+            sys.exit(1)
+        logger.info(
+            f"スイープジョブ送信成功: ID = {response['jobId']}（点 {offset}〜{offset + size - 1}）"
+        )
+        print(f"Job ID: {response['jobId']}")
+
+
+if __name__ == "__main__":
+    main()
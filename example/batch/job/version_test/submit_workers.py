@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+作業キューを処理するワーカージョブの送信スクリプト
+
+作業アイテム（CONFIG 形式のJSON）を SQS キューに投入し、キューを処理し続ける
+ワーカーを配列ジョブとして N 個起動する。アイテムごとにジョブを送信する場合と比べ、
+イメージの取得やインタプリタの起動のコストを多数のアイテムで分け合える。
+コンテナ側は環境変数 WORK_QUEUE_URL を受け取るとワーカーモードで動作する。
+--queue-name で作るキューには、max_receive_count 回受信しても成功しないメッセージを移す
+デッドレターキュー（<キュー名>-dlq）を再処理ポリシーで設定する。
+"""
+
+import argparse
+import boto3
+import datetime
+import uuid
+import logging
+import json
+import sys
+import config
+import metrics
+from submit_packed_job import load_items_file
+
+PLATFORM_CONFIG = {
+    "ec2": config.EC2_CONFIG,
+    "fargate": config.FARGATE_CONFIG,
+}
+
+# send_message_batch に一度に渡せるメッセージ数の上限
+SEND_BATCH_SIZE = 10
+
+
+def configure_logging():
+    """基本的なロギング設定"""
+    logging.basicConfig(
+        level=logging.INFO, format=config.LOG_FORMAT, datefmt=config.LOG_DATE_FORMAT
+    )
+    return logging.getLogger(__name__)
+
+
+def parse_args():
+    """コマンドライン引数のパース"""
+    worker = config.WORKER_CONFIG
+    parser = argparse.ArgumentParser(
+        description="作業キューを処理するワーカージョブの送信ツール"
+    )
+    parser.add_argument(
+        "--platform",
+        choices=sorted(PLATFORM_CONFIG),
+        default="fargate",
+        help="送信先のプラットフォーム",
+    )
+    parser.add_argument("--job-queue", help="使用するジョブキュー名")
+    parser.add_argument("--job-definition", help="使用するジョブ定義名")
+    parser.add_argument(
+        "--region", default=config.DEFAULT_REGION, help="AWS リージョン"
+    )
+    queue = parser.add_mutually_exclusive_group(required=True)
+    queue.add_argument("--queue-url", help="作業キュー（SQS）の URL")
+    queue.add_argument(
+        "--queue-name", help="作業キュー（SQS）の名前。存在しなければ作成する"
+    )
+    parser.add_argument(
+        "--items-file",
+        help="キューに投入する作業アイテム（CONFIG 形式のJSON）の配列を含むファイルのパス",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=worker["workers"], help="起動するワーカーの数"
+    )
+    parser.add_argument(
+        "--idle-seconds",
+        type=int,
+        default=worker["idle_seconds"],
+        help="キューが空のままこの時間たつとワーカーが終了する（秒）",
+    )
+    parser.add_argument(
+        "--visibility-seconds",
+        type=int,
+        default=worker["visibility_seconds"],
+        help="処理中のメッセージを他のワーカーから隠す時間（秒）",
+    )
+    parser.add_argument(
+        "--max-receive-count",
+        type=int,
+        default=worker["max_receive_count"],
+        help="この回数受信しても成功しないメッセージをデッドレターキューへ移す",
+    )
+    return parser.parse_args()
+
+
+def create_queue(sqs, name, visibility_seconds, max_receive_count):
+    """
+    作業キューとデッドレターキュー（<name>-dlq）を作り、作業キューの URL を返す
+
+    既にあるキューにも属性を設定し直すため、以前に再処理ポリシーなしで作ったキューにも
+    デッドレターキューが設定される。
+    """
+    retention_seconds = config.WORKER_CONFIG["dead_letter_retention_days"] * 86400
+    dlq_url = sqs.create_queue(QueueName=f"{name}-dlq")["QueueUrl"]
+    sqs.set_queue_attributes(
+        QueueUrl=dlq_url, Attributes={"MessageRetentionPeriod": str(retention_seconds)}
+    )
+    dlq_arn = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+
+    queue_url = sqs.create_queue(QueueName=name)["QueueUrl"]
+    sqs.set_queue_attributes(
+        QueueUrl=queue_url,
+        Attributes={
+            "VisibilityTimeout": str(visibility_seconds),
+            "RedrivePolicy": json.dumps(
+                {"deadLetterTargetArn": dlq_arn, "maxReceiveCount": str(max_receive_count)}
+            ),
+        },
+    )
+    return queue_url
+
+
+def has_redrive_policy(sqs, queue_url):
+    """キューにデッドレターキューが設定されているか"""
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=["RedrivePolicy"])
+    return "RedrivePolicy" in attributes.get("Attributes", {})
+
+
+def enqueue_items(sqs, queue_url, items):
+    """
+    作業アイテムをキューに投入する
+
+    Returns:
+        投入に失敗したアイテムの数
+    """
+    failed = 0
+    for i in range(0, len(items), SEND_BATCH_SIZE):
+        entries = [
+            {
+                "Id": str(n),
+                "MessageBody": json.dumps(item, separators=(",", ":"), ensure_ascii=False),
+            }
+            for n, item in enumerate(items[i:i + SEND_BATCH_SIZE])
+        ]
+        response = sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+        failed += len(response.get("Failed", []))
+    return failed
+
+
+def main():
+    """メイン処理"""
+    # ロギング設定
+    logger = configure_logging()
+    args = parse_args()
+    # 送信先か出力ファイルが設定されていれば API 呼び出しを計測し、終了時に書き出す
+    metrics.install_from_env()
+    platform_config = PLATFORM_CONFIG[args.platform]
+    job_queue = args.job_queue or platform_config["job_queue"]
+    job_definition = args.job_definition or platform_config["job_definition"]
+    if args.workers < 1:
+        logger.error("ワーカーの数は1以上である必要があります")
+        sys.exit(1)
+    if not 1 <= args.max_receive_count <= 1000:
+        logger.error("--max-receive-count は 1 から 1000 の範囲で指定してください")
+        sys.exit(1)
+
+    # AWS クライアントを作成
+    try:
+        batch = boto3.client("batch", region_name=args.region)
+        sqs = boto3.client("sqs", region_name=args.region)
+    except Exception as e:
+        logger.error(f"AWS クライアント作成エラー: {e}")
+        sys.exit(1)
+
+    # 作業キューを用意し、アイテムを投入する
+    try:
+        queue_url = args.queue_url
+        if not queue_url:
+            queue_url = create_queue(sqs, args.queue_name, args.visibility_seconds, args.max_receive_count)
+            logger.info(f"作業キュー: {queue_url}（デッドレターキュー: {args.queue_name}-dlq）")
+        elif not has_redrive_policy(sqs, queue_url):
+            logger.warning(
+                "作業キューにデッドレターキューが設定されていません。失敗し続けるアイテムは再配信され続けます"
+            )
+        if args.items_file:
+            items = load_items_file(args.items_file)
+            failed = enqueue_items(sqs, queue_url, items)
+            logger.info(f"{len(items) - failed} アイテムをキューに投入しました（失敗 {failed} 件）")
+            if failed:
+                sys.exit(1)
+    except Exception as e:
+        logger.error(f"作業キュー準備エラー: {e}")
+        sys.exit(1)
+
+    # ジョブ名を生成（タイムスタンプとUUIDを含む）
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    job_id_suffix = str(uuid.uuid4())[:8]
+    submit_params = {
+        "jobName": f"{args.platform}-worker-job-{timestamp}-{job_id_suffix}",
+        "jobQueue": job_queue,
+        "jobDefinition": job_definition,
+        "containerOverrides": {
+            "environment": [
+                {"name": "WORK_QUEUE_URL", "value": queue_url},
+                {"name": "WORKER_IDLE_SECONDS", "value": str(args.idle_seconds)},
+                {"name": "WORKER_VISIBILITY_SECONDS", "value": str(args.visibility_seconds)},
+                # 各アイテムは入力全体を処理する（配列インデックスをシャード番号として使わない）
+                {"name": "SHARD_INDEX", "value": "0"},
+                {"name": "SHARD_COUNT", "value": "1"},
+            ]
+        },
+    }
+    # 配列ジョブのサイズは2以上のため、ワーカーが1つの場合は通常のジョブとして送信する
+    if args.workers > 1:
+        submit_params["arrayProperties"] = {"size": args.workers}
+
+    # フェアシェアスケジューリングを使用する場合、必要なパラメータを追加
+    fair_share = config.FAIR_SHARE_CONFIG[args.platform]
+    if fair_share["use_fair_share"]:
+        if fair_share["share_identifier"]:
+            submit_params["shareIdentifier"] = fair_share["share_identifier"]
+        if fair_share["scheduling_priority"] is not None:
+            submit_params["schedulingPriorityOverride"] = fair_share["scheduling_priority"]
+
+    # ジョブを送信
+    try:
+        response = batch.submit_job(**submit_params)
+        job_id = response["jobId"]
+        logger.info(f"ワーカー {args.workers} 個を送信しました: ID = {job_id}")
+        print(job_id)  # 標準出力にジョブIDを出力
+    except Exception as e:
+        logger.error(f"ワーカージョブ送信エラー: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+パラメータスイープの定義
+
+スイープの定義（SWEEP_SPEC）の検証、点の数の計算、点ごとのパラメータの計算を行う。
+点の計算はコンテナ側 sweep.py と同じ規則で、送信前のプレビューに使う
+（同じ結果になることは tests/test_sweep_parity.py で確認する）。
+形式はコンテナ側 sweep.py の説明を参照。
+"""
+import json
+import math
+import random
+from typing import Any, Dict, List, Optional
+
+SWEEP_MODES = ("grid", "random", "lhs")
+
+
+def field_values(name: str, field: Any) -> Optional[List[Any]]:
+    """
+    フィールドの離散値の一覧を返す。連続値の範囲（num のない min / max）なら None
+
+    Raises:
+        ValueError: 定義が不正な場合
+    """
+    if isinstance(field, list):
+        if not field:
+            raise ValueError(f"{name}: 値の一覧が空です")
+        return field
+    if not isinstance(field, dict):
+        return [field]
+    if "step" in field:
+        start, stop, step = field["start"], field["stop"], field["step"]
+        if step <= 0 or stop < start:
+            raise ValueError(f"{name}: start / stop / step が不正です")
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        values = [round(start + i * step, 12) for i in range(count)]
+        return [int(v) for v in values] if all(isinstance(v, int) for v in (start, stop, step)) else values
+    if "num" in field:
+        num = int(field["num"])
+        if num < 1:
+            raise ValueError(f"{name}: num は1以上にしてください")
+        return [_scale(field, i / (num - 1) if num > 1 else 0.0) for i in range(num)]
+    if "min" in field and "max" in field:
+        return None
+    raise ValueError(f"{name}: 値の一覧、start / stop / step、min / max のいずれかで指定してください")
+
+
+def _scale(field: Dict[str, Any], u: float) -> Any:
+    """0〜1 の値 u を範囲 [min, max] の値に変換する"""
+    low, high = field["min"], field["max"]
+    if field.get("log"):
+        if low <= 0:
+            raise ValueError("log を指定する範囲の min は正の値にしてください")
+        value = math.exp(math.log(low) + u * (math.log(high) - math.log(low)))
+    else:
+        value = low + u * (high - low)
+    if field.get("type") == "int":
+        return int(min(max(round(value), math.ceil(low)), math.floor(high)))
+    return round(value, 12)
+
+
+def _pick(name: str, field: Any, u: float) -> Any:
+    """0〜1 の値 u からフィールドの値を選ぶ"""
+    values = field_values(name, field)
+    if values is None:
+        return _scale(field, u)
+    return values[min(int(u * len(values)), len(values) - 1)]
+
+
+def sweep_size(spec: Dict[str, Any]) -> int:
+    """
+    スイープの点の数を返す
+
+    Raises:
+        ValueError: 定義が不正な場合
+    """
+    mode = spec.get("mode", "grid")
+    if mode not in SWEEP_MODES:
+        raise ValueError(f"mode が不正です: {mode}（{', '.join(SWEEP_MODES)} から選択）")
+    fields = spec.get("fields") or {}
+    if not fields:
+        raise ValueError("fields が空です")
+    if mode != "grid":
+        samples = int(spec.get("samples", 0))
+        if samples < 1:
+            raise ValueError(f"{mode} には samples（1以上）が必要です")
+        return samples
+    size = 1
+    for name, field in fields.items():
+        values = field_values(name, field)
+        if values is None:
+            raise ValueError(f"{name}: grid では min / max の範囲に num が必要です")
+        size *= len(values)
+    return size
+
+
+def point(spec: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """
+    index 番目の点のパラメータ（フィールド名 → 値）を返す
+
+    他の点を列挙せずに計算する（lhs だけはフィールドごとにサンプル数の長さの順列を作る）。
+
+    Raises:
+        ValueError: index が範囲外、または定義が不正な場合
+    """
+    size = sweep_size(spec)
+    if not 0 <= index < size:
+        raise ValueError(f"インデックス {index} がスイープの範囲（0〜{size - 1}）外です")
+    mode = spec.get("mode", "grid")
+    seed = spec.get("seed", 0)
+    fields = list(spec["fields"].items())
+
+    params = {}
+    if mode == "grid":
+        # 最後のフィールドが最も速く変わる混合基数で分解する
+        remainder = index
+        for name, field in reversed(fields):
+            values = field_values(name, field)
+            remainder, position = divmod(remainder, len(values))
+            params[name] = values[position]
+        return {name: params[name] for name, _ in fields}
+
+    for number, (name, field) in enumerate(fields):
+        u = random.Random(f"{seed}:{index}:{number}").random()
+        if mode == "lhs":
+            # フィールドごとに区間の順列を作り、各点が各区間を1回ずつ使うようにする
+            strata = list(range(size))
+            random.Random(f"{seed}:lhs:{number}").shuffle(strata)
+            u = (strata[index] + u) / size
+        params[name] = _pick(name, field, u)
+    return params
+
+
+def load_sweep_file(path):
+    """スイープの定義ファイル（JSON）を読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_field_arg(value):
+    """
+    --field の値（"パス=値"）を (パス, フィールド定義) に変換する
+
+    値は JSON（例: [32,64]、{"min":0.001,"max":0.1,"log":true}）か、カンマ区切りの一覧（例: 32,64,128）。
+    """
+    name, sep, text = value.partition("=")
+    if not sep or not name:
+        raise ValueError(f"--field は パス=値 の形式で指定してください: {value}")
+    try:
+        return name, json.loads(text)
+    except json.JSONDecodeError:
+        return name, [json.loads(item) if _is_number(item) else item for item in text.split(",")]
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
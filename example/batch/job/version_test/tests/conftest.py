@@ -0,0 +1,119 @@
+"""
+送信側のテストの共通設定
+
+送信側のスクリプトはこのディレクトリから直接実行する前提のため、ディレクトリを import パスに加える。
+コンテナ側（container/test）と同じ名前のモジュール（sweep.py / memo.py など）があるため、
+コンテナ側のモジュールは load_container_module で送信側のモジュールと入れ替えずに読み込む。
+"""
+import importlib
+import os
+import sys
+
+import pytest
+
+JOB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTAINER_DIR = os.path.normpath(os.path.join(JOB_DIR, "..", "..", "container", "test"))
+
+sys.path.insert(0, JOB_DIR)
+
+
+def _module_dir(module) -> str:
+    path = getattr(module, "__file__", None)
+    return os.path.dirname(os.path.abspath(path)) if path else ""
+
+
+def load_container_module(name: str):
+    """コンテナ側のモジュールを読み込む（sys.modules の送信側のモジュールはそのまま残す）"""
+    shadowed = {key: module for key, module in sys.modules.items() if _module_dir(module) == JOB_DIR}
+    for key in shadowed:
+        del sys.modules[key]
+    sys.path.insert(0, CONTAINER_DIR)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(CONTAINER_DIR)
+        for key, module in list(sys.modules.items()):
+            if _module_dir(module) == CONTAINER_DIR:
+                del sys.modules[key]
+        sys.modules.update(shadowed)
+
+
+@pytest.fixture(scope="session")
+def container_sweep():
+    return load_container_module("sweep")
+
+
+@pytest.fixture(scope="session")
+def container_memo():
+    return load_container_module("memo")
+
+
+@pytest.fixture(scope="session")
+def container_committer():
+    return load_container_module("committer")
+
+
+@pytest.fixture(scope="session")
+def container_bundle():
+    pytest.importorskip("pydantic_settings")
+    return load_container_module("bundle")
+
+
+@pytest.fixture(scope="session")
+def container_worker():
+    pytest.importorskip("pydantic_settings")
+    return load_container_module("worker")
+
+
+@pytest.fixture(scope="session")
+def container_metrics():
+    return load_container_module("metrics")
+
+
+@pytest.fixture(scope="session")
+def container_profiling():
+    return load_container_module("profiling")
+
+
+@pytest.fixture(scope="session")
+def container_dir():
+    return CONTAINER_DIR
+
+
+@pytest.fixture(scope="session")
+def container_models():
+    pytest.importorskip("pydantic_settings")
+    return load_container_module("models")
+
+
+@pytest.fixture(scope="session")
+def container_fastconfig():
+    pytest.importorskip("pydantic_settings")
+    return load_container_module("fastconfig")
+
+
+@pytest.fixture
+def standin():
+    """Batch と CloudWatch Logs の API の代わりにローカルで応答するサーバー（async_batch_client.StandinBatch）"""
+    from async_batch_client import StandinBatch
+
+    server = StandinBatch(start_seconds=0.0, run_seconds=0.0).start_in_thread()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def standin_client(standin):
+    """スタンドインに接続する boto3 のクライアントを作る関数"""
+    boto3 = pytest.importorskip("boto3")
+
+    def client(service):
+        return boto3.client(
+            service,
+            region_name="ap-northeast-1",
+            endpoint_url=standin.url,
+            aws_access_key_id="standin",
+            aws_secret_access_key="standin",
+        )
+
+    return client
@@ -0,0 +1,124 @@
+"""AsyncBatchClient の再試行・describe_job のまとめ・接続の再利用の確認（StandinBatch を相手にする）"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from botocore.credentials import Credentials  # noqa: E402
+
+from async_batch_client import AsyncBatchClient, ApiError, StandinBatch, submit_params  # noqa: E402
+from metrics import Registry  # noqa: E402
+
+# 再試行の待ちでテストが遅くならないようにする
+FAST_RETRY = {"base_delay_seconds": 0.001, "max_delay_seconds": 0.01}
+
+
+def run(test, client_settings=None, **standin_settings):
+    """同じイベントループでスタンドインとクライアントを起動し、test(standin, client) を実行する"""
+
+    async def main():
+        standin = await StandinBatch(**{"start_seconds": 0.0, "run_seconds": 0.0, **standin_settings}).start()
+        try:
+            async with AsyncBatchClient(
+                endpoint_url=standin.url,
+                credentials=Credentials("standin", "standin"),
+                registry=Registry(),
+                **{**FAST_RETRY, **(client_settings or {})},
+            ) as client:
+                return await test(standin, client)
+        finally:
+            await standin.stop()
+
+    return asyncio.run(main())
+
+
+async def submit_many(client, count):
+    responses = await asyncio.gather(
+        *(client.submit_job(**submit_params("fargate", job_name=f"job-{index}")) for index in range(count))
+    )
+    return [response["jobId"] for response in responses]
+
+
+def test_retries_throttled_calls_until_success():
+    async def test(standin, client):
+        job_ids = await submit_many(client, 40)
+        assert len(set(job_ids)) == 40
+        assert standin.throttled > 0
+        # スロットリングされた呼び出しだけが再送され、ジョブは重複しない
+        assert standin.calls["SubmitJob"] == 40 + standin.throttled
+        assert len(standin.jobs) == 40
+        registry = client.registry
+        assert registry.value("batch_api_throttles", operation="SubmitJob") == standin.throttled
+        assert registry.value("batch_submissions", outcome="ok") == 40
+
+    run(test, throttle=0.3)
+
+
+def test_gives_up_after_max_attempts():
+    async def test(standin, client):
+        with pytest.raises(ApiError) as error:
+            await client.describe_jobs(["missing"])
+        assert error.value.throttled
+        assert standin.calls["DescribeJobs"] == 3
+        assert client.registry.value("batch_api_calls", operation="DescribeJobs", outcome="error") == 1
+
+    run(test, client_settings={"max_attempts": 3}, throttle=1.0)
+
+
+def test_does_not_retry_client_errors():
+    async def test(standin, client):
+        with pytest.raises(ApiError) as error:
+            await client.submit_job(jobQueue="queue", jobDefinition="definition")
+        assert (error.value.status, error.value.code) == (400, "ClientException")
+        assert standin.calls["SubmitJob"] == 1
+
+    run(test)
+
+
+def test_concurrent_describe_job_calls_are_coalesced():
+    async def test(standin, client):
+        job_ids = await submit_many(client, 250)
+        # 同じジョブの重複と存在しないジョブを含めて、同時に問い合わせる
+        requested = job_ids + job_ids[:10] + ["missing"]
+        jobs = await asyncio.gather(*(client.describe_job(job_id) for job_id in requested))
+        assert [job["jobId"] for job in jobs[:260]] == requested[:260]
+        assert all(job["status"] == "SUCCEEDED" for job in jobs[:260])
+        assert jobs[-1] is None
+        # 100件ずつまとめた describe_jobs の呼び出しだけになる
+        assert standin.calls["DescribeJobs"] == 3
+
+    run(test)
+
+
+def test_cancelled_describe_job_is_not_sent():
+    async def test(standin, client):
+        (job_id,) = await submit_many(client, 1)
+        waiters = [asyncio.ensure_future(client.describe_job(job_id)) for _ in range(5)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(client.settings["describe_delay_seconds"] * 3)
+        assert "DescribeJobs" not in standin.calls
+
+    run(test)
+
+
+def test_wait_for_job():
+    async def test(standin, client):
+        (job_id,) = await submit_many(client, 1)
+        job = await client.wait_for_job(job_id, poll_seconds=0.05, timeout_seconds=5)
+        assert job["status"] == "SUCCEEDED"
+        with pytest.raises(LookupError):
+            await client.wait_for_job("missing", poll_seconds=0.05, timeout_seconds=5)
+
+    run(test, run_seconds=0.2)
+
+
+def test_connections_are_reused():
+    async def test(standin, client):
+        await submit_many(client, 200)
+        assert standin.connections <= 4
+
+    run(test, client_settings={"max_connections": 4}, latency=0.001)
@@ -0,0 +1,86 @@
+"""配列ジョブの需要が、子ジョブの実行時間から求まり、親の区間全体に配列サイズ分を数えないことの確認"""
+import capacity_planner
+import export_job_history
+
+EC2_QUEUE = "arn:aws:batch:ap-northeast-1:000000000000:job-queue/awa-batch-dev-ec2"
+QUEUE_NAME = "awa-batch-dev-ec2"
+MINUTE = 60_000
+# 到着時刻（2026-10-19 00:00 UTC）
+CREATED = 1_792_368_000_000
+
+
+def job(job_id, started, stopped, **fields):
+    record = {
+        "jobId": job_id,
+        "jobQueue": EC2_QUEUE,
+        "createdAt": CREATED,
+        "startedAt": CREATED + started,
+        "stoppedAt": CREATED + stopped,
+        "platformCapabilities": ["EC2"],
+        "container": {"vcpus": 2, "memory": 4096},
+        "status": "SUCCEEDED",
+    }
+    record.update(fields)
+    return record
+
+
+def array_parent(size, stopped, status_summary=None):
+    array_properties = {"size": size}
+    if status_summary is not None:
+        array_properties["statusSummary"] = status_summary
+    return job("array-1", 0, stopped, arrayProperties=array_properties)
+
+
+def test_children_are_counted_for_their_own_run_time():
+    # 4 つの子ジョブが 2 つずつ 10 分ずつずれて実行され、親の区間は 20 分になる
+    children = [
+        job(f"array-1:{index}", wave * 10 * MINUTE, (wave + 1) * 10 * MINUTE, arrayProperties={"index": index})
+        for index, wave in enumerate([0, 0, 1, 1])
+    ]
+    intervals, estimated = capacity_planner.demand_intervals(
+        [array_parent(4, 20 * MINUTE)] + children, QUEUE_NAME
+    )
+
+    assert estimated == 0
+    # 親は数えず、子ジョブごとに到着時刻から 10 分の区間になる
+    arrival = CREATED / 1000
+    assert sorted(intervals) == [(arrival, arrival + 600, 2)] * 4
+    clock = capacity_planner.SlotClock("daily", 15, "UTC")
+    assert list(capacity_planner.slot_peaks(intervals, clock).values()) == [8]
+
+
+def test_parent_without_children_scales_by_children_that_ran():
+    parent = array_parent(10, 20 * MINUTE, {"SUCCEEDED": 3, "FAILED": 1, "RUNNABLE": 0})
+    intervals, estimated = capacity_planner.demand_intervals([parent], QUEUE_NAME)
+    assert estimated == 1
+    arrival = CREATED / 1000
+    assert intervals == [(arrival, arrival + 1200, 8)]
+
+    # statusSummary がない親は配列サイズで概算し、子ジョブが1つも実行されなかった親は数えない
+    intervals, _ = capacity_planner.demand_intervals([array_parent(10, 20 * MINUTE)], QUEUE_NAME)
+    assert intervals == [(arrival, arrival + 1200, 20)]
+    assert capacity_planner.demand_intervals([array_parent(10, 0, {"FAILED": 0})], QUEUE_NAME) == ([], 0)
+
+
+class StandinBatch:
+    """list_jobs の arrayJobId とステータスごとに子ジョブを返す Batch クライアント"""
+
+    def __init__(self, children):
+        self.children = children
+
+    def get_paginator(self, name):
+        assert name == "list_jobs"
+        return self
+
+    def paginate(self, arrayJobId, jobStatus):
+        summaries = [
+            {"jobId": f"{arrayJobId}:{index}"} for index, status in enumerate(self.children) if status == jobStatus
+        ]
+        return [{"jobSummaryList": summaries}]
+
+
+def test_child_job_ids_lists_finished_children_of_array_parents():
+    batch = StandinBatch(["SUCCEEDED", "FAILED", "SUCCEEDED"])
+    assert export_job_history.child_job_ids(batch, array_parent(3, MINUTE)) == ["array-1:0", "array-1:2", "array-1:1"]
+    assert export_job_history.child_job_ids(batch, job("single", 0, MINUTE)) == []
+    assert export_job_history.child_job_ids(batch, job("array-1:0", 0, MINUTE, arrayProperties={"index": 0})) == []
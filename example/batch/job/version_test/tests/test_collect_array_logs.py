@@ -0,0 +1,111 @@
+"""collect_array_logs.py のログストリームの列挙・取得・マージの確認（async_batch_client のスタンドインを使う）"""
+import logging
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import collect_array_logs  # noqa: E402
+from async_batch_client import submit_params  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def submit_children(standin, batch, count):
+    """スタンドインに配列の子ジョブに見立てたジョブを送信し、インデックスを付ける"""
+    job_ids = []
+    for index in range(count):
+        job_id = batch.submit_job(**submit_params("fargate", job_name=f"child-{index}"))["jobId"]
+        standin.jobs[job_id]["arrayProperties"] = {"index": index}
+        job_ids.append(job_id)
+    return job_ids
+
+
+def test_describe_log_streams_tags_each_attempt(standin, standin_client):
+    batch = standin_client("batch")
+    job_ids = submit_children(standin, batch, 3)
+    # 2番目の子ジョブは1回リトライされ、前の試行のログストリームが attempts に残っている
+    standin.jobs[job_ids[2]]["attempts"] = [{"container": {"logStreamName": "previous/default/attempt-0"}}]
+
+    streams = collect_array_logs.describe_log_streams(batch, job_ids)
+
+    current = {job_id: f"{standin.jobs[job_id]['jobDefinition']}/default/{job_id}" for job_id in job_ids}
+    assert streams == [
+        ("0", current[job_ids[0]]),
+        ("1", current[job_ids[1]]),
+        ("2.0", "previous/default/attempt-0"),
+        ("2.1", current[job_ids[2]]),
+    ]
+
+
+def test_describe_log_streams_splits_requests(standin, standin_client, monkeypatch):
+    batch = standin_client("batch")
+    job_ids = submit_children(standin, batch, 5)
+    monkeypatch.setattr(collect_array_logs, "DESCRIBE_BATCH_SIZE", 2)
+
+    streams = collect_array_logs.describe_log_streams(batch, job_ids)
+
+    assert [tag for tag, _ in streams] == ["0", "1", "2", "3", "4"]
+    assert standin.calls["DescribeJobs"] == 3
+
+
+def test_fetch_stream_follows_tokens_to_the_end(standin, standin_client):
+    standin.log_events = 250
+    standin.log_page_size = 100
+    logs = standin_client("logs")
+
+    events = collect_array_logs.fetch_stream(logs, "/aws/batch/job", "0", "stream-a", lambda message: True)
+
+    assert [message for _, _, message in events] == [f"stream-a line {i}" for i in range(250)]
+    assert {tag for _, tag, _ in events} == {"0"}
+    # 3ページと、同じトークンが返って末尾とわかる1回
+    assert standin.calls["GetLogEvents"] == 4
+
+
+def test_collect_merges_streams_by_timestamp(standin, standin_client):
+    standin.log_events = 300
+    logs = standin_client("logs")
+    streams = [("0", "stream-a"), ("1", "stream-b"), ("2", "stream-c")]
+    accept = collect_array_logs.make_filter(None, r"line 1\d\d$")
+
+    merged = list(collect_array_logs.collect(logs, "/aws/batch/job", streams, accept, 3, logger))
+
+    assert len(merged) == 3 * 100
+    assert [timestamp for timestamp, _, _ in merged] == sorted(timestamp for timestamp, _, _ in merged)
+    for tag, stream in streams:
+        messages = [message for _, event_tag, message in merged if event_tag == tag]
+        assert messages == [f"{stream} line {i}" for i in range(100, 200)]
+
+
+def test_collect_skips_streams_that_fail(standin_client):
+    logs = standin_client("logs")
+
+    class FailingLogs:
+        def get_log_events(self, **params):
+            if params["logStreamName"] == "broken":
+                raise RuntimeError("接続できません")
+            return logs.get_log_events(**params)
+
+    merged = list(
+        collect_array_logs.collect(
+            FailingLogs(), "/aws/batch/job", [("0", "broken"), ("1", "ok")], lambda message: True, 2, logger
+        )
+    )
+
+    assert merged and {tag for _, tag, _ in merged} == {"1"}
+
+
+@pytest.mark.parametrize(
+    "level, pattern, message, accepted",
+    [
+        ("WARNING", None, "2024-01-01 ERROR 失敗", True),
+        ("WARNING", None, "WARN 再試行します", True),
+        ("WARNING", None, "INFO 開始", False),
+        ("WARNING", None, "レベルのない行", False),
+        (None, r"shard \d+", "INFO shard 12 完了", True),
+        ("INFO", r"shard \d+", "INFO 開始", False),
+        (None, None, "何でも", True),
+    ],
+)
+def test_make_filter(level, pattern, message, accepted):
+    assert collect_array_logs.make_filter(level, pattern)(message) is accepted
@@ -0,0 +1,129 @@
+"""cost_report.py の料金区分・スポットの節約額・使用率と、export_job_history.py が加える項目の確認"""
+import json
+import logging
+
+import config
+import cost_report
+import export_job_history
+
+EC2_QUEUE = "arn:aws:batch:ap-northeast-1:000000000000:job-queue/awa-batch-dev-ec2"
+FARGATE_QUEUE = "arn:aws:batch:ap-northeast-1:000000000000:job-queue/awa-batch-dev-fargate"
+
+
+def job(queue=EC2_QUEUE, hours=1.0, **fields):
+    record = {
+        "jobId": "job-1",
+        "jobQueue": queue,
+        "jobDefinition": "arn:aws:batch:ap-northeast-1:000000000000:job-definition/sample:1",
+        "createdAt": 0,
+        "startedAt": 60_000,
+        "stoppedAt": 60_000 + int(hours * 3_600_000),
+        "platformCapabilities": ["FARGATE" if queue == FARGATE_QUEUE else "EC2"],
+        "container": {"vcpus": 2, "memory": 4096},
+        "status": "SUCCEEDED",
+    }
+    record.update(fields)
+    return record
+
+
+def report(jobs):
+    groups = cost_report.aggregate(jobs, ["queue"], config.PRICE_TABLE, config.QUEUE_PRICING)
+    return {row["queue"]: row for row in cost_report.report_rows(groups, ["queue"])}
+
+
+def test_spot_pricing_from_record_reports_savings():
+    rows = report([job(), job(pricing="ec2_spot")])
+    prices = config.PRICE_TABLE
+    on_demand = 2 * prices["ec2"]["vcpu_hour"] + 4 * prices["ec2"]["gb_hour"]
+    spot = 2 * prices["ec2_spot"]["vcpu_hour"] + 4 * prices["ec2_spot"]["gb_hour"]
+    row = rows["awa-batch-dev-ec2"]
+    assert row["cost_usd"] == round(on_demand + spot, 4)
+    assert row["spot_savings_usd"] == round(on_demand - spot, 4)
+
+
+def test_queue_pricing_maps_spot_queue(monkeypatch):
+    monkeypatch.setitem(config.QUEUE_PRICING, "awa-batch-dev-fargate", "fargate_spot")
+    rows = report([job(queue=FARGATE_QUEUE)])
+    assert rows["awa-batch-dev-fargate"]["spot_savings_usd"] > 0
+
+
+def test_utilization_columns_only_with_usage():
+    assert "cpu_util" not in report([job()])["awa-batch-dev-ec2"]
+
+    rows = report([job(usage={"cpuSeconds": 3600, "maxRssMb": 1024}), job()])
+    row = rows["awa-batch-dev-ec2"]
+    # 使用量を持つジョブだけで計算する（2 vCPU × 1時間に対して CPU 1時間、4096 MB に対して 1024 MB）
+    assert (row["cpu_util"], row["mem_util"]) == (0.5, 0.25)
+
+
+class StandinBatch:
+    """describe_job_queues / describe_compute_environments だけに応答する Batch クライアント"""
+
+    def __init__(self, queues, environments):
+        self.queues = queues
+        self.environments = environments
+
+    def describe_job_queues(self, jobQueues):
+        return {
+            "jobQueues": [
+                {
+                    "jobQueueName": name,
+                    "computeEnvironmentOrder": [
+                        {"order": order, "computeEnvironment": f"arn:aws:batch:::compute-environment/{environment}"}
+                        for order, environment in enumerate(self.queues[name])
+                    ],
+                }
+                for name in jobQueues
+            ]
+        }
+
+    def describe_compute_environments(self, computeEnvironments):
+        return {
+            "computeEnvironments": [
+                {
+                    "computeEnvironmentName": arn.rsplit("/", 1)[-1],
+                    "computeEnvironmentArn": arn,
+                    "computeResources": {"type": self.environments[arn.rsplit("/", 1)[-1]]},
+                }
+                for arn in computeEnvironments
+            ]
+        }
+
+
+def test_queue_pricing_from_capacity_type():
+    batch = StandinBatch(
+        {"spot": ["spot-a", "spot-b"], "fargate": ["fargate"], "mixed": ["fargate", "fargate-spot"]},
+        {"spot-a": "SPOT", "spot-b": "SPOT", "fargate": "FARGATE", "fargate-spot": "FARGATE_SPOT"},
+    )
+    pricing = export_job_history.queue_pricing(batch, ["spot", "fargate", "mixed"], logging.getLogger(__name__))
+    assert pricing == {"spot": "ec2_spot", "fargate": "fargate"}
+
+
+def profiled_job(tmp_path, **environment):
+    values = {"PROFILE": "stages", "CONFIG": json.dumps({"outputPath": str(tmp_path / "output")}), **environment}
+    return job(
+        jobId="parent:3",
+        attempts=[{}, {}],
+        container={"environment": [{"name": name, "value": value} for name, value in values.items()]},
+    )
+
+
+def test_job_usage_reads_last_attempt_profile(tmp_path):
+    stages = tmp_path / "output" / "_profile" / "parent-3-attempt-2" / "stages.json"
+    stages.parent.mkdir(parents=True)
+    stages.write_text(json.dumps({"cpuSeconds": 12.5, "maxRssMb": 300.0, "stages": {}}), encoding="utf-8")
+
+    assert export_job_history.job_usage(profiled_job(tmp_path)) == {"cpuSeconds": 12.5, "maxRssMb": 300.0}
+    assert export_job_history.job_usage(profiled_job(tmp_path, PROFILE="off")) is None
+    assert export_job_history.job_usage(profiled_job(tmp_path, PROFILE_OUTPUT=str(tmp_path / "other"))) is None
+
+
+def test_container_profile_has_usage_fields(tmp_path, container_profiling, monkeypatch):
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "parent:3")
+    monkeypatch.setenv("AWS_BATCH_JOB_ATTEMPT", "2")
+    config_json = json.dumps({"outputPath": str(tmp_path / "output")})
+    container_profiling.Profiler("stages", output=str(tmp_path / "output")).finish()
+
+    usage = export_job_history.job_usage(profiled_job(tmp_path, CONFIG=config_json))
+    assert usage["cpuSeconds"] >= 0
+    assert usage["maxRssMb"] > 0
@@ -0,0 +1,165 @@
+"""job_state_index.py に記録したイベントを取り込んだときの状態と絞り込みの確認"""
+import argparse
+import json
+import os
+import random
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import bulk_control  # noqa: E402
+import job_state_index  # noqa: E402
+from job_state_index import JobStateIndex, event_millis, read_events  # noqa: E402
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "job_state_events_sample.jsonl")
+PARENT = "0b1c2d3e-0000-4000-8000-000000000001"
+EC2_JOB = "7a8b9c0d-0000-4000-8000-000000000002"
+
+# サンプルのイベントをすべて取り込んだ後の各ジョブの状態
+FINAL_STATUS = {
+    PARENT: "FAILED",
+    f"{PARENT}:0": "SUCCEEDED",
+    f"{PARENT}:1": "SUCCEEDED",
+    f"{PARENT}:2": "FAILED",
+    EC2_JOB: "SUCCEEDED",
+}
+
+
+@pytest.fixture
+def events():
+    return read_events(SAMPLE)
+
+
+@pytest.fixture
+def index(tmp_path, events):
+    index = JobStateIndex(str(tmp_path / "index.db"))
+    index.ingest(events)
+    yield index
+    index.close()
+
+
+def snapshot(index):
+    return [tuple(row) for row in index.db.execute("SELECT * FROM jobs ORDER BY job_id")]
+
+
+def test_sample_converges_to_latest_status(index):
+    assert {row["job_id"]: row["status"] for row in index.query()} == FINAL_STATUS
+    # リトライで試行回数が増えたイベントは、前の試行の終了より新しい
+    ec2 = index.query(statuses=["SUCCEEDED"], queues=["awa-batch-dev-ec2"])
+    assert [(row["job_id"], row["attempt_count"]) for row in ec2] == [(EC2_JOB, 2)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_ingest_order_and_duplicates_do_not_matter(tmp_path, index, events, seed):
+    shuffled = events + random.Random(seed).sample(events, len(events) // 2)
+    random.Random(seed).shuffle(shuffled)
+    other = JobStateIndex(str(tmp_path / f"shuffled-{seed}.db"))
+    try:
+        other.ingest(shuffled)
+        assert snapshot(other) == snapshot(index)
+    finally:
+        other.close()
+
+
+def test_stale_and_duplicate_events_are_not_applied(index, events):
+    assert index.ingest(events) == 0
+    running = next(event for event in events if event["detail"]["jobId"] == EC2_JOB and event["detail"]["status"] == "RUNNING")
+    assert index.ingest([running]) == 0
+    assert index.query(statuses=["SUCCEEDED"], queues=["awa-batch-dev-ec2"])[0]["job_id"] == EC2_JOB
+
+
+def test_ignores_other_event_types(tmp_path):
+    index = JobStateIndex(str(tmp_path / "index.db"))
+    try:
+        event = {"detail-type": "ECS Task State Change", "time": "2026-10-19T01:00:00Z", "detail": {}}
+        assert index.ingest([event]) == 0
+        assert index.query() == []
+    finally:
+        index.close()
+
+
+def test_query_filters(index):
+    children = index.query(array_parent=PARENT)
+    assert [row["job_id"] for row in children] == [f"{PARENT}:{number}" for number in range(3)]
+    assert [row["array_index"] for row in children] == [0, 1, 2]
+
+    assert {row["job_id"] for row in index.query(statuses=["FAILED"])} == {PARENT, f"{PARENT}:2"}
+    assert {row["job_id"] for row in index.query(definition="awa-batch-dev-ec2-sample1")} == {EC2_JOB}
+    assert {row["job_id"] for row in index.query(name="ec2-*")} == {EC2_JOB}
+    assert len(index.query(queues=["awa-batch-dev-fargate"], limit=2)) == 2
+
+
+def test_query_time_range(index):
+    since = event_millis("2026-10-19T01:05:00Z")
+    until = event_millis("2026-10-19T01:07:00Z")
+    rows = index.query(since=since, until=until, time_field="stopped_at")
+    assert [row["job_id"] for row in rows] == [f"{PARENT}:0", PARENT, f"{PARENT}:1"]
+    with pytest.raises(ValueError):
+        index.query(time_field="detail")
+
+
+def test_jobs_returns_describe_jobs_shape(index):
+    (job,) = index.jobs(statuses=["FAILED"], array_parent=PARENT)
+    assert job["jobId"] == f"{PARENT}:2"
+    assert job["status"] == "FAILED"
+    assert job["arrayProperties"]["index"] == 2
+
+
+def test_summary(index):
+    assert [tuple(row) for row in index.summary()] == [
+        ("awa-batch-dev-ec2", "SUCCEEDED", 1),
+        ("awa-batch-dev-fargate", "FAILED", 2),
+        ("awa-batch-dev-fargate", "SUCCEEDED", 2),
+    ]
+    with pytest.raises(ValueError):
+        index.summary(group_by="status")
+
+
+def test_prune_removes_only_old_finished_jobs(index, monkeypatch):
+    # SUCCEEDED の最後のイベント（01:08）から1日と少したった時点
+    now = event_millis("2026-10-20T01:07:00Z") / 1000
+    monkeypatch.setattr(job_state_index.time, "time", lambda: now)
+    assert index.prune(1) == 4
+    assert {row["job_id"] for row in index.query()} == {EC2_JOB}
+
+
+class FakeSqs:
+    """receive_message / delete_message_batch だけを持つ SQS の代わり"""
+
+    def __init__(self, bodies):
+        self.messages = [{"Body": body, "ReceiptHandle": f"handle-{number}"} for number, body in enumerate(bodies)]
+        self.deleted = []
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds):
+        batch, self.messages = self.messages[:MaxNumberOfMessages], self.messages[MaxNumberOfMessages:]
+        return {"Messages": batch} if batch else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.deleted += [entry["ReceiptHandle"] for entry in Entries]
+
+
+def test_consume_ingests_then_deletes_messages(tmp_path, index, events):
+    sqs = FakeSqs([json.dumps(event) for event in events])
+    consumed = JobStateIndex(str(tmp_path / "consumed.db"))
+    try:
+        job_state_index.consume(consumed, sqs, ["queue"], once=True, logger=job_state_index.logging.getLogger(__name__))
+        assert snapshot(consumed) == snapshot(index)
+    finally:
+        consumed.close()
+    assert len(sqs.deleted) == len(events)
+
+
+def test_bulk_control_selects_from_index(index):
+    args = argparse.Namespace(
+        status=["FAILED"],
+        job_queue=["awa-batch-dev-fargate"],
+        array_job_id=None,
+        name=None,
+        created_after=None,
+        created_before=None,
+    )
+    # ジョブキューから選ぶ場合は list_jobs と同じく配列の子ジョブを含めない
+    assert [job["jobId"] for job in bulk_control.indexed_jobs(index.path, args)] == [PARENT]
+    args.array_job_id = PARENT
+    assert [job["jobId"] for job in bulk_control.indexed_jobs(index.path, args)] == [f"{PARENT}:2"]
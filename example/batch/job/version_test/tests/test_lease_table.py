@@ -0,0 +1,92 @@
+"""送信側 lease_table.ensure_table が、既存のテーブルでも purge_at の TTL を有効にすることの確認"""
+import logging
+
+import pytest
+
+import lease_table
+
+TABLE = "awa-batch-dev-lease-shards"
+
+
+class StandinDynamoDB:
+    """ensure_table が使う操作だけに応答する DynamoDB の代わり（テーブルは1つ）"""
+
+    class exceptions:
+        class ResourceNotFoundException(Exception):
+            pass
+
+    def __init__(self, exists=True, ttl=None):
+        self.table = {"GlobalSecondaryIndexes": []} if exists else None
+        if exists:
+            self.table["GlobalSecondaryIndexes"].append(
+                {"IndexName": lease_table.STATE_INDEX, "IndexStatus": "ACTIVE"}
+            )
+        self.ttl = ttl or {"TimeToLiveStatus": "DISABLED"}
+        self.ttl_updates = []
+
+    def describe_table(self, TableName):
+        if self.table is None:
+            raise self.exceptions.ResourceNotFoundException(TableName)
+        return {"Table": self.table}
+
+    def create_table(self, TableName, GlobalSecondaryIndexes, **kwargs):
+        self.table = {
+            "GlobalSecondaryIndexes": [
+                dict(index, IndexStatus="ACTIVE") for index in GlobalSecondaryIndexes
+            ]
+        }
+
+    def get_waiter(self, name):
+        class Waiter:
+            def wait(self, **kwargs):
+                pass
+
+        return Waiter()
+
+    def describe_time_to_live(self, TableName):
+        return {"TimeToLiveDescription": dict(self.ttl)}
+
+    def update_time_to_live(self, TableName, TimeToLiveSpecification):
+        self.ttl_updates.append(TimeToLiveSpecification)
+        self.ttl = {"TimeToLiveStatus": "ENABLING", "AttributeName": TimeToLiveSpecification["AttributeName"]}
+
+
+@pytest.fixture
+def logger():
+    return logging.getLogger(__name__)
+
+
+ENABLE = {"Enabled": True, "AttributeName": "purge_at"}
+
+
+@pytest.mark.parametrize("exists", [False, True], ids=["created", "existing"])
+def test_enables_ttl_when_disabled(logger, exists):
+    dynamodb = StandinDynamoDB(exists=exists)
+    lease_table.ensure_table(dynamodb, TABLE, logger)
+    assert dynamodb.ttl_updates == [ENABLE]
+
+    # 2回目は有効化の途中でも設定し直さない
+    lease_table.ensure_table(dynamodb, TABLE, logger)
+    assert dynamodb.ttl_updates == [ENABLE]
+
+
+def test_keeps_enabled_ttl(logger):
+    dynamodb = StandinDynamoDB(ttl={"TimeToLiveStatus": "ENABLED", "AttributeName": "purge_at"})
+    lease_table.ensure_table(dynamodb, TABLE, logger)
+    assert dynamodb.ttl_updates == []
+
+
+@pytest.mark.parametrize(
+    "ttl",
+    [
+        {"TimeToLiveStatus": "ENABLED", "AttributeName": "expires"},
+        {"TimeToLiveStatus": "DISABLING", "AttributeName": "purge_at"},
+    ],
+    ids=["other-attribute", "disabling"],
+)
+def test_warns_when_ttl_cannot_be_changed(logger, caplog, ttl):
+    dynamodb = StandinDynamoDB(ttl=ttl)
+    with caplog.at_level(logging.WARNING):
+        lease_table.ensure_table(dynamodb, TABLE, logger)
+    assert dynamodb.ttl_updates == []
+    assert "古いグループは削除されません" in caplog.text
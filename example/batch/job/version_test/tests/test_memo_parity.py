@@ -0,0 +1,116 @@
+"""送信側 memo.py・history.py とコンテナ側 memo.py・committer.py・bundle.py が同じキーを計算することの確認"""
+import json
+import os
+
+import pytest
+
+import memo
+from history import item_key
+
+METADATA = {"jobType": "batch-processing", "version": "1.0.0", "description": "テスト"}
+
+ITEMS = [
+    {"inputFile": "s3://bucket/in/a.csv", "outputPath": "s3://bucket/out/", "settings": {}, "metadata": METADATA},
+    {
+        "inputFile": "s3://bucket/in/b.csv",
+        "outputPath": "s3://bucket/out/b/",
+        "settings": {"batchSize": 128, "learningRate": 1},
+        "metadata": METADATA,
+        "referenceFiles": ["s3://bucket/ref/model.bin"],
+        "cacheInput": True,
+    },
+    {
+        "inputFile": "/data/c.csv",
+        "outputPath": "/data/out/",
+        "settings": {"maxIterations": 10, "learningRate": 0.5},
+        "metadata": {**METADATA, "description": "日本語の説明"},
+        "lookup": {"referenceFile": "s3://bucket/ref/products.csv", "key": "product_id"},
+    },
+    {
+        "inputFile": "s3://bucket/in/d.csv",
+        "outputPath": "s3://bucket/out/",
+        "settings": {"batchSize": 32},
+        "metadata": METADATA,
+        "lookup": {
+            "referenceFile": "s3://bucket/ref/customers.csv",
+            "key": "id",
+            "inputColumn": 2,
+            "columns": ["name", "region"],
+            "missing": "drop",
+            "delimiter": "\t",
+        },
+    },
+    {
+        # 入れ子のモデルは未知の項目を無視するため、送信側でも除いてから計算する
+        "inputFile": "s3://bucket/in/e.csv",
+        "outputPath": "s3://bucket/out/",
+        "settings": {"batchSize": 16, "owner": "team-a"},
+        "metadata": {**METADATA, "ticket": "BATCH-1"},
+        "lookup": {"referenceFile": "s3://bucket/ref/users.csv", "key": "user_id", "comment": "unused"},
+    },
+]
+
+
+@pytest.fixture(scope="module")
+def container_configs(container_models, container_fastconfig):
+    """コンテナが検証後に得る設定の辞書（run_batch.config_dict と同じ変換）を、pydantic 版と軽量版で返す"""
+    return [
+        lambda item: json.loads(container_models.BatchJobConfig(**item).model_dump_json()),
+        lambda item: json.loads(container_fastconfig.parse_config(json.dumps(item)).model_dump_json()),
+    ]
+
+
+@pytest.mark.parametrize("item", ITEMS)
+def test_config_hash_matches_container(item, container_memo, container_configs):
+    expected = memo.config_hash(item)
+    for to_dict in container_configs:
+        assert container_memo.config_hash(to_dict(item)) == expected
+
+
+@pytest.mark.parametrize("item", ITEMS)
+def test_reference_uris_match_container(item, container_memo):
+    assert memo.reference_uris(item) == container_memo.reference_uris(item)
+
+
+def test_fingerprint_matches_container(container_memo):
+    args = ("etag-1", "0" * 64, "abcdef0123456789", 0, 1, ["etag-2", "etag-3"], {"codec": "auto", "level": ""})
+    assert memo.fingerprint(*args) == container_memo.fingerprint(*args)
+
+
+def test_code_version_matches_container(container_memo, container_dir, monkeypatch):
+    monkeypatch.delenv("CODE_VERSION", raising=False)
+    container_memo.code_version.cache_clear()
+    assert memo.code_version(container_dir) == container_memo.code_version(container_dir)
+
+
+def test_local_etag_matches_container(tmp_path, container_memo):
+    path = tmp_path / "input.csv"
+    path.write_bytes(b"a,b\n1,2\n")
+    assert memo.head_etag(str(path)) == container_memo.head_etag(str(path))
+    assert memo.head_etag(str(tmp_path / "missing.csv")) is None
+
+
+@pytest.mark.parametrize("item", ITEMS)
+def test_shard_manifest_uri_matches_container(item, container_committer, container_configs):
+    expected = memo.shard_manifest_uri(item, "run-1")
+    for to_dict in container_configs:
+        assert container_committer.shard_manifest_uri(
+            to_dict(item), "run-1", memo.SHARD_INDEX, memo.SHARD_COUNT
+        ) == expected
+
+
+def test_item_id_distinguishes_items_sharing_input():
+    item = ITEMS[0]
+    assert memo.item_id(item) != memo.item_id({**item, "settings": {"batchSize": 32}})
+    assert memo.item_id(item) != memo.item_id({**item, "outputPath": "s3://bucket/out/other/"})
+    # 出力の内容に影響しない項目やキーの順序では変わらない
+    assert memo.item_id(item) == memo.item_id({**dict(reversed(list(item.items()))), "cacheInput": True})
+
+
+@pytest.mark.parametrize("item", ITEMS + [["not", "a", "config"]])
+def test_item_key_matches_container(item, container_bundle):
+    assert item_key(item) == container_bundle.item_key(item)
+
+
+def test_memo_keys_is_loaded_from_container_source(container_dir):
+    assert os.path.samefile(memo.memo_keys.__file__, os.path.join(container_dir, "memo_keys.py"))
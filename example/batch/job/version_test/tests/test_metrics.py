@@ -0,0 +1,42 @@
+"""コンテナ側 metrics.py が終了時に送る値を、送信側の StandinPushgateway が受け取って公開することの確認"""
+import urllib.request
+
+import pytest
+
+from metrics import StandinPushgateway
+
+
+@pytest.fixture
+def pushgateway():
+    standin = StandinPushgateway(port=0).serve_in_thread()
+    yield standin
+    standin.shutdown()
+
+
+def test_container_pushes_final_values(pushgateway, container_metrics, monkeypatch):
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "job-1:3")
+    monkeypatch.setenv("AWS_BATCH_JOB_ATTEMPT", "2")
+    job_metrics = container_metrics.JobMetrics(pushgateway.url, "awa-batch", sample_every=1)
+    job_metrics.record_shard("COMMITTED", 100, 2048, 512, 0.5)
+    job_metrics.finish()
+
+    # グループはジョブ名・ジョブID・試行回数（ジョブIDの : もエスケープして送る）
+    [(grouping, group)] = pushgateway.groups.items()
+    assert grouping == (("job", "awa-batch"), ("instance", "job-1:3"), ("attempt", "2"))
+    lines = group["body"].splitlines()
+    # Pushgateway が受け付ける Prometheus のテキスト形式（カウンタの TYPE 行は _total 付き、# EOF なし）
+    assert "# TYPE batch_job_rows_total counter" in lines
+    assert "batch_job_rows_total 100" in lines
+    assert "batch_job_read_bytes_total 2048" in lines
+    assert "batch_job_written_bytes_total 512" in lines
+    assert 'batch_job_shards_total{status="COMMITTED"} 1' in lines
+    assert "batch_job_rows_per_second 200.0" in lines
+    assert any(line.startswith("batch_job_max_rss_bytes ") for line in lines)
+    assert "# EOF" not in lines
+
+    with urllib.request.urlopen(f"{pushgateway.url}/metrics", timeout=10) as response:
+        exposed = response.read().decode("utf-8").splitlines()
+    labels = 'job="awa-batch",instance="job-1:3",attempt="2"'
+    assert f"batch_job_rows_total{{{labels}}} 100" in exposed
+    assert f'batch_job_shards_total{{{labels},status="COMMITTED"}} 1' in exposed
+    assert any(line.startswith(f"push_time_seconds{{{labels}}} ") for line in exposed)
@@ -0,0 +1,173 @@
+"""submit_workers.py が作るデッドレターキューと、失敗し続けるアイテムがあってもワーカーが終了することの確認"""
+import json
+import time
+
+import submit_workers
+from history import item_key
+
+VISIBILITY = 1
+MAX_RECEIVE_COUNT = 2
+IDLE_SECONDS = 2.5
+
+
+class StandinSqs:
+    """
+    SQS の代わりにメモリ上で応答するクライアント（送信側とワーカーが使う操作だけ）
+
+    受信回数が RedrivePolicy の maxReceiveCount を超えるメッセージは、SQS と同じく
+    次に受信されるときにデッドレターキューへ移す。
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.calls = []
+
+    def _url(self, name):
+        return f"https://sqs.ap-northeast-1.amazonaws.com/000000000000/{name}"
+
+    def _queue(self, url):
+        return self.queues[url.rsplit("/", 1)[-1]]
+
+    def create_queue(self, QueueName, Attributes=None):
+        self.calls.append(("create_queue", QueueName))
+        queue = self.queues.setdefault(QueueName, {"attributes": {}, "messages": [], "next_id": 0})
+        queue["attributes"].update(Attributes or {})
+        return {"QueueUrl": self._url(QueueName)}
+
+    def set_queue_attributes(self, QueueUrl, Attributes):
+        self._queue(QueueUrl)["attributes"].update(Attributes)
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames):
+        name = QueueUrl.rsplit("/", 1)[-1]
+        attributes = {**self.queues[name]["attributes"], "QueueArn": f"arn:aws:sqs:ap-northeast-1:000000000000:{name}"}
+        return {"Attributes": {key: value for key, value in attributes.items() if key in AttributeNames}}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        queue = self._queue(QueueUrl)
+        for entry in Entries:
+            queue["next_id"] += 1
+            queue["messages"].append(
+                {"id": queue["next_id"], "body": entry["MessageBody"], "visible_at": 0.0, "receive_count": 0}
+            )
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds, VisibilityTimeout, AttributeNames):
+        queue = self._queue(QueueUrl)
+        deadline = time.monotonic() + WaitTimeSeconds
+        while True:
+            now = time.monotonic()
+            for message in list(queue["messages"]):
+                if message["visible_at"] > now:
+                    continue
+                policy = queue["attributes"].get("RedrivePolicy")
+                if policy:
+                    policy = json.loads(policy)
+                    if message["receive_count"] >= int(policy["maxReceiveCount"]):
+                        queue["messages"].remove(message)
+                        dead_letter = self.queues[policy["deadLetterTargetArn"].rsplit(":", 1)[-1]]
+                        dead_letter["messages"].append(message)
+                        continue
+                message["receive_count"] += 1
+                message["visible_at"] = now + VisibilityTimeout
+                return {
+                    "Messages": [
+                        {
+                            "Body": message["body"],
+                            "ReceiptHandle": f"{message['id']}:{message['receive_count']}",
+                            "Attributes": {"ApproximateReceiveCount": str(message["receive_count"])},
+                        }
+                    ]
+                }
+            if now >= deadline:
+                return {}
+            time.sleep(0.05)
+
+    def _find(self, QueueUrl, ReceiptHandle):
+        message_id, receive_count = map(int, ReceiptHandle.split(":"))
+        for message in self._queue(QueueUrl)["messages"]:
+            if (message["id"], message["receive_count"]) == (message_id, receive_count):
+                return message
+        return None
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        message = self._find(QueueUrl, ReceiptHandle)
+        if message is not None:
+            message["visible_at"] = time.monotonic() + VisibilityTimeout
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        message = self._find(QueueUrl, ReceiptHandle)
+        if message is not None:
+            self._queue(QueueUrl)["messages"].remove(message)
+
+
+def bodies(sqs, name):
+    return [message["body"] for message in sqs.queues[name]["messages"]]
+
+
+def test_create_queue_sets_redrive_policy():
+    sqs = StandinSqs()
+    # 以前に再処理ポリシーなしで作ったキューにも設定し直す
+    sqs.create_queue(QueueName="awa-batch-dev-work-sample", Attributes={"VisibilityTimeout": "30"})
+
+    queue_url = submit_workers.create_queue(sqs, "awa-batch-dev-work-sample", 120, 3)
+
+    assert queue_url.endswith("/awa-batch-dev-work-sample")
+    attributes = sqs.queues["awa-batch-dev-work-sample"]["attributes"]
+    assert attributes["VisibilityTimeout"] == "120"
+    assert json.loads(attributes["RedrivePolicy"]) == {
+        "deadLetterTargetArn": "arn:aws:sqs:ap-northeast-1:000000000000:awa-batch-dev-work-sample-dlq",
+        "maxReceiveCount": "3",
+    }
+    assert sqs.queues["awa-batch-dev-work-sample-dlq"]["attributes"]["MessageRetentionPeriod"] == str(14 * 86400)
+    assert submit_workers.has_redrive_policy(sqs, queue_url)
+    assert not submit_workers.has_redrive_policy(sqs, sqs.create_queue(QueueName="other")["QueueUrl"])
+
+
+def test_poison_item_moves_to_dead_letter_queue_and_worker_exits(container_worker):
+    sqs = StandinSqs()
+    queue_url = submit_workers.create_queue(sqs, "awa-batch-dev-work-sample", VISIBILITY, MAX_RECEIVE_COUNT)
+    items = [{"inputFile": "s3://bucket/poison.csv"}, {"inputFile": "s3://bucket/ok.csv"}]
+    assert submit_workers.enqueue_items(sqs, queue_url, items) == 0
+
+    def process(item):
+        if item["inputFile"].endswith("poison.csv"):
+            raise RuntimeError("常に失敗")
+
+    started = time.monotonic()
+    results = container_worker.run_worker(
+        container_worker.SqsWorkQueue(queue_url, client=sqs),
+        process,
+        idle_seconds=IDLE_SECONDS,
+        visibility_seconds=VISIBILITY,
+    )
+    elapsed = time.monotonic() - started
+
+    assert [(result.key, result.status) for result in results] == [
+        (item_key(items[0]), "FAILED"),
+        (item_key(items[1]), "SUCCEEDED"),
+        (item_key(items[0]), "FAILED"),
+    ]
+    assert bodies(sqs, "awa-batch-dev-work-sample") == []
+    assert [json.loads(body) for body in bodies(sqs, "awa-batch-dev-work-sample-dlq")] == items[:1]
+    # 最後に成功してから idle_seconds で終了する
+    assert elapsed < IDLE_SECONDS * 2
+
+
+def test_worker_exits_while_item_keeps_failing(container_worker):
+    sqs = StandinSqs()
+    # デッドレターキューのないキューでも、失敗が続くだけならワーカーは終了する
+    queue_url = sqs.create_queue(QueueName="awa-batch-dev-work-plain")["QueueUrl"]
+    sqs.send_message_batch(QueueUrl=queue_url, Entries=[{"Id": "0", "MessageBody": "not json"}])
+
+    started = time.monotonic()
+    results = container_worker.run_worker(
+        container_worker.SqsWorkQueue(queue_url, client=sqs),
+        lambda item: None,
+        idle_seconds=IDLE_SECONDS,
+        visibility_seconds=VISIBILITY,
+    )
+
+    assert {result.status for result in results} == {"FAILED"}
+    assert len(results) >= 2
+    assert time.monotonic() - started < IDLE_SECONDS + VISIBILITY + 1
+    assert bodies(sqs, "awa-batch-dev-work-plain") == ["not json"]
@@ -0,0 +1,79 @@
+"""送信側 sweep.py とコンテナ側 sweep.py が同じ点を計算することの確認"""
+import pytest
+
+import sweep
+
+SPECS = [
+    {
+        "mode": "grid",
+        "fields": {
+            "settings.batchSize": [32, 64, 128],
+            "settings.maxIterations": {"start": 100, "stop": 500, "step": 100},
+            "settings.learningRate": {"min": 0.0001, "max": 0.1, "num": 4, "log": True},
+        },
+    },
+    {
+        "mode": "grid",
+        "fields": {
+            "settings.learningRate": {"start": 0.1, "stop": 0.5, "step": 0.1},
+            "settings.batchSize": {"min": 16, "max": 256, "num": 5, "type": "int"},
+            "metadata.version": "2.0.0",
+        },
+    },
+    {
+        "mode": "random",
+        "samples": 50,
+        "seed": 7,
+        "fields": {
+            "settings.learningRate": {"min": 0.0001, "max": 0.1, "log": True},
+            "settings.batchSize": {"min": 8, "max": 512, "type": "int"},
+            "settings.maxIterations": [100, 200, 300],
+        },
+    },
+    {
+        "mode": "lhs",
+        "samples": 40,
+        "seed": 3,
+        "fields": {
+            "settings.learningRate": {"min": 0.001, "max": 0.01},
+            "settings.batchSize": {"min": 16, "max": 128, "num": 8, "type": "int"},
+        },
+    },
+]
+
+INVALID_SPECS = [
+    {"mode": "sobol", "fields": {"a": [1]}},
+    {"mode": "grid", "fields": {}},
+    {"mode": "grid", "fields": {"a": []}},
+    {"mode": "grid", "fields": {"a": {"min": 0, "max": 1}}},
+    {"mode": "random", "fields": {"a": [1, 2]}},
+    {"mode": "grid", "fields": {"a": {"start": 5, "stop": 1, "step": 1}}},
+    {"mode": "grid", "fields": {"a": {"min": 0, "max": 1, "num": 3, "log": True}}},
+]
+
+
+@pytest.mark.parametrize("spec", SPECS)
+def test_points_match_container(spec, container_sweep):
+    size = sweep.sweep_size(spec)
+    assert container_sweep.sweep_size(spec) == size
+    for index in range(size):
+        assert sweep.point(spec, index) == container_sweep.point(spec, index)
+
+
+@pytest.mark.parametrize("spec", INVALID_SPECS)
+def test_errors_match_container(spec, container_sweep):
+    with pytest.raises(ValueError) as job_error:
+        sweep.point(spec, 0)
+    with pytest.raises(ValueError) as container_error:
+        container_sweep.point(spec, 0)
+    assert str(job_error.value) == str(container_error.value)
+
+
+def test_index_out_of_range_matches_container(container_sweep):
+    spec = SPECS[0]
+    size = sweep.sweep_size(spec)
+    for index in (-1, size):
+        with pytest.raises(ValueError, match="範囲"):
+            sweep.point(spec, index)
+        with pytest.raises(ValueError, match="範囲"):
+            container_sweep.point(spec, index)
@@ -38,4 +38,6 @@ module "iam" {
   project_name = var.project_name
   environment  = var.environment
   common_tags  = local.common_tags
+
+  data_bucket_names = var.data_bucket_names
 }
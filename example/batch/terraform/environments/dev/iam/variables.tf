@@ -15,3 +15,9 @@ variable "project_name" {
   type        = string
   default     = "awa-batch"
 }
+
+variable "data_bucket_names" {
+  description = "Additional S3 buckets that batch jobs read and write (buckets named <project>-<environment>-* are always allowed)"
+  type        = list(string)
+  default     = []
+}
@@ -22,3 +22,8 @@ output "job_queue_arn" { # 出力名を変更
   description = "ARN of the job queue" # 説明を変更
   value       = module.resources.job_queue_arn # モジュールの正しい出力名を参照
 }
+
+output "job_state_events_queue_url" {
+  description = "URL of the SQS queue receiving AWS Batch job state change events"
+  value       = module.resources.job_state_events_queue_url
+}
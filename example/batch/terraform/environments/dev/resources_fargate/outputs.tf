@@ -38,3 +38,8 @@ output "fargate_compute_environment_arn" {
   description = "ARN of the Fargate compute environment"
   value       = module.resources_fargate.fargate_compute_environment_arn
 }
+
+output "job_state_events_queue_url" {
+  description = "URL of the SQS queue receiving AWS Batch job state change events"
+  value       = module.resources_fargate.job_state_events_queue_url
+}
@@ -10,6 +10,12 @@ locals {
       "ManagedBy"   = "terraform"
     }
   )
+
+  # ジョブが読み書きする S3 バケット
+  data_bucket_arns = concat(
+    ["arn:aws:s3:::${local.name_prefix}-*"],
+    [for name in var.data_bucket_names : "arn:aws:s3:::${name}"]
+  )
 }
 
 #----------------------------------------------------------------------
@@ -36,12 +42,83 @@ resource "aws_iam_role" "batch_job_role" {
   tags = local.common_tags
 }
 
-resource "aws_iam_role_policy_attachment" "batch_job_role_s3" {
-  role       = aws_iam_role.batch_job_role.name
-  policy_arn = "arn:aws:iam::aws:policy/AmazonS3FullAccess"
+# 入出力・チェックポイント・シャードのマニフェスト・結果インデックス・キャッシュの取得に使う S3 バケット
+# （名前が <接頭辞>- で始まるバケットと data_bucket_names）のオブジェクトの読み書き・削除・一覧
+resource "aws_iam_role_policy" "batch_job_role_s3" {
+  name = "${local.name_prefix}-batch-job-s3"
+  role = aws_iam_role.batch_job_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["s3:ListBucket"]
+        Resource = local.data_bucket_arns
+      },
+      {
+        # DeleteObject はファイナライズで参照されないステージングファイルを削除するため
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
+        ]
+        Resource = [for arn in local.data_bucket_arns : "${arn}/*"]
+      }
+    ]
+  })
 }
 
 resource "aws_iam_role_policy_attachment" "batch_job_role_logs" {
   role       = aws_iam_role.batch_job_role.name
   policy_arn = "arn:aws:iam::aws:policy/CloudWatchLogsFullAccess"
 }
+
+# ワーカーモードの作業キュー（名前が <接頭辞>-work- で始まる SQS キュー）の受信・削除・可視性延長
+resource "aws_iam_role_policy" "batch_job_role_work_queue" {
+  name = "${local.name_prefix}-batch-job-work-queue"
+  role = aws_iam_role.batch_job_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = "arn:aws:sqs:*:*:${local.name_prefix}-work-*"
+      }
+    ]
+  })
+}
+
+# リース実行のシャードのリーステーブル（名前が <接頭辞>-lease- で始まる DynamoDB テーブル）の取得・延長・完了
+resource "aws_iam_role_policy" "batch_job_role_lease_table" {
+  name = "${local.name_prefix}-batch-job-lease-table"
+  role = aws_iam_role.batch_job_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:Query",
+          "dynamodb:PutItem",
+          "dynamodb:UpdateItem"
+        ]
+        # 子ジョブは取得できるシャードを状態インデックスから読む
+        Resource = [
+          "arn:aws:dynamodb:*:*:table/${local.name_prefix}-lease-*",
+          "arn:aws:dynamodb:*:*:table/${local.name_prefix}-lease-*/index/*"
+        ]
+      }
+    ]
+  })
+}
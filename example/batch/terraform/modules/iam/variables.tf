@@ -13,3 +13,9 @@ variable "common_tags" {
   type        = map(string)
   default     = {}
 }
+
+variable "data_bucket_names" {
+  description = "Additional S3 buckets that batch jobs read and write (buckets named <project>-<environment>-* are always allowed)"
+  type        = list(string)
+  default     = []
+}
@@ -0,0 +1,62 @@
+#----------------------------------------------------------------------
+# AWS Batch Job State Change events for EC2 environment
+# ジョブのすべての状態変化（SUBMITTED〜SUCCEEDED/FAILED）を EventBridge から SQS に送り、
+# 送信側 job_state_index.py がローカルのジョブ状態インデックスに取り込む
+#----------------------------------------------------------------------
+
+# 状態変化イベントのキュー
+resource "aws_sqs_queue" "batch_job_state_events" {
+  name                       = "${local.name_prefix}-job-state-events-ec2"
+  message_retention_seconds  = 345600 # 4日（コンシューマーが停止していても取りこぼさない）
+  visibility_timeout_seconds = 60
+  receive_wait_time_seconds  = 20
+
+  tags = merge(
+    local.common_tags,
+    {
+      Name        = "${local.name_prefix}-job-state-events-ec2"
+      Description = "SQS queue for AWS Batch job state change events"
+    }
+  )
+}
+
+# このモジュールのジョブキューのジョブ状態変化イベント
+resource "aws_cloudwatch_event_rule" "batch_job_state_change" {
+  name        = "${local.name_prefix}-batch-job-state-change-ec2"
+  description = "All AWS Batch job state changes for the EC2 job queue"
+
+  event_pattern = jsonencode({
+    source        = ["aws.batch"]
+    "detail-type" = ["Batch Job State Change"]
+    detail = {
+      jobQueue = [module.batch.job_queues["on_demand_queue"].arn]
+    }
+  })
+
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "batch_job_state_change_sqs" {
+  rule = aws_cloudwatch_event_rule.batch_job_state_change.name
+  arn  = aws_sqs_queue.batch_job_state_events.arn
+}
+
+# EventBridge からキューへの送信を許可
+resource "aws_sqs_queue_policy" "batch_job_state_events" {
+  queue_url = aws_sqs_queue.batch_job_state_events.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "events.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.batch_job_state_events.arn
+        Condition = {
+          ArnEquals = { "aws:SourceArn" = aws_cloudwatch_event_rule.batch_job_state_change.arn }
+        }
+      }
+    ]
+  })
+}
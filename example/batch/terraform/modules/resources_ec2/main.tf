@@ -68,6 +68,30 @@ resource "aws_security_group" "batch_compute_environment" {
   tags = local.common_tags
 }
 
+# Batch インスタンス用の起動テンプレート
+# コンテナ間で共有するキャッシュディレクトリを、コンテナの実行ユーザー（UID 1001）の所有で作成します
+# AWS Batch の起動テンプレートのユーザーデータは MIME マルチパート形式である必要があります
+resource "aws_launch_template" "batch_instance" {
+  name_prefix = "${local.name_prefix}-batch-ec2-"
+
+  user_data = base64encode(<<-EOT
+    MIME-Version: 1.0
+    Content-Type: multipart/mixed; boundary="==BOUNDARY=="
+
+    --==BOUNDARY==
+    Content-Type: text/x-shellscript; charset="us-ascii"
+
+    #!/bin/bash
+    mkdir -p ${var.cache_host_path}
+    chown 1001:1001 ${var.cache_host_path}
+
+    --==BOUNDARY==--
+  EOT
+  )
+
+  tags = local.common_tags
+}
+
 # AWS Batch terraform モジュールの利用
 # コミュニティが提供するモジュールを使用して、AWS Batch環境を効率的に構築します
 module "batch" {
@@ -153,6 +177,13 @@ module "batch" {
           aws_security_group.batch_compute_environment.id
         ]
 
+        # 起動テンプレート
+        # キャッシュ用のホストディレクトリをコンテナの実行ユーザーが書き込めるように作成します
+        launch_template = {
+          launch_template_id = aws_launch_template.batch_instance.id
+          version            = "$Latest"
+        }
+
         # インスタンスに付けるタグ
         # インスタンスを識別しやすくするためのタグを設定
         tags = {
@@ -243,13 +274,42 @@ resource "aws_batch_job_definition" "sample1" {
       {
         name  = "CUSTOM_ENVIRONMENT"
         value = var.common_env_var_value
+      },
+      {
+        # ホスト共有キャッシュのマウント先と上限サイズ
+        # キャッシュするのは参照ファイルと、cacheInput で指定された入力ファイルだけです
+        name  = "CACHE_DIR"
+        value = "/cache"
+      },
+      {
+        name  = "CACHE_MAX_BYTES"
+        value = tostring(var.cache_max_bytes)
+      },
+      {
+        # CONFIG の cacheInput を省略したジョブの入力ファイルをキャッシュするか
+        name  = "CACHE_INPUTS"
+        value = tostring(var.cache_input_files)
       }
     ]
 
-    # ボリュームとマウントポイントの設定（現在は空）
-    # コンテナにデータボリュームをマウントする場合に設定します
-    mountPoints = []
-    volumes = []
+    # ボリュームとマウントポイントの設定
+    # ホストのキャッシュディレクトリをバインドマウントし、同じインスタンス上の
+    # コンテナ間で参照ファイルのキャッシュ（container/test/cache.py）を共有します
+    mountPoints = [
+      {
+        sourceVolume  = "content-cache"
+        containerPath = "/cache"
+        readOnly      = false
+      }
+    ]
+    volumes = [
+      {
+        name = "content-cache"
+        host = {
+          sourcePath = var.cache_host_path
+        }
+      }
+    ]
 
     # ログ設定
     # コンテナのログをCloudWatch Logsに送信する設定
@@ -274,12 +334,27 @@ resource "aws_batch_job_definition" "sample1" {
     
     # 終了条件の評価ルール
     # 特定の終了条件に対する動作を定義します
+    evaluate_on_exit {
+      # メモリ不足は同じサイズで再試行しても再び失敗するため、リトライせずに終了する
+      # （retry_controller.py が memory を引き上げて再送信します）
+      action    = "EXIT"
+      on_reason = "OutOfMemoryError*"
+    }
+
     evaluate_on_exit {
       # 終了コード1、または任意の理由（"*"）で失敗した場合のリトライ設定
       action       = "RETRY"  # リトライする
       on_reason    = "*"     # 任意の理由
       on_exit_code = 1       # 終了コード1（一般的なエラーコード）
     }
+
+    evaluate_on_exit {
+      # 終了コード75（SIGTERMによる中断）の場合のリトライ設定
+      # コンテナは完了済みの作業をチェックポイントに記録してから終了するため、
+      # リトライでは未完了の作業だけが処理されます
+      action       = "RETRY"  # リトライする
+      on_exit_code = 75        # run_batch.py の EXIT_CODE_INTERRUPTED
+    }
     
     evaluate_on_exit {
       # 終了コード0（正常終了）の場合のアクション
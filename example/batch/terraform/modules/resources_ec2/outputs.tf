@@ -39,3 +39,10 @@ output "on_demand_compute_environment_arn" {
   description = "ARN of the EC2 on-demand compute environment"
   value       = module.batch.compute_environments["on_demand"].arn
 }
+
+# ジョブ状態変化イベントのキュー URL
+# job_state_index.py --consume --queue-url に指定する
+output "job_state_events_queue_url" {
+  description = "URL of the SQS queue receiving AWS Batch job state change events"
+  value       = aws_sqs_queue.batch_job_state_events.id
+}
@@ -152,3 +152,26 @@ variable "slack_webhook_url" {
   default     = ""
   sensitive   = true
 }
+
+# コンテンツキャッシュのホストディレクトリ
+# 同じインスタンス上のジョブ間で参照ファイルを共有するためにバインドマウントします
+variable "cache_host_path" {
+  description = "コンテナ間で共有するコンテンツキャッシュのホスト上のディレクトリ"
+  type        = string
+  default     = "/var/cache/awa-batch"
+}
+
+# コンテンツキャッシュの上限サイズ（デフォルト 10GiB）
+variable "cache_max_bytes" {
+  description = "コンテンツキャッシュの上限サイズ（バイト）。超えると最も古く使われたファイルから削除"
+  type        = number
+  default     = 10737418240
+}
+
+# 入力ファイルもキャッシュするか
+# 一度しか読まない大きな入力で参照ファイルが押し出されないよう、デフォルトでは参照ファイルだけをキャッシュします
+variable "cache_input_files" {
+  description = "CONFIG の cacheInput を省略したジョブの入力ファイルもコンテンツキャッシュに置くか"
+  type        = bool
+  default     = false
+}
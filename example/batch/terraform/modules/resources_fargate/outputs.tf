@@ -124,3 +124,10 @@ output "module_config" {
     retry_attempts       = var.retry_attempts
   }
 }
+
+# ジョブ状態変化イベントのキュー URL
+# job_state_index.py --consume --queue-url に指定する
+output "job_state_events_queue_url" {
+  description = "URL of the SQS queue receiving AWS Batch job state change events"
+  value       = aws_sqs_queue.batch_job_state_events.id
+}
@@ -151,9 +151,13 @@ variable "scheduling_policy_arn" {
 }
 
 variable "retry_attempts" {
-  description = "ジョブ失敗時の最大再試行回数"
+  description = "ジョブの最大試行回数（1〜10）。Spot 回収による中断（終了コード 75）のリトライもこの回数に含まれる"
   type        = number
-  default     = 1
+  default     = 5
+  validation {
+    condition     = var.retry_attempts >= 1 && var.retry_attempts <= 10
+    error_message = "retry_attemptsは1以上10以下である必要があります。"
+  }
 }
 
 variable "retry_exit_conditions" {
@@ -178,17 +182,22 @@ variable "retry_exit_conditions" {
       action    = "RETRY"
       on_reason = "ResourceError:*"  # リソース関連のエラー
     },
-    # 通常の終了条件 - 成功時
+    # Spot回収などでSIGTERMを受け、チェックポイントを記録して中断した場合
     {
-      action       = "EXIT"
-      on_exit_code = "0"
+      action       = "RETRY"
+      on_exit_code = "75"  # run_batch.py の EXIT_CODE_INTERRUPTED
     },
     # その他すべてのエラーは失敗として扱う
+    # （成功したジョブには終了条件が評価されないため、終了コード 0 の条件は不要）
     {
       action    = "EXIT"
       on_reason = "*"
     }
   ]
+  validation {
+    condition     = length(var.retry_exit_conditions) <= 5
+    error_message = "retry_exit_conditionsは5件以下である必要があります（AWS Batch の evaluateOnExit の上限）。"
+  }
 }
 
 #----------------------------------------------------------------------